@@ -250,6 +250,37 @@ def get_finegrainedness_split_enum():
   return split_enum
 
 
+# The ImageNet DatasetSpecification and the lowest common ancestor table of the
+# fine-grainedness split. They are loaded at most once per process.
+_IMAGENET_DATA_SPEC = None
+_LOWEST_COMMON_ANCESTOR_TABLE = None
+
+
+def get_imagenet_records_path():
+  """Returns the directory containing the records of ImageNet."""
+  return os.path.join(FLAGS.records_root_dir, 'ilsvrc_2012')
+
+
+def get_imagenet_data_spec():
+  """Returns the DatasetSpecification of ImageNet.
+
+  Raises:
+    ValueError: The dataset specification is not found in the expected location.
+  """
+  global _IMAGENET_DATA_SPEC
+  if _IMAGENET_DATA_SPEC is None:
+    dataset_spec_path = os.path.join(get_imagenet_records_path(),
+                                     'dataset_spec.pkl')
+    if not tf.gfile.Exists(dataset_spec_path):
+      raise ValueError(
+          'Dataset specification is not found in the expected path ({}).'
+          .format(dataset_spec_path))
+
+    with tf.gfile.Open(dataset_spec_path, 'rb') as f:
+      _IMAGENET_DATA_SPEC = pkl.load(f)
+  return _IMAGENET_DATA_SPEC
+
+
 def get_synsets_from_class_ids(class_ids):
   """Returns the Synsets of the appropriate subgraph corresponding to class_ids.
 
@@ -268,15 +299,7 @@ def get_synsets_from_class_ids(class_ids):
     ValueError: The dataset specification is not found in the expected location.
   """
   # First load the DatasetSpecification of ImageNet.
-  dataset_records_path = os.path.join(FLAGS.records_root_dir, 'ilsvrc_2012')
-  dataset_spec_path = os.path.join(dataset_records_path, 'dataset_spec.pkl')
-  if not tf.gfile.Exists(dataset_spec_path):
-    raise ValueError(
-        'Dataset specification is not found in the expected path ({}).'.format(
-            dataset_spec_path))
-
-  with tf.gfile.Open(dataset_spec_path, 'rb') as f:
-    imagenet_data_spec = pkl.load(f)
+  imagenet_data_spec = get_imagenet_data_spec()
 
   # A set of Synsets of the split's subgraph.
   split_enum = get_finegrainedness_split_enum()
@@ -293,6 +316,29 @@ def get_synsets_from_class_ids(class_ids):
   return [synsets[wn_id] for wn_id in wn_ids]
 
 
+def get_lowest_common_ancestor_table():
+  """Returns the LowestCommonAncestorTable of the fine-grainedness split.
+
+  The table holds the lowest common ancestor of every pair of leaves of the
+  split's subgraph. It is stored next to the dataset specification of ImageNet
+  the first time it is computed.
+
+  Raises:
+    ValueError: The dataset specification is not found in the expected location.
+  """
+  global _LOWEST_COMMON_ANCESTOR_TABLE
+  if _LOWEST_COMMON_ANCESTOR_TABLE is None:
+    split_enum = get_finegrainedness_split_enum()
+    split_subgraph = get_imagenet_data_spec().split_subgraphs[split_enum]
+    cache_path = os.path.join(
+        get_imagenet_records_path(),
+        'lca_table_{}.npz'.format(FLAGS.eval_finegrainedness_split))
+    _LOWEST_COMMON_ANCESTOR_TABLE = (
+        imagenet_spec.get_lowest_common_ancestor_table(
+            split_subgraph, cache_path=cache_path))
+  return _LOWEST_COMMON_ANCESTOR_TABLE
+
+
 def get_height_to_accuracy(class_ids, logits, targets):
   """Accuracy as a function of the height of class' the lowest common ancestor.
 
@@ -321,18 +367,21 @@ def get_height_to_accuracy(class_ids, logits, targets):
     ValueError: There should have been exactly 2 elements in the list of each
       episode's class id's.
   """
-  height_to_accuracy = collections.defaultdict(list)
-  for episode_num, episode_class_ids in enumerate(class_ids):
+  imagenet_data_spec = get_imagenet_data_spec()
+  wn_ids_a, wn_ids_b = [], []
+  for episode_class_ids in class_ids:
     if len(episode_class_ids) != 2:
       raise ValueError('There should have been exactly 2 elements in the list '
                        "of each episode's class id's.")
-    # Get the Synsets corresponding to the class id's episode_class_ids.
-    episode_synsets = get_synsets_from_class_ids(episode_class_ids)
-    assert len(episode_synsets) == 2, ('Fine- vs coarse- grained analysis '
-                                       'should be restricted to binary tasks.')
-    # Compute the height of the lowest common ancestor of the episode's Synsets.
-    _, height = imagenet_spec.get_lowest_common_ancestor(
-        episode_synsets[0], episode_synsets[1])
+    # Get the WordNet ids corresponding to the class id's episode_class_ids.
+    wn_ids_a.append(imagenet_data_spec.class_names[episode_class_ids[0]])
+    wn_ids_b.append(imagenet_data_spec.class_names[episode_class_ids[1]])
+
+  # Look up the heights of the lowest common ancestors of all episodes.
+  heights = get_lowest_common_ancestor_table().get_heights(wn_ids_a, wn_ids_b)
+
+  height_to_accuracy = collections.defaultdict(list)
+  for episode_num, height in enumerate(heights.tolist()):
     # Compute the accuracy of the episode.
     episode_logits = logits[episode_num]
     episode_targets = targets[episode_num]
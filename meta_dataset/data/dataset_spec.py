@@ -20,10 +20,12 @@ from __future__ import division
 from __future__ import print_function
 
 import collections
+import collections.abc
 from meta_dataset import data
 from meta_dataset.data import imagenet_specification
 from meta_dataset.data import learning_spec
 from meta_dataset.utils.argparse import argparse
+import numpy as np
 
 # Global records root directory, for all datasets (except diagnostics).
 parser = argparse.parser
@@ -94,7 +96,7 @@ def get_total_images_per_class(data_spec, class_id=None, pool=None):
   num_images = data_spec.images_per_class[class_id]
 
   if pool is None:
-    if isinstance(num_images, collections.Mapping):
+    if isinstance(num_images, collections.abc.Mapping):
       raise ValueError('DatasetSpecification {} has example-level splits, so '
                        'the "pool" argument has to be set (to "train" or '
                        '"test".'.format(data_spec.name))
@@ -424,10 +426,46 @@ class HierarchicalDatasetSpecification(
         ImageNet this is the WordNet id).
   """
 
+  def __reduce__(self):
+    """Pickles the split subgraphs in the compact SynsetGraph format.
+
+    Pickling the Synsets themselves recurses through the parent / child links
+    and is slow to load, so each split subgraph is stored as a SynsetGraph
+    instead, and images_per_class as an array aligned with its nodes.
+
+    A compiled specification, whose split_subgraphs and images_per_class are
+    the lazy mappings of meta_dataset.datasets.utils.LazySplitMapping, is
+    pickled as is, so that it does not load its hierarchy, e.g. when sent to
+    the DataLoader workers.
+
+    Returns:
+      A tuple to be used by pickle.
+    """
+    if not isinstance(self.split_subgraphs, dict):
+      return (type(self), tuple(self), self.__dict__ or None)
+    state = {}
+    for split, nodes in self.split_subgraphs.items():
+      graph = imagenet_specification.SynsetGraph.from_synsets(nodes)
+      wn_id_to_node = dict((n.wn_id, n) for n in nodes)
+      images_per_class = self.images_per_class[split]
+      num_images = [
+          images_per_class.get(wn_id_to_node[wn_id], -1)
+          for wn_id in graph.wn_ids
+      ]
+      num_images = np.array(num_images, dtype=np.int64)
+      state[split] = (tuple(graph), num_images)
+    args = (imagenet_specification.SYNSET_GRAPH_FORMAT_VERSION, self.name,
+            state, self.class_names, self.path, self.file_pattern)
+    return (_restore_hierarchical_dataset_spec, args, self.__dict__ or None)
+
   # TODO(etriantafillou): Make this class inherit from object instead
   # TODO(etriantafillou): Move this method to the __init__ of that revised class
   def initialize(self):
     """Initializes a HierarchicalDatasetSpecification."""
+    # Already initialized, e.g. when loaded from a compiled benchmark
+    # specification, whose hierarchy is only loaded when first accessed.
+    if 'classes_per_split' in self.__dict__:
+      return
     # Set self.class_names_to_ids to the inverse dict of self.class_names.
     self.class_names_to_ids = dict(
         zip(self.class_names.values(), self.class_names.keys()))
@@ -477,26 +515,35 @@ class HierarchicalDatasetSpecification(
       examples, if the classes are balanced, or -1 to indicate class imbalance.
     """
 
-    def list_leaf_num_images(split):
-      return [
-          self.images_per_class[split][n] for n in
-          imagenet_specification.get_leaves(self.split_subgraphs[split])
-      ]
+    class_num_images = self.get_class_num_images()
+    example_counts = np.unique(class_num_images[class_num_images >= 0])
+    if len(example_counts) == 1:
+      return int(example_counts[0])
+    else:
+      return -1
 
-    train_example_counts = set(list_leaf_num_images(learning_spec.Split.TRAIN))
-    valid_example_counts = set(list_leaf_num_images(learning_spec.Split.VALID))
-    test_example_counts = set(list_leaf_num_images(learning_spec.Split.TEST))
+  def get_class_num_images(self):
+    """Returns the number of images of each class, indexed by class id.
 
-    is_class_balanced = (
-        len(train_example_counts) == 1 and len(valid_example_counts) == 1 and
-        len(test_example_counts) == 1 and
-        len(train_example_counts | valid_example_counts
-            | test_example_counts) == 1)
+    The array is computed once from the leaves of the split subgraphs, unless
+    it was loaded with a compiled benchmark specification. Ids that do not
+    correspond to any leaf have -1 images.
 
-    if is_class_balanced:
-      return list(train_example_counts)[0]
-    else:
-      return -1
+    Returns:
+      An np.array of int64.
+    """
+    if self.__dict__.get('class_num_images') is None:
+      self.initialize()
+      class_num_images = np.full(
+          max(self.class_names) + 1 if self.class_names else 0, -1,
+          dtype=np.int64)
+      for s in learning_spec.Split:
+        for n in imagenet_specification.get_leaves(self.split_subgraphs[s]):
+          class_id = self.class_names_to_ids.get(n.wn_id)
+          if class_id is not None:
+            class_num_images[class_id] = self.images_per_class[s][n]
+      self.class_num_images = class_num_images
+    return self.class_num_images
 
   def get_total_images_per_class(self, class_id=None, pool=None):
     """Gets the number of images of class whose id is class_id.
@@ -528,12 +575,50 @@ class HierarchicalDatasetSpecification(
                          'dataset classes have the same number of images.')
       return common_num_class_images
 
-    # Find the class with class_id in one of the split graphs.
-    for s in learning_spec.Split:
-      for n in self.split_subgraphs[s]:
-        # Only consider leaves, as class_names_to_ids only has keys for them.
-        if n.children:
-          continue
-        if self.class_names_to_ids[n.wn_id] == class_id:
-          return self.images_per_class[s][n]
-    raise ValueError('Class id {} not found.'.format(class_id))
+    class_num_images = self.get_class_num_images()
+    if (not 0 <= class_id < len(class_num_images) or
+        class_num_images[class_id] < 0):
+      raise ValueError('Class id {} not found.'.format(class_id))
+    return int(class_num_images[class_id])
+
+
+# This function is referenced by name from pickled
+# HierarchicalDatasetSpecifications, it must not be renamed or moved.
+def _restore_hierarchical_dataset_spec(version, name, state, class_names,
+                                       path, file_pattern):
+  """Recreates a HierarchicalDatasetSpecification pickled by __reduce__.
+
+  Specifications pickled before the compact format was introduced do not go
+  through this function; they are restored directly, with the Synsets loaded
+  by Synset.__setstate__.
+
+  Args:
+    version: int, the SynsetGraph format version used to pickle the spec.
+    name: string, the name of the dataset.
+    state: dict mapping each Split to a tuple of the fields of a SynsetGraph
+      and an np.array with the number of images spanned by each of its nodes.
+    class_names: a dict mapping each class id to the corresponding class name.
+    path: the path to the dataset's files.
+    file_pattern: the naming pattern for each class's file.
+
+  Returns:
+    A HierarchicalDatasetSpecification.
+
+  Raises:
+    ValueError: if the spec was pickled with an unknown format version.
+  """
+  if version != imagenet_specification.SYNSET_GRAPH_FORMAT_VERSION:
+    raise ValueError(
+        'Unsupported SynsetGraph format version {} (expected {}), the dataset '
+        'specification should be regenerated.'.format(
+            version, imagenet_specification.SYNSET_GRAPH_FORMAT_VERSION))
+  split_subgraphs, images_per_class = {}, {}
+  for split, (graph_fields, num_images) in state.items():
+    graph = imagenet_specification.SynsetGraph(*graph_fields)
+    nodes = graph.to_synsets()
+    split_subgraphs[split] = set(nodes)
+    images_per_class[split] = dict(
+        (n, int(k)) for n, k in zip(nodes, num_images) if k >= 0)
+  return HierarchicalDatasetSpecification(name, split_subgraphs,
+                                          images_per_class, class_names, path,
+                                          file_pattern)
@@ -0,0 +1,97 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Layout of the hdf5 files written by the dataset converters.
+
+The images of each class are stored, encoded, in a dataset of variable length
+uint8 arrays named after the class. Optionally, the images are additionally
+stored at several resolutions, or pyramid levels: the level of size s holds
+each image resized to get_aligned_size(s), and lives in its own group, so that
+each level can be read without touching the others. The size in bytes of each
+encoded image of a class, at full resolution, is also stored in a dataset of
+int64 named after the class in the IMAGE_SIZES_GROUP group, so that the sizes
+can be known without reading the images.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+# Attribute of the root of a hdf5 file listing the sizes of its pyramid levels.
+PYRAMID_SIZES_ATTR = 'pyramid_sizes'
+# Group of the datasets of the sizes of the images of each class.
+IMAGE_SIZES_GROUP = 'image_sizes'
+
+
+def get_aligned_size(image_size):
+  """Returns the side of the square images stored ready to load at image_size.
+
+  Images are stored slightly larger than image_size, so that they can still be
+  randomly cropped to image_size.
+
+  Args:
+    image_size: int, the size of the images fed to the model.
+  """
+  return int(np.ceil(image_size / 32.0)) * 32 + 1
+
+
+def get_dataset_name(class_key, level=None):
+  """Returns the name of the dataset of a class at a pyramid level.
+
+  Args:
+    class_key: the name of the dataset of the class at full resolution.
+    level: int, the size of the pyramid level, or None for full resolution.
+  """
+  if level is None:
+    return str(class_key)
+  return 'pyramid_{}/{}'.format(level, class_key)
+
+
+def get_image_sizes_name(class_key):
+  """Returns the name of the dataset of the image sizes of a class.
+
+  Args:
+    class_key: the name of the dataset of the class at full resolution.
+  """
+  return '{}/{}'.format(IMAGE_SIZES_GROUP, class_key)
+
+
+def parse_pyramid_sizes(pyramid_sizes):
+  """Parses a comma-separated string of pyramid sizes into a sorted tuple."""
+  return tuple(sorted(int(s) for s in pyramid_sizes.split(',') if s.strip()))
+
+
+def get_pyramid_sizes(h5fp):
+  """Returns the sorted tuple of pyramid sizes stored in an open hdf5 file."""
+  return tuple(sorted(int(s) for s in h5fp.attrs.get(PYRAMID_SIZES_ATTR, ())))
+
+
+def choose_pyramid_level(pyramid_sizes, image_size):
+  """Returns the smallest pyramid level that is at least image_size.
+
+  Args:
+    pyramid_sizes: a sequence of the sizes of the available pyramid levels.
+    image_size: int, the size of the images fed to the model.
+
+  Returns:
+    The size of the level, or None if no level is large enough, in which case
+    the full resolution images should be used.
+  """
+  if image_size is None:
+    return None
+  candidates = [s for s in pyramid_sizes if s >= image_size]
+  return min(candidates) if candidates else None
@@ -0,0 +1,66 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for `hdf5_format` module."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import tempfile
+import unittest
+
+import h5py
+from meta_dataset.data import hdf5_format
+
+
+class Hdf5FormatTest(unittest.TestCase):
+
+  def test_aligned_size(self):
+    self.assertEqual(hdf5_format.get_aligned_size(84), 97)
+    self.assertEqual(hdf5_format.get_aligned_size(96), 97)
+    self.assertEqual(hdf5_format.get_aligned_size(126), 129)
+
+  def test_choose_pyramid_level(self):
+    sizes = (84, 126, 224)
+    self.assertEqual(hdf5_format.choose_pyramid_level(sizes, 84), 84)
+    self.assertEqual(hdf5_format.choose_pyramid_level(sizes, 100), 126)
+    self.assertEqual(hdf5_format.choose_pyramid_level(sizes, 224), 224)
+    self.assertIsNone(hdf5_format.choose_pyramid_level(sizes, 256))
+    self.assertIsNone(hdf5_format.choose_pyramid_level((), 84))
+    self.assertIsNone(hdf5_format.choose_pyramid_level(sizes, None))
+
+  def test_parse_pyramid_sizes(self):
+    self.assertEqual(hdf5_format.parse_pyramid_sizes('224, 84,126'),
+                     (84, 126, 224))
+    self.assertEqual(hdf5_format.parse_pyramid_sizes(''), ())
+
+  def test_levels_are_independent_datasets(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      path = os.path.join(tmp_dir, 'test.h5')
+      with h5py.File(path, 'w') as h5fp:
+        h5fp.attrs[hdf5_format.PYRAMID_SIZES_ATTR] = (126, 84)
+        h5fp.create_dataset(hdf5_format.get_dataset_name(3), data=[1, 2])
+        h5fp.create_dataset(hdf5_format.get_dataset_name(3, 84), data=[3])
+      with h5py.File(path, 'r') as h5fp:
+        self.assertEqual(hdf5_format.get_pyramid_sizes(h5fp), (84, 126))
+        self.assertEqual(len(h5fp[hdf5_format.get_dataset_name(3)]), 2)
+        self.assertEqual(len(h5fp[hdf5_format.get_dataset_name(3, 84)]), 1)
+        self.assertNotIn(hdf5_format.get_dataset_name(3, 126), h5fp)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,463 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Reading records over HTTP with range requests.
+
+Records served over HTTP, e.g. by an object store, are read with range
+requests rather than downloaded. Files are read in blocks of a fixed size,
+which are kept in an in-memory LRU cache and, optionally, in a directory on
+disk. The ranges read at once, e.g. the images of one class of an episode, are
+mapped to the blocks that hold them, and the missing blocks are fetched with
+one request per run of consecutive blocks.
+
+Each thread of each process keeps its own connection to each server, reused
+across requests.
+
+RangeRequestHandler serves a local directory with support for range requests,
+and optionally an added latency, to stand in for a remote store in tests and
+benchmarks.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import hashlib
+import http.client
+import http.server
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+import urllib.parse
+
+from meta_dataset.data import records_index
+from meta_dataset.data import tfrecord_format
+import numpy as np
+
+DEFAULT_BLOCK_SIZE = 256 * 2 ** 10
+DEFAULT_MEMORY_CACHE_BYTES = 256 * 2 ** 20
+
+_RANGE_RE = re.compile(r'bytes=(\d+)-(\d*)$')
+
+
+def is_url(path):
+  """Returns whether path is an http(s) url rather than a local path."""
+  return path.startswith('http://') or path.startswith('https://')
+
+
+def join_url(base_url, *names):
+  """Joins names to a base url, as os.path.join does to a directory."""
+  return '/'.join([base_url.rstrip('/')] +
+                  [urllib.parse.quote(name) for name in names])
+
+
+class HttpRangeReader(object):
+  """Reads byte ranges of files over HTTP through a block cache.
+
+  The reader can be pickled to DataLoader workers: connections and the
+  in-memory cache are not pickled, each process starts its own.
+  """
+
+  def __init__(self, block_size=DEFAULT_BLOCK_SIZE,
+               memory_cache_bytes=DEFAULT_MEMORY_CACHE_BYTES,
+               disk_cache_dir=None, timeout=60, max_retries=2):
+    """Initializes the reader.
+
+    Args:
+      block_size: int, the size of the blocks files are read and cached in.
+      memory_cache_bytes: int, the maximum size of the blocks kept in memory.
+      disk_cache_dir: optional directory where blocks are also stored, shared
+        by all the processes that use it.
+      timeout: float, the timeout of the requests in seconds.
+      max_retries: int, the number of times a failed request is retried.
+    """
+    self.block_size = block_size
+    self.memory_cache_bytes = memory_cache_bytes
+    self.disk_cache_dir = disk_cache_dir
+    self.timeout = timeout
+    self.max_retries = max_retries
+    if disk_cache_dir:
+      os.makedirs(disk_cache_dir, exist_ok=True)
+    self._reset()
+
+  def _reset(self):
+    self.pid = os.getpid()
+    self.local = threading.local()
+    self.lock = threading.Lock()
+    self.blocks = collections.OrderedDict()
+    self.cached_bytes = 0
+    self.metrics = dict(requests=0, bytes_fetched=0, memory_hits=0,
+                        disk_hits=0, misses=0, request_seconds=0.)
+
+  def __getstate__(self):
+    state = dict(self.__dict__)
+    for k in ('local', 'lock', 'blocks', 'cached_bytes', 'metrics', 'pid'):
+      del state[k]
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self._reset()
+
+  def get_connection(self, netloc, scheme, new=False):
+    """Returns the connection of this thread to a server.
+
+    Args:
+      netloc: the host and port of the server.
+      scheme: 'http' or 'https'.
+      new: whether to replace the current connection, e.g. after an error.
+    """
+    if self.pid != os.getpid():
+      self._reset()
+    connections = getattr(self.local, 'connections', None)
+    if connections is None:
+      connections = self.local.connections = {}
+    if new and netloc in connections:
+      connections.pop(netloc).close()
+    if netloc not in connections:
+      connection_class = (http.client.HTTPSConnection if scheme == 'https'
+                          else http.client.HTTPConnection)
+      connections[netloc] = connection_class(netloc, timeout=self.timeout)
+    return connections[netloc]
+
+  def request(self, url, start=None, end=None):
+    """Fetches a file, or the bytes [start, end) of it.
+
+    Args:
+      url: the url of the file.
+      start: optional int, the first byte to fetch.
+      end: optional int, the byte after the last one to fetch.
+
+    Returns:
+      The bytes, which may be fewer than requested at the end of the file.
+
+    Raises:
+      IOError: if the server returns an error status, or the request fails
+        max_retries + 1 times.
+    """
+    headers = {}
+    if start is not None:
+      headers['Range'] = 'bytes=%d-%d' % (start, end - 1)
+    response, data = self._send('GET', url, headers)
+    if response.status == 200 and start is not None:
+      # The server ignored the range and sent the whole file.
+      return data[start:end]
+    if response.status not in (200, 206):
+      raise IOError('Request to %s failed with status %d' %
+                    (url, response.status))
+    return data
+
+  def get_size(self, url):
+    """Returns the size of a file, with a HEAD request.
+
+    Raises:
+      IOError: if the server returns an error status or no size, or the
+        request fails max_retries + 1 times.
+    """
+    response, _ = self._send('HEAD', url, {})
+    size = response.getheader('Content-Length')
+    if response.status != 200 or size is None:
+      raise IOError('Could not get the size of %s, status %d' %
+                    (url, response.status))
+    return int(size)
+
+  def _send(self, method, url, headers):
+    """Sends a request, retrying on errors, and returns its response and body."""
+    parsed = urllib.parse.urlsplit(url)
+    target = parsed.path + ('?' + parsed.query if parsed.query else '')
+    for attempt in range(self.max_retries + 1):
+      connection = self.get_connection(parsed.netloc, parsed.scheme,
+                                       new=attempt > 0)
+      request_start = time.time()
+      try:
+        connection.request(method, target, headers=headers)
+        response = connection.getresponse()
+        data = response.read()
+      except (http.client.HTTPException, OSError) as e:
+        if attempt == self.max_retries:
+          raise IOError('Request to %s failed: %s' % (url, e))
+        logging.warning('Retrying request to %s after: %s', url, e)
+        continue
+      with self.lock:
+        self.metrics['requests'] += 1
+        self.metrics['bytes_fetched'] += len(data)
+        self.metrics['request_seconds'] += time.time() - request_start
+      return response, data
+
+  def _get_block_path(self, url, block):
+    digest = hashlib.md5(url.encode('utf-8')).hexdigest()
+    return os.path.join(self.disk_cache_dir, '%s_%d' % (digest, block))
+
+  def _get_cached_block(self, url, block):
+    """Returns a block from the memory or the disk cache, or None."""
+    key = (url, block)
+    with self.lock:
+      data = self.blocks.get(key)
+      if data is not None:
+        self.blocks.move_to_end(key)
+        self.metrics['memory_hits'] += 1
+        return data
+    if self.disk_cache_dir:
+      try:
+        with open(self._get_block_path(url, block), 'rb') as f:
+          data = f.read()
+      except FileNotFoundError:
+        return None
+      self._cache_block(url, block, data, to_disk=False)
+      with self.lock:
+        self.metrics['disk_hits'] += 1
+      return data
+    return None
+
+  def _cache_block(self, url, block, data, to_disk=True):
+    """Adds a block to the memory cache, evicting the least recent ones."""
+    with self.lock:
+      key = (url, block)
+      if key not in self.blocks:
+        self.blocks[key] = data
+        self.cached_bytes += len(data)
+      while self.cached_bytes > self.memory_cache_bytes and self.blocks:
+        _, evicted = self.blocks.popitem(last=False)
+        self.cached_bytes -= len(evicted)
+    if to_disk and self.disk_cache_dir:
+      path = self._get_block_path(url, block)
+      tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+      with open(tmp_path, 'wb') as f:
+        f.write(data)
+      os.replace(tmp_path, path)
+
+  def read_ranges(self, url, ranges):
+    """Reads several byte ranges of a file.
+
+    The blocks covering the ranges are read from the cache, and the missing
+    ones fetched with one request per run of consecutive blocks.
+
+    Args:
+      url: the url of the file.
+      ranges: a list of (start, end) tuples, the byte ranges to read.
+
+    Returns:
+      A list with the bytes of each range.
+    """
+    needed = sorted(set(
+        block for start, end in ranges if end > start
+        for block in range(start // self.block_size,
+                           (end - 1) // self.block_size + 1)))
+    blocks = {}
+    missing = []
+    for block in needed:
+      data = self._get_cached_block(url, block)
+      if data is None:
+        missing.append(block)
+      else:
+        blocks[block] = data
+    with self.lock:
+      self.metrics['misses'] += len(missing)
+
+    # Coalesce the missing blocks into runs of consecutive blocks.
+    runs = []
+    for block in missing:
+      if runs and runs[-1][1] == block:
+        runs[-1][1] = block + 1
+      else:
+        runs.append([block, block + 1])
+    for first, last in runs:
+      data = self.request(url, first * self.block_size,
+                          last * self.block_size)
+      for block in range(first, last):
+        offset = (block - first) * self.block_size
+        blocks[block] = data[offset:offset + self.block_size]
+        self._cache_block(url, block, blocks[block])
+
+    results = []
+    for start, end in ranges:
+      chunks = []
+      for block in range(start // self.block_size,
+                         (end - 1) // self.block_size + 1):
+        block_start = block * self.block_size
+        chunks.append(blocks[block][max(start - block_start, 0):
+                                    end - block_start])
+      data = b''.join(chunks)
+      if len(data) != end - start:
+        raise IOError('Truncated range [%d, %d) of %s' % (start, end, url))
+      results.append(data)
+    return results
+
+  def get_metrics(self):
+    """Returns the metrics of this process."""
+    with self.lock:
+      return dict(self.metrics)
+
+
+def load_records_index(reader, base_url):
+  """Fetches the records index of a dataset served over HTTP.
+
+  Unlike RecordsIndex.load, the index is not checked against the stamps of
+  the files, which are not available over HTTP.
+
+  Args:
+    reader: an HttpRangeReader.
+    base_url: the url of the directory of the records.
+
+  Returns:
+    A RecordsIndex with its offsets in memory, or None if the dataset has no
+    index.
+  """
+  try:
+    data = json.loads(reader.request(
+        join_url(base_url, records_index.INDEX_FILENAME)).decode('utf-8'))
+  except IOError:
+    return None
+  if data.get('version') != records_index.INDEX_FORMAT_VERSION:
+    logging.warning('Ignoring the records index of %s, which has an unknown '
+                    'version.', base_url)
+    return None
+  offsets = np.load(io.BytesIO(reader.request(
+      join_url(base_url, records_index.OFFSETS_FILENAME))))
+  return records_index.RecordsIndex(base_url, data['classes'], data['files'],
+                                    offsets)
+
+
+def load_tfrecord_index(reader, url):
+  """Fetches the index stored next to a TFRecord file by load_index.
+
+  If the file has no index, it is built by scan_tfrecord_index.
+
+  Args:
+    reader: an HttpRangeReader.
+    url: the url of the TFRecord file.
+
+  Returns:
+    The index of the file, see tfrecord_format.build_index.
+  """
+  try:
+    data = reader.request(url + tfrecord_format.INDEX_SUFFIX)
+  except IOError:
+    logging.info('No index of %s, scanning its records.', url)
+    return scan_tfrecord_index(reader, url)
+  return np.load(io.BytesIO(data))
+
+
+def scan_tfrecord_index(reader, url):
+  """Builds the index of a TFRecord file served over HTTP.
+
+  The header of each record is read in turn through the block cache of the
+  reader, so the file is fetched a block at a time, with one range request
+  per block, and the blocks are cached for reading the records afterwards.
+
+  Args:
+    reader: an HttpRangeReader.
+    url: the url of the TFRecord file.
+
+  Returns:
+    The index of the file, see tfrecord_format.build_index.
+
+  Raises:
+    ValueError: if the file is truncated or a length checksum does not match.
+  """
+  size = reader.get_size(url)
+  index = []
+  offset = 0
+  while offset < size:
+    header_end = min(offset + tfrecord_format.HEADER_SIZE, size)
+    header, = reader.read_ranges(url, [(offset, header_end)])
+    length = tfrecord_format.parse_header(header, url, offset)
+    data_offset = offset + tfrecord_format.HEADER_SIZE
+    offset = data_offset + length + tfrecord_format.FOOTER_SIZE
+    if offset > size:
+      raise ValueError('Truncated record in {} at offset {}.'.format(
+          url, data_offset))
+    index.append((data_offset, length))
+  return np.array(index, dtype=np.int64).reshape((-1, 2))
+
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+  """Serves files with support for single range requests and keep-alive.
+
+  A stand-in for a remote store. Subclasses can set latency, in seconds, which
+  is added to every request.
+  """
+
+  protocol_version = 'HTTP/1.1'
+  latency = 0.
+
+  def send_head(self):
+    path = self.translate_path(self.path)
+    if os.path.isdir(path):
+      self.send_error(404, 'Directories are not served')
+      return None
+    try:
+      f = open(path, 'rb')
+    except OSError:
+      self.send_error(404, 'File not found')
+      return None
+    size = os.fstat(f.fileno()).st_size
+    start, end = 0, size
+    match = _RANGE_RE.match(self.headers.get('Range', ''))
+    if match is not None:
+      start = int(match.group(1))
+      end = min(int(match.group(2)) + 1 if match.group(2) else size, size)
+      if start >= size:
+        f.close()
+        self.send_error(416, 'Requested range not satisfiable')
+        return None
+      self.send_response(206)
+      self.send_header('Content-Range',
+                       'bytes %d-%d/%d' % (start, end - 1, size))
+    else:
+      self.send_response(200)
+    self.send_header('Content-Type', 'application/octet-stream')
+    self.send_header('Content-Length', str(end - start))
+    self.send_header('Accept-Ranges', 'bytes')
+    self.end_headers()
+    f.seek(start)
+    return io.BytesIO(f.read(end - start))
+
+  def do_GET(self):
+    if self.latency:
+      time.sleep(self.latency)
+    super(RangeRequestHandler, self).do_GET()
+
+  def log_message(self, format, *args):
+    pass
+
+
+def serve_directory(directory, latency=0.):
+  """Serves a directory over HTTP in a background thread.
+
+  Args:
+    directory: the directory to serve.
+    latency: float, seconds added to every request.
+
+  Returns:
+    The server, whose base url is 'http://127.0.0.1:%d' % server.server_port.
+    Call server.shutdown() to stop it.
+  """
+  handler = type('Handler', (RangeRequestHandler,), {'latency': latency})
+
+  def make_handler(*args, **kwargs):
+    return handler(*args, directory=directory, **kwargs)
+
+  server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), make_handler)
+  server.daemon_threads = True
+  thread = threading.Thread(target=server.serve_forever, args=(0.05,),
+                            daemon=True)
+  thread.start()
+  return server
@@ -0,0 +1,154 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for `http_records` module."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import pickle as pkl
+import shutil
+import tempfile
+import unittest
+
+from meta_dataset.data import http_records
+from meta_dataset.data import records_index
+from meta_dataset.data import tfrecord_format
+from meta_dataset.data import tfrecord_test_utils
+from meta_dataset.data.dataset_spec import DatasetSpecification
+from meta_dataset.data.learning_spec import Split
+import numpy as np
+
+BLOCK_SIZE = 64
+
+
+class HttpRangeReaderTest(unittest.TestCase):
+
+  def setUp(self):
+    super(HttpRangeReaderTest, self).setUp()
+    self.directory = tempfile.mkdtemp()
+    self.content = np.random.RandomState(0).bytes(1000)
+    with open(os.path.join(self.directory, 'data.bin'), 'wb') as f:
+      f.write(self.content)
+    self.server = http_records.serve_directory(self.directory)
+    self.base_url = 'http://127.0.0.1:%d' % self.server.server_port
+    self.url = http_records.join_url(self.base_url, 'data.bin')
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+    shutil.rmtree(self.directory)
+    super(HttpRangeReaderTest, self).tearDown()
+
+  def test_read_ranges(self):
+    reader = http_records.HttpRangeReader(block_size=BLOCK_SIZE)
+    ranges = [(10, 20), (5, 300), (990, 1000), (0, 0)]
+    self.assertEqual(reader.read_ranges(self.url, ranges),
+                     [self.content[start:end] for start, end in ranges])
+
+  def test_coalesced_requests(self):
+    reader = http_records.HttpRangeReader(block_size=BLOCK_SIZE)
+    # Blocks 0 to 2 and block 10 are fetched with two requests.
+    reader.read_ranges(self.url, [(0, 10), (70, 150), (130, 140), (650, 660)])
+    self.assertEqual(reader.get_metrics()['requests'], 2)
+    self.assertEqual(reader.get_metrics()['misses'], 4)
+    reader.read_ranges(self.url, [(100, 110), (660, 670)])
+    self.assertEqual(reader.get_metrics()['requests'], 2)
+    self.assertEqual(reader.get_metrics()['memory_hits'], 2)
+
+  def test_memory_budget(self):
+    reader = http_records.HttpRangeReader(block_size=BLOCK_SIZE,
+                                          memory_cache_bytes=2 * BLOCK_SIZE)
+    reader.read_ranges(self.url, [(0, 5 * BLOCK_SIZE)])
+    self.assertLessEqual(reader.cached_bytes, 2 * BLOCK_SIZE)
+    reader.read_ranges(self.url, [(0, 10)])
+    self.assertEqual(reader.get_metrics()['requests'], 2)
+
+  def test_disk_cache(self):
+    cache_dir = tempfile.mkdtemp()
+    try:
+      reader = http_records.HttpRangeReader(block_size=BLOCK_SIZE,
+                                            disk_cache_dir=cache_dir)
+      reader.read_ranges(self.url, [(0, 200)])
+      # A reader unpickled in a worker has its own, empty, memory cache.
+      reader = pkl.loads(pkl.dumps(reader))
+      self.assertEqual(reader.read_ranges(self.url, [(50, 150)]),
+                       [self.content[50:150]])
+      self.assertEqual(reader.get_metrics()['requests'], 0)
+      self.assertEqual(reader.get_metrics()['disk_hits'], 3)
+    finally:
+      shutil.rmtree(cache_dir)
+
+  def test_missing_file(self):
+    reader = http_records.HttpRangeReader(block_size=BLOCK_SIZE)
+    with self.assertRaises(IOError):
+      reader.request(http_records.join_url(self.base_url, 'missing.bin'))
+    # The connection is still usable.
+    self.assertEqual(reader.request(self.url, 0, 10), self.content[:10])
+
+  def test_load_records_index(self):
+    reader = http_records.HttpRangeReader(block_size=BLOCK_SIZE)
+    self.assertIsNone(http_records.load_records_index(reader, self.base_url))
+    records = [
+        tfrecord_test_utils.serialize_example({'image': [bytes([i]) * (i + 1)]})
+        for i in range(5)
+    ]
+    tfrecord_test_utils.write_records(
+        os.path.join(self.directory, '0.tfrecords'), records)
+    spec = DatasetSpecification(
+        name='toy', classes_per_split={Split.TRAIN: 1, Split.VALID: 0,
+                                       Split.TEST: 0},
+        images_per_class={0: 5}, class_names=None, path=self.directory,
+        file_pattern='{}.tfrecords')
+    index = records_index.RecordsIndex.build(spec, 1)
+    index.save()
+    remote_index = http_records.load_records_index(reader, self.base_url)
+    np.testing.assert_array_equal(remote_index.get_image_offsets(0),
+                                  index.get_image_offsets(0))
+    url = http_records.join_url(self.base_url, '0.tfrecords')
+    ranges = [(int(o), int(o + n)) for o, n in index.get_image_offsets(0)]
+    self.assertEqual(reader.read_ranges(url, ranges), records)
+
+  def test_scan_tfrecord_index(self):
+    reader = http_records.HttpRangeReader(block_size=BLOCK_SIZE)
+    path = os.path.join(self.directory, '0.tfrecords')
+    tfrecord_test_utils.write_records(
+        path, [bytes([i]) * (10 * i) for i in range(20)])
+    url = http_records.join_url(self.base_url, '0.tfrecords')
+    self.assertEqual(reader.get_size(url), os.path.getsize(path))
+    # Without an index next to the file, its records are scanned.
+    np.testing.assert_array_equal(http_records.load_tfrecord_index(reader, url),
+                                  tfrecord_format.build_index(path))
+    tfrecord_format.load_index(path)
+    requests = reader.get_metrics()['requests']
+    np.testing.assert_array_equal(http_records.load_tfrecord_index(reader, url),
+                                  tfrecord_format.build_index(path))
+    self.assertEqual(reader.get_metrics()['requests'], requests + 1)
+
+  def test_scan_truncated(self):
+    reader = http_records.HttpRangeReader(block_size=BLOCK_SIZE)
+    path = os.path.join(self.directory, '0.tfrecords')
+    tfrecord_test_utils.write_records(path, [b'a' * 100, b'b' * 100])
+    with open(path, 'r+b') as f:
+      f.truncate(os.path.getsize(path) - 10)
+    with self.assertRaises(ValueError):
+      http_records.scan_tfrecord_index(
+          reader, http_records.join_url(self.base_url, '0.tfrecords'))
+
+
+if __name__ == '__main__':
+  unittest.main()
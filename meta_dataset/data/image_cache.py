@@ -0,0 +1,450 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tiered cache of the images read by the backends.
+
+Images are cached by (dataset, class_id, index) and the identity of the
+records of the class, e.g. the path, size and modification time of its file,
+so that records converted again are not read from the shared tiers. Images are
+cached in up to three tiers, each with its own byte budget:
+
+  * decoded: the decoded uint8 images, stored raw (see image_codecs.encode_raw)
+    in a directory in shared memory (/dev/shm), so that all the DataLoader
+    workers and ranks of a node share them. A hit skips reading and decoding.
+  * encoded: the encoded images, in the memory of each process. A hit skips
+    reading.
+  * disk: the encoded images, in a directory on a local disk, shared by the
+    processes of the node. A hit skips reading from the records, which may be
+    on a network filesystem.
+
+Each tier evicts the least recently (lru) or least frequently (lfu) used
+images when it exceeds its budget. The shared tiers count the accesses of each
+image in a frequency sketch, an array of counters memory-mapped by every
+process, which is halved periodically so that old accesses fade. Their budget
+is enforced approximately: each process scans its tier and evicts after having
+added a tenth of the budget.
+
+The statistics of each tier, per dataset, tell how to size them. Those of each
+process are returned by get_stats(), and the hits, misses, bytes put and
+evictions of all the processes are added up by the pipeline statistics, if
+they are enabled (see meta_dataset.data.pipeline_stats).
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+import threading
+
+from meta_dataset.data import image_codecs
+from meta_dataset.data import pipeline_stats
+import gin
+import numpy as np
+
+TIERS = ('decoded', 'encoded', 'disk')
+POLICIES = ('lru', 'lfu')
+
+# Fraction of its budget a tier is evicted down to.
+_EVICTION_TARGET = 0.9
+_SKETCH_FILENAME = 'frequencies.bin'
+_LOCK_FILENAME = 'tier.lock'
+_SKETCH_SIZE = 2 ** 20
+
+
+def get_key_digest(dataset, class_id, index, records_id=''):
+  """Returns the hex digest naming an image in the shared tiers."""
+  key = '%s|%s|%d|%s' % (dataset, class_id, index, records_id)
+  return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
+class MemoryTier(object):
+  """Images kept in the memory of the process, under a byte budget."""
+
+  def __init__(self, max_bytes, policy='lru', name=None):
+    """Initializes the tier.
+
+    Args:
+      max_bytes: int, the budget of the tier.
+      policy: 'lru' or 'lfu', the eviction policy.
+      name: optional name of the tier, whose evictions are then counted by the
+        pipeline statistics.
+    """
+    self.max_bytes = max_bytes
+    self.policy = policy
+    self.name = name
+    self.entries = collections.OrderedDict()
+    self.counts = collections.Counter()
+    self.num_bytes = 0
+    self.evictions = 0
+
+  def get(self, key):
+    value = self.entries.get(key)
+    if value is not None:
+      self.entries.move_to_end(key)
+      self.counts[key] += 1
+    return value
+
+  def put(self, key, value):
+    if key in self.entries or value.nbytes > self.max_bytes:
+      return
+    self.entries[key] = value
+    self.counts[key] += 1
+    self.num_bytes += value.nbytes
+    if self.num_bytes > self.max_bytes:
+      self.evict(int(self.max_bytes * _EVICTION_TARGET), keep=key)
+
+  def evict(self, max_bytes, keep=None):
+    """Evicts entries until they fit in max_bytes.
+
+    Args:
+      max_bytes: int, the size to evict down to.
+      keep: a key that is evicted last, e.g. the one just put, which would
+        otherwise be the least frequently used.
+    """
+    if self.policy == 'lru':
+      victims = iter(list(self.entries))
+    else:
+      # Least frequent first, and least recent among equally frequent ones.
+      recency = dict((k, i) for i, k in enumerate(self.entries))
+      victims = iter(sorted(self.entries,
+                            key=lambda k: (k == keep, self.counts[k],
+                                           recency[k])))
+    while self.num_bytes > max_bytes:
+      key = next(victims)
+      self.num_bytes -= self.entries.pop(key).nbytes
+      del self.counts[key]
+      self.evictions += 1
+      _count_eviction(self.name)
+
+
+class DirectoryTier(object):
+  """Images stored as files in a directory shared by the processes of a node.
+
+  Files are written atomically and removed without locking: a process reading
+  a file that is being evicted still reads it whole. Only eviction takes a lock
+  on the directory, so that processes do not evict the same files.
+  """
+
+  def __init__(self, directory, max_bytes, policy='lru', name=None):
+    """Initializes the tier.
+
+    Args:
+      directory: the directory of the images, created if needed.
+      max_bytes: int, the budget of the tier.
+      policy: 'lru' or 'lfu', the eviction policy.
+      name: optional name of the tier, whose evictions are then counted by the
+        pipeline statistics.
+    """
+    self.directory = directory
+    self.max_bytes = max_bytes
+    self.policy = policy
+    self.name = name
+    self.bytes_since_eviction = 0
+    self.num_bytes = 0
+    self.evictions = 0
+    self.sketch = None
+    self.sketch_increments = 0
+    os.makedirs(directory, exist_ok=True)
+
+  def __getstate__(self):
+    state = dict(self.__dict__)
+    state['sketch'] = None
+    return state
+
+  def get_sketch(self):
+    """Returns the frequency counters, shared through a memory-mapped file."""
+    if self.sketch is None:
+      path = os.path.join(self.directory, _SKETCH_FILENAME)
+      with open(path, 'ab') as f:
+        if f.tell() < _SKETCH_SIZE * 4:
+          f.truncate(_SKETCH_SIZE * 4)
+      self.sketch = np.memmap(path, dtype=np.uint32, mode='r+',
+                              shape=(_SKETCH_SIZE,))
+    return self.sketch
+
+  def _get_counter(self, digest):
+    return int(digest[:8], 16) % _SKETCH_SIZE
+
+  def record_access(self, digest):
+    """Counts an access in the sketch, halving the counters periodically."""
+    if self.policy != 'lfu':
+      return
+    sketch = self.get_sketch()
+    sketch[self._get_counter(digest)] += 1
+    self.sketch_increments += 1
+    # Increments of concurrent processes may be lost, which only makes the
+    # counts approximate.
+    if self.sketch_increments >= _SKETCH_SIZE:
+      sketch //= 2
+      self.sketch_increments = 0
+
+  def get_path(self, digest):
+    return os.path.join(self.directory, digest[:2], digest)
+
+  def get(self, digest):
+    path = self.get_path(digest)
+    try:
+      value = np.fromfile(path, dtype=np.uint8)
+    except (FileNotFoundError, ValueError):
+      return None
+    if self.policy == 'lru':
+      try:
+        os.utime(path)
+      except FileNotFoundError:
+        pass
+    self.record_access(digest)
+    return value
+
+  def put(self, digest, value):
+    data = np.ascontiguousarray(value, dtype=np.uint8)
+    if data.nbytes > self.max_bytes:
+      return
+    path = self.get_path(digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+    data.tofile(tmp_path)
+    os.replace(tmp_path, path)
+    self.record_access(digest)
+    self.bytes_since_eviction += data.nbytes
+    self.num_bytes += data.nbytes
+    if self.bytes_since_eviction > self.max_bytes * (1 - _EVICTION_TARGET):
+      self.evict(int(self.max_bytes * _EVICTION_TARGET))
+
+  def list_entries(self):
+    """Returns the (digest, path, size, mtime) of the stored images."""
+    entries = []
+    for subdir in os.scandir(self.directory):
+      if not subdir.is_dir():
+        continue
+      for entry in os.scandir(subdir.path):
+        if entry.name.endswith('.tmp'):
+          continue
+        try:
+          stat = entry.stat()
+        except FileNotFoundError:
+          continue
+        entries.append((entry.name, entry.path, stat.st_size,
+                        stat.st_mtime_ns))
+    return entries
+
+  def evict(self, max_bytes):
+    """Evicts images until they fit in max_bytes."""
+    with open(os.path.join(self.directory, _LOCK_FILENAME), 'a') as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+      entries = self.list_entries()
+      total = sum(e[2] for e in entries)
+      if total > max_bytes:
+        if self.policy == 'lru':
+          entries.sort(key=lambda e: e[3])
+        else:
+          sketch = self.get_sketch()
+          entries.sort(key=lambda e: (sketch[self._get_counter(e[0])], e[3]))
+        for _, path, size, _ in entries:
+          if total <= max_bytes:
+            break
+          with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+          total -= size
+          self.evictions += 1
+          _count_eviction(self.name)
+    self.num_bytes = total
+    self.bytes_since_eviction = 0
+
+
+class TieredImageCache(object):
+  """Caches the images of the backends in up to three tiers.
+
+  The cache can be pickled to DataLoader workers, each of which starts with an
+  empty encoded tier and its own statistics.
+  """
+
+  def __init__(self, decoded_bytes=0, encoded_bytes=0, disk_bytes=0,
+               decoded_dir='/dev/shm/meta_dataset_image_cache',
+               disk_dir=None, decoded_policy='lru', encoded_policy='lru',
+               disk_policy='lru'):
+    """Initializes the cache.
+
+    Args:
+      decoded_bytes: int, the budget of the decoded tier, 0 to disable it.
+      encoded_bytes: int, the budget of the encoded tier of each process, 0 to
+        disable it.
+      disk_bytes: int, the budget of the disk tier, 0 to disable it.
+      decoded_dir: the directory of the decoded tier, which should be in
+        shared memory.
+      disk_dir: the directory of the disk tier, required if disk_bytes > 0.
+      decoded_policy: 'lru' or 'lfu', the eviction policy of the decoded tier.
+      encoded_policy: 'lru' or 'lfu', the eviction policy of the encoded tier.
+      disk_policy: 'lru' or 'lfu', the eviction policy of the disk tier.
+
+    Raises:
+      ValueError: if a policy is unknown, or disk_bytes is set without a
+        disk_dir.
+    """
+    for policy in (decoded_policy, encoded_policy, disk_policy):
+      if policy not in POLICIES:
+        raise ValueError('Unknown eviction policy %r, expected one of %s' %
+                         (policy, POLICIES))
+    if disk_bytes and not disk_dir:
+      raise ValueError('The disk tier requires a disk_dir')
+    self.decoded = (DirectoryTier(decoded_dir, decoded_bytes, decoded_policy,
+                                  'decoded') if decoded_bytes else None)
+    self.encoded = (MemoryTier(encoded_bytes, encoded_policy, 'encoded')
+                    if encoded_bytes else None)
+    self.disk = (DirectoryTier(disk_dir, disk_bytes, disk_policy, 'disk')
+                 if disk_bytes else None)
+    self.stats = {}
+
+  def __getstate__(self):
+    state = dict(self.__dict__)
+    if self.encoded is not None:
+      state['encoded'] = MemoryTier(self.encoded.max_bytes,
+                                    self.encoded.policy, self.encoded.name)
+    state['stats'] = {}
+    return state
+
+  def _count(self, dataset, tier, stat, value=1):
+    counters = self.stats.setdefault(dataset, {}).setdefault(
+        tier, collections.Counter())
+    counters[stat] += value
+    pipeline_stats.add_count('image_cache_%s_%s' % (tier, stat), value)
+
+  def get_images(self, dataset, class_id, indices, read_encoded, get_decoder,
+                 records_id=''):
+    """Returns decoded images, reading and decoding only the missing ones.
+
+    Args:
+      dataset: the name of the dataset, or any string identifying its records.
+      class_id: the class of the images.
+      indices: the indices of the images in the class, without repetitions.
+      read_encoded: a function that reads the encoded images of the class at a
+        list of indices, in the order given.
+      get_decoder: a function that returns the function decoding the encoded
+        images into the images cached in the decoded tier. Only called if some
+        image has to be decoded.
+      records_id: a string identifying the records of the class, e.g. the
+        path, size and modification time of its file.
+
+    Returns:
+      A list with the decoded image at each index.
+    """
+    images = [None] * len(indices)
+    encoded = [None] * len(indices)
+    digests = [get_key_digest(dataset, class_id, i, records_id)
+               for i in indices]
+    to_read = []
+    for i, (index, digest) in enumerate(zip(indices, digests)):
+      if self.decoded is not None:
+        raw = self.decoded.get(digest)
+        if raw is not None:
+          images[i] = image_codecs.decode(raw)
+          self._count(dataset, 'decoded', 'hits')
+          continue
+        self._count(dataset, 'decoded', 'misses')
+      if self.encoded is not None:
+        encoded[i] = self.encoded.get(digest)
+        if encoded[i] is not None:
+          self._count(dataset, 'encoded', 'hits')
+          continue
+        self._count(dataset, 'encoded', 'misses')
+      if self.disk is not None:
+        encoded[i] = self.disk.get(digest)
+        if encoded[i] is not None:
+          self._count(dataset, 'disk', 'hits')
+          if self.encoded is not None:
+            self.encoded.put(digest, encoded[i])
+          continue
+        self._count(dataset, 'disk', 'misses')
+      to_read.append(i)
+
+    if to_read:
+      for i, im in zip(to_read, read_encoded([indices[i] for i in to_read])):
+        encoded[i] = np.asarray(im)
+        for tier_name, tier in (('encoded', self.encoded), ('disk', self.disk)):
+          if tier is not None:
+            tier.put(digests[i], encoded[i])
+            self._count(dataset, tier_name, 'bytes_put', encoded[i].nbytes)
+
+    decoder = None
+    for i, digest in enumerate(digests):
+      if images[i] is not None:
+        continue
+      if decoder is None:
+        decoder = get_decoder()
+      images[i] = decoder(encoded[i])
+      if self.decoded is not None:
+        raw = image_codecs.encode_raw(images[i])
+        self.decoded.put(digest, raw)
+        self._count(dataset, 'decoded', 'bytes_put', raw.nbytes)
+    return images
+
+  def get_stats(self):
+    """Returns the statistics of this process.
+
+    Returns:
+      A dict with, for each dataset, a dict with the hits, misses, hit rate and
+      bytes put of each tier, and under 'tiers' the size in bytes and evictions
+      of each tier. The size of a shared tier is the one found at its last
+      eviction plus the bytes this process put since.
+    """
+    stats = {}
+    for dataset, tiers in self.stats.items():
+      stats[dataset] = {}
+      for tier, counters in tiers.items():
+        counters = dict(counters)
+        lookups = counters.get('hits', 0) + counters.get('misses', 0)
+        counters['hit_rate'] = (counters.get('hits', 0) / lookups
+                                if lookups else 0.)
+        stats[dataset][tier] = counters
+    stats['tiers'] = {}
+    for name in TIERS:
+      tier = getattr(self, name)
+      if tier is not None:
+        stats['tiers'][name] = dict(bytes=tier.num_bytes,
+                                    max_bytes=tier.max_bytes,
+                                    evictions=tier.evictions)
+    return stats
+
+  def log_stats(self):
+    """Logs the statistics of this process."""
+    for dataset, tiers in sorted(self.get_stats().items()):
+      for tier, counters in sorted(tiers.items()):
+        logging.info('Image cache, %s, %s: %s', dataset, tier, counters)
+
+
+def _count_eviction(tier_name):
+  if tier_name is not None:
+    pipeline_stats.add_count('image_cache_%s_evictions' % tier_name)
+
+
+@gin.configurable('ImageCache')
+def make_image_cache(decoded_bytes=0, encoded_bytes=0, disk_bytes=0,
+                     decoded_dir='/dev/shm/meta_dataset_image_cache',
+                     disk_dir=None, decoded_policy='lru',
+                     encoded_policy='lru', disk_policy='lru'):
+  """Returns the TieredImageCache configured with gin, or None if disabled.
+
+  See TieredImageCache for the arguments.
+  """
+  if not (decoded_bytes or encoded_bytes or disk_bytes):
+    return None
+  return TieredImageCache(decoded_bytes, encoded_bytes, disk_bytes,
+                          decoded_dir, disk_dir, decoded_policy,
+                          encoded_policy, disk_policy)
@@ -0,0 +1,206 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for `image_cache` module."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import pickle as pkl
+import shutil
+import tempfile
+import unittest
+
+from meta_dataset.data import image_cache
+from meta_dataset.data import pipeline_stats
+import numpy as np
+
+
+class ToyRecords(object):
+  """Encoded images of a class, counting the reads and decodes."""
+
+  def __init__(self, num_images=10):
+    self.images = [np.full((4, 4, 3), i, dtype=np.uint8)
+                   for i in range(num_images)]
+    self.reads = []
+    self.decodes = 0
+
+  def read_encoded(self, indices):
+    self.reads.append(list(indices))
+    return [self.images[i].ravel() for i in indices]
+
+  def get_decoder(self):
+    def decode(encoded):
+      self.decodes += 1
+      return encoded.reshape(4, 4, 3)
+    return decode
+
+  def get_images(self, cache, indices, dataset='toy', records_id=''):
+    return cache.get_images(dataset, '0', indices, self.read_encoded,
+                            self.get_decoder, records_id)
+
+
+class MemoryTierTest(unittest.TestCase):
+
+  def test_lru_eviction(self):
+    tier = image_cache.MemoryTier(35, 'lru')
+    for key in 'abc':
+      tier.put(key, np.zeros(10, np.uint8))
+    tier.get('a')
+    tier.put('d', np.zeros(10, np.uint8))
+    self.assertEqual(sorted(tier.entries), ['a', 'c', 'd'])
+    self.assertEqual(tier.evictions, 1)
+
+  def test_lfu_eviction(self):
+    tier = image_cache.MemoryTier(35, 'lfu')
+    for key in 'abc':
+      tier.put(key, np.zeros(10, np.uint8))
+    tier.get('b')
+    tier.get('a')
+    tier.get('c')
+    tier.get('a')
+    tier.put('d', np.zeros(10, np.uint8))
+    # b and c were used as often, and b less recently.
+    self.assertEqual(sorted(tier.entries), ['a', 'c', 'd'])
+
+
+class DirectoryTierTest(unittest.TestCase):
+
+  def setUp(self):
+    super(DirectoryTierTest, self).setUp()
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+    super(DirectoryTierTest, self).tearDown()
+
+  def test_put_get(self):
+    tier = image_cache.DirectoryTier(self.directory, 1000)
+    digest = image_cache.get_key_digest('toy', '0', 1)
+    self.assertIsNone(tier.get(digest))
+    tier.put(digest, np.arange(10, dtype=np.uint8))
+    # Another process sees the stored images.
+    tier = pkl.loads(pkl.dumps(tier))
+    np.testing.assert_array_equal(tier.get(digest), np.arange(10))
+
+  def test_lfu_eviction(self):
+    tier = image_cache.DirectoryTier(self.directory, 120, 'lfu')
+    digests = [image_cache.get_key_digest('toy', '0', i) for i in range(5)]
+    for digest in digests[:4]:
+      tier.put(digest, np.zeros(25, np.uint8))
+    for digest in digests[1:4]:
+      tier.get(digest)
+    tier.put(digests[4], np.zeros(25, np.uint8))
+    self.assertIsNone(tier.get(digests[0]))
+    for digest in digests[1:]:
+      self.assertIsNotNone(tier.get(digest))
+    self.assertEqual(tier.num_bytes, 100)
+
+
+class TieredImageCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    super(TieredImageCacheTest, self).setUp()
+    self.decoded_dir = tempfile.mkdtemp()
+    self.disk_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.decoded_dir)
+    shutil.rmtree(self.disk_dir)
+    super(TieredImageCacheTest, self).tearDown()
+
+  def test_decoded_hits_skip_decoding(self):
+    cache = image_cache.TieredImageCache(decoded_bytes=10000,
+                                         decoded_dir=self.decoded_dir)
+    records = ToyRecords()
+    images = records.get_images(cache, [1, 3])
+    self.assertEqual(records.decodes, 2)
+    cache = pkl.loads(pkl.dumps(cache))
+    cached = records.get_images(cache, [1, 2, 3])
+    self.assertEqual(records.reads, [[1, 3], [2]])
+    self.assertEqual(records.decodes, 3)
+    for image, index in zip(cached, [1, 2, 3]):
+      np.testing.assert_array_equal(image, records.images[index])
+    np.testing.assert_array_equal(cached[0], images[0])
+    stats = cache.get_stats()['toy']['decoded']
+    self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+
+  def test_encoded_and_disk_tiers(self):
+    cache = image_cache.TieredImageCache(encoded_bytes=1000, disk_bytes=1000,
+                                         disk_dir=self.disk_dir)
+    records = ToyRecords()
+    records.get_images(cache, [0, 1])
+    records.get_images(cache, [0, 1])
+    self.assertEqual(records.reads, [[0, 1]])
+    # A new worker has an empty encoded tier but shares the disk tier.
+    worker_cache = pkl.loads(pkl.dumps(cache))
+    images = records.get_images(worker_cache, [1])
+    self.assertEqual(records.reads, [[0, 1]])
+    np.testing.assert_array_equal(images[0], records.images[1])
+    stats = worker_cache.get_stats()['toy']
+    self.assertEqual(stats['encoded']['misses'], 1)
+    self.assertEqual(stats['disk']['hit_rate'], 1.)
+    self.assertEqual(records.decodes, 5)
+
+  def test_stats_per_dataset(self):
+    cache = image_cache.TieredImageCache(encoded_bytes=1000)
+    records = ToyRecords()
+    records.get_images(cache, [0, 1], dataset='a')
+    records.get_images(cache, [0], dataset='a')
+    records.get_images(cache, [0], dataset='b')
+    stats = cache.get_stats()
+    self.assertEqual(stats['a']['encoded']['hit_rate'], 1. / 3)
+    self.assertEqual(stats['a']['encoded']['bytes_put'], 96)
+    self.assertEqual(stats['b']['encoded']['misses'], 1)
+    self.assertEqual(stats['tiers']['encoded']['bytes'], 144)
+
+  def test_records_id(self):
+    cache = image_cache.TieredImageCache(decoded_bytes=10000,
+                                         decoded_dir=self.decoded_dir)
+    records = ToyRecords()
+    records.get_images(cache, [0], records_id='0.h5:48:1')
+    records.get_images(cache, [0], records_id='0.h5:48:1')
+    self.assertEqual(records.reads, [[0]])
+    # The records were converted again.
+    records.images[0] = records.images[0] + 1
+    images = records.get_images(cache, [0], records_id='0.h5:48:2')
+    self.assertEqual(records.reads, [[0], [0]])
+    np.testing.assert_array_equal(images[0], records.images[0])
+
+  def test_pipeline_counters(self):
+    pipeline_stats._pipeline_stats = pipeline_stats.PipelineStats(max_processes=1)
+    try:
+      cache = image_cache.TieredImageCache(encoded_bytes=100)
+      records = ToyRecords()
+      records.get_images(cache, [0, 1])
+      records.get_images(cache, [1, 2, 3])
+      self.assertEqual(pipeline_stats._pipeline_stats.get_counters(), {
+          'image_cache_encoded_hits': 1, 'image_cache_encoded_misses': 4,
+          'image_cache_encoded_bytes_put': 192,
+          'image_cache_encoded_evictions': 2})
+    finally:
+      pipeline_stats._pipeline_stats = None
+
+  def test_make_image_cache(self):
+    self.assertIsNone(image_cache.make_image_cache())
+    with self.assertRaises(ValueError):
+      image_cache.make_image_cache(encoded_bytes=10, encoded_policy='fifo')
+    with self.assertRaises(ValueError):
+      image_cache.make_image_cache(disk_bytes=10)
+
+
+if __name__ == '__main__':
+  unittest.main()
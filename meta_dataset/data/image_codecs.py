@@ -0,0 +1,162 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Codecs of the images stored in the hdf5 files.
+
+A codec is selected with a spec string, "<name>[:<param>]":
+
+  jpeg[:quality]     JPEG, quality in [0, 100], 95 by default (cv2's default).
+  png[:compression]  PNG, compression level in [0, 9], 3 by default.
+  webp[:quality]     lossy WebP, quality in [1, 100], 90 by default.
+  webp_lossless      lossless WebP.
+  raw                uncompressed pixels.
+
+Images of every codec are decoded by decode(), so readers do not need to know
+the codec an hdf5 file was written with: JPEG, PNG and WebP are recognized by
+cv2, and raw images start with RAW_MAGIC followed by their shape.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+
+from meta_dataset.utils.lazy_import import lazy_import
+import numpy as np
+
+cv2 = lazy_import('cv2')
+
+DEFAULT_CODEC = 'jpeg'
+
+# Prefix of raw images, which can not be mistaken for a JPEG, PNG or WebP.
+RAW_MAGIC = b'\x93RAW'
+_RAW_HEADER_SIZE = len(RAW_MAGIC) + 3 * 4
+
+# Maps each codec name to its (extension, name of the cv2 parameter, default
+# value).
+_CV2_CODECS = {
+  'jpeg': ('.jpg', 'IMWRITE_JPEG_QUALITY', 95),
+  'png': ('.png', 'IMWRITE_PNG_COMPRESSION', 3),
+  'webp': ('.webp', 'IMWRITE_WEBP_QUALITY', 90),
+  # A WebP quality above 100 selects the lossless mode.
+  'webp_lossless': ('.webp', 'IMWRITE_WEBP_QUALITY', 101),
+}
+
+# The formerly used cv2 extensions are accepted as specs of the same codec.
+_EXTENSIONS = {'.jpg': 'jpeg', '.jpeg': 'jpeg', '.png': 'png', '.webp': 'webp'}
+
+# Codecs compared by the codec benchmark.
+BENCHMARK_CODECS = ('jpeg:75', 'jpeg:90', 'jpeg:95', 'png', 'webp:75',
+                    'webp:90', 'webp_lossless', 'raw')
+
+
+class ImageCodec(
+    collections.namedtuple('ImageCodec', 'name, extension, params')):
+  """An image codec, see get_codec.
+
+  Attributes:
+    name: the name of the codec.
+    extension: the cv2 extension of the codec, or None for raw images.
+    params: the cv2 encoding parameters.
+  """
+
+  @property
+  def is_lossless(self):
+    return self.name in ('png', 'webp_lossless', 'raw')
+
+  def encode(self, im):
+    """Encodes a decoded image as returned by cv2.
+
+    Args:
+      im: a numpy array of uint8 of shape [h, w] or [h, w, c].
+
+    Returns:
+      A 1D numpy array of uint8 with the encoded image.
+
+    Raises:
+      ValueError: if cv2 fails to encode the image.
+    """
+    if self.extension is None:
+      return encode_raw(im)
+    success, encoded = cv2.imencode(self.extension, im, list(self.params))
+    if not success:
+      raise ValueError('Could not encode image with codec {}.'.format(
+        self.name))
+    return encoded.ravel()
+
+  def decode(self, encoded, flags=None):
+    """Decodes an image, see decode."""
+    return decode(encoded, flags)
+
+
+def get_codec(spec):
+  """Returns the ImageCodec of a spec string.
+
+  Args:
+    spec: a codec spec as described in the module docstring, or one of the
+      cv2 extensions '.jpg', '.png' or '.webp' for the codec at its default
+      parameter.
+
+  Raises:
+    ValueError: if the spec is not valid.
+  """
+  spec = _EXTENSIONS.get(spec.lower(), spec.lower())
+  name, _, param = spec.partition(':')
+  if name == 'raw' and not param:
+    return ImageCodec('raw', None, ())
+  if name not in _CV2_CODECS or (param and name == 'webp_lossless'):
+    raise ValueError('Unknown codec spec "{}". Valid codecs are {}.'.format(
+      spec, sorted(list(_CV2_CODECS) + ['raw'])))
+  extension, cv2_param, value = _CV2_CODECS[name]
+  if param:
+    try:
+      value = int(param)
+    except ValueError:
+      raise ValueError('Invalid parameter in codec spec "{}".'.format(spec))
+  return ImageCodec(name, extension, (getattr(cv2, cv2_param), value))
+
+
+def encode_raw(im):
+  """Encodes an image as RAW_MAGIC, its shape as 3 uint32 and its pixels."""
+  im = np.ascontiguousarray(im, dtype=np.uint8)
+  shape = list(im.shape) + [0] * (3 - im.ndim)
+  header = np.frombuffer(RAW_MAGIC, dtype=np.uint8)
+  shape = np.array(shape, dtype=np.uint32).view(np.uint8)
+  return np.concatenate([header, shape, im.ravel()])
+
+
+def decode(encoded, flags=None):
+  """Decodes an image encoded by any codec.
+
+  Args:
+    encoded: a 1D numpy array of uint8 with the encoded image.
+    flags: the cv2 imread flags, cv2.IMREAD_COLOR by default. Raw images are
+      returned as stored, except that cv2.IMREAD_COLOR converts single channel
+      images to BGR, as cv2 does.
+
+  Returns:
+    The decoded image, as returned by cv2.imdecode.
+  """
+  if flags is None:
+    flags = cv2.IMREAD_COLOR
+  if encoded[:len(RAW_MAGIC)].tobytes() != RAW_MAGIC:
+    return cv2.imdecode(encoded, flags)
+  shape = encoded[len(RAW_MAGIC):_RAW_HEADER_SIZE].view(np.uint32)
+  shape = [int(s) for s in shape if s > 0]
+  im = encoded[_RAW_HEADER_SIZE:].reshape(shape)
+  if flags == cv2.IMREAD_COLOR and (im.ndim == 2 or im.shape[2] == 1):
+    im = cv2.cvtColor(im, cv2.COLOR_GRAY2BGR)
+  return im
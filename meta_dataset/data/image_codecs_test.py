@@ -0,0 +1,77 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for `image_codecs` module."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import unittest
+
+import cv2
+from meta_dataset.data import image_codecs
+import numpy as np
+
+
+class ImageCodecsTest(unittest.TestCase):
+
+  def setUp(self):
+    rng = np.random.RandomState(0)
+    self.image = rng.randint(0, 256, size=(33, 17, 3)).astype(np.uint8)
+
+  def test_lossless_codecs_round_trip(self):
+    for spec in ('png', 'png:9', 'webp_lossless', 'raw'):
+      codec = image_codecs.get_codec(spec)
+      self.assertTrue(codec.is_lossless)
+      encoded = codec.encode(self.image)
+      self.assertEqual(encoded.dtype, np.uint8)
+      self.assertEqual(encoded.ndim, 1)
+      np.testing.assert_array_equal(image_codecs.decode(encoded), self.image)
+
+  def test_lossy_codecs(self):
+    for spec in ('jpeg', 'jpeg:50', 'webp:75'):
+      codec = image_codecs.get_codec(spec)
+      self.assertFalse(codec.is_lossless)
+      decoded = image_codecs.decode(codec.encode(self.image))
+      self.assertEqual(decoded.shape, self.image.shape)
+
+  def test_jpeg_quality(self):
+    low = image_codecs.get_codec('jpeg:10').encode(self.image)
+    high = image_codecs.get_codec('jpeg:100').encode(self.image)
+    self.assertLess(low.size, high.size)
+
+  def test_raw_grayscale(self):
+    image = self.image[..., 0]
+    encoded = image_codecs.get_codec('raw').encode(image)
+    np.testing.assert_array_equal(
+      image_codecs.decode(encoded, cv2.IMREAD_UNCHANGED), image)
+    np.testing.assert_array_equal(
+      image_codecs.decode(encoded), cv2.cvtColor(image, cv2.COLOR_GRAY2BGR))
+
+  def test_extensions(self):
+    self.assertEqual(image_codecs.get_codec('.jpg'),
+                     image_codecs.get_codec('jpeg'))
+    self.assertEqual(image_codecs.get_codec('.png'),
+                     image_codecs.get_codec('png'))
+
+  def test_invalid_specs(self):
+    for spec in ('gif', 'jpeg:high', 'webp_lossless:90', 'raw:1'):
+      with self.assertRaises(ValueError):
+        image_codecs.get_codec(spec)
+
+
+if __name__ == '__main__':
+  unittest.main()
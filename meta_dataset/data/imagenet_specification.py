@@ -27,8 +27,12 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import hashlib
+import heapq
 import os
 import pickle as pkl
+import tarfile
 from meta_dataset.data import imagenet_stats
 from meta_dataset.utils.argparse import argparse
 import numpy as np
@@ -41,11 +45,25 @@ parser.add_argument("--path_to_is_a",
                     default='datasets/imagenet/metadata/wordnet.is_a.txt')
 parser.add_argument("--path_to_words",
                     default='datasets/imagenet/metadata/words.txt')
+parser.add_argument("--ilsvrc_2012_train_tar", default='',
+                    help='Path to ILSVRC2012_img_train.tar, which contains a '
+                    'tar per synset. If set, the images are read from it '
+                    'instead of from the synset directories in '
+                    'ilsvrc_2012_data_root, which need not be extracted.')
 
 FLAGS = argparse.FLAGS
 
 class Synset(object):
-  """A Synset object."""
+  """A Synset object.
+
+  Synsets use __slots__, so that graphs with thousands of nodes stay compact in
+  memory and do not need a per-instance __dict__. Their children and parents
+  are still sets of Synsets, since the functions building the splits edit the
+  graphs in place. The integer adjacency arrays of SynsetGraph are only used to
+  serialize them.
+  """
+
+  __slots__ = ('wn_id', 'words', 'children', 'parents')
 
   def __init__(self, wn_id, words, children, parents):
     """Initialize a Synset.
@@ -61,6 +79,21 @@ class Synset(object):
     self.children = children
     self.parents = parents
 
+  def __setstate__(self, state):
+    """Restores a pickled Synset.
+
+    Synsets pickled before the introduction of __slots__ have a dict as state,
+    while slotted ones have a (None, dict) tuple. Both are accepted so that old
+    dataset specifications can still be loaded.
+
+    Args:
+      state: The pickled state of the Synset.
+    """
+    if isinstance(state, tuple):
+      _, state = state
+    for name, value in state.items():
+      setattr(self, name, value)
+
 
 def get_node_ancestors(synset):
   """Create a set consisting of all and only the ancestors of synset.
@@ -201,6 +234,205 @@ def get_synsets_from_ids(wn_ids, synsets):
   return requested_synsets
 
 
+class IndexedGraph(object):
+  """An integer-indexed view of the DAG defined by a set of Synsets.
+
+  Nodes are given integer ids in topological order: every node comes before its
+  children, and ties are broken by WordNet id so that the ids do not depend on
+  the iteration order of the set of nodes. Leaves are additionally numbered from
+  0 to num_leaves - 1 in the same order, and the leaves spanned by each node are
+  stored as a row of a bitset matrix, computed bottom-up by OR-ing the rows of
+  the children of each node.
+
+  Attributes:
+    nodes: A list of Synsets, nodes[i] is the node with id i.
+    node_ids: A dict mapping each Synset to its id.
+    children: A list of np.arrays, the ids of the children of each node.
+    parents: A list of np.arrays, the ids of the parents of each node.
+    leaf_node_ids: An np.array of the node ids of the leaves.
+    leaf_bits: An np.array of uint8 of shape [num_nodes, ceil(num_leaves / 8)],
+      the bitsets (in np.packbits format) of the leaves spanned by each node.
+  """
+
+  def __init__(self, nodes):
+    """Initializes an IndexedGraph.
+
+    Args:
+      nodes: A set of Synsets, closed under the parent / child relations.
+    """
+    nodes = sorted(nodes, key=lambda n: n.wn_id)
+    position = dict((n, i) for i, n in enumerate(nodes))
+    num_parents = [len(n.parents) for n in nodes]
+
+    # Kahn's algorithm, always visiting the available node with the smallest
+    # WordNet id first.
+    available = [position[n] for n in nodes if not n.parents]
+    heapq.heapify(available)
+    self.nodes = []
+    while available:
+      node = nodes[heapq.heappop(available)]
+      self.nodes.append(node)
+      for c in node.children:
+        if c not in position:
+          raise ValueError('Synset {} links to a Synset outside of the '
+                           'graph.'.format(node.wn_id))
+        num_parents[position[c]] -= 1
+        if not num_parents[position[c]]:
+          heapq.heappush(available, position[c])
+    if len(self.nodes) != len(nodes):
+      raise ValueError('The graph has cycles.')
+
+    self.node_ids = dict((n, i) for i, n in enumerate(self.nodes))
+    self.children = [
+        np.array(sorted(self.node_ids[c] for c in n.children), dtype=np.int64)
+        for n in self.nodes
+    ]
+    self.parents = [
+        np.array(sorted(self.node_ids[p] for p in n.parents), dtype=np.int64)
+        for n in self.nodes
+    ]
+    self.leaf_node_ids = np.array(
+        [i for i, n in enumerate(self.nodes) if not n.children], dtype=np.int64)
+
+    # Bottom-up computation of the spanning leaves of each node.
+    self.leaf_bits = np.zeros(
+        (len(self.nodes), (self.num_leaves + 7) // 8), dtype=np.uint8)
+    leaf_bit = np.packbits(np.eye(self.num_leaves, dtype=bool), axis=1)
+    self.leaf_bits[self.leaf_node_ids] = leaf_bit
+    for i in range(len(self.nodes) - 1, -1, -1):
+      if len(self.children[i]):
+        self.leaf_bits[i] = np.bitwise_or.reduce(
+            self.leaf_bits[self.children[i]], axis=0)
+
+  @property
+  def num_nodes(self):
+    return len(self.nodes)
+
+  @property
+  def num_leaves(self):
+    return len(self.leaf_node_ids)
+
+  @property
+  def leaves(self):
+    """A list of the leaf Synsets, in the order of their leaf index."""
+    return [self.nodes[i] for i in self.leaf_node_ids]
+
+  def get_leaf_masks(self, node_ids=None):
+    """Returns the spanned leaves of the given nodes as a boolean matrix.
+
+    Args:
+      node_ids: A sequence of node ids, or None for all nodes.
+
+    Returns:
+      An np.array of bools of shape [len(node_ids), num_leaves].
+    """
+    bits = self.leaf_bits if node_ids is None else self.leaf_bits[node_ids]
+    return np.unpackbits(bits, axis=-1, count=self.num_leaves).astype(bool)
+
+  def get_span_sizes(self):
+    """Returns an np.array with the number of leaves spanned by each node."""
+    return _POPCOUNT[self.leaf_bits].sum(axis=1)
+
+  def get_spanning_leaf_indices(self, node_id):
+    """Returns the (sorted) leaf indices of the leaves spanned by a node."""
+    return np.flatnonzero(self.get_leaf_masks([node_id])[0])
+
+  def get_spanning_leaves(self):
+    """Returns a dict mapping each node to the set of leaf Synsets it spans."""
+    leaves = self.leaves
+    masks = self.get_leaf_masks()
+    return dict((n, set(leaves[j] for j in np.flatnonzero(masks[i])))
+                for i, n in enumerate(self.nodes))
+
+  def get_num_spanning_images(self, num_leaf_images):
+    """Returns a dict mapping each node to the number of images it spans.
+
+    Args:
+      num_leaf_images: a dict mapping the WordNet id of each leaf to its number
+        of images.
+    """
+    leaf_images = np.array([num_leaf_images[l.wn_id] for l in self.leaves])
+    num_images = self.get_leaf_masks().dot(leaf_images)
+    return dict((n, int(num_images[i])) for i, n in enumerate(self.nodes))
+
+
+# Version of the serialization format of SynsetGraph. It must be increased
+# whenever the fields of SynsetGraph change in an incompatible way.
+SYNSET_GRAPH_FORMAT_VERSION = 1
+
+
+class SynsetGraph(
+    collections.namedtuple('SynsetGraph',
+                           'wn_ids, words, child_offsets, child_ids')):
+  """A compact, serializable representation of a graph of Synsets.
+
+  Nodes are sorted by WordNet id and the parent -> child links are stored as
+  integer adjacency arrays in compressed sparse row format: the children of
+  node i are child_ids[child_offsets[i]:child_offsets[i + 1]]. Unlike a set of
+  Synsets, this can be pickled without recursing through the graph. It is a
+  serialization format only: to_synsets() rebuilds set-backed Synsets, which
+  the rest of this module works with.
+
+  Args:
+    wn_ids: A list of the WordNet ids of the nodes.
+    words: A list of the word descriptions of the nodes.
+    child_offsets: An np.array of int64 of length len(wn_ids) + 1.
+    child_ids: An np.array of int32, the concatenated children of all nodes.
+  """
+
+  @classmethod
+  def from_synsets(cls, nodes):
+    """Creates a SynsetGraph from a set of Synsets.
+
+    Args:
+      nodes: A set of Synsets, closed under the parent / child relations.
+
+    Returns:
+      A SynsetGraph.
+
+    Raises:
+      ValueError: if a Synset links to a Synset outside of nodes.
+    """
+    nodes = sorted(nodes, key=lambda n: n.wn_id)
+    position = dict((n, i) for i, n in enumerate(nodes))
+    child_offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+    child_ids = []
+    for i, n in enumerate(nodes):
+      for c in n.children:
+        if c not in position:
+          raise ValueError('Synset {} links to a Synset outside of the '
+                           'graph.'.format(n.wn_id))
+      child_ids.extend(sorted(position[c] for c in n.children))
+      child_offsets[i + 1] = len(child_ids)
+    return cls(
+        wn_ids=[n.wn_id for n in nodes],
+        words=[n.words for n in nodes],
+        child_offsets=child_offsets,
+        child_ids=np.array(child_ids, dtype=np.int32))
+
+  @property
+  def num_nodes(self):
+    return len(self.wn_ids)
+
+  def to_synsets(self):
+    """Returns a list of new Synsets, in the order of self.wn_ids."""
+    nodes = [
+        Synset(wn_id, words, set(), set())
+        for wn_id, words in zip(self.wn_ids, self.words)
+    ]
+    for i, n in enumerate(nodes):
+      start, end = self.child_offsets[i], self.child_offsets[i + 1]
+      for j in self.child_ids[start:end]:
+        n.children.add(nodes[j])
+        nodes[j].parents.add(n)
+    return nodes
+
+
+# Number of set bits of each uint8 value.
+_POPCOUNT = np.unpackbits(
+    np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
 def get_spanning_leaves(nodes):
   """Get the leaves that each node in nodes can reach.
 
@@ -217,17 +449,7 @@ def get_spanning_leaves(nodes):
     spanning_leaves: a dict mapping Synset instances to the set of leaf Synsets
       that are their descendants.
   """
-  # First find the leaves
-  leaves = get_leaves(nodes)
-
-  # dict mapping WordNet id's to the list of leaf Synsets they span
-  spanning_leaves = {}
-  for n in nodes:
-    spanning_leaves[n] = set()
-    for l in leaves:
-      if is_descendent(l, n) or l == n:
-        spanning_leaves[n].add(l)
-  return spanning_leaves
+  return IndexedGraph(nodes).get_spanning_leaves()
 
 
 def get_num_spanning_images(spanning_leaves, num_leaf_images):
@@ -764,6 +986,209 @@ def get_lowest_common_ancestor(leaf_a, leaf_b, path='longest'):
   return lca, height_of_lca
 
 
+# Distance used for nodes that are not on any considered path from a leaf.
+_UNREACHABLE = np.iinfo(np.int32).max
+
+
+class LowestCommonAncestorTable(
+    collections.namedtuple('LowestCommonAncestorTable',
+                           ('leaf_wn_ids, node_wn_ids, lca, heights, '
+                            'graph_digest'))):
+  """The lowest common ancestors of all pairs of leaves of a DAG.
+
+    Args:
+      leaf_wn_ids: an np.array of the WordNet ids of the leaves.
+      node_wn_ids: an np.array of the WordNet ids of all nodes.
+      lca: an np.array of ints of shape [num_leaves, num_leaves]. lca[i, j] is
+        the index in node_wn_ids of the lowest common ancestor of leaves i and
+        j, or -1 if they have no common ancestor.
+      heights: an np.array of ints of the same shape, with the corresponding
+        heights (see get_lowest_common_ancestor), or -1.
+      graph_digest: a string identifying the graph and the type of path the
+        table was computed for.
+  """
+
+  def initialize(self):
+    """Initializes a LowestCommonAncestorTable."""
+    # Maps each leaf WordNet id to its row / column in the tables.
+    self.leaf_indices = dict((wn_id, i) for i, wn_id in enumerate(
+        self.leaf_wn_ids.tolist()))
+
+  def get_lowest_common_ancestor(self, wn_id_a, wn_id_b):
+    """Returns the WordNet id and the height of the LCA of two leaves."""
+    if not hasattr(self, 'leaf_indices'):
+      self.initialize()
+    i, j = self.leaf_indices[wn_id_a], self.leaf_indices[wn_id_b]
+    if self.lca[i, j] < 0:
+      raise ValueError('No common ancestor for {} and {}.'.format(
+          wn_id_a, wn_id_b))
+    return self.node_wn_ids[self.lca[i, j]].item(), int(self.heights[i, j])
+
+  def get_heights(self, wn_ids_a, wn_ids_b):
+    """Returns the heights of the LCAs of pairs of leaves as an np.array."""
+    if not hasattr(self, 'leaf_indices'):
+      self.initialize()
+    rows = [self.leaf_indices[wn_id] for wn_id in wn_ids_a]
+    cols = [self.leaf_indices[wn_id] for wn_id in wn_ids_b]
+    return self.heights[rows, cols]
+
+
+def get_graph_digest(nodes):
+  """Returns a string identifying the structure of the graph defined by nodes."""
+  m = hashlib.md5()
+  for line in sorted('{} {}'.format(n.wn_id, c.wn_id)
+                     for n in nodes
+                     for c in n.children):
+    m.update(line.encode('utf-8') + b'\n')
+  for wn_id in sorted(str(n.wn_id) for n in nodes):
+    m.update(wn_id.encode('utf-8') + b'\n')
+  return m.hexdigest()
+
+
+def create_lowest_common_ancestor_table(nodes, path='longest'):
+  """Computes the lowest common ancestor of every pair of leaves of a DAG.
+
+  The result agrees with get_lowest_common_ancestor(leaf_a, leaf_b, path), but
+  the upward paths of each leaf are computed once by dynamic programming over
+  the topological order instead of being enumerated for each pair. Among
+  multiple longest paths, the one through the parent with the smallest id in
+  topological order is used, which makes the result deterministic.
+
+  Args:
+    nodes: A set of Synsets.
+    path: A str. One of 'longest', or 'all'.
+
+  Returns:
+    A LowestCommonAncestorTable.
+
+  Raises:
+    ValueError: Invalid path. Must be 'longest', or 'all'.
+  """
+  if path not in ['longest', 'all']:
+    raise ValueError('Invalid path. Must be "longest", or "all".')
+  graph = IndexedGraph(nodes)
+
+  # dist[i, n] is the distance from leaf i to node n along the considered
+  # upward paths of leaf i.
+  dist = np.full((graph.num_leaves, graph.num_nodes), _UNREACHABLE, np.int64)
+  if path == 'longest':
+    # Parents come before their children, so a single pass finds the length
+    # of the longest path from each node to a root and its first step.
+    up_length = np.zeros(graph.num_nodes, dtype=np.int64)
+    next_node = np.full(graph.num_nodes, -1, dtype=np.int64)
+    for i, parents in enumerate(graph.parents):
+      if len(parents):
+        next_node[i] = parents[np.argmax(up_length[parents])]
+        up_length[i] = up_length[next_node[i]] + 1
+    for j, leaf in enumerate(graph.leaf_node_ids):
+      node, distance = leaf, 0
+      while node >= 0:
+        dist[j, node] = distance
+        node, distance = next_node[node], distance + 1
+  else:
+    # Shortest upward distances, by breadth-first search from each leaf.
+    for j, leaf in enumerate(graph.leaf_node_ids):
+      frontier, distance = [leaf], 0
+      while frontier:
+        frontier = [n for n in frontier if dist[j, n] == _UNREACHABLE]
+        dist[j, frontier] = distance
+        frontier = sorted(set(p for n in frontier for p in graph.parents[n]))
+        distance += 1
+
+  lca = np.full((graph.num_leaves, graph.num_leaves), -1, dtype=np.int64)
+  heights = np.full((graph.num_leaves, graph.num_leaves), _UNREACHABLE,
+                    dtype=np.int64)
+  for i in range(graph.num_leaves):
+    ancestors = np.flatnonzero(dist[i] != _UNREACHABLE)
+    # Visit the ancestors of leaf i from the closest to the furthest, keeping
+    # the first one that achieves the minimal height for each other leaf.
+    for node in ancestors[np.argsort(dist[i, ancestors], kind='stable')]:
+      height = np.maximum(dist[i, node], dist[:, node])
+      is_lower = height < heights[i]
+      heights[i, is_lower] = height[is_lower]
+      lca[i, is_lower] = node
+  heights[lca < 0] = -1
+
+  return LowestCommonAncestorTable(
+      leaf_wn_ids=np.array([l.wn_id for l in graph.leaves]),
+      node_wn_ids=np.array([n.wn_id for n in graph.nodes]),
+      lca=lca,
+      heights=heights,
+      graph_digest='{}:{}'.format(path, get_graph_digest(nodes)))
+
+
+def get_lowest_common_ancestor_table(nodes, path='longest', cache_path=None):
+  """Returns the LowestCommonAncestorTable of a DAG, using a cache on disk.
+
+  If cache_path contains a table computed for the same graph and type of path,
+  it is read and returned, otherwise it is computed and stored at cache_path.
+
+  Args:
+    nodes: A set of Synsets.
+    path: A str. One of 'longest', or 'all'.
+    cache_path: An optional path to a .npz file where the table is / may be
+      stored.
+
+  Returns:
+    A LowestCommonAncestorTable.
+  """
+  if cache_path and os.path.exists(cache_path):
+    logging.info('Attempting to read the LCA table from {}...'.format(
+        cache_path))
+    with open(cache_path, 'rb') as f:
+      arrays = np.load(f)
+      table = LowestCommonAncestorTable(
+          **dict((k, arrays[k]) for k in LowestCommonAncestorTable._fields))
+    table = table._replace(graph_digest=str(table.graph_digest))
+    if table.graph_digest == '{}:{}'.format(path, get_graph_digest(nodes)):
+      logging.info('Successful.')
+      return table
+    logging.info('The cached table was computed for a different graph.')
+
+  table = create_lowest_common_ancestor_table(nodes, path=path)
+  if cache_path:
+    with open(cache_path, 'wb') as f:
+      np.savez(f, **table._asdict())
+  return table
+
+
+# Memoizes get_ilsvrc_2012_tar_index for each archive path.
+_ILSVRC_2012_TAR_INDEX = {}
+
+
+def get_ilsvrc_2012_tar_index(tar_path):
+  """Indexes the images of the ILSVRC 2012 training archive.
+
+  The archive contains one uncompressed tar per synset, named by the synset's
+  WordNet id (e.g. n15075141.tar), with the images of that synset. Only tar
+  headers are read, seeking over the image data, so that the images can later
+  be read directly from the archive without extracting it.
+
+  Args:
+    tar_path: The path to ILSVRC2012_img_train.tar.
+
+  Returns:
+    A collections.OrderedDict mapping the WordNet id of each synset, in archive
+    order, to a list of (file_name, offset, size) tuples, one per image in
+    archive order, where offset is the position of the image data in tar_path.
+  """
+  if tar_path not in _ILSVRC_2012_TAR_INDEX:
+    logging.info('Indexing {}...'.format(tar_path))
+    index = collections.OrderedDict()
+    with tarfile.open(tar_path, 'r:') as synset_tars:
+      for synset_tar in synset_tars:
+        if not synset_tar.isfile():
+          continue
+        wn_id = os.path.splitext(os.path.basename(synset_tar.name))[0]
+        with tarfile.open(
+            fileobj=synset_tars.extractfile(synset_tar), mode='r:') as images:
+          index[wn_id] = [(os.path.basename(image.name),
+                           synset_tar.offset_data + image.offset_data,
+                           image.size) for image in images if image.isfile()]
+    _ILSVRC_2012_TAR_INDEX[tar_path] = index
+  return _ILSVRC_2012_TAR_INDEX[tar_path]
+
+
 def get_num_synset_2012_images(path, synsets_2012, files_to_skip=None):
   """Count the number of images of each class in ILSVRC 2012.
 
@@ -771,7 +1196,8 @@ def get_num_synset_2012_images(path, synsets_2012, files_to_skip=None):
   number of its images.
   This assumes that within FLAGS.ilsvrc_2012_data_root there is a directory for
   every 2012 synset, named by that synset's WordNet ID (e.g. n15075141) and
-  containing all images of that synset.
+  containing all images of that synset, unless FLAGS.ilsvrc_2012_train_tar is
+  set, in which case the images are counted in that archive.
 
   If path contains this dict, it is read and returned, otherwise it is computed
   and stored at path.
@@ -796,11 +1222,17 @@ def get_num_synset_2012_images(path, synsets_2012, files_to_skip=None):
         return num_synset_2012_images
 
   logging.info('Unsuccessful. Deriving number of leaf images...')
+  if files_to_skip is None:
+    files_to_skip = set()
   num_synset_2012_images = {}
   for s_2012 in synsets_2012:
-    synset_dir = os.path.join(FLAGS.ilsvrc_2012_data_root, s_2012.wn_id)
-    num_synset_2012_images[s_2012.wn_id] = len(
-        set(os.listdir(synset_dir)) - files_to_skip)
+    if FLAGS.ilsvrc_2012_train_tar:
+      tar_index = get_ilsvrc_2012_tar_index(FLAGS.ilsvrc_2012_train_tar)
+      file_names = [name for name, _, _ in tar_index[s_2012.wn_id]]
+    else:
+      synset_dir = os.path.join(FLAGS.ilsvrc_2012_data_root, s_2012.wn_id)
+      file_names = os.listdir(synset_dir)
+    num_synset_2012_images[s_2012.wn_id] = len(set(file_names) - files_to_skip)
 
   if path:
     with open(path, 'wb') as f:
@@ -873,10 +1305,13 @@ def create_imagenet_specification(split_enum,
       synsets[child].parents.add(synsets[parent])
 
   # Get the WordNet id's of the synsets of ILSVRC 2012.
-  wn_ids_2012 = os.listdir(data_root)
-  wn_ids_2012 = set(
-      entry for entry in wn_ids_2012
-      if os.path.isdir(os.path.join(data_root, entry)))
+  if FLAGS.ilsvrc_2012_train_tar:
+    wn_ids_2012 = set(get_ilsvrc_2012_tar_index(FLAGS.ilsvrc_2012_train_tar))
+  else:
+    wn_ids_2012 = os.listdir(data_root)
+    wn_ids_2012 = set(
+        entry for entry in wn_ids_2012
+        if os.path.isdir(os.path.join(data_root, entry)))
   synsets_2012 = [s for s in synsets.values() if s.wn_id in wn_ids_2012]
   assert len(wn_ids_2012) == len(synsets_2012)
 
@@ -888,11 +1323,12 @@ def create_imagenet_specification(split_enum,
   sampling_graph = create_sampling_graph(synsets_2012)
 
   # Create a dict mapping each node to its reachable leaves.
-  spanning_leaves = get_spanning_leaves(sampling_graph)
+  indexed_graph = IndexedGraph(sampling_graph)
+  spanning_leaves = indexed_graph.get_spanning_leaves()
 
   # Create a dict mapping each node in sampling graph to the number of images of
   # ILSVRC 2012 synsets that live in the sub-graph rooted at that node.
-  num_images = get_num_spanning_images(spanning_leaves, num_synset_2012_images)
+  num_images = indexed_graph.get_num_spanning_images(num_synset_2012_images)
 
   # Create class splits, each with its own sampling graph.
   # Choose roots for the validation and test subtrees (see the docstring of
@@ -908,13 +1344,12 @@ def create_imagenet_specification(split_enum,
       spanning_leaves, split_enum, valid_test_roots=valid_test_roots)
 
   # Compute num_images for each split.
+  split_indexed_graphs = {}
   split_num_images = {}
-  split_num_images[split_enum.TRAIN] = get_num_spanning_images(
-      get_spanning_leaves(splits[split_enum.TRAIN]), num_synset_2012_images)
-  split_num_images[split_enum.VALID] = get_num_spanning_images(
-      get_spanning_leaves(splits[split_enum.VALID]), num_synset_2012_images)
-  split_num_images[split_enum.TEST] = get_num_spanning_images(
-      get_spanning_leaves(splits[split_enum.TEST]), num_synset_2012_images)
+  for split in (split_enum.TRAIN, split_enum.VALID, split_enum.TEST):
+    split_indexed_graphs[split] = IndexedGraph(splits[split])
+    split_num_images[split] = split_indexed_graphs[
+        split].get_num_spanning_images(num_synset_2012_images)
 
   # Compute statistics.
   if log_stats:
@@ -923,25 +1358,29 @@ def create_imagenet_specification(split_enum,
         num_images,
         get_leaves,
         get_spanning_leaves,
-        graph_name='all')
+        graph_name='all',
+        indexed_graph=indexed_graph)
     imagenet_stats.log_graph_stats(
         splits[split_enum.TRAIN],
         split_num_images[split_enum.TRAIN],
         get_leaves,
         get_spanning_leaves,
-        graph_name='train')
+        graph_name='train',
+        indexed_graph=split_indexed_graphs[split_enum.TRAIN])
     imagenet_stats.log_graph_stats(
         splits[split_enum.VALID],
         split_num_images[split_enum.VALID],
         get_leaves,
         get_spanning_leaves,
-        graph_name='valid')
+        graph_name='valid',
+        indexed_graph=split_indexed_graphs[split_enum.VALID])
     imagenet_stats.log_graph_stats(
         splits[split_enum.TEST],
         split_num_images[split_enum.TEST],
         get_leaves,
         get_spanning_leaves,
-        graph_name='test')
+        graph_name='test',
+        indexed_graph=split_indexed_graphs[split_enum.TEST])
     # Stats relevant to analysis of fine-graindness.
     imagenet_stats.log_stats_finegrainedness(
         splits[split_enum.TRAIN],
@@ -19,10 +19,18 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import copyreg
+import io
+from meta_dataset.data import dataset_spec as dataset_spec_lib
 from meta_dataset.data import imagenet_specification as imagenet_spec
 from meta_dataset.data import learning_spec
 from meta_dataset.utils.argparse import argparse
 import numpy as np
+import os
+import pickle as pkl
+import shutil
+import tarfile
+import tempfile
 import unittest
 
 argparse.parser.parse_args()
@@ -421,5 +429,302 @@ class ImagenetSpecificationTest(unittest.TestCase):
     validate_spanning_leaves(toy_span_leaves, toy_synsets_2012, self)
 
 
+def create_random_dag(num_nodes, rng):
+  """Creates a random DAG of Synsets in which every node reaches a leaf."""
+  synsets = [
+      imagenet_spec.Synset('n%08d' % i, str(i), set(), set())
+      for i in range(num_nodes)
+  ]
+  for i in range(1, num_nodes):
+    # Each node gets one to three parents among the previous nodes.
+    num_parents = min(i, rng.randint(1, 4))
+    for j in rng.choice(i, num_parents, replace=False):
+      synsets[j].children.add(synsets[i])
+      synsets[i].parents.add(synsets[j])
+  return set(synsets)
+
+
+class _OldFormatPickler(pkl.Pickler):
+  """Pickles Synsets and specs the way it was done before SynsetGraph."""
+
+  def reducer_override(self, obj):
+    if isinstance(obj, imagenet_spec.Synset):
+      state = dict((name, getattr(obj, name)) for name in obj.__slots__)
+      return copyreg.__newobj__, (imagenet_spec.Synset,), state
+    if isinstance(obj, dataset_spec_lib.HierarchicalDatasetSpecification):
+      return copyreg.__newobj__, (type(obj),) + tuple(obj), None
+    return NotImplemented
+
+
+def create_hierarchical_spec(rng):
+  """Creates a HierarchicalDatasetSpecification with random split graphs."""
+  split_subgraphs, images_per_class = {}, {}
+  for split in learning_spec.Split:
+    nodes = create_random_dag(20, rng)
+    split_subgraphs[split] = nodes
+    images_per_class[split] = dict((n, rng.randint(1, 100)) for n in nodes)
+  return dataset_spec_lib.HierarchicalDatasetSpecification(
+      'random', split_subgraphs, images_per_class, {0: 'n00000001'}, '/tmp',
+      '{}.h5')
+
+
+class SynsetGraphTest(unittest.TestCase):
+
+  def assert_same_graph(self, nodes, other_nodes):
+    edges = set((p.wn_id, c.wn_id) for p in nodes for c in p.children)
+    other_edges = set(
+        (p.wn_id, c.wn_id) for p in other_nodes for c in p.children)
+    self.assertEqual(edges, other_edges)
+    self.assertEqual(
+        set((n.wn_id, n.words) for n in nodes),
+        set((n.wn_id, n.words) for n in other_nodes))
+    for n in other_nodes:
+      for c in n.children:
+        self.assertIn(n, c.parents)
+
+  def test_round_trip(self):
+    nodes = create_random_dag(30, np.random.RandomState(0))
+    graph = imagenet_spec.SynsetGraph.from_synsets(nodes)
+    self.assertEqual(graph.num_nodes, len(nodes))
+    self.assertEqual(graph.child_offsets[-1], len(graph.child_ids))
+    self.assert_same_graph(nodes, graph.to_synsets())
+
+  def test_outside_link(self):
+    nodes = create_random_dag(10, np.random.RandomState(0))
+    nodes.remove(imagenet_spec.get_leaves(nodes)[0])
+    with self.assertRaises(ValueError):
+      imagenet_spec.SynsetGraph.from_synsets(nodes)
+
+  def test_synset_has_no_dict(self):
+    synset = imagenet_spec.Synset('n0', 'a', set(), set())
+    self.assertFalse(hasattr(synset, '__dict__'))
+
+  def test_pickle_spec(self):
+    spec = create_hierarchical_spec(np.random.RandomState(1))
+    spec.initialize()
+    loaded = pkl.loads(pkl.dumps(spec, protocol=pkl.HIGHEST_PROTOCOL))
+    self.assertEqual(loaded.name, spec.name)
+    self.assertEqual(loaded.class_names, spec.class_names)
+    self.assertEqual(loaded.file_pattern, spec.file_pattern)
+    self.assertEqual(loaded.classes_per_split, spec.classes_per_split)
+    for split in learning_spec.Split:
+      self.assert_same_graph(spec.split_subgraphs[split],
+                             loaded.split_subgraphs[split])
+      self.assertEqual(
+          dict((n.wn_id, k) for n, k in spec.images_per_class[split].items()),
+          dict((n.wn_id, k) for n, k in loaded.images_per_class[split].items()))
+      self.assertTrue(
+          set(loaded.images_per_class[split]) <= loaded.split_subgraphs[split])
+
+  def test_class_num_images(self):
+    spec = create_hierarchical_spec(np.random.RandomState(4))
+    leaves = dict((l.wn_id, (s, l)) for s in learning_spec.Split
+                  for l in imagenet_spec.get_leaves(spec.split_subgraphs[s]))
+    spec = spec._replace(class_names=dict(enumerate(sorted(leaves))))
+    for class_id, wn_id in spec.class_names.items():
+      split, leaf = leaves[wn_id]
+      self.assertEqual(
+          spec.get_total_images_per_class(class_id),
+          spec.images_per_class[split][leaf])
+    with self.assertRaises(ValueError):
+      spec.get_total_images_per_class(len(leaves))
+
+  def test_unknown_version(self):
+    spec = create_hierarchical_spec(np.random.RandomState(2))
+    restore, args, _ = spec.__reduce__()
+    with self.assertRaises(ValueError):
+      restore(imagenet_spec.SYNSET_GRAPH_FORMAT_VERSION + 1, *args[1:])
+
+  def test_load_old_pickle(self):
+    spec = create_hierarchical_spec(np.random.RandomState(3))
+    f = io.BytesIO()
+    _OldFormatPickler(f, protocol=pkl.HIGHEST_PROTOCOL).dump(spec)
+    loaded = pkl.loads(f.getvalue())
+    for split in learning_spec.Split:
+      self.assert_same_graph(spec.split_subgraphs[split],
+                             loaded.split_subgraphs[split])
+      self.assertEqual(
+          sorted(spec.images_per_class[split].values()),
+          sorted(loaded.images_per_class[split].values()))
+
+
+class IndexedGraphTest(unittest.TestCase):
+
+  def check_spanning_leaves(self, nodes):
+    """Compares the bitsets to a brute-force computation of spanning leaves."""
+    indexed_graph = imagenet_spec.IndexedGraph(nodes)
+    spanning_leaves = indexed_graph.get_spanning_leaves()
+    leaves = imagenet_spec.get_leaves(nodes)
+    self.assertEqual(set(indexed_graph.leaves), set(leaves))
+    self.assertEqual(set(spanning_leaves.keys()), set(nodes))
+    for n in nodes:
+      expected = set(
+          l for l in leaves if l == n or imagenet_spec.is_descendent(l, n))
+      self.assertEqual(spanning_leaves[n], expected)
+    span_sizes = indexed_graph.get_span_sizes()
+    for i, n in enumerate(indexed_graph.nodes):
+      self.assertEqual(span_sizes[i], len(spanning_leaves[n]))
+      self.assertEqual(
+          set(indexed_graph.leaves[j]
+              for j in indexed_graph.get_spanning_leaf_indices(i)),
+          spanning_leaves[n])
+
+  def check_topological_order(self, nodes):
+    indexed_graph = imagenet_spec.IndexedGraph(nodes)
+    self.assertEqual(indexed_graph.num_nodes, len(nodes))
+    for i, n in enumerate(indexed_graph.nodes):
+      self.assertEqual(indexed_graph.node_ids[n], i)
+      for c in indexed_graph.children[i]:
+        self.assertGreater(c, i)
+      for p in indexed_graph.parents[i]:
+        self.assertLess(p, i)
+
+  def test_toy_graph(self):
+    graph_nodes, _, _ = create_toy_graph()
+    self.check_topological_order(graph_nodes)
+    self.check_spanning_leaves(graph_nodes)
+
+  def test_random_dag(self):
+    nodes = create_random_dag(60, np.random.RandomState(0))
+    self.check_topological_order(nodes)
+    self.check_spanning_leaves(nodes)
+
+  def test_deterministic_ids(self):
+    """Node ids should not depend on the iteration order of the nodes."""
+    nodes = create_random_dag(30, np.random.RandomState(1))
+    ids = [n.wn_id for n in imagenet_spec.IndexedGraph(nodes).nodes]
+    shuffled = list(nodes)
+    np.random.RandomState(2).shuffle(shuffled)
+    self.assertEqual(
+        ids, [n.wn_id for n in imagenet_spec.IndexedGraph(shuffled).nodes])
+
+  def test_num_spanning_images(self):
+    nodes = create_random_dag(40, np.random.RandomState(3))
+    leaves = imagenet_spec.get_leaves(nodes)
+    num_leaf_images = dict((l.wn_id, i + 1) for i, l in enumerate(leaves))
+    expected = imagenet_spec.get_num_spanning_images(
+        imagenet_spec.get_spanning_leaves(nodes), num_leaf_images)
+    self.assertEqual(
+        imagenet_spec.IndexedGraph(nodes).get_num_spanning_images(
+            num_leaf_images), expected)
+
+
+def create_random_tree(num_nodes, rng):
+  """Creates a random tree of Synsets."""
+  synsets = [
+      imagenet_spec.Synset('n%08d' % i, str(i), set(), set())
+      for i in range(num_nodes)
+  ]
+  for i in range(1, num_nodes):
+    parent = synsets[rng.randint(i)]
+    parent.children.add(synsets[i])
+    synsets[i].parents.add(parent)
+  return set(synsets)
+
+
+class LowestCommonAncestorTableTest(unittest.TestCase):
+
+  def check_heights(self, nodes, path):
+    """Compares the table to get_lowest_common_ancestor for each pair."""
+    table = imagenet_spec.create_lowest_common_ancestor_table(nodes, path=path)
+    leaves = sorted(imagenet_spec.get_leaves(nodes), key=lambda l: l.wn_id)
+    for i, leaf_a in enumerate(leaves):
+      for leaf_b in leaves[i + 1:]:
+        _, expected_height = imagenet_spec.get_lowest_common_ancestor(
+            leaf_a, leaf_b, path=path)
+        _, height = table.get_lowest_common_ancestor(leaf_a.wn_id, leaf_b.wn_id)
+        self.assertEqual(height, expected_height)
+    # The table is symmetric in heights.
+    self.assertTrue((table.heights == table.heights.T).all())
+
+  def test_toy_graph(self):
+    graph_nodes, _, _ = create_toy_graph()
+    self.check_heights(graph_nodes, 'longest')
+    self.check_heights(graph_nodes, 'all')
+
+  def test_random_tree(self):
+    nodes = create_random_tree(40, np.random.RandomState(0))
+    self.check_heights(nodes, 'longest')
+    self.check_heights(nodes, 'all')
+    # In a tree, the LCA is unique.
+    table = imagenet_spec.create_lowest_common_ancestor_table(nodes)
+    leaves = imagenet_spec.get_leaves(nodes)
+    for leaf_a in leaves[:5]:
+      for leaf_b in leaves[:5]:
+        if leaf_a == leaf_b:
+          continue
+        lca, _ = imagenet_spec.get_lowest_common_ancestor(leaf_a, leaf_b)
+        self.assertEqual(
+            table.get_lowest_common_ancestor(leaf_a.wn_id, leaf_b.wn_id)[0],
+            lca.wn_id)
+
+  def test_random_dag_all_paths(self):
+    nodes = create_random_dag(25, np.random.RandomState(4))
+    self.check_heights(nodes, 'all')
+
+  def test_get_heights(self):
+    nodes = create_random_tree(30, np.random.RandomState(5))
+    table = imagenet_spec.create_lowest_common_ancestor_table(nodes)
+    wn_ids = table.leaf_wn_ids.tolist()
+    heights = table.get_heights(wn_ids[:-1], wn_ids[1:])
+    for wn_id_a, wn_id_b, height in zip(wn_ids[:-1], wn_ids[1:], heights):
+      self.assertEqual(
+          table.get_lowest_common_ancestor(wn_id_a, wn_id_b)[1], height)
+
+  def test_cache(self):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      cache_path = os.path.join(tmp_dir, 'lca.npz')
+      nodes = create_random_tree(30, np.random.RandomState(6))
+      table = imagenet_spec.get_lowest_common_ancestor_table(
+          nodes, cache_path=cache_path)
+      self.assertTrue(os.path.exists(cache_path))
+      cached = imagenet_spec.get_lowest_common_ancestor_table(
+          nodes, cache_path=cache_path)
+      self.assertEqual(cached.graph_digest, table.graph_digest)
+      np.testing.assert_array_equal(cached.heights, table.heights)
+      np.testing.assert_array_equal(cached.leaf_wn_ids, table.leaf_wn_ids)
+      # A different graph invalidates the cache.
+      other_nodes = create_random_tree(30, np.random.RandomState(7))
+      other = imagenet_spec.get_lowest_common_ancestor_table(
+          other_nodes, cache_path=cache_path)
+      self.assertNotEqual(other.graph_digest, table.graph_digest)
+    finally:
+      shutil.rmtree(tmp_dir)
+
+
+class IlsvrcTarIndexTest(unittest.TestCase):
+
+  def test_index(self):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+      images = {
+          'n01': {'n01_1.JPEG': b'abc', 'n01_2.JPEG': b'defgh'},
+          'n02': {'n02_1.JPEG': b'x' * 1000},
+      }
+      tar_path = os.path.join(tmp_dir, 'train.tar')
+      with tarfile.open(tar_path, 'w') as synset_tars:
+        for wn_id, synset_images in sorted(images.items()):
+          synset_tar_path = os.path.join(tmp_dir, wn_id + '.tar')
+          with tarfile.open(synset_tar_path, 'w') as synset_tar:
+            for file_name, data in sorted(synset_images.items()):
+              info = tarfile.TarInfo(file_name)
+              info.size = len(data)
+              synset_tar.addfile(info, io.BytesIO(data))
+          synset_tars.add(synset_tar_path, arcname=wn_id + '.tar')
+
+      index = imagenet_spec.get_ilsvrc_2012_tar_index(tar_path)
+      self.assertEqual(list(index), ['n01', 'n02'])
+      with open(tar_path, 'rb') as f:
+        for wn_id, entries in index.items():
+          self.assertEqual([name for name, _, _ in entries],
+                           sorted(images[wn_id]))
+          for name, offset, size in entries:
+            f.seek(offset)
+            self.assertEqual(f.read(size), images[wn_id][name])
+    finally:
+      shutil.rmtree(tmp_dir)
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -30,7 +30,8 @@ def log_graph_stats(nodes,
                     get_spanning_leaves_fn,
                     graph_name=None,
                     min_way=5,
-                    max_way=50):
+                    max_way=50,
+                    indexed_graph=None):
   """Compute and display statistics about the graph defined by nodes.
 
   In particular, the statistics that are computed are:
@@ -50,15 +51,28 @@ def log_graph_stats(nodes,
     graph_name: A name for the graph (for the printed logs).
     min_way: The smallest allowable way of an episode.
     max_way: The largest allowable way of an episode.
+    indexed_graph: An IndexedGraph of nodes (optional). If provided, the
+      spanning leaves are read from its bitsets instead of being computed with
+      get_spanning_leaves_fn.
   """
   logging.info('Graph statistics{}:'.format(
       ' of graph {}'.format(graph_name) if graph_name is not None else ''))
   logging.info('Number of nodes: {}'.format(len(nodes)))
 
-  # Compute the dict mapping internal nodes to their spanning leaves. Note that
-  # this is different for the different splits since even for nodes that may be
-  # shared across splits, their connectivity will be different.
-  spanning_leaves = get_spanning_leaves_fn(nodes)
+  # Compute the number of leaves spanned by each node. Note that this is
+  # different for the different splits since even for nodes that may be shared
+  # across splits, their connectivity will be different.
+  if indexed_graph is None:
+    spanning_leaves = get_spanning_leaves_fn(nodes)
+    leaf_index = dict((l, j) for j, l in enumerate(get_leaves_fn(nodes)))
+    leaf_masks = np.zeros((len(spanning_leaves), len(leaf_index)), dtype=bool)
+    span_nodes = list(spanning_leaves.keys())
+    for i, n in enumerate(span_nodes):
+      leaf_masks[i, [leaf_index[l] for l in spanning_leaves[n]]] = True
+  else:
+    span_nodes = indexed_graph.nodes
+    leaf_masks = indexed_graph.get_leaf_masks()
+  span_sizes = leaf_masks.sum(axis=1)
 
   # Compute the number of roots and leaves
   num_roots = 0
@@ -92,11 +106,9 @@ def log_graph_stats(nodes,
           np.median(num_children)))
 
   # Compute the average number of leaves spanned by internal nodes.
-  num_span_leaves = []
-  for n in nodes:
-    if not n.children:
-      continue
-    num_span_leaves.append(len(spanning_leaves[n]))
+  num_span_leaves = [
+      size for n, size in zip(span_nodes, span_sizes) if n.children
+  ]
   logging.info(
       'Number of spanning leaves of internal nodes: min {}, max {}, mean {} '
       'median {}'.format(
@@ -104,13 +116,10 @@ def log_graph_stats(nodes,
           np.median(num_span_leaves)))
 
   # Log the effects of restricting the allowable 'way' of episodes.
-  all_reachable_leaves = set()  # leaves reachable under the restriction.
-  possible_ways_in_range = []
-  for v in spanning_leaves.values():
-    way = len(v)
-    if way >= min_way and way <= max_way:
-      possible_ways_in_range.append(way)
-      all_reachable_leaves |= set(v)
+  in_range = (span_sizes >= min_way) & (span_sizes <= max_way)
+  possible_ways_in_range = span_sizes[in_range].tolist()
+  # leaves reachable under the restriction.
+  num_reachable_leaves = leaf_masks[in_range].any(axis=0).sum()
   logging.info('When restricting the allowable way to be between {} and {}, '
                   'the achievable ways are: {}'.format(min_way, max_way,
                                                        possible_ways_in_range))
@@ -120,7 +129,7 @@ def log_graph_stats(nodes,
                       len(set(possible_ways_in_range))))
   # Are all leaves reachable when using the restricted way?
   logging.info(' {} / {} are reachable.'.format(
-      len(all_reachable_leaves), len(leaves)))
+      num_reachable_leaves, len(leaves)))
 
 
 def log_stats_finegrainedness(nodes,
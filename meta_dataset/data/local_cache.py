@@ -0,0 +1,314 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Node-local read-through cache of record files.
+
+When the records live on a network filesystem, the small random reads of the
+backends are slow and their latency unpredictable. A LocalFileCache copies each
+file, the first time it is read, to a directory on a local disk, and the reads
+go to the copy afterwards.
+
+The cache is shared by all the processes of a node (e.g. one per rank and their
+DataLoader workers) through file locks. Each copy has two: the processes
+reading it hold a shared lock on the first, and the process filling it holds
+an exclusive lock on the second, so that each file is copied once, by the first
+process that reads it, while the others wait for the copy. The total size of
+the copies is kept under a byte budget by evicting the least recently used
+ones, the recency of a copy being its modification time, which is refreshed on
+every hit. Copies that some process is reading are never evicted, and the lock
+files are removed with their copy.
+
+The directory itself has a lock, held only to evict copies and reserve the
+bytes of a new one: its temporary file is created at its full size, so that it
+counts toward the budget while it is filled, after the directory lock is
+released. Files are therefore copied concurrently, and a large copy does not
+delay the misses of the other files. The temporary files left by processes
+that died while filling them are removed by the evictions.
+
+The hits, misses and evictions of every process are added up by the pipeline
+statistics, if they are enabled (see meta_dataset.data.pipeline_stats).
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import time
+
+from meta_dataset.data import pipeline_stats
+
+# Suffixes of the read and fill locks of each copy, and name of the lock of the
+# directory.
+LOCK_SUFFIX = '.lock'
+FILL_LOCK_SUFFIX = '.fill' + LOCK_SUFFIX
+DIRECTORY_LOCK = 'cache' + LOCK_SUFFIX
+_TMP_SUFFIX = '.tmp'
+# Size of the reads and writes of a copy.
+_COPY_BUFFER_SIZE = 2 ** 20
+
+
+def _lock(path, operation):
+  """Returns a file descriptor of path holding a flock, creating it if needed.
+
+  Lock files are removed by the process evicting their copy, while it holds
+  the lock, so the lock is only returned once the file it was taken on is
+  still the one at path.
+
+  Returns:
+    The file descriptor, or None if operation is non-blocking and the lock is
+    held by another process.
+  """
+  while True:
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+      fcntl.flock(fd, operation)
+    except BlockingIOError:
+      os.close(fd)
+      return None
+    try:
+      if os.stat(path).st_ino == os.fstat(fd).st_ino:
+        return fd
+    except FileNotFoundError:
+      pass
+    os.close(fd)
+
+
+@contextlib.contextmanager
+def _flock(path, operation):
+  """Holds a flock on path, which is created if needed."""
+  fd = _lock(path, operation)
+  try:
+    yield fd
+  finally:
+    os.close(fd)
+
+
+class LocalFileCache(object):
+  """Copies files to a local directory on first access, under a byte budget.
+
+  The object holds no open files and can be pickled to DataLoader workers. Its
+  metrics count the operations of the process that owns it, see
+  pipeline_stats for those of all the processes.
+  """
+
+  def __init__(self, cache_dir, max_bytes):
+    """Initializes the cache.
+
+    Args:
+      cache_dir: the local directory of the copies, created if needed.
+      max_bytes: int, the maximum total size of the copies. Files larger than
+        this are read from their source.
+    """
+    self.cache_dir = cache_dir
+    self.max_bytes = max_bytes
+    # Local names of the source files already looked up by this process.
+    self.local_names = {}
+    self.metrics = dict(hits=0, misses=0, bypasses=0, evictions=0,
+                        bytes_copied=0, bytes_evicted=0, copy_seconds=0.)
+    os.makedirs(cache_dir, exist_ok=True)
+
+  def get_local_name(self, path):
+    """Returns the name of the copy of path in the cache directory.
+
+    The name depends on the absolute path, size and modification time of the
+    source, so that a rewritten source gets a new copy. The source is only
+    stat'ed the first time each process looks it up.
+
+    Args:
+      path: the path of the source file.
+    """
+    if path not in self.local_names:
+      stat = os.stat(path)
+      key = '%s:%d:%d' % (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+      digest = hashlib.md5(key.encode('utf-8')).hexdigest()[:16]
+      self.local_names[path] = (
+          '%s_%s' % (digest, os.path.basename(path)), stat.st_size)
+    return self.local_names[path]
+
+  @contextlib.contextmanager
+  def open(self, path):
+    """Yields the path of the local copy of path, copying it if needed.
+
+    The copy is not evicted before the context exits. If the file does not fit
+    in the budget, the source path is yielded instead.
+
+    Args:
+      path: the path of the source file.
+    """
+    name, size = self.get_local_name(path)
+    if size > self.max_bytes:
+      self._count('bypasses')
+      yield path
+      return
+    local_path = os.path.join(self.cache_dir, name)
+    # The shared lock keeps the copy from being evicted while it is read.
+    with _flock(local_path + LOCK_SUFFIX, fcntl.LOCK_SH):
+      if os.path.exists(local_path):
+        self._count('hits')
+        os.utime(local_path)
+      else:
+        # Only one process copies the file, the others wait on the fill lock
+        # and find the copy once they get it.
+        with _flock(local_path + FILL_LOCK_SUFFIX, fcntl.LOCK_EX):
+          if os.path.exists(local_path):
+            self._count('hits')
+            os.utime(local_path)
+          else:
+            self._count('misses')
+            self._copy(path, local_path, size)
+      yield local_path
+
+  def _count(self, metric, value=1):
+    self.metrics[metric] += value
+    pipeline_stats.add_count('local_cache_' + metric, value)
+
+  def _copy(self, path, local_path, size):
+    """Makes room for size bytes and copies path to local_path."""
+    start = time.time()
+    tmp_path = '%s.%d%s' % (local_path, os.getpid(), _TMP_SUFFIX)
+    with _flock(os.path.join(self.cache_dir, DIRECTORY_LOCK), fcntl.LOCK_EX):
+      self.evict(self.max_bytes - size)
+      # The bytes of the copy are reserved, as the evictions of the other
+      # processes count them, before the file is filled.
+      with open(tmp_path, 'wb') as f:
+        f.truncate(size)
+    try:
+      with open(path, 'rb') as src, open(tmp_path, 'r+b') as dst:
+        shutil.copyfileobj(src, dst, _COPY_BUFFER_SIZE)
+      os.replace(tmp_path, local_path)
+    except BaseException:
+      os.remove(tmp_path)
+      raise
+    self._count('bytes_copied', size)
+    self.metrics['copy_seconds'] += time.time() - start
+
+  def list_copies(self):
+    """Returns the (mtime, size, path) of the copies, least recent first."""
+    copies = []
+    for entry in os.scandir(self.cache_dir):
+      if entry.name.endswith(LOCK_SUFFIX) or entry.name.endswith(_TMP_SUFFIX):
+        continue
+      try:
+        stat = entry.stat()
+      except FileNotFoundError:
+        continue
+      copies.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    return sorted(copies)
+
+  def _get_filling_size(self):
+    """Returns the size reserved by the copies being filled.
+
+    The temporary files of the copies that no process is filling, i.e. whose
+    fill lock is free, are removed. Callers must hold the directory lock, so
+    that no process reserves a copy meanwhile.
+    """
+    total = 0
+    for entry in os.scandir(self.cache_dir):
+      if not entry.name.endswith(_TMP_SUFFIX):
+        continue
+      # The name of a temporary file is <local_path>.<pid>.tmp.
+      local_path = entry.path[:-len(_TMP_SUFFIX)].rsplit('.', 1)[0]
+      fd = _lock(local_path + FILL_LOCK_SUFFIX, fcntl.LOCK_EX | fcntl.LOCK_NB)
+      if fd is None:
+        try:
+          total += entry.stat().st_size
+        except FileNotFoundError:
+          pass
+        continue
+      try:
+        os.remove(entry.path)
+        logging.info('Removed %s, left by a failed copy.', entry.path)
+      except FileNotFoundError:
+        pass
+      finally:
+        os.close(fd)
+    return total
+
+  def get_size(self):
+    """Returns the total size in bytes of the copies."""
+    return sum(size for _, size, _ in self.list_copies())
+
+  def evict(self, max_bytes):
+    """Evicts the least recently used copies until they fit in max_bytes.
+
+    Copies being read, i.e. whose lock is held by some process, are skipped,
+    and the copies being filled count with the size reserved for them. The
+    locks of the copies evicted, and the locks and temporary files left by the
+    copies that failed, are removed. Callers must hold the directory lock.
+
+    Args:
+      max_bytes: int, the size the copies must fit in.
+
+    Returns:
+      The total size of the copies left, including the ones being filled.
+    """
+    copies = self.list_copies()
+    total = self._get_filling_size() + sum(size for _, size, _ in copies)
+    for _, size, local_path in copies:
+      if total <= max_bytes:
+        break
+      if self._remove(local_path):
+        total -= size
+        self._count('evictions')
+        self._count('bytes_evicted', size)
+    copy_paths = set(local_path for _, _, local_path in copies)
+    for entry in os.scandir(self.cache_dir):
+      if entry.name == DIRECTORY_LOCK:
+        continue
+      for suffix in (FILL_LOCK_SUFFIX, LOCK_SUFFIX):
+        if entry.name.endswith(suffix):
+          local_path = entry.path[:-len(suffix)]
+          if local_path not in copy_paths and not os.path.exists(local_path):
+            self._remove(local_path)
+          break
+    if total > max_bytes:
+      logging.warning('The local cache in %s exceeds its budget, all its files '
+                      'are being read' % self.cache_dir)
+    return total
+
+  def _remove(self, local_path):
+    """Removes a copy and its locks, unless some process is reading it.
+
+    Returns:
+      Whether the copy was removed.
+    """
+    lock_path = local_path + LOCK_SUFFIX
+    fd = _lock(lock_path, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    if fd is None:
+      return False
+    try:
+      # Processes filling the copy hold its read lock, so none holds the fill
+      # lock now.
+      for path in (local_path, local_path + FILL_LOCK_SUFFIX, lock_path):
+        try:
+          os.remove(path)
+        except FileNotFoundError:
+          pass
+    finally:
+      os.close(fd)
+    return True
+
+  def get_metrics(self):
+    """Returns the metrics of this process and the hit rate of its reads."""
+    metrics = dict(self.metrics)
+    reads = metrics['hits'] + metrics['misses']
+    metrics['hit_rate'] = metrics['hits'] / reads if reads else 0.
+    return metrics
@@ -0,0 +1,177 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for `local_cache` module."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from meta_dataset.data import local_cache
+from meta_dataset.data import pipeline_stats
+
+
+def read_through_cache(args):
+  """Reads a file through a new cache, returns its content and the metrics."""
+  cache_dir, path = args
+  cache = local_cache.LocalFileCache(cache_dir, 1000)
+  with cache.open(path) as local_path:
+    with open(local_path, 'rb') as f:
+      return f.read(), cache.get_metrics()
+
+
+class LocalFileCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    super(LocalFileCacheTest, self).setUp()
+    self.source_dir = tempfile.mkdtemp()
+    self.cache_dir = tempfile.mkdtemp()
+    self.paths = []
+    for i in range(4):
+      path = os.path.join(self.source_dir, '%d.h5' % i)
+      with open(path, 'wb') as f:
+        f.write(bytes([i]) * 100)
+      self.paths.append(path)
+
+  def tearDown(self):
+    shutil.rmtree(self.source_dir)
+    shutil.rmtree(self.cache_dir)
+    super(LocalFileCacheTest, self).tearDown()
+
+  def read(self, cache, path):
+    with cache.open(path) as local_path:
+      with open(local_path, 'rb') as f:
+        return local_path, f.read()
+
+  def test_read_through(self):
+    cache = local_cache.LocalFileCache(self.cache_dir, 1000)
+    local_path, content = self.read(cache, self.paths[1])
+    self.assertEqual(content, bytes([1]) * 100)
+    self.assertEqual(os.path.dirname(local_path), self.cache_dir)
+    self.assertEqual(self.read(cache, self.paths[1]), (local_path, content))
+    metrics = cache.get_metrics()
+    self.assertEqual((metrics['hits'], metrics['misses']), (1, 1))
+    self.assertEqual(metrics['bytes_copied'], 100)
+
+  def test_lru_eviction(self):
+    cache = local_cache.LocalFileCache(self.cache_dir, 250)
+    first, _ = self.read(cache, self.paths[0])
+    second, _ = self.read(cache, self.paths[1])
+    # Reading the first file again makes the second the least recently used.
+    os.utime(second, ns=(1, 1))
+    self.read(cache, self.paths[0])
+    self.read(cache, self.paths[2])
+    self.assertTrue(os.path.exists(first))
+    self.assertFalse(os.path.exists(second))
+    self.assertLessEqual(cache.get_size(), 250)
+    self.assertEqual(cache.get_metrics()['evictions'], 1)
+    # The locks are removed with their copy.
+    self.assertFalse(os.path.exists(second + local_cache.LOCK_SUFFIX))
+    self.assertFalse(os.path.exists(second + local_cache.FILL_LOCK_SUFFIX))
+    self.assertTrue(os.path.exists(first + local_cache.LOCK_SUFFIX))
+
+  def test_orphan_locks(self):
+    cache = local_cache.LocalFileCache(self.cache_dir, 150)
+    # Locks left by a copy that failed.
+    orphan = os.path.join(self.cache_dir, 'orphan')
+    for suffix in (local_cache.LOCK_SUFFIX, local_cache.FILL_LOCK_SUFFIX):
+      open(orphan + suffix, 'w').close()
+    self.read(cache, self.paths[0])
+    local_path, _ = self.read(cache, self.paths[1])
+    name = os.path.basename(local_path)
+    self.assertEqual(sorted(os.listdir(self.cache_dir)), sorted([
+        local_cache.DIRECTORY_LOCK, name, name + local_cache.LOCK_SUFFIX,
+        name + local_cache.FILL_LOCK_SUFFIX]))
+
+  def test_copies_being_filled(self):
+    cache = local_cache.LocalFileCache(self.cache_dir, 250)
+    # A copy of 100 bytes reserved by another process, filling it with its
+    # locks held.
+    filling = os.path.join(self.cache_dir, 'filling.h5')
+    fds = [local_cache._lock(filling + local_cache.LOCK_SUFFIX,
+                             local_cache.fcntl.LOCK_SH),
+           local_cache._lock(filling + local_cache.FILL_LOCK_SUFFIX,
+                             local_cache.fcntl.LOCK_EX)]
+    with open(filling + '.123' + local_cache._TMP_SUFFIX, 'wb') as f:
+      f.truncate(100)
+    try:
+      first, _ = self.read(cache, self.paths[0])
+      self.read(cache, self.paths[1])
+      # The reserved bytes count toward the budget.
+      self.assertFalse(os.path.exists(first))
+      self.assertEqual(cache.evict(250), 200)
+    finally:
+      for fd in fds:
+        os.close(fd)
+    # Once no process fills it, the temporary file is removed.
+    self.assertEqual(cache.evict(250), 100)
+    self.assertFalse(os.path.exists(filling + '.123' + local_cache._TMP_SUFFIX))
+    self.assertFalse(os.path.exists(filling + local_cache.FILL_LOCK_SUFFIX))
+
+  def test_open_copies_are_kept(self):
+    cache = local_cache.LocalFileCache(self.cache_dir, 150)
+    with cache.open(self.paths[0]) as first:
+      self.read(cache, self.paths[1])
+      self.assertTrue(os.path.exists(first))
+
+  def test_too_large(self):
+    cache = local_cache.LocalFileCache(self.cache_dir, 50)
+    local_path, _ = self.read(cache, self.paths[0])
+    self.assertEqual(local_path, self.paths[0])
+    self.assertEqual(cache.get_metrics()['bypasses'], 1)
+
+  def test_rewritten_source(self):
+    cache = local_cache.LocalFileCache(self.cache_dir, 1000)
+    self.read(cache, self.paths[0])
+    with open(self.paths[0], 'wb') as f:
+      f.write(b'new')
+    cache = local_cache.LocalFileCache(self.cache_dir, 1000)
+    self.assertEqual(self.read(cache, self.paths[0])[1], b'new')
+
+  def test_processes_share_copies(self):
+    pool = multiprocessing.Pool(4)
+    try:
+      results = pool.map(read_through_cache,
+                         [(self.cache_dir, self.paths[3])] * 8)
+    finally:
+      pool.close()
+      pool.join()
+    for content, _ in results:
+      self.assertEqual(content, bytes([3]) * 100)
+    self.assertEqual(sum(metrics['misses'] for _, metrics in results), 1)
+
+  def test_pipeline_counters(self):
+    pipeline_stats._pipeline_stats = pipeline_stats.PipelineStats(max_processes=1)
+    try:
+      cache = local_cache.LocalFileCache(self.cache_dir, 150)
+      self.read(cache, self.paths[0])
+      self.read(cache, self.paths[0])
+      self.read(cache, self.paths[1])
+      self.assertEqual(pipeline_stats._pipeline_stats.get_counters(), {
+          'local_cache_hits': 1, 'local_cache_misses': 2,
+          'local_cache_evictions': 1, 'local_cache_bytes_copied': 200,
+          'local_cache_bytes_evicted': 100})
+    finally:
+      pipeline_stats._pipeline_stats = None
+
+
+if __name__ == '__main__':
+  unittest.main()
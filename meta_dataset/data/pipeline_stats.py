@@ -0,0 +1,361 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Latency histograms of the stages of the data pipeline.
+
+The datasets and backends time the stages of every episode or batch they read,
+and the time of each stage is added up over the episode:
+
+  index      looking up the indices and labels of the episode.
+  open       opening the class files.
+  read       reading the encoded images.
+  decode     decoding the images, including the resize from a pyramid level.
+  transform  applying the transforms.
+  collate    stacking the images of the episode.
+  wait       waiting for the DataLoader workers, in the main process.
+
+The dataset reading an episode calls begin_episode() and end_episode(), and
+the code in between times its stages with time_stage(), without knowing which
+dataset the episode is of. The durations of the episodes are counted in
+log-spaced histograms per dataset and stage, four buckets per power of two from
+1us, so that percentiles are within 12.5% of the exact ones. The histograms of
+all the processes are in a tensor in shared memory, created by the main process
+and inherited or unpickled by the DataLoader workers. Each process counts in
+its own row, which it claims from a shared counter under a file lock the first
+time it counts, so that the workers of concurrent DataLoaders, or of
+successive epochs, do not share rows. No locking is needed afterwards, and the
+summaries add the rows up.
+
+The caches also count their hits and misses in COUNTERS, with add_count(), in
+the same way but for all the datasets together.
+
+The statistics are opt-in, enabled with `PipelineStats.enabled = True` in gin.
+Recording a duration is then a few array updates.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import atexit
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+
+import gin
+import numpy as np
+import torch
+
+STAGES = ('index', 'open', 'read', 'decode', 'transform', 'collate', 'wait')
+COUNTERS = ('local_cache_hits', 'local_cache_misses', 'local_cache_bypasses',
+            'local_cache_evictions', 'local_cache_bytes_copied',
+            'local_cache_bytes_evicted') + tuple(
+                'image_cache_%s_%s' % (tier, counter)
+                for tier in ('decoded', 'encoded', 'disk')
+                for counter in ('hits', 'misses', 'bytes_put', 'evictions'))
+PERCENTILES = (50, 95, 99)
+
+# Bucket 0 counts durations under 2**_MIN_EXPONENT ns, bucket 4 * (e - 10) +
+# s + 1 the ones in [(4 + s) * 2**(e - 2), (5 + s) * 2**(e - 2)) ns.
+_MIN_EXPONENT = 10
+_SUB_BUCKETS = 4
+NUM_BUCKETS = 128
+
+
+def get_bucket(duration_ns):
+  """Returns the histogram bucket of a duration in nanoseconds."""
+  exponent = duration_ns.bit_length() - 1
+  if exponent < _MIN_EXPONENT:
+    return 0
+  sub_bucket = (duration_ns >> (exponent - 2)) & (_SUB_BUCKETS - 1)
+  return min((exponent - _MIN_EXPONENT) * _SUB_BUCKETS + sub_bucket + 1,
+             NUM_BUCKETS - 1)
+
+
+def get_bucket_value(bucket):
+  """Returns the duration in nanoseconds representing a bucket, its middle."""
+  if bucket == 0:
+    return 2 ** _MIN_EXPONENT / 2
+  exponent = (bucket - 1) // _SUB_BUCKETS + _MIN_EXPONENT
+  sub_bucket = (bucket - 1) % _SUB_BUCKETS
+  return (_SUB_BUCKETS + sub_bucket + 0.5) * 2 ** (exponent - 2)
+
+
+class _StageTimer(object):
+  """Context manager adding the duration of its block to the episode."""
+
+  __slots__ = ('stats', 'stage', 'start')
+
+  def __init__(self, stats, stage):
+    self.stats = stats
+    self.stage = stage
+
+  def __enter__(self):
+    self.start = time.perf_counter_ns()
+    return self
+
+  def __exit__(self, *exc_info):
+    self.stats.episode_ns[self.stage] += time.perf_counter_ns() - self.start
+    self.stats.episode_timed[self.stage] = True
+    return False
+
+
+class _NullTimer(object):
+  """Context manager timing nothing, used when the statistics are disabled."""
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class PipelineStats(object):
+  """Latency histograms per dataset and stage, shared by all the processes.
+
+  The datasets are registered, in the main process, before the workers are
+  started, so that all the processes agree on their slots.
+  """
+
+  def __init__(self, max_processes=256, max_datasets=16):
+    """Initializes the histograms.
+
+    Args:
+      max_processes: int, the number of processes, i.e. the main process and
+        all the DataLoader workers started while it runs, that count in their
+        own row. Processes beyond it share the last row, and may lose counts.
+      max_datasets: int, the number of datasets with their own histograms.
+        Datasets beyond it are counted together under 'other'.
+    """
+    self.max_processes = max_processes
+    self.max_datasets = max_datasets
+    self.datasets = []
+    shape = (max_processes, max_datasets + 1, len(STAGES))
+    self.counts = torch.zeros(shape + (NUM_BUCKETS,),
+                              dtype=torch.int64).share_memory_()
+    self.total_ns = torch.zeros(shape, dtype=torch.int64).share_memory_()
+    self.counters = torch.zeros((max_processes, len(COUNTERS)),
+                                dtype=torch.int64).share_memory_()
+    # The number of rows claimed, incremented under the lock of lock_path,
+    # which the main process removes when it exits.
+    self.rows_claimed = torch.zeros(1, dtype=torch.int64).share_memory_()
+    fd, self.lock_path = tempfile.mkstemp(prefix='meta_dataset_stats.',
+                                          suffix='.lock')
+    os.close(fd)
+    atexit.register(_remove_lock, self.lock_path, os.getpid())
+    self._stage_ids = dict((s, i) for i, s in enumerate(STAGES))
+    self._counter_ids = dict((c, i) for i, c in enumerate(COUNTERS))
+    # The time of each stage in the episode being read by this process.
+    self.episode_ns = [0] * len(STAGES)
+    self.episode_timed = [False] * len(STAGES)
+    # The process the views are of, since forked workers inherit them.
+    self._views = None
+    self._views_pid = None
+
+  def __getstate__(self):
+    state = dict(self.__dict__)
+    state['_views'] = None
+    state['_views_pid'] = None
+    return state
+
+  def __setstate__(self, state):
+    global _pipeline_stats
+    self.__dict__.update(state)
+    # Workers that unpickle the datasets, instead of forking, time their
+    # stages with the stats of the datasets.
+    if _pipeline_stats is None:
+      _pipeline_stats = self
+
+  def register(self, dataset):
+    """Returns the slot of a dataset, registering it if needed."""
+    if dataset not in self.datasets:
+      self.datasets.append(dataset)
+    return min(self.datasets.index(dataset), self.max_datasets)
+
+  def _claim_row(self):
+    """Returns the row of a process that did not count yet."""
+    with open(self.lock_path, 'a') as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+      row = int(self.rows_claimed[0])
+      self.rows_claimed[0] += 1
+    if row >= self.max_processes:
+      if row == self.max_processes:
+        logging.warning('More than %d processes count pipeline statistics, '
+                        'the others share the last row and may lose counts',
+                        self.max_processes)
+      row = self.max_processes - 1
+    return row
+
+  def _get_views(self):
+    """Returns numpy views of the row of this process."""
+    if self._views_pid != os.getpid():
+      row = self._claim_row()
+      self._views = (self.counts.numpy()[row], self.total_ns.numpy()[row],
+                     self.counters.numpy()[row])
+      self._views_pid = os.getpid()
+    return self._views
+
+  def record(self, slot, stage, duration_ns):
+    """Counts the duration of a stage, in nanoseconds."""
+    counts, total_ns, _ = self._get_views()
+    stage = self._stage_ids[stage]
+    counts[slot, stage, get_bucket(duration_ns)] += 1
+    total_ns[slot, stage] += duration_ns
+
+  def time(self, stage):
+    """Returns a context manager adding the duration of its block to the episode."""
+    return _StageTimer(self, self._stage_ids[stage])
+
+  def begin_episode(self):
+    for i in range(len(STAGES)):
+      self.episode_ns[i] = 0
+      self.episode_timed[i] = False
+
+  def end_episode(self, slot):
+    """Counts the time of each stage timed since begin_episode."""
+    counts, total_ns, _ = self._get_views()
+    for i, duration_ns in enumerate(self.episode_ns):
+      if self.episode_timed[i]:
+        counts[slot, i, get_bucket(duration_ns)] += 1
+        total_ns[slot, i] += duration_ns
+    self.begin_episode()
+
+  def add(self, counter, value=1):
+    """Adds value to one of COUNTERS."""
+    self._get_views()[2][self._counter_ids[counter]] += value
+
+  def reset(self):
+    self.counts.zero_()
+    self.total_ns.zero_()
+    self.counters.zero_()
+
+  def get_counters(self):
+    """Returns a dict from counter to its total over all the processes.
+
+    Counters that are zero are omitted.
+    """
+    totals = self.counters.numpy().sum(axis=0)
+    return dict((c, int(totals[i])) for i, c in enumerate(COUNTERS)
+                if totals[i])
+
+  def get_summary(self):
+    """Returns the statistics of all the processes.
+
+    Returns:
+      A dict from dataset name to a dict from stage to its count, mean and
+      percentiles in milliseconds. Stages that were never timed are omitted.
+    """
+    counts = self.counts.numpy().sum(axis=0)
+    total_ns = self.total_ns.numpy().sum(axis=0)
+    slots = list(enumerate(self.datasets[:self.max_datasets]))
+    slots.append((self.max_datasets, 'other'))
+    summary = {}
+    for slot, name in slots:
+      for stage_id, stage in enumerate(STAGES):
+        histogram = counts[slot, stage_id]
+        count = int(histogram.sum())
+        if count == 0:
+          continue
+        cumulative = np.cumsum(histogram)
+        stats = dict(count=count,
+                     mean_ms=float(total_ns[slot, stage_id]) / count / 1e6)
+        for p in PERCENTILES:
+          bucket = int(np.searchsorted(cumulative, p / 100. * count))
+          stats['p%d_ms' % p] = get_bucket_value(bucket) / 1e6
+        summary.setdefault(name, {})[stage] = stats
+    return summary
+
+  def write_json(self, path):
+    summary = self.get_summary()
+    counters = self.get_counters()
+    if counters:
+      summary['counters'] = counters
+    with open(path, 'w') as f:
+      json.dump(summary, f, indent=2, sort_keys=True)
+
+  def write_tensorboard(self, writer, step):
+    """Adds the summary as scalars, e.g. to a torch.utils.tensorboard.SummaryWriter.
+
+    Args:
+      writer: an object with an add_scalar(tag, value, step) method.
+      step: the global step of the scalars.
+    """
+    for name, stages in self.get_summary().items():
+      for stage, stats in stages.items():
+        for k, v in stats.items():
+          writer.add_scalar('pipeline/%s/%s/%s' % (name, stage, k), v, step)
+    for counter, value in self.get_counters().items():
+      writer.add_scalar('pipeline/counters/%s' % counter, value, step)
+
+  def log_summary(self):
+    for name, stages in sorted(self.get_summary().items()):
+      for stage in STAGES:
+        if stage in stages:
+          logging.info('Pipeline %s, %s: %s', name, stage,
+                       ', '.join('%s %.3g' % kv
+                                 for kv in sorted(stages[stage].items())))
+    counters = self.get_counters()
+    if counters:
+      logging.info('Pipeline counters: %s',
+                   ', '.join('%s %d' % kv for kv in sorted(counters.items())))
+
+
+_pipeline_stats = None
+
+
+def _remove_lock(path, pid):
+  # Forked workers inherit the exit handlers of the main process.
+  if os.getpid() == pid:
+    try:
+      os.remove(path)
+    except OSError:
+      pass
+
+
+@gin.configurable('PipelineStats')
+def get_pipeline_stats(enabled=False, max_processes=256, max_datasets=16):
+  """Returns the PipelineStats of this process, or None if disabled.
+
+  It is created by the first call, in the main process, and inherited by the
+  DataLoader workers with the datasets. See PipelineStats for the arguments.
+  """
+  global _pipeline_stats
+  if not enabled:
+    return None
+  if _pipeline_stats is None:
+    _pipeline_stats = PipelineStats(max_processes, max_datasets)
+  return _pipeline_stats
+
+
+def time_stage(stage):
+  """Returns a context manager timing a stage of the episode being read.
+
+  It does nothing if the statistics are disabled.
+  """
+  if _pipeline_stats is None:
+    return NULL_TIMER
+  return _pipeline_stats.time(stage)
+
+
+def add_count(counter, value=1):
+  """Adds value to one of COUNTERS, if the statistics are enabled."""
+  if _pipeline_stats is not None:
+    _pipeline_stats.add(counter, value)
@@ -0,0 +1,176 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for `pipeline_stats` module."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import tempfile
+import unittest
+
+import gin
+from meta_dataset.data import pipeline_stats
+from meta_dataset.datasets import episodic_dataloader
+import torch
+
+
+class ToyEpisodes(torch.utils.data.Dataset):
+  """Episodes whose read stage lasts 1ms plus 1ms per 10 episodes."""
+
+  def __init__(self, stats):
+    self.stats = stats
+    self.slot = stats.register('toy')
+
+  def __getitem__(self, item):
+    self.stats.begin_episode()
+    with pipeline_stats.time_stage('read'):
+      pass
+    self.stats.episode_ns[pipeline_stats.STAGES.index('read')] = (
+        (1 + item // 10) * 10 ** 6)
+    self.stats.end_episode(self.slot)
+    return item
+
+  def __len__(self):
+    return 100
+
+
+class ToyEpisodicDataset(ToyEpisodes):
+  """Episodes with the interface the EpisodicDataLoader expects."""
+
+  name = 'toy'
+
+  def build_episode_indices(self):
+    pass
+
+
+class TimeStageTest(unittest.TestCase):
+
+  def test_disabled(self):
+    self.assertIs(pipeline_stats.time_stage('read'), pipeline_stats.NULL_TIMER)
+    # The statistics are opt-in.
+    self.assertIsNone(pipeline_stats.get_pipeline_stats())
+
+
+class PipelineStatsTest(unittest.TestCase):
+
+  def setUp(self):
+    super(PipelineStatsTest, self).setUp()
+    self.stats = pipeline_stats.PipelineStats(max_processes=4, max_datasets=2)
+    pipeline_stats._pipeline_stats = self.stats
+
+  def tearDown(self):
+    pipeline_stats._pipeline_stats = None
+    super(PipelineStatsTest, self).tearDown()
+
+  def test_buckets(self):
+    for duration_ns in (1, 1023, 1024, 1500, 10 ** 6, 3 * 10 ** 9):
+      bucket = pipeline_stats.get_bucket(duration_ns)
+      value = pipeline_stats.get_bucket_value(bucket)
+      if duration_ns >= 1024:
+        self.assertLessEqual(abs(value - duration_ns) / duration_ns, 0.125)
+      else:
+        self.assertEqual(bucket, 0)
+    self.assertEqual(pipeline_stats.get_bucket(2 ** 62),
+                     pipeline_stats.NUM_BUCKETS - 1)
+
+  def test_episode_stages(self):
+    slot = self.stats.register('a')
+    self.stats.begin_episode()
+    with pipeline_stats.time_stage('read'):
+      pass
+    with pipeline_stats.time_stage('read'):
+      pass
+    self.stats.end_episode(slot)
+    self.stats.record(slot, 'wait', 5 * 10 ** 6)
+    summary = self.stats.get_summary()
+    self.assertEqual(set(summary['a']), {'read', 'wait'})
+    self.assertEqual(summary['a']['read']['count'], 1)
+    self.assertAlmostEqual(summary['a']['wait']['p99_ms'], 5, delta=0.7)
+
+  def test_other_datasets(self):
+    for name in ('a', 'b', 'c', 'd'):
+      self.stats.record(self.stats.register(name), 'read', 1000)
+    self.assertEqual(self.stats.register('b'), 1)
+    summary = self.stats.get_summary()
+    self.assertEqual(sorted(summary), ['a', 'b', 'other'])
+    self.assertEqual(summary['other']['read']['count'], 2)
+
+  def test_workers_share_histograms(self):
+    loader = torch.utils.data.DataLoader(ToyEpisodes(self.stats),
+                                         batch_size=None, num_workers=2)
+    self.assertEqual(len(list(loader)), 100)
+    stats = self.stats.get_summary()['toy']['read']
+    self.assertEqual(stats['count'], 100)
+    self.assertAlmostEqual(stats['mean_ms'], 5.5)
+    self.assertAlmostEqual(stats['p50_ms'], 5, delta=0.7)
+    self.assertAlmostEqual(stats['p95_ms'], 10, delta=1.3)
+    # The main process did not count, the workers claimed a row each.
+    self.assertEqual(int(self.stats.rows_claimed[0]), 2)
+
+  def test_concurrent_loaders(self):
+    loaders = [torch.utils.data.DataLoader(ToyEpisodes(self.stats),
+                                           batch_size=None, num_workers=2)
+               for _ in range(2)]
+    self.assertEqual(len(list(zip(*loaders))), 100)
+    self.assertEqual(self.stats.get_summary()['toy']['read']['count'], 200)
+    # Each worker of each loader counted in its own row.
+    self.assertEqual(int(self.stats.rows_claimed[0]), 4)
+    read = pipeline_stats.STAGES.index('read')
+    self.assertEqual(
+        sorted(int(n) for n in self.stats.counts[:, 0, read].sum(axis=1)),
+        [50, 50, 50, 50])
+
+  def test_loader_wait(self):
+    gin.bind_parameter('PipelineStats.enabled', True)
+    self.addCleanup(gin.bind_parameter, 'PipelineStats.enabled', False)
+    loader = episodic_dataloader.EpisodicDataLoader(
+        ToyEpisodicDataset(self.stats), batch_size=None, num_workers=2,
+        persistent_workers=True)
+    for _ in range(2):
+      iterator = iter(loader)
+      # The iterator is timed without being wrapped.
+      self.assertIsInstance(iterator,
+                            torch.utils.data.dataloader._BaseDataLoaderIter)
+      self.assertEqual(len(iterator), 100)
+      self.assertEqual(len(list(iterator)), 100)
+    self.assertEqual(self.stats.get_summary()['toy']['wait']['count'], 200)
+
+  def test_export(self):
+    self.stats.record(self.stats.register('a'), 'decode', 2 * 10 ** 6)
+    path = os.path.join(tempfile.mkdtemp(), 'stats.json')
+    self.stats.write_json(path)
+    with open(path) as f:
+      self.assertEqual(json.load(f)['a']['decode']['count'], 1)
+    os.remove(path)
+
+    class Writer(object):
+      scalars = {}
+
+      def add_scalar(self, tag, value, step):
+        self.scalars[tag] = (value, step)
+
+    writer = Writer()
+    self.stats.write_tensorboard(writer, 7)
+    self.assertEqual(writer.scalars['pipeline/a/decode/count'], (1, 7))
+    self.stats.reset()
+    self.assertEqual(self.stats.get_summary(), {})
+
+
+if __name__ == '__main__':
+  unittest.main()
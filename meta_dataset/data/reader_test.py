@@ -365,25 +365,18 @@ class EpisodeReaderTest(tf.test.TestCase):
     Even with the same episode descriptions, the content should be different.
     """
     num_episodes = 10
-    init_rng = sampling.RNG
     seed = 20181120
     episode_streams = []
     chunk_sizes = []
-    try:
-      for _ in range(2):
-        sampling.RNG = np.random.RandomState(seed)
-        sampler = sampling.EpisodeDescriptionSampler(self.dataset_spec,
-                                                     self.split)
-        episodes = self.generate_episodes(sampler, num_episodes)
-        episode_streams.append(episodes)
-        chunk_size = sampler.compute_chunk_sizes()
-        chunk_sizes.append(chunk_size)
-        for examples, targets in episodes:
-          self.check_episode_consistency(examples, targets, chunk_size)
-
-    finally:
-      # Restore the original RNG
-      sampling.RNG = init_rng
+    for _ in range(2):
+      sampler = sampling.EpisodeDescriptionSampler(
+          self.dataset_spec, self.split, seed=seed)
+      episodes = self.generate_episodes(sampler, num_episodes)
+      episode_streams.append(episodes)
+      chunk_size = sampler.compute_chunk_sizes()
+      chunk_sizes.append(chunk_size)
+      for examples, targets in episodes:
+        self.check_episode_consistency(examples, targets, chunk_size)
 
     self.assertEqual(chunk_sizes[0], chunk_sizes[1])
 
@@ -401,25 +394,18 @@ class EpisodeReaderTest(tf.test.TestCase):
   def test_deterministic_noshuffle(self):
     """Tests episode generation determinism when there is noshuffle queue."""
     num_episodes = 10
-    init_rng = sampling.RNG
     seed = 20181120
     episode_streams = []
     chunk_sizes = []
-    try:
-      for _ in range(2):
-        sampling.RNG = np.random.RandomState(seed)
-        sampler = sampling.EpisodeDescriptionSampler(self.dataset_spec,
-                                                     self.split)
-        episodes = self.generate_episodes(sampler, num_episodes, shuffle=False)
-        episode_streams.append(episodes)
-        chunk_size = sampler.compute_chunk_sizes()
-        chunk_sizes.append(chunk_size)
-        for examples, targets in episodes:
-          self.check_episode_consistency(examples, targets, chunk_size)
-
-    finally:
-      # Restore the original RNG
-      sampling.RNG = init_rng
+    for _ in range(2):
+      sampler = sampling.EpisodeDescriptionSampler(
+          self.dataset_spec, self.split, seed=seed)
+      episodes = self.generate_episodes(sampler, num_episodes, shuffle=False)
+      episode_streams.append(episodes)
+      chunk_size = sampler.compute_chunk_sizes()
+      chunk_sizes.append(chunk_size)
+      for examples, targets in episodes:
+        self.check_episode_consistency(examples, targets, chunk_size)
 
     self.assertEqual(chunk_sizes[0], chunk_sizes[1])
 
@@ -433,23 +419,16 @@ class EpisodeReaderTest(tf.test.TestCase):
     seed = 20181120
     episode_streams = []
     chunk_sizes = []
-    init_rng = sampling.RNG
-    try:
-      for _ in range(2):
-        sampling.RNG = np.random.RandomState(seed)
-        sampler = sampling.EpisodeDescriptionSampler(self.dataset_spec,
-                                                     self.split)
-        episodes = self.generate_episodes(
-            sampler, num_episodes, shuffle_seed=seed)
-        episode_streams.append(episodes)
-        chunk_size = sampler.compute_chunk_sizes()
-        chunk_sizes.append(chunk_size)
-        for examples, targets in episodes:
-          self.check_episode_consistency(examples, targets, chunk_size)
-
-    finally:
-      # Restore the original RNG
-      sampling.RNG = init_rng
+    for _ in range(2):
+      sampler = sampling.EpisodeDescriptionSampler(
+          self.dataset_spec, self.split, seed=seed)
+      episodes = self.generate_episodes(
+          sampler, num_episodes, shuffle_seed=seed)
+      episode_streams.append(episodes)
+      chunk_size = sampler.compute_chunk_sizes()
+      chunk_sizes.append(chunk_size)
+      for examples, targets in episodes:
+        self.check_episode_consistency(examples, targets, chunk_size)
 
     self.assertEqual(chunk_sizes[0], chunk_sizes[1])
 
@@ -502,29 +481,25 @@ class EpisodeReaderTest(tf.test.TestCase):
     """
     num_episodes = 10
     seed = 20181121
-    init_rng = sampling.RNG
-    try:
-      sampling.RNG = np.random.RandomState(seed)
-      sampler = sampling.EpisodeDescriptionSampler(self.dataset_spec, split)
-      # Each description is a (class_id, num_support, num_query) tuple.
-      descriptions = [
-          sampler.sample_episode_description() for _ in range(num_episodes)
-      ]
-
-      sampling.RNG = np.random.RandomState(seed)
-      sampler = sampling.EpisodeDescriptionSampler(self.dataset_spec, split)
-      episodes = self.generate_episodes(sampler, num_episodes)
-      chunk_sizes = sampler.compute_chunk_sizes()
-      self.assertEqual(len(descriptions), len(episodes))
-      for (description, episode) in zip(descriptions, episodes):
-        examples, targets = episode
-        self.check_episode_consistency(examples, targets, chunk_sizes)
-        _, targets_support_chunk, targets_query_chunk = split_into_chunks(
-            targets, chunk_sizes)
-        self.check_description_vs_target_chunks(
-            description, targets_support_chunk, targets_query_chunk, offset)
-    finally:
-      sampling.RNG = init_rng
+    sampler = sampling.EpisodeDescriptionSampler(
+        self.dataset_spec, split, seed=seed)
+    # Each description is a (class_id, num_support, num_query) tuple.
+    descriptions = [
+        sampler.sample_episode_description() for _ in range(num_episodes)
+    ]
+
+    sampler = sampling.EpisodeDescriptionSampler(
+        self.dataset_spec, split, seed=seed)
+    episodes = self.generate_episodes(sampler, num_episodes)
+    chunk_sizes = sampler.compute_chunk_sizes()
+    self.assertEqual(len(descriptions), len(episodes))
+    for (description, episode) in zip(descriptions, episodes):
+      examples, targets = episode
+      self.check_episode_consistency(examples, targets, chunk_sizes)
+      _, targets_support_chunk, targets_query_chunk = split_into_chunks(
+          targets, chunk_sizes)
+      self.check_description_vs_target_chunks(
+          description, targets_support_chunk, targets_query_chunk, offset)
 
   def test_same_as_generator(self):
     # The offset corresponds to the difference between the absolute class ID as
@@ -0,0 +1,307 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+r"""Sidecar index of the records of a dataset.
+
+The index records, for each class of a dataset, where its images are stored
+(file and, for hdf5 files, dataset), how many there are and their total size
+in bytes. It also records the offset and size of each image: the offset is
+the position of the image in the file for TFRecord files, and its position
+among the concatenated images of its class for hdf5 files. It is stored next
+to the records, as INDEX_FILENAME (JSON, with everything but the offsets and
+sizes of the images, so that it is quick to load) and OFFSETS_FILENAME (a
+.npy array of shape [num_images, 2] with the offset and size of each image,
+grouped by class).
+
+The index is built at conversion time, from the sizes of the images that the
+converters store in the hdf5 files (see hdf5_format), or with
+
+  python -m meta_dataset.data.records_index \
+    --records_index_path=<path/to/dataset>
+
+which reads the classes in parallel, and reads back the images of the files
+converted before their sizes were stored. It also records the size and
+modification time of the files it describes, so that an index made out of
+date by a new conversion is not used.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import logging
+import multiprocessing
+import os
+import pickle as pkl
+
+from meta_dataset.data import hdf5_format
+from meta_dataset.data import learning_spec
+from meta_dataset.data import tfrecord_format
+from meta_dataset.utils.argparse import argparse
+from meta_dataset.utils.lazy_import import lazy_import
+import numpy as np
+
+h5py = lazy_import('h5py')
+
+parser = argparse.parser
+parser.add_argument(
+  '--records_index_path', default='',
+  help='The directory of the records and dataset_spec.pkl of the dataset to '
+       'index when running this module.')
+parser.add_argument(
+  '--records_index_workers', type=int, default=None,
+  help='The number of processes reading classes to build a records index, by '
+       'default the number of cpus.')
+FLAGS = argparse.FLAGS
+
+INDEX_FILENAME = 'records_index.json'
+OFFSETS_FILENAME = 'records_index.npy'
+INDEX_FORMAT_VERSION = 1
+
+# Name of the dataset of the images of a class stored in a file of its own.
+CLASS_FILE_DATASET = 'images'
+
+# Number of images read at once to measure their sizes in hdf5 files.
+_READ_CHUNK_SIZE = 1024
+
+
+def get_all_classes(dataset_spec):
+  """Returns the ids of the classes of all the splits of a dataset."""
+  classes = []
+  for split in learning_spec.Split:
+    classes.extend(dataset_spec.get_classes(split))
+  return sorted(set(classes))
+
+
+def get_class_location(dataset_spec, class_id):
+  """Returns where the images of a class are stored.
+
+  The converters store all classes in one hdf5 file named after the dataset,
+  with a dataset per class named after the class. Alternatively, each class can
+  have its own file, formatted from the file pattern with the class id, which
+  holds its images in CLASS_FILE_DATASET for hdf5 files.
+
+  Args:
+    dataset_spec: the DatasetSpecification of the dataset.
+    class_id: the id of the class.
+
+  Returns:
+    A (file_name, key) tuple, with the file_name relative to the path of the
+    dataset, and key the name of the dataset in the hdf5 file, or None for
+    TFRecord files.
+  """
+  if dataset_spec.file_pattern.endswith('.tfrecords'):
+    return dataset_spec.file_pattern.format(class_id), None
+  dataset_file = dataset_spec.file_pattern.format(dataset_spec.name)
+  if os.path.exists(os.path.join(dataset_spec.path, dataset_file)):
+    return dataset_file, str(class_id)
+  return dataset_spec.file_pattern.format(class_id), CLASS_FILE_DATASET
+
+
+def read_image_offsets(path, key=None):
+  """Reads the offset and size of each image of a class.
+
+  Args:
+    path: the path to the file of the class.
+    key: the name of the dataset of the class in the hdf5 file, or None for
+      a TFRecord file.
+
+  Returns:
+    An int64 numpy array of shape [num_images, 2], see the module docstring.
+  """
+  if key is None:
+    return tfrecord_format.build_index(path)
+  with h5py.File(path, 'r') as h5fp:
+    dataset = h5fp[key]
+    sizes_key = hdf5_format.get_image_sizes_name(key)
+    if sizes_key in h5fp and len(h5fp[sizes_key]) == len(dataset):
+      sizes = h5fp[sizes_key][:]
+    else:
+      # The sizes are not stored in the files converted before they were, so
+      # the images are read back.
+      sizes = np.zeros(len(dataset), dtype=np.int64)
+      for start in range(0, len(dataset), _READ_CHUNK_SIZE):
+        images = dataset[start:start + _READ_CHUNK_SIZE]
+        sizes[start:start + len(images)] = [im.size for im in images]
+  offsets = np.cumsum(sizes) - sizes
+  return np.stack([offsets, sizes], axis=1)
+
+
+def _read_image_offsets(args):
+  return read_image_offsets(*args)
+
+
+def _get_file_stamp(path):
+  stat = os.stat(path)
+  return [stat.st_size, stat.st_mtime_ns]
+
+
+class RecordsIndex(object):
+  """The index of the records of a dataset, see the module docstring."""
+
+  def __init__(self, path, classes, files, offsets=None):
+    """Initialize a RecordsIndex.
+
+    Args:
+      path: the path of the dataset.
+      classes: a dict mapping each class id, as a string, to a dict with its
+        "file", "key", "num_images", "num_bytes" and "start", the row of the
+        offsets of its first image.
+      files: a dict mapping each file name to its [size, mtime_ns].
+      offsets: optional int64 numpy array of shape [num_images, 2], loaded
+        from OFFSETS_FILENAME on demand if not given.
+    """
+    self.path = path
+    self.classes = classes
+    self.files = files
+    self._offsets = offsets
+
+  @classmethod
+  def load(cls, path):
+    """Loads the index of a dataset.
+
+    Args:
+      path: the path of the dataset.
+
+    Returns:
+      The RecordsIndex, or None if the dataset has no index, or one that is
+      out of date.
+    """
+    index_path = os.path.join(path, INDEX_FILENAME)
+    if not os.path.exists(index_path):
+      return None
+    with open(index_path) as f:
+      data = json.load(f)
+    if data.get('version') != INDEX_FORMAT_VERSION:
+      logging.warning('Ignoring %s, which has an unknown version.', index_path)
+      return None
+    for file_name, stamp in data['files'].items():
+      file_path = os.path.join(path, file_name)
+      if not os.path.exists(file_path) or _get_file_stamp(file_path) != stamp:
+        logging.warning('Ignoring %s, since %s changed after it was built.',
+                        index_path, file_name)
+        return None
+    return cls(path, data['classes'], data['files'])
+
+  @classmethod
+  def build(cls, dataset_spec, n_jobs=None):
+    """Builds the index of a dataset by reading its classes in parallel.
+
+    Args:
+      dataset_spec: the DatasetSpecification of the dataset.
+      n_jobs: the number of processes reading classes, by default the number
+        of cpus.
+
+    Returns:
+      The RecordsIndex.
+    """
+    locations = [(class_id, get_class_location(dataset_spec, class_id))
+                 for class_id in get_all_classes(dataset_spec)]
+    args = [(os.path.join(dataset_spec.path, file_name), key)
+            for _, (file_name, key) in locations]
+    with multiprocessing.Pool(n_jobs) as pool:
+      class_offsets = pool.map(_read_image_offsets, args, chunksize=1)
+    classes = {}
+    start = 0
+    for (class_id, (file_name, key)), offsets in zip(locations, class_offsets):
+      classes[str(class_id)] = {
+        'file': file_name,
+        'key': key,
+        'num_images': len(offsets),
+        'num_bytes': int(offsets[:, 1].sum()),
+        'start': start,
+      }
+      start += len(offsets)
+    files = {
+      file_name: _get_file_stamp(os.path.join(dataset_spec.path, file_name))
+      for _, (file_name, _) in locations
+    }
+    offsets = (np.concatenate(class_offsets) if class_offsets else
+               np.zeros((0, 2), dtype=np.int64))
+    return cls(dataset_spec.path, classes, files, offsets)
+
+  def save(self):
+    """Writes the index next to the records."""
+    offsets_path = os.path.join(self.path, OFFSETS_FILENAME)
+    with open(offsets_path + '.tmp', 'wb') as f:
+      np.save(f, self.offsets)
+    os.replace(offsets_path + '.tmp', offsets_path)
+    index_path = os.path.join(self.path, INDEX_FILENAME)
+    with open(index_path + '.tmp', 'w') as f:
+      json.dump({
+        'version': INDEX_FORMAT_VERSION,
+        'classes': self.classes,
+        'files': self.files,
+      }, f, indent=1, sort_keys=True)
+    os.replace(index_path + '.tmp', index_path)
+
+  def __getstate__(self):
+    state = dict(self.__dict__)
+    # Memory mapped offsets are mapped again on demand rather than copied.
+    if isinstance(self._offsets, np.memmap):
+      state['_offsets'] = None
+    return state
+
+  @property
+  def offsets(self):
+    if self._offsets is None:
+      self._offsets = np.load(
+        os.path.join(self.path, OFFSETS_FILENAME), mmap_mode='r')
+    return self._offsets
+
+  def __contains__(self, class_id):
+    return str(class_id) in self.classes
+
+  def get_num_images(self, class_id):
+    """Returns the number of images of a class."""
+    return self.classes[str(class_id)]['num_images']
+
+  def get_num_bytes(self, class_id):
+    """Returns the total size in bytes of the images of a class."""
+    return self.classes[str(class_id)]['num_bytes']
+
+  def get_image_offsets(self, class_id):
+    """Returns the offsets of the images of a class, see read_image_offsets."""
+    entry = self.classes[str(class_id)]
+    start = entry['start']
+    return np.asarray(self.offsets[start:start + entry['num_images']])
+
+
+def load_or_build(dataset_spec, n_jobs=None):
+  """Returns the index of a dataset, building and saving it if necessary."""
+  index = RecordsIndex.load(dataset_spec.path)
+  if index is None:
+    logging.info('Building the records index of %s.', dataset_spec.name)
+    index = RecordsIndex.build(dataset_spec, n_jobs)
+    index.save()
+  return index
+
+
+def main():
+  path = FLAGS.records_index_path
+  with open(os.path.join(path, 'dataset_spec.pkl'), 'rb') as f:
+    dataset_spec = pkl.load(f)
+  dataset_spec = dataset_spec._replace(path=path)
+  index = RecordsIndex.build(dataset_spec, FLAGS.records_index_workers)
+  index.save()
+  logging.info('Indexed %d images of %d classes.', len(index.offsets),
+               len(index.classes))
+
+
+if __name__ == '__main__':
+  logging.getLogger().setLevel(logging.INFO)
+  argparse.parser.parse_args()
+  main()
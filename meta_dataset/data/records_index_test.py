@@ -0,0 +1,164 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for `records_index` module."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import pickle as pkl
+import tempfile
+import time
+import unittest
+
+import h5py
+from meta_dataset.data import hdf5_format
+from meta_dataset.data import records_index
+from meta_dataset.data import tfrecord_format
+from meta_dataset.data import tfrecord_test_utils
+from meta_dataset.data.dataset_spec import DatasetSpecification
+from meta_dataset.data.learning_spec import Split
+import numpy as np
+
+NUM_IMAGES = [3, 0, 5, 2]
+
+
+def create_spec(path, file_pattern):
+  return DatasetSpecification(
+    name='toy',
+    classes_per_split={
+      Split.TRAIN: 2,
+      Split.VALID: 1,
+      Split.TEST: 1
+    },
+    images_per_class=dict(enumerate(NUM_IMAGES)),
+    class_names=None,
+    path=path,
+    file_pattern=file_pattern)
+
+
+def get_image(class_id, i):
+  return np.full(10 * class_id + i + 1, i, dtype=np.uint8)
+
+
+class RecordsIndexTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.path = self.tmp_dir.name
+
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+
+  def write_hdf5(self, per_class_files):
+    for class_id, num_images in enumerate(NUM_IMAGES):
+      if per_class_files:
+        file_name = '{}.h5'.format(class_id)
+        key = records_index.CLASS_FILE_DATASET
+      else:
+        file_name = 'toy.h5'
+        key = str(class_id)
+      with h5py.File(os.path.join(self.path, file_name), 'a') as h5fp:
+        dataset = h5fp.create_dataset(
+          key, (num_images,), dtype=h5py.special_dtype(vlen=np.uint8))
+        for i in range(num_images):
+          dataset[i] = get_image(class_id, i)
+
+  def check_index(self, index):
+    self.assertEqual(len(index.classes), len(NUM_IMAGES))
+    for class_id, num_images in enumerate(NUM_IMAGES):
+      self.assertIn(class_id, index)
+      self.assertEqual(index.get_num_images(class_id), num_images)
+      sizes = [get_image(class_id, i).size for i in range(num_images)]
+      self.assertEqual(index.get_num_bytes(class_id), sum(sizes))
+      offsets = index.get_image_offsets(class_id)
+      self.assertEqual(offsets.shape, (num_images, 2))
+      np.testing.assert_array_equal(offsets[:, 1], sizes)
+    self.assertNotIn(len(NUM_IMAGES), index)
+
+  def test_dataset_file(self):
+    self.write_hdf5(per_class_files=False)
+    spec = create_spec(self.path, '{}.h5')
+    self.assertEqual(records_index.get_class_location(spec, 2), ('toy.h5', '2'))
+    index = records_index.RecordsIndex.build(spec, n_jobs=2)
+    self.check_index(index)
+    np.testing.assert_array_equal(
+      index.get_image_offsets(2)[:, 0], [0, 21, 43, 66, 90])
+
+  def test_stored_image_sizes(self):
+    self.write_hdf5(per_class_files=False)
+    with h5py.File(os.path.join(self.path, 'toy.h5'), 'a') as h5fp:
+      h5fp[hdf5_format.get_image_sizes_name(2)] = np.arange(5, dtype=np.int64)
+      # Sizes that do not match their class are ignored.
+      h5fp[hdf5_format.get_image_sizes_name(3)] = np.arange(1, dtype=np.int64)
+    path = os.path.join(self.path, 'toy.h5')
+    # The stored sizes are used instead of reading the images.
+    np.testing.assert_array_equal(
+      records_index.read_image_offsets(path, '2'),
+      [[0, 0], [0, 1], [1, 2], [3, 3], [6, 4]])
+    np.testing.assert_array_equal(
+      records_index.read_image_offsets(path, '3')[:, 1],
+      [get_image(3, i).size for i in range(2)])
+
+  def test_class_files(self):
+    self.write_hdf5(per_class_files=True)
+    spec = create_spec(self.path, '{}.h5')
+    self.assertEqual(
+      records_index.get_class_location(spec, 2),
+      ('2.h5', records_index.CLASS_FILE_DATASET))
+    self.check_index(records_index.RecordsIndex.build(spec, n_jobs=2))
+
+  def test_tfrecords(self):
+    for class_id, num_images in enumerate(NUM_IMAGES):
+      tfrecord_test_utils.write_records(
+        os.path.join(self.path, '{}.tfrecords'.format(class_id)), [
+          get_image(class_id, i).tobytes() for i in range(num_images)
+        ])
+    spec = create_spec(self.path, '{}.tfrecords')
+    index = records_index.RecordsIndex.build(spec, n_jobs=2)
+    self.check_index(index)
+    np.testing.assert_array_equal(
+      index.get_image_offsets(2),
+      tfrecord_format.build_index(os.path.join(self.path, '2.tfrecords')))
+
+  def test_save_and_load(self):
+    self.write_hdf5(per_class_files=False)
+    spec = create_spec(self.path, '{}.h5')
+    self.assertIsNone(records_index.RecordsIndex.load(self.path))
+    records_index.load_or_build(spec, n_jobs=2)
+    index = records_index.RecordsIndex.load(self.path)
+    self.check_index(index)
+    # Memory mapped offsets are not pickled.
+    self.assertIsInstance(index.offsets, np.memmap)
+    self.assertIsNone(pkl.loads(pkl.dumps(index))._offsets)
+
+  def test_out_of_date(self):
+    self.write_hdf5(per_class_files=False)
+    spec = create_spec(self.path, '{}.h5')
+    records_index.RecordsIndex.build(spec, n_jobs=2).save()
+    time.sleep(0.01)
+    with h5py.File(os.path.join(self.path, 'toy.h5'), 'a') as h5fp:
+      del h5fp['0']
+      h5fp.create_dataset('0', data=np.zeros((2, 1), dtype=np.uint8))
+    self.assertIsNone(records_index.RecordsIndex.load(self.path))
+    index = records_index.load_or_build(spec, n_jobs=2)
+    self.assertEqual(index.get_num_images(0), 2)
+    self.assertIsNotNone(records_index.RecordsIndex.load(self.path))
+
+
+if __name__ == '__main__':
+  unittest.main()
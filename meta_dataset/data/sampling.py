@@ -28,13 +28,19 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import zlib
+
 import gin
 from meta_dataset.data import dataset_spec as dataset_spec_lib
 from meta_dataset.data import imagenet_specification
 import numpy as np
 
-# Module-level random number generator. Initialized randomly, can be seeded.
-RNG = np.random.RandomState(seed=None)
+# Keys of the children of a (root, source, split) node of the seed tree. The
+# episode description sampler and the shuffling of the images inside each class
+# draw from independent streams.
+SAMPLER_STREAM = 0
+SHUFFLE_STREAM = 1
 
 # How the value of MAX_SPANNING_LEAVES_ELIGIBLE was selected.
 # This controls the upper bound on the number of leaves that an internal node
@@ -48,8 +54,141 @@ RNG = np.random.RandomState(seed=None)
 # selection without taking the hierarchy into account).
 MAX_SPANNING_LEAVES_ELIGIBLE = 392
 
+# Value used to pad the class IDs of episodes that have fewer than the maximum
+# number of ways in an `EpisodeDescriptions` batch.
+PADDING_CLASS_ID = -1
+
+
+class EpisodeDescriptions(
+    collections.namedtuple('EpisodeDescriptions',
+                           'num_ways, class_ids, num_support, num_query')):
+  """A batch of episode descriptions stored as padded arrays.
+
+    Args:
+      num_ways: np.array of shape [num_episodes], the number of ways of each
+        episode.
+      class_ids: np.array of shape [num_episodes, max_ways], the (relative)
+        class IDs of each episode. Entries past `num_ways` are set to
+        PADDING_CLASS_ID.
+      num_support: np.array of shape [num_episodes, max_ways], the number of
+        support examples per class. Padded with zeros.
+      num_query: np.array of shape [num_episodes, max_ways], the number of query
+        examples per class. Padded with zeros.
+  """
+
+  @property
+  def num_episodes(self):
+    return len(self.num_ways)
+
+  def get_episode_description(self, index):
+    """Returns episode `index` in the format of `sample_episode_description`.
+
+    Args:
+      index: int, the index of the episode in the batch.
+
+    Returns:
+      A sequence of `(class_id, num_support, num_query)` tuples.
+    """
+    num_ways = self.num_ways[index]
+    return tuple(
+        zip(self.class_ids[index, :num_ways].tolist(),
+            self.num_support[index, :num_ways].tolist(),
+            self.num_query[index, :num_ways].tolist()))
+
+  def __iter__(self):
+    """Iterates over the episodes, yielding one description at a time."""
+    for index in range(self.num_episodes):
+      yield self.get_episode_description(index)
+
+
+def get_seed_sequence(seed=None, source=None, split=None):
+  """Returns the node (seed, source, split) of the seed tree.
+
+  Every sampler and class dataset owns a random number generator derived from
+  its own node, so that the streams of different sources and splits are
+  independent and reproducible regardless of the order in which they are used.
+
+  Args:
+    seed: int, np.random.SeedSequence or None, the root of the tree. If None,
+      fresh entropy is drawn from the OS.
+    source: string (optional), the name of the dataset.
+    split: Split (optional), the split of the dataset.
+
+  Returns:
+    A np.random.SeedSequence.
+  """
+  if isinstance(seed, np.random.SeedSequence):
+    entropy, spawn_key = seed.entropy, tuple(seed.spawn_key)
+  else:
+    entropy, spawn_key = seed, ()
+  if source is not None:
+    spawn_key += (zlib.crc32(str(source).encode('utf-8')),)
+  if split is not None:
+    spawn_key += (getattr(split, 'value', split),)
+  return np.random.SeedSequence(entropy, spawn_key=spawn_key)
+
+
+def get_seed_key(seed):
+  """Returns a hashable value identifying the root `seed` of a seed tree.
+
+  Unlike the entropy of the root node, which is drawn from the OS when `seed`
+  is None, the key of None is stable across runs, so that it can key a cache.
+
+  Args:
+    seed: int, np.random.SeedSequence or None, see `get_seed_sequence`.
+
+  Returns:
+    None, an int or a tuple.
+  """
+  if isinstance(seed, np.random.SeedSequence):
+    return (seed.entropy, tuple(seed.spawn_key))
+  return seed
+
+
+def make_rng(seed_sequence, *keys):
+  """Returns a Generator seeded by a descendant of `seed_sequence`.
+
+  Args:
+    seed_sequence: np.random.SeedSequence, typically from `get_seed_sequence`.
+    *keys: ints, path from `seed_sequence` to the descendant, e.g.
+      (SAMPLER_STREAM, epoch).
+
+  Returns:
+    A np.random.Generator.
+  """
+  return np.random.default_rng(
+      np.random.SeedSequence(
+          seed_sequence.entropy,
+          spawn_key=tuple(seed_sequence.spawn_key) + tuple(keys)))
+
+
+def sample_ordered_subsets(set_sizes, max_size, rng=None):
+  """Samples ordered subsets without replacement for a batch of sets.
+
+  Row `i` is a uniformly random permutation of `range(set_sizes[i])`, truncated
+  to its first `max_size` elements. This has the same distribution as calling
+  `rng.choice(set_sizes[i], min(set_sizes[i], max_size), replace=False)` once
+  per row.
+
+  Args:
+    set_sizes: np.array of ints of shape [num_sets], the size of each set.
+    max_size: int, the number of elements to keep in each row.
+    rng: np.random.Generator (optional), source of randomness.
+
+  Returns:
+    indices: np.array of shape [num_sets, min(max_size, set_sizes.max())]. Row
+      `i` contains `min(set_sizes[i], max_size)` valid indices, followed by
+      arbitrary values that should be masked out by the caller.
+  """
+  max_set_size = set_sizes.max()
+  rng = np.random.default_rng(rng)
+  keys = rng.uniform(size=(len(set_sizes), max_set_size))
+  # Padding elements are sorted last, so that they are never selected.
+  keys[np.arange(max_set_size)[None, :] >= set_sizes[:, None]] = np.inf
+  return np.argsort(keys, axis=1)[:, :min(max_size, max_set_size)]
+
 
-def sample_num_ways_uniformly(num_classes, min_ways, max_ways):
+def sample_num_ways_uniformly(num_classes, min_ways, max_ways, rng=None):
   """Samples a number of ways for an episode uniformly and at random.
 
   The support of the distribution is [min_ways, num_classes], or
@@ -59,26 +198,30 @@ def sample_num_ways_uniformly(num_classes, min_ways, max_ways):
     num_classes: int, number of classes.
     min_ways: int, minimum number of ways.
     max_ways: int, maximum number of ways. Only used if num_classes > max_ways.
+    rng: np.random.Generator (optional), source of randomness.
 
   Returns:
     num_ways: int, number of ways for the episode.
   """
+  rng = np.random.default_rng(rng)
   max_ways = min(max_ways, num_classes)
-  return RNG.randint(low=min_ways, high=max_ways + 1)
+  return rng.integers(low=min_ways, high=max_ways + 1)
 
 
-def sample_class_ids_uniformly(num_ways, num_classes):
+def sample_class_ids_uniformly(num_ways, num_classes, rng=None):
   """Samples the (relative) class IDs for the episode.
 
   Args:
     num_ways: int, number of ways for the episode.
     num_classes: int, number of classes.
+    rng: np.random.Generator (optional), source of randomness.
 
   Returns:
     class_ids: np.array, class IDs for the episode, with values in
         [0, num_classes - 1].
   """
-  return RNG.choice(num_classes, num_ways, replace=False)
+  rng = np.random.default_rng(rng)
+  return rng.choice(num_classes, num_ways, replace=False)
 
 
 def compute_num_query(images_per_class, max_num_query):
@@ -105,7 +248,8 @@ def compute_num_query(images_per_class, max_num_query):
 
 def sample_support_set_size(num_remaining_per_class,
                             max_support_size_contrib_per_class,
-                            max_support_set_size):
+                            max_support_set_size,
+                            rng=None):
   """Samples the size of the support set in the episode.
 
   That number is such that:
@@ -123,6 +267,7 @@ def sample_support_set_size(num_remaining_per_class,
       of examples of that class in the support set; this is a limit on its
       contribution to computing the support set _size_.
     max_support_set_size: int, maximum size of the support set.
+    rng: np.random.Generator (optional), source of randomness.
 
   Returns:
     support_set_size: int, size of the support set in the episode.
@@ -130,7 +275,7 @@ def sample_support_set_size(num_remaining_per_class,
   if max_support_set_size < len(num_remaining_per_class):
     raise ValueError('max_support_set_size is too small to have at least one '
                      'support example per class.')
-  beta = RNG.uniform()
+  beta = np.random.default_rng(rng).uniform()
   support_size_contributions = np.minimum(max_support_size_contrib_per_class,
                                           num_remaining_per_class)
   return np.minimum(
@@ -144,7 +289,7 @@ def sample_support_set_size(num_remaining_per_class,
 
 def sample_num_support_per_class(images_per_class, num_remaining_per_class,
                                  support_set_size, min_log_weight,
-                                 max_log_weight):
+                                 max_log_weight, rng=None):
   """Samples the number of support examples per class.
 
   At a high level, we wish the composition to loosely match class frequencies.
@@ -163,6 +308,7 @@ def sample_num_support_per_class(images_per_class, num_remaining_per_class,
     support_set_size: int, size of the support set in the episode.
     min_log_weight: float, minimum log-weight to give to any particular class.
     max_log_weight: float, maximum log-weight to give to any particular class.
+    rng: np.random.Generator (optional), source of randomness.
 
   Returns:
     num_support_per_class: np.array, number of support examples for each class.
@@ -176,8 +322,9 @@ def sample_num_support_per_class(images_per_class, num_remaining_per_class,
   # support example per class.
   remaining_support_set_size = support_set_size - len(num_remaining_per_class)
 
+  rng = np.random.default_rng(rng)
   unnormalized_proportions = images_per_class * np.exp(
-      RNG.uniform(min_log_weight, max_log_weight, size=images_per_class.shape))
+      rng.uniform(min_log_weight, max_log_weight, size=images_per_class.shape))
   support_set_proportions = (
       unnormalized_proportions / unnormalized_proportions.sum())
 
@@ -188,6 +335,102 @@ def sample_num_support_per_class(images_per_class, num_remaining_per_class,
   return np.minimum(num_desired_per_class, num_remaining_per_class)
 
 
+def compute_num_query_batch(images_per_class, mask, max_num_query):
+  """Batched version of `compute_num_query`.
+
+  Args:
+    images_per_class: np.array of shape [num_episodes, max_ways], number of
+      images for each class of each episode.
+    mask: np.array of bools of the same shape, indicating the valid entries.
+    max_num_query: int, maximum number of query examples per class.
+
+  Returns:
+    num_query: np.array of shape [num_episodes], number of query examples per
+      class in each episode.
+  """
+  min_images = np.where(mask, images_per_class, np.iinfo(np.int64).max).min(1)
+  if min_images.min() < 2:
+    raise ValueError('Expected at least 2 images per class.')
+  return np.minimum(max_num_query, min_images // 2)
+
+
+def sample_support_set_size_batch(num_remaining_per_class, mask,
+                                  max_support_size_contrib_per_class,
+                                  max_support_set_size, rng=None):
+  """Batched version of `sample_support_set_size`.
+
+  Args:
+    num_remaining_per_class: np.array of shape [num_episodes, max_ways], number
+      of images available for each class after taking into account the number
+      of query images.
+    mask: np.array of bools of the same shape, indicating the valid entries.
+    max_support_size_contrib_per_class: int, maximum contribution for any given
+      class to the support set size.
+    max_support_set_size: int, maximum size of the support set.
+    rng: np.random.Generator (optional), source of randomness.
+
+  Returns:
+    support_set_size: np.array of shape [num_episodes], size of the support set
+      of each episode.
+  """
+  if max_support_set_size < mask.sum(1).max():
+    raise ValueError('max_support_set_size is too small to have at least one '
+                     'support example per class.')
+  beta = np.random.default_rng(rng).uniform(size=(len(mask), 1))
+  support_size_contributions = np.minimum(max_support_size_contrib_per_class,
+                                          num_remaining_per_class)
+  return np.minimum(
+      np.where(mask, np.floor(beta * support_size_contributions + 1), 0).sum(1),
+      max_support_set_size)
+
+
+def sample_num_support_per_class_batch(images_per_class,
+                                       num_remaining_per_class, mask,
+                                       support_set_size, min_log_weight,
+                                       max_log_weight, rng=None):
+  """Batched version of `sample_num_support_per_class`.
+
+  Args:
+    images_per_class: np.array of shape [num_episodes, max_ways], number of
+      images for each class of each episode.
+    num_remaining_per_class: np.array of the same shape, number of images
+      available for each class after taking into account the number of query
+      images.
+    mask: np.array of bools of the same shape, indicating the valid entries.
+    support_set_size: np.array of shape [num_episodes], size of the support set
+      of each episode.
+    min_log_weight: float, minimum log-weight to give to any particular class.
+    max_log_weight: float, maximum log-weight to give to any particular class.
+    rng: np.random.Generator (optional), source of randomness.
+
+  Returns:
+    num_support_per_class: np.array of shape [num_episodes, max_ways], number
+      of support examples for each class, zero for padding entries.
+  """
+  num_ways = mask.sum(1)
+  if np.any(support_set_size < num_ways):
+    raise ValueError('Requesting smaller support set than the number of ways.')
+  if np.where(mask, num_remaining_per_class, 1).min() < 1:
+    raise ValueError('Some classes have no remaining examples.')
+
+  remaining_support_set_size = support_set_size - num_ways
+
+  rng = np.random.default_rng(rng)
+  unnormalized_proportions = np.where(
+      mask, images_per_class * np.exp(
+          rng.uniform(min_log_weight, max_log_weight,
+                      size=images_per_class.shape)), 0.)
+  support_set_proportions = (
+      unnormalized_proportions / unnormalized_proportions.sum(1, keepdims=True))
+
+  num_desired_per_class = np.floor(
+      support_set_proportions *
+      remaining_support_set_size[:, None]).astype('int32') + 1
+
+  return np.where(mask,
+                  np.minimum(num_desired_per_class, num_remaining_per_class), 0)
+
+
 @gin.configurable(whitelist=[
     'min_ways', 'max_ways_upper_bound', 'max_num_query', 'max_support_set_size',
     'max_support_size_contrib_per_class', 'min_log_weight', 'max_log_weight'
@@ -216,7 +459,8 @@ class EpisodeDescriptionSampler(object):
                max_support_set_size=None,
                max_support_size_contrib_per_class=None,
                min_log_weight=None,
-               max_log_weight=None):
+               max_log_weight=None,
+               seed=None):
     """Initializes an EpisodeDescriptionSampler.
 
     Args:
@@ -255,6 +499,10 @@ class EpisodeDescriptionSampler(object):
       max_log_weight: Float, the maximum log-weight to give to any particular
         class (has to be provided if `num_support` is
         None).
+      seed: int, np.random.SeedSequence or None, the root of the seed tree. The
+        sampler draws from its own generator, derived from the
+        (seed, dataset name, split) node of the tree. If None, the generator is
+        seeded from fresh OS entropy.
 
     Raises:
       RuntimeError: if required parameters are missing.
@@ -303,9 +551,16 @@ class EpisodeDescriptionSampler(object):
     self.max_support_size_contrib_per_class = max_support_size_contrib_per_class
     self.min_log_weight = min_log_weight
     self.max_log_weight = max_log_weight
+    self.seed = seed
+    self.seed_sequence = get_seed_sequence(seed, dataset_spec.name, split)
+    self.reseed()
 
     self.class_set = dataset_spec.get_classes(self.split)
     self.num_classes = len(self.class_set)
+    # Arrays used by `sample_episode_descriptions`, built on first use.
+    self._images_per_class = None
+    self._span_leaves_table = None
+    self._superclass_table = None
 
     if self.use_all_classes:
       self.num_ways = self.num_classes
@@ -334,32 +589,32 @@ class EpisodeDescriptionSampler(object):
                          'dataset specification.')
 
       # A DAG for navigating the ontology for the given split.
-      graph = dataset_spec.get_split_subgraph(self.split)
+      graph = imagenet_specification.IndexedGraph(
+          dataset_spec.get_split_subgraph(self.split))
 
       # Map the absolute class IDs in the split's class set to IDs relative to
       # the split.
       class_set = self.dataset_spec.get_classes(self.split)
       abs_to_rel_ids = dict((abs_id, i) for i, abs_id in enumerate(class_set))
 
-      # Extract the sets of leaves and internal nodes in the DAG.
-      leaves = set(imagenet_specification.get_leaves(graph))
-      internal_nodes = graph - leaves  # set difference
-
-      # Map each node of the DAG to the Synsets of the leaves it spans.
-      spanning_leaves_dict = imagenet_specification.get_spanning_leaves(graph)
+      # Relative class ID of each leaf of the DAG, in leaf index order.
+      leaves_rel = np.array([
+          abs_to_rel_ids[dataset_spec.class_names_to_ids[l.wn_id]]
+          for l in graph.leaves
+      ])
 
       # Build a list of lists storing the relative class IDs of the spanning
-      # leaves for each eligible internal node.
-      self.span_leaves_rel = []
-      for node in internal_nodes:
-        node_leaves = spanning_leaves_dict[node]
-        # Internal nodes are eligible if they span at least
-        # `min_allowed_classes` and at most `max_eligible` leaves.
-        if self.min_ways <= len(node_leaves) <= MAX_SPANNING_LEAVES_ELIGIBLE:
-          # Build a list of relative class IDs for this internal node.
-          ids = [dataset_spec.class_names_to_ids[s.wn_id] for s in node_leaves]
-          ids_rel = [abs_to_rel_ids[abs_id] for abs_id in ids]
-          self.span_leaves_rel.append(ids_rel)
+      # leaves for each eligible internal node. Internal nodes are eligible if
+      # they span at least `min_allowed_classes` and at most `max_eligible`
+      # leaves.
+      span_sizes = graph.get_span_sizes()
+      is_internal = np.array([len(c) > 0 for c in graph.children], dtype=bool)
+      eligible = np.flatnonzero(is_internal & (span_sizes >= self.min_ways) &
+                                (span_sizes <= MAX_SPANNING_LEAVES_ELIGIBLE))
+      leaf_masks = graph.get_leaf_masks(eligible)
+      self.span_leaves_rel = [
+          leaves_rel[mask].tolist() for mask in leaf_masks
+      ]
 
       num_eligible_nodes = len(self.span_leaves_rel)
       if num_eligible_nodes < 1:
@@ -368,6 +623,44 @@ class EpisodeDescriptionSampler(object):
                          '`EpisodeDescriptionSampler.min_ways` in gin, or '
                          'or MAX_SPANNING_LEAVES_ELIGIBLE in data.py.')
 
+  def reseed(self, *keys):
+    """Resets the generator of the sampler.
+
+    Args:
+      *keys: ints, extra keys appended to the path of the sampler in the seed
+        tree, e.g. an epoch number so that epochs can be generated
+        independently.
+    """
+    self.rng = make_rng(self.seed_sequence, SAMPLER_STREAM, *keys)
+
+  def get_parameters(self):
+    """Returns the parameters that determine the sampled episode descriptions.
+
+    Two samplers of the same dataset and split with equal parameters generate
+    the same episode descriptions, so the parameters can key a cache of them.
+
+    Returns:
+      A dict from parameter name to a hashable value.
+    """
+    return dict(
+        split=getattr(self.split, 'value', self.split),
+        pool=self.pool,
+        use_dag_hierarchy=self.use_dag_hierarchy,
+        use_bilevel_hierarchy=self.use_bilevel_hierarchy,
+        use_all_classes=self.use_all_classes,
+        num_ways=self.num_ways,
+        num_support=self.num_support,
+        num_query=self.num_query,
+        min_ways=self.min_ways,
+        max_ways_upper_bound=self.max_ways_upper_bound,
+        max_num_query=self.max_num_query,
+        max_support_set_size=self.max_support_set_size,
+        max_support_size_contrib_per_class=(
+            self.max_support_size_contrib_per_class),
+        min_log_weight=self.min_log_weight,
+        max_log_weight=self.max_log_weight,
+        seed=get_seed_key(self.seed))
+
   def sample_class_ids(self):
     """Returns the (relative) class IDs for an episode.
 
@@ -377,11 +670,12 @@ class EpisodeDescriptionSampler(object):
     if self.use_dag_hierarchy:
       # Retrieve the list of relative class IDs for an internal node sampled
       # uniformly at random.
-      episode_classes_rel = RNG.choice(self.span_leaves_rel)
+      episode_classes_rel = self.span_leaves_rel[self.rng.integers(
+          len(self.span_leaves_rel))]
 
       # If the number of chosen classes is larger than desired, sub-sample them.
       if len(episode_classes_rel) > self.max_ways_upper_bound:
-        episode_classes_rel = RNG.choice(
+        episode_classes_rel = self.rng.choice(
             episode_classes_rel,
             size=[self.max_ways_upper_bound],
             replace=False)
@@ -393,22 +687,23 @@ class EpisodeDescriptionSampler(object):
       # First sample a coarse category uniformly. Then randomly sample the way
       # uniformly, but taking care not to sample more than the number of classes
       # of the chosen supercategory.
-      episode_superclass = RNG.choice(self.superclass_set, 1)[0]
+      episode_superclass = self.rng.choice(self.superclass_set, 1)[0]
       num_superclass_classes = self.dataset_spec.classes_per_superclass[
           episode_superclass]
 
       num_ways = sample_num_ways_uniformly(
           num_superclass_classes,
           min_ways=self.min_ways,
-          max_ways=self.max_ways_upper_bound)
+          max_ways=self.max_ways_upper_bound,
+          rng=self.rng)
 
       # e.g. if these are [3, 1] then the 4'th and the 2'nd of the subclasses
       # that belong to the chosen superclass will be used. If the class id's
       # that belong to this superclass are [23, 24, 25, 26] then the returned
       # episode_classes_rel will be [26, 24] which as usual are number relative
       # to the split.
-      episode_subclass_ids = sample_class_ids_uniformly(num_ways,
-                                                        num_superclass_classes)
+      episode_subclass_ids = sample_class_ids_uniformly(
+          num_ways, num_superclass_classes, rng=self.rng)
       (episode_classes_rel,
        _) = self.dataset_spec.get_class_ids_from_superclass_subclass_inds(
            self.split, episode_superclass, episode_subclass_ids)
@@ -421,9 +716,10 @@ class EpisodeDescriptionSampler(object):
         num_ways = sample_num_ways_uniformly(
             self.num_classes,
             min_ways=self.min_ways,
-            max_ways=self.max_ways_upper_bound)
-      episode_classes_rel = sample_class_ids_uniformly(num_ways,
-                                                       self.num_classes)
+            max_ways=self.max_ways_upper_bound,
+            rng=self.rng)
+      episode_classes_rel = sample_class_ids_uniformly(
+          num_ways, self.num_classes, rng=self.rng)
 
     return episode_classes_rel
 
@@ -455,18 +751,176 @@ class EpisodeDescriptionSampler(object):
       support_set_size = sample_support_set_size(
           num_remaining_per_class,
           self.max_support_size_contrib_per_class,
-          max_support_set_size=self.max_support_set_size)
+          max_support_set_size=self.max_support_set_size,
+          rng=self.rng)
       num_support_per_class = sample_num_support_per_class(
           images_per_class,
           num_remaining_per_class,
           support_set_size,
           min_log_weight=self.min_log_weight,
-          max_log_weight=self.max_log_weight)
+          max_log_weight=self.max_log_weight,
+          rng=self.rng)
 
     return tuple(
         (class_id, num_support, num_query)
         for class_id, num_support in zip(class_ids, num_support_per_class))
 
+  def _build_batch_tables(self):
+    """Builds the padded lookup arrays used by `sample_episode_descriptions`.
+
+    Class IDs relative to the split index `self._images_per_class`. Sets of
+    candidate classes (spanning leaves of internal nodes in the DAG case,
+    classes of each superclass in the bi-level case) are stored as rows of a
+    table padded with PADDING_CLASS_ID, along with the size of each row.
+    """
+    self._images_per_class = np.array([
+        self.dataset_spec.get_total_images_per_class(
+            self.class_set[cid], pool=self.pool)
+        for cid in range(self.num_classes)
+    ])
+    if self.use_dag_hierarchy:
+      sets = self.span_leaves_rel
+    elif self.use_bilevel_hierarchy:
+      sets = [
+          self.dataset_spec.get_class_ids_from_superclass_subclass_inds(
+              self.split, superclass,
+              range(self.dataset_spec.classes_per_superclass[superclass]))[0]
+          for superclass in self.superclass_set
+      ]
+    else:
+      return
+    sizes = np.array([len(class_ids) for class_ids in sets])
+    table = np.full((len(sets), sizes.max()), PADDING_CLASS_ID, dtype=np.int64)
+    for i, class_ids in enumerate(sets):
+      table[i, :len(class_ids)] = class_ids
+    if self.use_dag_hierarchy:
+      self._span_leaves_table = (table, sizes)
+    else:
+      self._superclass_table = (table, sizes)
+
+  def sample_class_ids_batch(self, num_episodes):
+    """Returns the (relative) class IDs for a batch of episodes.
+
+    Follows the same distribution as `sample_class_ids`, but draws all the
+    episodes with a few vectorized calls to the random number generator.
+
+    Args:
+      num_episodes: int, number of episodes to sample.
+
+    Returns:
+      class_ids: np.array of shape [num_episodes, max_ways], padded with
+        PADDING_CLASS_ID.
+      num_ways: np.array of shape [num_episodes], the number of ways of each
+        episode.
+    """
+    if self._images_per_class is None:
+      self._build_batch_tables()
+
+    if self.use_dag_hierarchy:
+      table, sizes = self._span_leaves_table
+      nodes = self.rng.integers(len(table), size=num_episodes)
+      node_sizes = sizes[nodes]
+      num_ways = np.minimum(node_sizes, self.max_ways_upper_bound)
+      class_ids = table[nodes]
+      # If the number of chosen classes is larger than desired, sub-sample them.
+      too_large = node_sizes > self.max_ways_upper_bound
+      if too_large.any():
+        subset = sample_ordered_subsets(
+            node_sizes[too_large], self.max_ways_upper_bound, rng=self.rng)
+        class_ids[too_large, :subset.shape[1]] = np.take_along_axis(
+            class_ids[too_large], subset, axis=1)
+      class_ids = class_ids[:, :num_ways.max()]
+    elif self.use_bilevel_hierarchy:
+      table, sizes = self._superclass_table
+      superclasses = self.rng.integers(len(table), size=num_episodes)
+      num_superclass_classes = sizes[superclasses]
+      num_ways = self.rng.integers(
+          low=self.min_ways,
+          high=np.minimum(self.max_ways_upper_bound, num_superclass_classes) +
+          1)
+      subset = sample_ordered_subsets(
+          num_superclass_classes, num_ways.max(), rng=self.rng)
+      class_ids = np.take_along_axis(table[superclasses], subset, axis=1)
+    elif self.use_all_classes:
+      num_ways = np.full(num_episodes, self.num_classes)
+      class_ids = np.tile(np.arange(self.num_classes), (num_episodes, 1))
+    else:  # No type of hierarchy is used. Classes are randomly sampled.
+      if self.num_ways is not None:
+        if self.num_ways > self.num_classes:
+          raise ValueError('Cannot sample %d ways out of %d classes.' %
+                           (self.num_ways, self.num_classes))
+        num_ways = np.full(num_episodes, self.num_ways)
+      else:
+        num_ways = self.rng.integers(
+            low=self.min_ways,
+            high=min(self.max_ways_upper_bound, self.num_classes) + 1,
+            size=num_episodes)
+      class_ids = sample_ordered_subsets(
+          np.full(num_episodes, self.num_classes), num_ways.max(), rng=self.rng)
+
+    class_ids = np.where(
+        np.arange(class_ids.shape[1])[None, :] < num_ways[:, None], class_ids,
+        PADDING_CLASS_ID)
+    return class_ids, num_ways
+
+  def sample_episode_descriptions(self, num_episodes):
+    """Returns the composition of a batch of episodes.
+
+    This is equivalent to calling `sample_episode_description` `num_episodes`
+    times, but avoids the per-episode Python overhead, which dominates when
+    precomputing the episodes of a whole epoch.
+
+    Args:
+      num_episodes: int, number of episodes to sample.
+
+    Returns:
+      An EpisodeDescriptions namedtuple of padded arrays.
+    """
+    if num_episodes == 0:
+      empty = np.zeros((0, 0), dtype=np.int64)
+      return EpisodeDescriptions(
+          num_ways=np.zeros(0, dtype=np.int64),
+          class_ids=empty,
+          num_support=empty,
+          num_query=empty)
+    class_ids, num_ways = self.sample_class_ids_batch(num_episodes)
+    mask = class_ids != PADDING_CLASS_ID
+    images_per_class = np.where(mask, self._images_per_class[class_ids], 0)
+
+    if self.num_query is not None:
+      num_query = np.full(num_episodes, self.num_query)
+    else:
+      num_query = compute_num_query_batch(
+          images_per_class, mask, max_num_query=self.max_num_query)
+
+    if self.num_support is not None:
+      if np.any(mask &
+                (self.num_support + num_query[:, None] > images_per_class)):
+        raise ValueError('Some classes have not enough examples.')
+      num_support_per_class = np.where(mask, self.num_support, 0)
+    else:
+      num_remaining_per_class = images_per_class - num_query[:, None]
+      support_set_size = sample_support_set_size_batch(
+          num_remaining_per_class,
+          mask,
+          self.max_support_size_contrib_per_class,
+          max_support_set_size=self.max_support_set_size,
+          rng=self.rng)
+      num_support_per_class = sample_num_support_per_class_batch(
+          images_per_class,
+          num_remaining_per_class,
+          mask,
+          support_set_size,
+          min_log_weight=self.min_log_weight,
+          max_log_weight=self.max_log_weight,
+          rng=self.rng)
+
+    return EpisodeDescriptions(
+        num_ways=num_ways,
+        class_ids=class_ids,
+        num_support=num_support_per_class,
+        num_query=np.where(mask, num_query[:, None], 0))
+
   def compute_chunk_sizes(self):
     """Computes the maximal sizes for the flush, support, and query chunks.
 
@@ -225,6 +225,32 @@ class SampleNumSupportPerClassTest(unittest.TestCase):
           max_log_weight=MAX_LOG_WEIGHT)
 
 
+class SeedTreeTest(unittest.TestCase):
+  """Tests the derivation of generators from the seed tree."""
+
+  def test_same_node_same_stream(self):
+    rng_a = sampling.make_rng(sampling.get_seed_sequence(1, 'a', Split.TRAIN))
+    rng_b = sampling.make_rng(sampling.get_seed_sequence(1, 'a', Split.TRAIN))
+    self.assertTrue((rng_a.integers(1 << 30, size=10) == rng_b.integers(
+        1 << 30, size=10)).all())
+
+  def test_different_nodes_different_streams(self):
+    nodes = [(1, 'a', Split.TRAIN), (1, 'a', Split.VALID),
+             (1, 'b', Split.TRAIN), (2, 'a', Split.TRAIN)]
+    draws = set()
+    for node in nodes:
+      rng = sampling.make_rng(sampling.get_seed_sequence(*node))
+      draws.add(tuple(rng.integers(1 << 30, size=10)))
+    self.assertEqual(len(draws), len(nodes))
+
+  def test_nested_root(self):
+    """A SeedSequence root is extended rather than replaced."""
+    root = sampling.get_seed_sequence(1, 'a')
+    self.assertEqual(
+        sampling.get_seed_sequence(root, split=Split.TEST).spawn_key,
+        sampling.get_seed_sequence(1, 'a', Split.TEST).spawn_key)
+
+
 class EpisodeDescrSamplerErrorTest(parameterized.TestCase, unittest.TestCase):
   """Episode sampler should verify args when ways/shots are sampled."""
   dataset_spec = DATASET_SPEC
@@ -288,9 +314,10 @@ class EpisodeDescrSamplerTest(unittest.TestCase):
     super(EpisodeDescrSamplerTest, self).setUp()
     self.sampler = self.make_sampler()
 
-  def make_sampler(self):
+  def make_sampler(self, seed=None):
     """Helper function to make a new instance of the tested sampler."""
-    return sampling.EpisodeDescriptionSampler(self.dataset_spec, self.split)
+    return sampling.EpisodeDescriptionSampler(
+        self.dataset_spec, self.split, seed=seed)
 
   def test_max_examples(self):
     """The number of requested examples per class should not be too large."""
@@ -309,6 +336,62 @@ class EpisodeDescrSamplerTest(unittest.TestCase):
       self.assertTrue(
           all(s >= 1 and q >= 1 for cid, s, q in episode_description))
 
+  def test_batch_max_examples(self):
+    """Same as test_max_examples, for batches of episode descriptions."""
+    class_set = self.dataset_spec.get_classes(self.split)
+    for episode_description in self.sampler.sample_episode_descriptions(10):
+      self.assertTrue(
+          all(s +
+              q <= self.dataset_spec.get_total_images_per_class(class_set[cid])
+              for cid, s, q in episode_description))
+
+  def test_batch_min_examples(self):
+    """Same as test_min_examples, for batches of episode descriptions."""
+    for episode_description in self.sampler.sample_episode_descriptions(10):
+      self.assertTrue(
+          all(s >= 1 and q >= 1 for cid, s, q in episode_description))
+
+  def test_batch_padding(self):
+    """Entries past the number of ways should be padded."""
+    descriptions = self.sampler.sample_episode_descriptions(10)
+    self.assertEqual(descriptions.num_episodes, 10)
+    for i, num_ways in enumerate(descriptions.num_ways):
+      class_ids = descriptions.class_ids[i]
+      self.assertTrue((class_ids[num_ways:] == sampling.PADDING_CLASS_ID).all())
+      self.assertTrue((descriptions.num_support[i, num_ways:] == 0).all())
+      self.assertTrue((descriptions.num_query[i, num_ways:] == 0).all())
+      # Class IDs within an episode are unique.
+      self.assertEqual(len(set(class_ids[:num_ways])), num_ways)
+
+  def test_batch_empty(self):
+    """Sampling no episodes should return an empty batch."""
+    descriptions = self.sampler.sample_episode_descriptions(0)
+    self.assertEqual(descriptions.num_episodes, 0)
+    self.assertEqual(list(descriptions), [])
+
+  def test_batch_distribution(self):
+    """Batched and single sampling should follow the same distribution."""
+    num_episodes = 2000
+    single = [
+        self.sampler.sample_episode_description() for _ in range(num_episodes)
+    ]
+    batch = list(self.sampler.sample_episode_descriptions(num_episodes))
+    for statistic in (len, lambda e: sum(s for _, s, _ in e),
+                      lambda e: sum(q for _, _, q in e)):
+      single_values = np.array([statistic(e) for e in single], dtype=float)
+      batch_values = np.array([statistic(e) for e in batch], dtype=float)
+      tolerance = 5 * np.sqrt(2 * single_values.var() / num_episodes) + 1e-6
+      self.assertLess(
+          abs(single_values.mean() - batch_values.mean()), tolerance)
+    # Every class should be picked with the same frequency.
+    single_counts = np.bincount(
+        [cid for e in single for cid, _, _ in e], minlength=self.sampler.num_classes)
+    batch_counts = np.bincount(
+        [cid for e in batch for cid, _, _ in e], minlength=self.sampler.num_classes)
+    self.assertLess(
+        np.abs(single_counts - batch_counts).max(),
+        5 * np.sqrt(2 * single_counts.max()) + 1)
+
   def test_non_deterministic(self):
     """By default, generated episodes should be different across Samplers."""
     reference_sample = self.sampler.sample_episode_description()
@@ -324,23 +407,55 @@ class EpisodeDescrSamplerTest(unittest.TestCase):
       raise AssertionError('Different EpisodeDescriptionSamplers generate '
                            'the same sequence of episode descriptions.')
 
-  def test_setting_randomstate(self):
-    """Setting the RNG state should make episode generation deterministic."""
-    init_rng = sampling.RNG
+  def test_setting_seed(self):
+    """Setting the seed should make episode generation deterministic."""
     seed = 20181113
-    try:
-      sampling.RNG = np.random.RandomState(seed)
-      sampler = self.make_sampler()
-      reference_sample = sampler.sample_episode_description()
-      for _ in range(10):
-        sampling.RNG = np.random.RandomState(seed)
-        sampler = self.make_sampler()
-        sample = sampler.sample_episode_description()
-        self.assertEqual(reference_sample, sample)
+    sampler = self.make_sampler(seed=seed)
+    reference_sample = sampler.sample_episode_description()
+    reference_batch = sampler.sample_episode_descriptions(10)
+    for _ in range(10):
+      sampler = self.make_sampler(seed=seed)
+      self.assertEqual(reference_sample, sampler.sample_episode_description())
+      self.assertEqual(
+          list(reference_batch), list(sampler.sample_episode_descriptions(10)))
 
-    finally:
-      # Restore the original RNG
-      sampling.RNG = init_rng
+  def test_independent_streams(self):
+    """Samplers with the same seed should not perturb each other."""
+    seed = 20181113
+    sampler = self.make_sampler(seed=seed)
+    other_sampler = self.make_sampler(seed=seed)
+    reference = [sampler.sample_episode_description() for _ in range(5)]
+    sampler = self.make_sampler(seed=seed)
+    samples = []
+    for _ in range(5):
+      other_sampler.sample_episode_description()
+      samples.append(sampler.sample_episode_description())
+    self.assertEqual(reference, samples)
+
+  def test_reseed(self):
+    """Reseeding with the same keys should replay the same episodes."""
+    sampler = self.make_sampler(seed=20181113)
+    sampler.reseed(3)
+    reference = list(sampler.sample_episode_descriptions(10))
+    sampler.sample_episode_descriptions(10)
+    sampler.reseed(3)
+    self.assertEqual(reference, list(sampler.sample_episode_descriptions(10)))
+
+  def test_parameters(self):
+    """Samplers with equal parameters should generate the same episodes."""
+    sampler = self.make_sampler(seed=20181113)
+    other_sampler = self.make_sampler(seed=20181113)
+    self.assertEqual(sampler.get_parameters(), other_sampler.get_parameters())
+    self.assertEqual(
+        list(sampler.sample_episode_descriptions(10)),
+        list(other_sampler.sample_episode_descriptions(10)))
+    self.assertNotEqual(sampler.get_parameters(),
+                        self.make_sampler(seed=20181114).get_parameters())
+
+  def test_parameters_unseeded(self):
+    """The parameters of unseeded samplers should not depend on the entropy."""
+    self.assertEqual(self.make_sampler().get_parameters(),
+                     self.make_sampler().get_parameters())
 
   def assert_expected_chunk_sizes(self, expected_support_chunk_size,
                                   expected_query_chunk_size):
@@ -370,9 +485,9 @@ class FixedQueryEpisodeDescrSamplerTest(EpisodeDescrSamplerTest):
   split = Split.TRAIN
   num_query = 5
 
-  def make_sampler(self):
+  def make_sampler(self, seed=None):
     return sampling.EpisodeDescriptionSampler(
-        self.dataset_spec, self.split, num_query=self.num_query)
+        self.dataset_spec, self.split, num_query=self.num_query, seed=seed)
 
   def test_num_query_examples(self):
     class_set = self.dataset_spec.get_classes(self.split)
@@ -409,6 +524,10 @@ class NoQueryEpisodeDescrSamplerTest(FixedQueryEpisodeDescrSamplerTest):
       episode_description = self.sampler.sample_episode_description()
       self.assertTrue(all(s >= 1 for cid, s, q in episode_description))
 
+  def test_batch_min_examples(self):
+    for episode_description in self.sampler.sample_episode_descriptions(10):
+      self.assertTrue(all(s >= 1 for cid, s, q in episode_description))
+
 
 class FixedShotsEpisodeDescrSamplerTest(FixedQueryEpisodeDescrSamplerTest):
   """Tests EpisodeDescriptionSampler with fixed support and query size.
@@ -420,12 +539,13 @@ class FixedShotsEpisodeDescrSamplerTest(FixedQueryEpisodeDescrSamplerTest):
   num_support = 3
   num_query = 7
 
-  def make_sampler(self):
+  def make_sampler(self, seed=None):
     return sampling.EpisodeDescriptionSampler(
         self.dataset_spec,
         self.split,
         num_support=self.num_support,
-        num_query=self.num_query)
+        num_query=self.num_query,
+        seed=seed)
 
   def test_num_support_examples(self):
     for _ in range(10):
@@ -450,9 +570,9 @@ class FixedWaysEpisodeDescrSamplerTest(EpisodeDescrSamplerTest):
   split = Split.TRAIN
   num_ways = 12
 
-  def make_sampler(self):
+  def make_sampler(self, seed=None):
     return sampling.EpisodeDescriptionSampler(
-        self.dataset_spec, self.split, num_ways=self.num_ways)
+        self.dataset_spec, self.split, num_ways=self.num_ways, seed=seed)
 
   def test_num_ways(self):
     for _ in range(10):
@@ -476,13 +596,14 @@ class FixedEpisodeDescrSamplerTest(FixedShotsEpisodeDescrSamplerTest,
                                    FixedWaysEpisodeDescrSamplerTest):
   """Tests EpisodeDescriptionSampler with fixed shots and ways."""
 
-  def make_sampler(self):
+  def make_sampler(self, seed=None):
     return sampling.EpisodeDescriptionSampler(
         self.dataset_spec,
         self.split,
         num_ways=self.num_ways,
         num_support=self.num_support,
-        num_query=self.num_query)
+        num_query=self.num_query,
+        seed=seed)
 
   def test_correct_chunk_sizes(self):
     self.assert_expected_chunk_sizes(self.num_ways * self.num_support,
@@ -534,10 +655,12 @@ class ChunkSizesTest(unittest.TestCase):
         self.dataset_spec, Split.TRAIN, num_ways=600)
     with self.assertRaises(ValueError):
       sampler.sample_episode_description()
+    with self.assertRaises(ValueError):
+      sampler.sample_episode_descriptions(10)
 
 
 # TODO(lamblinp)
 # - test with use_hierarchy=True
 
 if __name__ == '__main__':
-  tf.test.main()
+  unittest.main()
@@ -0,0 +1,295 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Reading the TFRecord files of the original Meta-Dataset without TensorFlow.
+
+A TFRecord file is a sequence of records, each framed as
+
+  uint64 length
+  uint32 masked crc32c of length
+  byte   data[length]
+  uint32 masked crc32c of data
+
+with little-endian integers. The data of each record of Meta-Dataset is a
+serialized tf.train.Example with an "image" bytes feature and a "label" int64
+feature. Since each file holds the records of a single class, the readers only
+parse the image and take the label from the file. This module parses the
+framing and the Example protocol buffer directly, and builds an index of the offsets of the records of a file, so that
+any record can be read with a single pread.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import logging
+import os
+import struct
+
+import numpy as np
+
+# Suffix of the index of a TFRecord file, stored next to it.
+INDEX_SUFFIX = '.index.npy'
+
+_HEADER = struct.Struct('<QI')
+HEADER_SIZE = _HEADER.size
+FOOTER_SIZE = 4
+
+# Wire types of the protocol buffer encoding.
+_VARINT = 0
+_FIXED64 = 1
+_LENGTH_DELIMITED = 2
+_FIXED32 = 5
+
+
+def _make_crc32c_table():
+  table = []
+  for i in range(256):
+    crc = i
+    for _ in range(8):
+      crc = (crc >> 1) ^ 0x82F63B78 if crc & 1 else crc >> 1
+    table.append(crc)
+  return table
+
+
+_CRC32C_TABLE = _make_crc32c_table()
+
+
+def crc32c(data):
+  """Returns the CRC-32C (Castagnoli) checksum of data."""
+  crc = 0xFFFFFFFF
+  for byte in bytearray(data):
+    crc = _CRC32C_TABLE[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+  return crc ^ 0xFFFFFFFF
+
+
+def masked_crc32c(data):
+  """Returns the masked CRC-32C used by the TFRecord format."""
+  crc = crc32c(data)
+  return (((crc >> 15) | (crc << 17)) + 0xA282EAD8) & 0xFFFFFFFF
+
+
+def parse_header(header, path, offset):
+  """Returns the length of the data of a record, given its header.
+
+  Args:
+    header: the HEADER_SIZE bytes at the start of the record.
+    path: the path or url of the file, for the error messages.
+    offset: the offset of the record in the file.
+
+  Raises:
+    ValueError: if the header is truncated or its checksum does not match.
+  """
+  if len(header) < _HEADER.size:
+    raise ValueError('Truncated record header in {} at offset {}.'.format(
+      path, offset))
+  length, length_crc = _HEADER.unpack(header)
+  if masked_crc32c(header[:8]) != length_crc:
+    raise ValueError('Corrupted record length in {} at offset {}.'.format(
+      path, offset))
+  return length
+
+
+def build_index(path, verify_data=False):
+  """Scans a TFRecord file to locate its records.
+
+  Args:
+    path: the path to the TFRecord file.
+    verify_data: whether to also verify the checksum of the data of each
+      record, which requires reading the whole file. The checksum of the length
+      of each record is always verified.
+
+  Returns:
+    An int64 numpy array of shape [num_records, 2] with the offset and the
+    length of the data of each record.
+
+  Raises:
+    ValueError: if the file is truncated or a checksum does not match.
+  """
+  index = []
+  file_size = os.path.getsize(path)
+  with open(path, 'rb') as f:
+    offset = 0
+    while offset < file_size:
+      length = parse_header(f.read(_HEADER.size), path, offset)
+      data_offset = offset + _HEADER.size
+      offset = data_offset + length + FOOTER_SIZE
+      if offset > file_size:
+        raise ValueError('Truncated record in {} at offset {}.'.format(
+          path, data_offset))
+      if verify_data:
+        data = f.read(length)
+        data_crc, = struct.unpack('<I', f.read(FOOTER_SIZE))
+        if masked_crc32c(data) != data_crc:
+          raise ValueError('Corrupted record in {} at offset {}.'.format(
+            path, data_offset))
+      else:
+        f.seek(offset)
+      index.append((data_offset, length))
+  return np.array(index, dtype=np.int64).reshape((-1, 2))
+
+
+def load_index(path):
+  """Returns the index of a TFRecord file, building it if necessary.
+
+  The index is stored next to the file the first time it is built, and rebuilt
+  if the file is modified afterwards. If it can not be stored, e.g. because the
+  directory is read only, it is built again on every call.
+
+  Args:
+    path: the path to the TFRecord file.
+
+  Returns:
+    The index of the file, see build_index.
+  """
+  index_path = path + INDEX_SUFFIX
+  if (os.path.exists(index_path) and
+      os.path.getmtime(index_path) >= os.path.getmtime(path)):
+    return np.load(index_path)
+  index = build_index(path)
+  tmp_path = '{}.tmp{}'.format(index_path, os.getpid())
+  try:
+    with open(tmp_path, 'wb') as f:
+      np.save(f, index)
+    os.replace(tmp_path, index_path)
+  except OSError as e:
+    logging.warning('Could not store the index of %s: %s', path, e)
+  return index
+
+
+def read_record(fd, offset, length):
+  """Reads the data of a record located with an index, see build_index.
+
+  Args:
+    fd: a file descriptor of the TFRecord file, as returned by os.open.
+    offset: the offset of the data of the record.
+    length: the length of the data of the record.
+
+  Returns:
+    The data of the record, as bytes.
+  """
+  data = os.pread(fd, int(length), int(offset))
+  if len(data) != length:
+    raise ValueError('Truncated record at offset {}.'.format(offset))
+  return data
+
+
+def iter_records(path):
+  """Yields the data of each record of a TFRecord file, in order."""
+  fd = os.open(path, os.O_RDONLY)
+  try:
+    for offset, length in build_index(path):
+      yield read_record(fd, offset, length)
+  finally:
+    os.close(fd)
+
+
+def _read_varint(buf, pos):
+  """Reads a varint from buf at pos, returning it and the position after it."""
+  result = 0
+  shift = 0
+  while True:
+    byte = buf[pos]
+    pos += 1
+    result |= (byte & 0x7F) << shift
+    if not byte & 0x80:
+      return result, pos
+    shift += 7
+
+
+def _iter_fields(buf, start, end):
+  """Yields the (field number, wire type, value) of a serialized message.
+
+  The value is an int for varints, the (start, end) positions of the field in
+  buf for length delimited fields, and the bytes of fixed size fields.
+  """
+  pos = start
+  while pos < end:
+    key, pos = _read_varint(buf, pos)
+    field_number, wire_type = key >> 3, key & 7
+    if wire_type == _VARINT:
+      value, pos = _read_varint(buf, pos)
+    elif wire_type == _LENGTH_DELIMITED:
+      length, pos = _read_varint(buf, pos)
+      value = (pos, pos + length)
+      pos += length
+    elif wire_type == _FIXED64:
+      value = buf[pos:pos + 8]
+      pos += 8
+    elif wire_type == _FIXED32:
+      value = buf[pos:pos + 4]
+      pos += 4
+    else:
+      raise ValueError('Unsupported wire type {}.'.format(wire_type))
+    yield field_number, wire_type, value
+
+
+def _to_int64(value):
+  return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _parse_feature(buf, start, end):
+  """Parses a tf.train.Feature into a list of bytes, floats or ints."""
+  values = []
+  for kind, _, (list_start, list_end) in _iter_fields(buf, start, end):
+    for _, wire_type, value in _iter_fields(buf, list_start, list_end):
+      if kind == 1:  # BytesList.
+        values.append(bytes(buf[value[0]:value[1]]))
+      elif kind == 2:  # FloatList, packed or not.
+        if wire_type == _LENGTH_DELIMITED:
+          values.extend(
+            struct.unpack('<{}f'.format((value[1] - value[0]) // 4),
+                          buf[value[0]:value[1]]))
+        else:
+          values.append(struct.unpack('<f', value)[0])
+      elif kind == 3:  # Int64List, packed or not.
+        if wire_type == _LENGTH_DELIMITED:
+          pos = value[0]
+          while pos < value[1]:
+            v, pos = _read_varint(buf, pos)
+            values.append(_to_int64(v))
+        else:
+          values.append(_to_int64(value))
+  return values
+
+
+def parse_example(serialized, keys=None):
+  """Parses a serialized tf.train.Example.
+
+  Args:
+    serialized: the bytes of the Example.
+    keys: optional collection of the names of the features to parse, the
+      others are skipped.
+
+  Returns:
+    A dict mapping the name of each parsed feature to the list of its values,
+    which are bytes, floats or ints depending on the type of the feature.
+  """
+  buf = memoryview(serialized)
+  features = {}
+  for field, _, (start, end) in _iter_fields(buf, 0, len(buf)):
+    if field != 1:  # Example.features.
+      continue
+    for _, _, (entry_start, entry_end) in _iter_fields(buf, start, end):
+      name = feature = None
+      for entry_field, _, value in _iter_fields(buf, entry_start, entry_end):
+        if entry_field == 1:
+          name = bytes(buf[value[0]:value[1]]).decode('utf-8')
+        elif entry_field == 2:
+          feature = value
+      if feature is not None and (keys is None or name in keys):
+        features[name] = _parse_feature(buf, feature[0], feature[1])
+  return features
+
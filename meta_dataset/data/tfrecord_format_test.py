@@ -0,0 +1,115 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for `tfrecord_format` module."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import tempfile
+import unittest
+
+from meta_dataset.data import tfrecord_format
+from meta_dataset.data import tfrecord_test_utils
+import numpy as np
+
+
+class TFRecordFormatTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.tmp_dir.name, '0.tfrecords')
+    self.examples = [{
+      'image': [os.urandom(n)],
+      'label': [n]
+    } for n in (10, 0, 300, 5)]
+    tfrecord_test_utils.write_records(
+      self.path, [tfrecord_test_utils.serialize_example(e) for e in self.examples])
+
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+
+  def test_crc32c(self):
+    # Check value of the CRC-32C standard.
+    self.assertEqual(tfrecord_format.crc32c(b'123456789'), 0xE3069283)
+
+  def test_serialize_example(self):
+    # As serialized by tf.train.Example.SerializeToString.
+    self.assertEqual(
+      tfrecord_test_utils.serialize_example({'label': [3]}),
+      bytes.fromhex('0a100a0e0a056c6162656c12051a030a0103'))
+
+  def test_parse_example(self):
+    serialized = tfrecord_test_utils.serialize_example({
+      'image': [b'abc', b''],
+      'label': [-2, 1 << 40]
+    })
+    self.assertEqual(
+      tfrecord_format.parse_example(serialized), {
+        'image': [b'abc', b''],
+        'label': [-2, 1 << 40]
+      })
+    self.assertEqual(
+      tfrecord_format.parse_example(serialized, ('label',)),
+      {'label': [-2, 1 << 40]})
+
+  def test_iter_records(self):
+    examples = [
+      tfrecord_format.parse_example(r)
+      for r in tfrecord_format.iter_records(self.path)
+    ]
+    self.assertEqual(examples, self.examples)
+
+  def test_random_access(self):
+    index = tfrecord_format.load_index(self.path)
+    self.assertEqual(index.shape, (4, 2))
+    self.assertTrue(os.path.exists(self.path + tfrecord_format.INDEX_SUFFIX))
+    np.testing.assert_array_equal(tfrecord_format.load_index(self.path), index)
+    fd = os.open(self.path, os.O_RDONLY)
+    try:
+      for i in (2, 0, 3, 2):
+        record = tfrecord_format.read_record(fd, *index[i])
+        self.assertEqual(tfrecord_format.parse_example(record),
+                         self.examples[i])
+    finally:
+      os.close(fd)
+
+  def test_corrupted_file(self):
+    with open(self.path, 'r+b') as f:
+      f.seek(0)
+      f.write(b'\xff')
+    with self.assertRaises(ValueError):
+      tfrecord_format.build_index(self.path)
+
+  def test_truncated_file(self):
+    with open(self.path, 'r+b') as f:
+      f.truncate(os.path.getsize(self.path) - 1)
+    with self.assertRaises(ValueError):
+      tfrecord_format.build_index(self.path)
+
+  def test_verify_data(self):
+    index = tfrecord_format.build_index(self.path, verify_data=True)
+    with open(self.path, 'r+b') as f:
+      f.seek(int(index[0, 0]))
+      f.write(b'\x00\x00')
+    tfrecord_format.build_index(self.path)
+    with self.assertRaises(ValueError):
+      tfrecord_format.build_index(self.path, verify_data=True)
+
+
+if __name__ == '__main__':
+  unittest.main()
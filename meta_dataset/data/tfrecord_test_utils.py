@@ -0,0 +1,77 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helpers writing TFRecord files, for the tests and benchmarks."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import struct
+
+from meta_dataset.data import tfrecord_format
+
+
+def _encode_varint(value):
+  value &= (1 << 64) - 1
+  encoded = bytearray()
+  while True:
+    byte = value & 0x7F
+    value >>= 7
+    if value:
+      encoded.append(byte | 0x80)
+    else:
+      encoded.append(byte)
+      return bytes(encoded)
+
+
+def _encode_field(field_number, data):
+  """Encodes a length delimited field."""
+  return (_encode_varint(field_number << 3 | tfrecord_format._LENGTH_DELIMITED) +
+          _encode_varint(len(data)) + data)
+
+
+def serialize_example(features):
+  """Serializes a tf.train.Example, as done by TensorFlow.
+
+  Args:
+    features: a dict mapping feature names to lists of bytes or of ints.
+
+  Returns:
+    The bytes of the serialized Example.
+  """
+  entries = b''
+  for name in sorted(features):
+    values = features[name]
+    if all(isinstance(v, bytes) for v in values):
+      value_list = _encode_field(
+        1, b''.join(_encode_field(1, v) for v in values))
+    else:
+      value_list = _encode_field(
+        3, _encode_field(1, b''.join(_encode_varint(v) for v in values)))
+    entries += _encode_field(
+      1, _encode_field(1, name.encode('utf-8')) + _encode_field(2, value_list))
+  return _encode_field(1, entries)
+
+
+def write_records(path, records):
+  """Writes a TFRecord file with the given records, a list of bytes."""
+  with open(path, 'wb') as f:
+    for data in records:
+      length = struct.pack('<Q', len(data))
+      f.write(length)
+      f.write(struct.pack('<I', tfrecord_format.masked_crc32c(length)))
+      f.write(data)
+      f.write(struct.pack('<I', tfrecord_format.masked_crc32c(data)))
@@ -0,0 +1,300 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pyformat: disable
+r"""Traces of the data pipeline, in the Chrome trace format.
+
+Tracing is opt-in, enabled with `Tracing.directory = '<path/to/trace>'` in gin.
+Every process that records a span, i.e. the main process, the DataLoader
+workers and the MasterHdf5Reader of SequentialAccessHdf5Backend, writes its
+spans to its own ring buffer: a file in the directory, preallocated and
+memory-mapped, so that recording a span only writes four integers and no span
+is lost if the process is killed. Once full, a buffer overwrites its oldest
+spans. The names of the spans and of the process and its threads are written to
+a small json file next to it.
+
+merge_traces() merges the buffers into a single trace, with a lane per process
+and thread, that can be opened in chrome://tracing or https://ui.perfetto.dev.
+
+Example command:
+# pylint: disable=line-too-long
+python -m meta_dataset.data.tracing \
+  --trace_dir=<path/to/trace> \
+  --trace_output=<path/to/trace.json>
+# pylint: enable=line-too-long
+"""
+# pyformat: enable
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import functools
+import glob
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+import gin
+from meta_dataset.utils.argparse import argparse
+import numpy as np
+
+parser = argparse.parser
+parser.add_argument('--trace_dir', default='',
+                    help='Directory of the traced ring buffers to merge.')
+parser.add_argument('--trace_output', default='trace.json',
+                    help='Path of the merged Chrome trace.')
+FLAGS = argparse.FLAGS
+
+DEFAULT_CAPACITY = 2 ** 16
+
+# Columns of a span in a buffer. Row 0 of a buffer is its header, with the
+# number of spans recorded.
+_NAME, _TID, _START, _DURATION = range(4)
+
+
+class _Span(object):
+  """Context manager recording a span."""
+
+  __slots__ = ('tracer', 'name', 'start')
+
+  def __init__(self, tracer, name):
+    self.tracer = tracer
+    self.name = name
+
+  def __enter__(self):
+    self.start = time.monotonic_ns()
+    return self
+
+  def __exit__(self, *exc_info):
+    self.tracer.record(self.name, self.start, time.monotonic_ns() - self.start)
+    return False
+
+
+class _NullSpan(object):
+  """Context manager recording nothing, used when tracing is disabled."""
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer(object):
+  """Records the spans of each process to its own ring buffer in a directory.
+
+  The buffer of a process is created by its first span, so a Tracer can be
+  inherited or unpickled by the DataLoader workers.
+  """
+
+  def __init__(self, directory, capacity=DEFAULT_CAPACITY):
+    """Initializes the tracer.
+
+    Args:
+      directory: the directory of the buffers, which should be empty.
+      capacity: int, the number of spans kept by each process.
+    """
+    self.directory = directory
+    self.capacity = capacity
+    os.makedirs(directory, exist_ok=True)
+    self._reset()
+
+  def _reset(self):
+    self.pid = None
+    self.buffer = None
+    self.names = {}
+    self.threads = {}
+    self.counter = None
+    self.process_name = None
+    self.lock = threading.Lock()
+
+  def __getstate__(self):
+    return dict(directory=self.directory, capacity=self.capacity)
+
+  def __setstate__(self, state):
+    global _tracer
+    self.__dict__.update(state)
+    self._reset()
+    # Workers that unpickle the datasets, instead of forking, trace with the
+    # tracer of the datasets.
+    if _tracer is None:
+      _tracer = self
+
+  def get_process_name(self):
+    from torch.utils.data import get_worker_info  # pylint: disable=g-import-not-at-top
+    worker_info = get_worker_info()
+    if worker_info is not None:
+      return 'DataLoader worker %d' % worker_info.id
+    process = multiprocessing.current_process()
+    return 'main' if process.name == 'MainProcess' else process.name
+
+  def _get_path(self):
+    return os.path.join(self.directory, 'spans.%d' % self.pid)
+
+  def _open(self):
+    """Creates the buffer of this process."""
+    self.pid = os.getpid()
+    self.names = {}
+    self.threads = {}
+    self.counter = itertools.count()
+    self.buffer = np.memmap(self._get_path() + '.bin', dtype=np.int64,
+                            mode='w+', shape=(self.capacity + 1, 4))
+    self.buffer[1:, _NAME] = -1
+    self.process_name = self.get_process_name()
+    self._write_names()
+
+  def _write_names(self):
+    """Writes the names of the spans, process and threads, atomically."""
+    path = self._get_path() + '.json'
+    with open(path + '.tmp', 'w') as f:
+      json.dump(dict(pid=self.pid, process_name=self.process_name,
+                     names=sorted(self.names, key=self.names.get),
+                     threads=dict((str(k), v) for k, v in self.threads.items())),
+                f)
+    os.replace(path + '.tmp', path)
+
+  def _intern(self, name, tid):
+    """Returns the id of a span name, writing the names if it or tid is new."""
+    name_id = self.names.get(name)
+    if name_id is None or tid not in self.threads:
+      with self.lock:
+        if name not in self.names:
+          self.names[name] = len(self.names)
+        self.threads.setdefault(tid, threading.current_thread().name)
+        self._write_names()
+        name_id = self.names[name]
+    return name_id
+
+  def record(self, name, start_ns, duration_ns):
+    """Records a span of this process and thread."""
+    if self.pid != os.getpid():
+      with self.lock:
+        if self.pid != os.getpid():
+          self._open()
+    tid = threading.get_native_id()
+    name_id = self._intern(name, tid)
+    # next() on a count is atomic, so threads write different rows.
+    i = next(self.counter)
+    row = self.buffer[1 + i % self.capacity]
+    row[_TID] = tid
+    row[_START] = start_ns
+    row[_DURATION] = duration_ns
+    row[_NAME] = name_id
+    self.buffer[0, 0] = max(self.buffer[0, 0], i + 1)
+
+  def span(self, name):
+    """Returns a context manager recording a span named name."""
+    return _Span(self, name)
+
+
+_tracer = None
+
+
+@gin.configurable('Tracing')
+def get_tracer(directory=None, capacity=DEFAULT_CAPACITY):
+  """Returns the Tracer of this process, or None if tracing is disabled.
+
+  It is created by the first call, in the main process, and inherited by the
+  processes it starts. See Tracer for the arguments.
+  """
+  global _tracer
+  if not directory:
+    return None
+  if _tracer is None:
+    _tracer = Tracer(directory, capacity)
+  return _tracer
+
+
+def span(name):
+  """Returns a context manager recording a span, doing nothing if disabled."""
+  if _tracer is None:
+    return NULL_SPAN
+  return _tracer.span(name)
+
+
+def traced(method):
+  """Decorates a method to record its spans, named after it and self.name."""
+
+  @functools.wraps(method)
+  def wrapper(self, *args, **kwargs):
+    if _tracer is None:
+      return method(self, *args, **kwargs)
+    with _tracer.span('%s(%s)' % (method.__name__, self.name)):
+      return method(self, *args, **kwargs)
+
+  return wrapper
+
+
+def load_spans(directory):
+  """Returns the Chrome trace events of the buffers in a directory."""
+  events = []
+  for names_path in sorted(glob.glob(os.path.join(directory, 'spans.*.json'))):
+    with open(names_path) as f:
+      names = json.load(f)
+    pid = names['pid']
+    events.append(dict(ph='M', name='process_name', pid=pid,
+                       args=dict(name=names['process_name'])))
+    for tid, thread_name in names['threads'].items():
+      events.append(dict(ph='M', name='thread_name', pid=pid, tid=int(tid),
+                         args=dict(name=thread_name)))
+    buffer = np.fromfile(names_path[:-len('.json')] + '.bin',
+                         dtype=np.int64).reshape(-1, 4)
+    spans = buffer[1:1 + min(int(buffer[0, 0]), len(buffer) - 1)]
+    # Spans whose name was not written yet were being recorded.
+    spans = spans[(spans[:, _NAME] >= 0) &
+                  (spans[:, _NAME] < len(names['names']))]
+    for name_id, tid, start_ns, duration_ns in spans.tolist():
+      events.append(dict(ph='X', name=names['names'][name_id], pid=pid,
+                         tid=tid, ts=start_ns / 1e3, dur=duration_ns / 1e3))
+  return events
+
+
+def merge_traces(directory, output):
+  """Merges the buffers in directory into a Chrome trace written to output.
+
+  Returns:
+    The number of spans merged.
+  """
+  events = load_spans(directory)
+  spans = [e for e in events if e['ph'] == 'X']
+  if spans:
+    # Timestamps start at the first span, they are monotonic clock readings.
+    start = min(e['ts'] for e in spans)
+    for e in spans:
+      e['ts'] -= start
+  spans.sort(key=lambda e: e['ts'])
+  with open(output, 'w') as f:
+    json.dump(dict(traceEvents=[e for e in events if e['ph'] == 'M'] + spans,
+                   displayTimeUnit='ms'), f)
+  return len(spans)
+
+
+def main():
+  num_spans = merge_traces(FLAGS.trace_dir, FLAGS.trace_output)
+  logging.info('Merged %d spans into %s', num_spans, FLAGS.trace_output)
+
+
+if __name__ == '__main__':
+  logging.getLogger().setLevel(logging.INFO)
+  argparse.parser.parse_args()
+  main()
@@ -0,0 +1,103 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for `tracing` module."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from meta_dataset.data import tracing
+import torch
+
+
+class ToyEpisodes(torch.utils.data.Dataset):
+  """Episodes recording a span each."""
+
+  name = 'toy'
+
+  @tracing.traced
+  def __getitem__(self, item):
+    return item
+
+  def __len__(self):
+    return 8
+
+
+class TracingTest(unittest.TestCase):
+
+  def setUp(self):
+    super(TracingTest, self).setUp()
+    self.directory = tempfile.mkdtemp()
+    self.tracer = tracing.Tracer(os.path.join(self.directory, 'spans'),
+                                 capacity=4)
+    tracing._tracer = self.tracer
+
+  def tearDown(self):
+    tracing._tracer = None
+    shutil.rmtree(self.directory)
+    super(TracingTest, self).tearDown()
+
+  def merge(self):
+    output = os.path.join(self.directory, 'trace.json')
+    tracing.merge_traces(self.tracer.directory, output)
+    with open(output) as f:
+      return json.load(f)['traceEvents']
+
+  def test_disabled(self):
+    tracing._tracer = None
+    self.assertIs(tracing.span('a'), tracing.NULL_SPAN)
+    self.assertIsNone(tracing.get_tracer())
+
+  def test_ring_buffer(self):
+    for i in range(6):
+      self.tracer.record('span %d' % (i % 2), 1000 * i, 500)
+    spans = [e for e in self.merge() if e['ph'] == 'X']
+    # The two oldest spans were overwritten.
+    self.assertEqual([(e['name'], e['ts'], e['dur']) for e in spans],
+                     [('span 0', 0, 0.5), ('span 1', 1, 0.5),
+                      ('span 0', 2, 0.5), ('span 1', 3, 0.5)])
+    self.assertEqual(set(e['pid'] for e in spans), set([os.getpid()]))
+
+  def test_workers(self):
+    loader = torch.utils.data.DataLoader(ToyEpisodes(), batch_size=None,
+                                         num_workers=2)
+    with tracing.span('epoch'):
+      self.assertEqual(sorted(loader), list(range(8)))
+    events = self.merge()
+    processes = dict((e['pid'], e['args']['name']) for e in events
+                     if e['name'] == 'process_name')
+    self.assertEqual(sorted(processes.values()),
+                     ['DataLoader worker 0', 'DataLoader worker 1', 'main'])
+    spans = [e for e in events if e['ph'] == 'X']
+    self.assertEqual([processes[e['pid']] for e in spans
+                      if e['name'] == 'epoch'], ['main'])
+    worker_spans = [e for e in spans if e['name'] == '__getitem__(toy)']
+    # Each worker read half the episodes, into its own buffer.
+    self.assertEqual(len(worker_spans), 8)
+    self.assertEqual(set(processes[e['pid']] for e in worker_spans),
+                     set(['DataLoader worker 0', 'DataLoader worker 1']))
+    threads = [e for e in events if e['name'] == 'thread_name']
+    self.assertEqual(len(threads), 3)
+
+
+if __name__ == '__main__':
+  unittest.main()
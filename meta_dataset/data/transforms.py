@@ -0,0 +1,115 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Splits the transforms of the images into a cacheable prefix and a suffix.
+
+The transforms applied to the decoded images start with deterministic steps,
+e.g. the resize of QuickDraw and Omniglot images, and end with stochastic ones,
+e.g. jitter and noise. split_transforms() returns the longest prefix of steps
+marked with deterministic(), whose output only depends on the image and can be
+cached (see meta_dataset.data.image_cache), and the suffix, which is applied to
+every sample.
+
+Only steps mapping a uint8 numpy image to a uint8 numpy image of the same kind
+can be part of the prefix, so that the cache stores compact images. Unmarked
+steps, including the conversions to PIL images and tensors, which are cheap,
+start the suffix. The order of the steps is kept, so caching the prefix does
+not change the augmentation.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import re
+
+from meta_dataset.utils.lazy_import import lazy_import
+# torch is imported before torchvision is registered lazily: importing torch
+# inspects the modules in sys.modules, which would import torchvision midway.
+import torch  # pylint: disable=unused-import
+
+torchvision = lazy_import('torchvision')
+
+
+def deterministic(transform, name):
+  """Marks a transform as deterministic, so that its output can be cached.
+
+  Args:
+    transform: a function mapping a uint8 numpy image to a uint8 numpy image,
+      which only depends on its input.
+    name: str, identifies the transform and its parameters in the cache keys,
+      e.g. 'resize_129'. Different transforms must have different names.
+
+  Returns:
+    A torchvision Lambda applying the transform.
+  """
+  transform = torchvision.transforms.Lambda(transform)
+  transform.deterministic = True
+  transform.name = name
+  return transform
+
+
+def is_deterministic(transform):
+  return getattr(transform, 'deterministic', False)
+
+
+def flatten_transforms(transforms):
+  """Returns the list of steps of transforms, expanding nested Composes."""
+  if transforms is None:
+    return []
+  if isinstance(transforms, torchvision.transforms.Compose):
+    return [t for step in transforms.transforms
+            for t in flatten_transforms(step)]
+  if isinstance(transforms, (list, tuple)):
+    return [t for step in transforms for t in flatten_transforms(step)]
+  return [transforms]
+
+
+def split_transforms(transforms):
+  """Splits transforms into a deterministic prefix and a stochastic suffix.
+
+  Args:
+    transforms: a transform, a torchvision Compose or a list of transforms, or
+      None.
+
+  Returns:
+    The prefix and the suffix, torchvision Composes such that applying the
+    prefix and then the suffix is the same as applying transforms, and the name
+    of the prefix, which identifies its outputs in the cache keys.
+  """
+  steps = flatten_transforms(transforms)
+  size = 0
+  while size < len(steps) and is_deterministic(steps[size]):
+    size += 1
+  prefix, suffix = steps[:size], steps[size:]
+  name = '+'.join(t.name for t in prefix) or 'none'
+  return (torchvision.transforms.Compose(prefix),
+          torchvision.transforms.Compose(suffix), name)
+
+
+def describe_transforms(transforms):
+  """Returns a string describing the steps of transforms and their parameters.
+
+  Deterministic steps are described by their name and the others by their repr,
+  without the memory addresses that the reprs of some objects contain, so that
+  the description is the same in every run.
+
+  Args:
+    transforms: a transform, a torchvision Compose or a list of transforms, or
+      None.
+  """
+  return ' + '.join(
+      t.name if is_deterministic(t) else re.sub(r' at 0x[0-9a-f]+', '', repr(t))
+      for t in flatten_transforms(transforms)) or 'none'
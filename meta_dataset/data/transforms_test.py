@@ -0,0 +1,94 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for `transforms` module."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import unittest
+
+from meta_dataset.data import transforms
+import numpy as np
+import torch
+from torchvision import transforms as tv_transforms
+
+
+def double(im):
+  return im * 2
+
+
+def add_one(im):
+  return im + 1
+
+
+class SplitTransformsTest(unittest.TestCase):
+
+  def test_split(self):
+    pipeline = tv_transforms.Compose([
+        transforms.deterministic(double, 'double'),
+        tv_transforms.Compose([transforms.deterministic(add_one, 'add_one')]),
+        tv_transforms.ToPILImage(),
+        tv_transforms.RandomCrop(4, padding=1),
+        tv_transforms.ToTensor(),
+        transforms.deterministic(double, 'double'),
+    ])
+    prefix, suffix, name = transforms.split_transforms(pipeline)
+    self.assertEqual(name, 'double+add_one')
+    self.assertEqual(len(prefix.transforms), 2)
+    # Deterministic steps after a stochastic one stay in the suffix.
+    self.assertEqual(len(suffix.transforms), 4)
+    image = np.arange(48, dtype=np.uint8).reshape(4, 4, 3)
+    np.testing.assert_array_equal(prefix(image), image * 2 + 1)
+    torch.manual_seed(0)
+    expected = pipeline(image)
+    torch.manual_seed(0)
+    self.assertTrue(torch.equal(suffix(prefix(image)), expected))
+
+  def test_no_prefix(self):
+    prefix, suffix, name = transforms.split_transforms(
+        tv_transforms.ToTensor())
+    self.assertEqual((prefix.transforms, name), ([], 'none'))
+    self.assertEqual(len(suffix.transforms), 1)
+    prefix, suffix, name = transforms.split_transforms(None)
+    image = np.zeros((2, 2, 3), np.uint8)
+    self.assertIs(suffix(prefix(image)), image)
+
+
+class DescribeTransformsTest(unittest.TestCase):
+
+  def test_describe(self):
+    pipeline = tv_transforms.Compose([
+        transforms.deterministic(double, 'double'),
+        tv_transforms.ToPILImage(),
+        tv_transforms.RandomCrop(4, padding=1),
+    ])
+    description = transforms.describe_transforms(pipeline)
+    self.assertTrue(description.startswith('double + ToPILImage'))
+    self.assertIn('RandomCrop(size=(4, 4), padding=1)', description)
+    self.assertNotEqual(description, transforms.describe_transforms(
+        tv_transforms.Compose([tv_transforms.RandomCrop(4, padding=2)])))
+    self.assertEqual(transforms.describe_transforms(None), 'none')
+
+  def test_no_addresses(self):
+    description = transforms.describe_transforms(
+        tv_transforms.Compose([add_one]))
+    self.assertNotIn(' at 0x', description)
+    self.assertIn('add_one', description)
+
+
+if __name__ == '__main__':
+  unittest.main()
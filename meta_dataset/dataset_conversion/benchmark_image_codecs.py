@@ -0,0 +1,157 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pyformat: disable
+r"""Compares the image codecs on a sample of the converted datasets.
+
+For each dataset, a sample of its converted images is decoded and resized to
+each benchmarked size, and then encoded with each codec. The benchmark reports,
+per dataset, size and codec, the bytes per image once encoded, the time to
+decode an image, and the pixel error introduced by the codec, measured as PSNR
+and mean absolute error against the resized images.
+
+Example command:
+# pylint: disable=line-too-long
+python -m meta_dataset.dataset_conversion.benchmark_image_codecs \
+  --records_root=<path/to/records> \
+  --benchmark_datasets=omniglot,ilsvrc_2012 \
+  --benchmark_output=<path/to/results.json>
+# pylint: enable=line-too-long
+"""
+# pyformat: enable
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import logging
+import os
+import time
+logging.getLogger().setLevel(logging.INFO)
+
+import cv2
+import h5py
+import numpy as np
+
+from meta_dataset.data import image_codecs
+from meta_dataset.dataset_conversion import dataset_to_hdf5
+from meta_dataset.utils.argparse import argparse
+
+parser = argparse.parser
+parser.add_argument(
+  '--benchmark_datasets',
+  default='ilsvrc_2012,omniglot,aircraft,cu_birds,dtd,quickdraw,fungi,'
+          'vgg_flower,traffic_sign,mscoco',
+  help='Comma-separated names of the converted datasets to sample images from.')
+parser.add_argument(
+  '--benchmark_codecs', default=','.join(image_codecs.BENCHMARK_CODECS),
+  help='Comma-separated specs of the codecs to compare.')
+parser.add_argument(
+  '--benchmark_sizes', default='84,224',
+  help='Comma-separated image sizes at which the codecs are compared.')
+parser.add_argument(
+  '--benchmark_num_images', type=int, default=200,
+  help='The number of images sampled from each dataset.')
+parser.add_argument(
+  '--benchmark_repeats', type=int, default=3,
+  help='The number of times the images are decoded, keeping the fastest.')
+parser.add_argument(
+  '--benchmark_output', default='',
+  help='If set, the path of a JSON file where the results are written.')
+FLAGS = argparse.FLAGS
+
+
+def sample_images(path, num_images, seed=0):
+  """Decodes a random sample of the images of a converted dataset.
+
+  Args:
+    path: the path to the hdf5 file of the dataset.
+    num_images: the number of images to sample.
+    seed: the seed of the sample.
+
+  Returns:
+    A list of decoded images.
+  """
+  with h5py.File(path, 'r') as h5fp:
+    # The pyramid levels are groups, only the full resolution images are used.
+    keys = [k for k, v in h5fp.items() if isinstance(v, h5py.Dataset)]
+    indices = [(k, i) for k in keys for i in range(len(h5fp[k]))]
+    rng = np.random.RandomState(seed)
+    sample = rng.choice(len(indices), min(num_images, len(indices)),
+                        replace=False)
+    return [image_codecs.decode(h5fp[indices[j][0]][indices[j][1]])
+            for j in sorted(sample)]
+
+
+def benchmark_codec(codec, images, repeats=3):
+  """Measures the size, decoding time and pixel error of a codec.
+
+  Args:
+    codec: an image_codecs.ImageCodec.
+    images: a list of decoded images.
+    repeats: the number of times the images are decoded, keeping the fastest.
+
+  Returns:
+    A dict with the mean bytes per image, the mean microseconds to decode an
+    image, the mean PSNR and the mean absolute error of the decoded images.
+  """
+  encoded = [codec.encode(im) for im in images]
+  decode_time = float('inf')
+  for _ in range(repeats):
+    start_time = time.perf_counter()
+    decoded = [codec.decode(e) for e in encoded]
+    decode_time = min(decode_time, time.perf_counter() - start_time)
+  errors = [np.abs(d.astype(np.float64) - im) for d, im in zip(decoded, images)]
+  mse = np.mean([np.mean(e ** 2) for e in errors])
+  return {
+    'bytes_per_image': float(np.mean([e.size for e in encoded])),
+    'decode_us_per_image': 1e6 * decode_time / len(images),
+    'psnr': float(10 * np.log10(255 ** 2 / mse)) if mse > 0 else float('inf'),
+    'mean_abs_error': float(np.mean([np.mean(e) for e in errors])),
+  }
+
+
+def main():
+  specs = FLAGS.benchmark_codecs.split(',')
+  sizes = [int(s) for s in FLAGS.benchmark_sizes.split(',')]
+  results = []
+  for name in FLAGS.benchmark_datasets.split(','):
+    path = os.path.join(FLAGS.records_root, name,
+                        dataset_to_hdf5.DEFAULT_FILE_PATTERN.format(name))
+    if not os.path.exists(path):
+      logging.warning('Skipping %s, %s does not exist.', name, path)
+      continue
+    images = sample_images(path, FLAGS.benchmark_num_images)
+    for size in sizes:
+      resized = [cv2.resize(im, (size, size), interpolation=cv2.INTER_AREA)
+                 for im in images]
+      for spec in specs:
+        codec = image_codecs.get_codec(spec)
+        result = benchmark_codec(codec, resized, FLAGS.benchmark_repeats)
+        result.update(dataset=name, size=size, codec=spec)
+        results.append(result)
+        logging.info('%12s %4dpx %14s: %9.0f bytes/img %8.1f us/img '
+                     'PSNR %6.2f dB MAE %6.3f', name, size, spec,
+                     result['bytes_per_image'], result['decode_us_per_image'],
+                     result['psnr'], result['mean_abs_error'])
+
+  if FLAGS.benchmark_output:
+    with open(FLAGS.benchmark_output, 'w') as f:
+      json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+  argparse.parser.parse_args()
+  main()
@@ -33,14 +33,22 @@ from __future__ import division
 from __future__ import print_function
 
 import collections
+import hashlib
 import pickle as pkl
 import io
 import json
+import multiprocessing
 import os
+import queue
 import random
+import threading
+import time
 from meta_dataset.data import dataset_spec as ds_spec
+from meta_dataset.data import hdf5_format
+from meta_dataset.data import image_codecs
 from meta_dataset.data import imagenet_specification
 from meta_dataset.data import learning_spec
+from meta_dataset.data import records_index
 import numpy as np
 from PIL import Image
 from PIL import ImageOps
@@ -65,6 +73,22 @@ parser.add_argument(
   '--save_ready_to_load', type=int, default=0,
   help="Saves images already resized, cropped and decoded. The argument is the image size"
 )
+parser.add_argument(
+  '--image_codec', default=image_codecs.DEFAULT_CODEC,
+  help='The codec of the converted images, e.g. "jpeg:90", "png", "webp:90", '
+       '"webp_lossless" or "raw". See meta_dataset/data/image_codecs.py.')
+parser.add_argument(
+  '--pyramid_sizes', default='',
+  help='Comma-separated image sizes, e.g. "84,126,224". For each size s, every '
+       'image is additionally stored resized as with --save_ready_to_load=s, '
+       'in a separate pyramid level that backends use when reading images of '
+       'size at most s.')
+parser.add_argument(
+  '--verify_manifest', action='store_true',
+  help='Reads the images of the classes that the conversion manifest records as '
+       'converted to verify their checksum, instead of only checking their '
+       'number and the size of their file, so that a corrupted dataset is '
+       'converted again.')
 parser.add_argument(
   '--omniglot_data_root',
   default='',
@@ -134,6 +158,16 @@ FLAGS = argparse.FLAGS
 DEFAULT_FILE_PATTERN = '{}.h5'
 TRAIN_TEST_FILE_PATTERN = '{}_{}.h5'
 ILSCRC_DUPLICATES_PATH = os.path.dirname(os.path.realpath(__file__))
+# Number of images buffered per class before they are written to the hdf5 in a
+# single slice assignment. This is also the chunk size of the hdf5 datasets.
+WRITE_CHUNK_SIZE = 256
+# Number of processes used to load and encode images.
+NUM_WORKERS = 16
+# Name of the conversion manifest of ConversionScheduler, in records_path.
+MANIFEST_FILENAME = 'conversion_manifest.json'
+# Version of the conversion manifest format. Manifests of other versions are
+# ignored, which triggers a full reconversion.
+MANIFEST_FORMAT_VERSION = 1
 
 
 def gen_rand_split_inds(num_train_classes, num_valid_classes, num_test_classes):
@@ -173,74 +207,414 @@ def gen_rand_split_inds(num_train_classes, num_valid_classes, num_test_classes):
   return train_inds, valid_inds, test_inds
 
 
+class HDF5Writer(object):
+  """Writes encoded images into the per-class datasets of a hdf5 file.
+
+  Each class is stored as a resizable dataset of variable length uint8 arrays,
+  named after the class label. Images are buffered per class and written in
+  bulk once WRITE_CHUNK_SIZE of them are available, so memory stays bounded
+  regardless of the number of images of a class, and hdf5 sees one large slice
+  assignment instead of one small write per image. The datasets grow
+  geometrically, doubling their capacity when it is exceeded, and are trimmed
+  to the number of written images when the writer is closed, so the number of
+  resizes is logarithmic in the number of images.
+
+  If pyramid_sizes are given, each image is written along with its pyramid
+  levels (see load_and_process_image), each level to its own dataset as laid
+  out in hdf5_format. The sizes of the images of each class are written when
+  it is finished, for the records index to be built without reading them.
+
+  Typical usage:
+
+    with HDF5Writer(output_path) as writer:
+      for image in images:
+        writer.write(class_label, image)
+  """
+
+  def __init__(self, output_path, chunk_size=WRITE_CHUNK_SIZE,
+               pyramid_sizes=()):
+    """Initialize a HDF5Writer.
+
+    Args:
+      output_path: the path to the hdf5 file, which is created if it does not
+        exist.
+      chunk_size: the number of images per bulk write.
+      pyramid_sizes: the sizes of the pyramid levels of the images.
+    """
+    self.output_path = output_path
+    self.chunk_size = chunk_size
+    self.pyramid_sizes = tuple(pyramid_sizes)
+    self._file = h5py.File(output_path, 'a')
+    if self.pyramid_sizes:
+      self._file.attrs[hdf5_format.PYRAMID_SIZES_ATTR] = self.pyramid_sizes
+    self._datasets = {}
+    self._buffers = {}
+    self._counts = collections.Counter()
+    # The md5 and sizes of the full resolution images written to each class.
+    self._checksums = {}
+    self._image_sizes = {}
+    # The classes whose image sizes are not written yet.
+    self._unwritten_sizes = set()
+
+  def _get_keys(self, class_label):
+    """Returns the dataset names of class_label, the full resolution first."""
+    return [hdf5_format.get_dataset_name(class_label)] + [
+      hdf5_format.get_dataset_name(class_label, size)
+      for size in self.pyramid_sizes
+    ]
+
+  def add_class(self, class_label, overwrite=False):
+    """Creates the datasets of class_label if necessary.
+
+    Args:
+      class_label: the label of the class.
+      overwrite: whether to delete a dataset of class_label that already exists
+        in the file, e.g. left by an interrupted conversion. Otherwise, such a
+        dataset makes the creation fail.
+
+    Returns:
+      The names of the datasets of class_label in the hdf5 file, the full
+      resolution one first, followed by one per pyramid level.
+    """
+    keys = self._get_keys(class_label)
+    if class_label not in self._checksums:
+      self._checksums[class_label] = hashlib.md5()
+      self._image_sizes[class_label] = []
+      self._unwritten_sizes.add(class_label)
+      sizes_key = hdf5_format.get_image_sizes_name(class_label)
+      if overwrite and sizes_key in self._file:
+        del self._file[sizes_key]
+    for key in keys:
+      if key in self._datasets:
+        continue
+      if overwrite and key in self._file:
+        del self._file[key]
+      self._datasets[key] = self._file.create_dataset(
+        key,
+        dtype=h5py.special_dtype(vlen=np.uint8),
+        shape=(0,),
+        maxshape=(None,),
+        chunks=(self.chunk_size,))
+      self._buffers[key] = []
+    return keys
+
+  def write(self, class_label, image):
+    """Buffers an encoded image of class class_label, flushing if needed.
+
+    Args:
+      class_label: the label of the class of the image.
+      image: a numpy array of uint8 with the encoded image or, if the writer
+        has pyramid_sizes, a list of the encoded image followed by its levels.
+    """
+    keys = self.add_class(class_label)
+    levels = image if self.pyramid_sizes else [image]
+    for key, level in zip(keys, levels):
+      self._buffers[key].append(np.asarray(level, dtype=np.uint8).ravel())
+    self._checksums[class_label].update(self._buffers[keys[0]][-1].tobytes())
+    self._image_sizes[class_label].append(self._buffers[keys[0]][-1].size)
+    self._unwritten_sizes.add(class_label)
+    for key in keys:
+      if len(self._buffers[key]) >= self.chunk_size:
+        self._flush(key)
+
+  def write_many(self, class_label, images):
+    """Writes an iterable of encoded images of class class_label."""
+    for image in images:
+      self.write(class_label, image)
+
+  def _flush(self, key):
+    """Writes the buffered images of the dataset key in a single slice."""
+    buf = self._buffers[key]
+    if not buf:
+      return
+    # The images are placed one by one in an object array, as numpy would
+    # otherwise build a 2D array out of images that happen to have equal sizes.
+    images = np.empty(len(buf), dtype=object)
+    for i, image in enumerate(buf):
+      images[i] = image
+    dataset = self._datasets[key]
+    start = self._counts[key]
+    end = start + len(buf)
+    if end > dataset.shape[0]:
+      dataset.resize((max(end, 2 * dataset.shape[0]),))
+    # The slice is written through the low-level API, since Dataset.__setitem__
+    # also tries to broadcast object arrays of equally sized images to 2D.
+    file_space = dataset.id.get_space()
+    file_space.select_hyperslab((start,), (len(buf),))
+    dataset.id.write(h5py.h5s.create_simple((len(buf),)), file_space, images)
+    self._counts[key] = end
+    self._buffers[key] = []
+
+  def finish_class(self, class_label):
+    """Writes the buffered images of class_label and trims its datasets.
+
+    The file is flushed, so that the datasets are complete on disk.
+
+    Args:
+      class_label: the label of the class.
+    """
+    for key in self.add_class(class_label):
+      self._flush(key)
+      self._datasets[key].resize((self._counts[key],))
+    self._write_image_sizes(class_label)
+    self._file.flush()
+
+  def _write_image_sizes(self, class_label):
+    """Writes the sizes of the images of class_label, see hdf5_format."""
+    sizes_key = hdf5_format.get_image_sizes_name(class_label)
+    if sizes_key in self._file:
+      del self._file[sizes_key]
+    self._file.create_dataset(
+      sizes_key, data=np.array(self._image_sizes[class_label], dtype=np.int64))
+    self._unwritten_sizes.discard(class_label)
+
+  def num_images(self, class_label):
+    """Returns the number of images of class_label written so far."""
+    key = hdf5_format.get_dataset_name(class_label)
+    return self._counts[key] + len(self._buffers.get(key, ()))
+
+  def checksum(self, class_label):
+    """Returns the md5 hex digest of the images of class_label, see get_checksum."""
+    return self._checksums[class_label].hexdigest()
+
+  def flush(self):
+    """Writes all buffered images."""
+    for key in self._buffers:
+      self._flush(key)
+
+  def close(self):
+    """Writes all buffered images, trims the datasets and closes the file."""
+    if self._file is None:
+      return
+    self.flush()
+    for key, dataset in self._datasets.items():
+      if dataset.shape[0] != self._counts[key]:
+        dataset.resize((self._counts[key],))
+    for class_label in list(self._unwritten_sizes):
+      self._write_image_sizes(class_label)
+    self._file.close()
+    self._file = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+
+def get_checksum(h5fp, class_label, chunk_size=WRITE_CHUNK_SIZE):
+  """Returns the md5 hex digest of the full resolution images of a class.
+
+  It is the digest of the concatenated encoded images, as computed by
+  HDF5Writer while writing them.
+
+  Args:
+    h5fp: an open h5py.File.
+    class_label: the label of the class.
+    chunk_size: the number of images read at once.
+  """
+  md5 = hashlib.md5()
+  dataset = h5fp[hdf5_format.get_dataset_name(class_label)]
+  for start in range(0, dataset.shape[0], chunk_size):
+    for image in dataset[start:start + chunk_size]:
+      md5.update(image.tobytes())
+  return md5.hexdigest()
+
+
+def get_file_digest(path, *options):
+  """Returns a md5 hex digest of a file and of the options of its conversion.
+
+  The file is identified by its path, size and modification time, as the
+  inputs of ClassConversion.get_source_digest.
+  """
+  stat = os.stat(path)
+  return hashlib.md5(repr((path, stat.st_size, stat.st_mtime_ns) +
+                          options).encode()).hexdigest()
+
+
+def _parallel_imap(fn, args, n_jobs=NUM_WORKERS):
+  """Lazily applies fn to each element of args in a pool of processes.
+
+  Results are yielded in order, as soon as they are ready, and only a bounded
+  number of tasks is dispatched ahead of the consumer.
+
+  Args:
+    fn: the function to apply.
+    args: an iterable of tuples of arguments for fn.
+    n_jobs: the number of processes.
+
+  Returns:
+    A generator of the results.
+  """
+  return Parallel(n_jobs=n_jobs, return_as='generator')(
+    delayed(fn)(*a) for a in args)
+
+
+def _encode_npy_images(class_npy_file, start, end, output_format):
+  """Encodes a slice of the single channel images of a .npy file.
+
+  The file is memory mapped, so that only the slice is read, and each worker
+  process reads its own slices instead of receiving them from the parent.
+
+  Args:
+    class_npy_file: the .npy file of the images of a class, of shape
+      [num_images, side**2].
+    start: the index of the first image of the slice.
+    end: the index after the last image of the slice.
+    output_format: the codec spec of the encoded images.
+
+  Returns:
+    The list of the encoded images.
+  """
+  codec = image_codecs.get_codec(output_format)
+  imgs = np.load(class_npy_file, mmap_mode='r')[start:end]
+  # If the values are in the range 0-1, bring them to the range 0-255.
+  if imgs.dtype == bool:
+    imgs = imgs.astype(np.uint8) * 255
+  # We make the assumption that the images are square.
+  side = int(np.sqrt(imgs.shape[1]))
+  return [codec.encode(img.reshape((side, side))) for img in imgs]
+
+
 def write_hdf5_from_npy_single_channel(class_npy_file, class_label,
-                                       output_path):
+                                       output_path, manifest_path=None):
   """Create and write a hdf5 file for the data of a class.
 
   This assumes that the provided .npy file stores the data of a given class in
   an array of shape [num_images_of_given_class, side**2].
   In the case of the Quickdraw dataset for example, side = 28.
   Each row of that array is interpreted as a single-channel side x side image,
-  read into a PIL.Image, converted to RGB and then written into a hdf5.
+  encoded and then written into a hdf5. The .npy file is memory mapped by the
+  worker processes, each encoding its own slices of WRITE_CHUNK_SIZE images,
+  and the encoded images are streamed into the hdf5, so the memory used does
+  not depend on the number of images.
   Args:
     class_npy_file: the .npy file of the images of class class_label.
     class_label: the label of the class that a hdf5 is being made for.
     output_path: the location to write the hdf5.
+    manifest_path: optional path to the ConversionManifest of the dataset. If
+      it records the class as converted from the same file, it is skipped.
 
   Returns:
     The number of images in the .npy file for class class_label.
   """
+  manifest = ConversionManifest(manifest_path) if manifest_path else None
+  source_digest = get_file_digest(class_npy_file, FLAGS.image_codec)
+  if manifest is not None and manifest.is_complete(output_path, class_label,
+                                                   source_digest):
+    return manifest.get_num_images(output_path, class_label)
+  num_images = len(np.load(class_npy_file, mmap_mode='r'))
+  args = ((class_npy_file, start, min(start + WRITE_CHUNK_SIZE, num_images),
+           FLAGS.image_codec)
+          for start in range(0, num_images, WRITE_CHUNK_SIZE))
+  with HDF5Writer(output_path) as writer:
+    # A dataset of the class may be left by an interrupted conversion.
+    writer.add_class(class_label, overwrite=True)
+    for chunk in _parallel_imap(_encode_npy_images, args):
+      writer.write_many(class_label, chunk)
+    writer.finish_class(class_label)
+    if manifest is not None:
+      manifest.set_complete(output_path, class_label, source_digest,
+                            num_images, writer.checksum(class_label))
+
+  return num_images
+
+
+class ArchivedImage(
+    collections.namedtuple('ArchivedImage', 'path, offset, size')):
+  """An image stored uncompressed at offset within the archive at path.
+
+  ArchivedImages can be passed in place of image paths to the functions of this
+  module, so that images are read from an archive without extracting it.
+  """
 
-  def load_image(img):
-    """Load image img.
+  def read(self):
+    """Returns the encoded image as a numpy array of uint8."""
+    with open(self.path, 'rb') as f:
+      f.seek(self.offset)
+      return np.frombuffer(f.read(self.size), dtype=np.uint8)
 
-    Args:
-      img: a 1D numpy array of shape [side**2]
 
-    Returns:
-      a jpeg encoded image
-    """
-    # We make the assumption that the images are square.
-    side = int(np.sqrt(img.shape[0]))
-    img = img.reshape((side, side))
-    return cv2.imencode(".jpg", img)[1].ravel()
-
-  with open(class_npy_file, 'rb') as f:
-    imgs = np.load(f)
-
-  def load_images(imgs):
-    # If the values are in the range 0-1, bring them to the range 0-255.
-    if imgs.dtype == np.bool:
-      imgs = imgs.astype(np.uint8)
-      imgs *= 255
-    ret = []
-    for im in imgs:
-      ret.append(load_image(im))
-    return ret
-
-  workers = 16
-  chunk_size = len(imgs) // workers
-  offsets = []
-  for i in range(workers):
-    start = i * chunk_size
-    end = (i + 1) * chunk_size
-    if i == workers - 1:
-      end = len(imgs)
-    offsets.append((start, end))
-  ret = Parallel(workers)(delayed(load_images)(imgs[start:end]) for start, end in offsets)
-
-  writer = h5py.File(output_path, 'a')
-  dt = h5py.special_dtype(vlen=np.uint8)
-  writer.create_dataset(str(class_label), dtype=dt, shape=(len(imgs),))
-
-  counter = 0
-  for chunk in ret:
-    for img in chunk:
-      writer[str(class_label)][counter] = img
-      counter += 1
-
-  writer.close()
-  return len(imgs)
+def resize_ready_to_load(im, image_size):
+  """Resizes im as stored with save_ready_to_load=image_size."""
+  aligned_size = hdf5_format.get_aligned_size(image_size)
+  return cv2.resize(im, (aligned_size, aligned_size), interpolation=cv2.INTER_CUBIC)
+
+
+def encode_image(im, output_format=image_codecs.DEFAULT_CODEC, pyramid_sizes=()):
+  """Encodes an image, and its pyramid levels if pyramid_sizes is not empty.
+
+  Args:
+    im: the decoded image.
+    output_format: the codec spec of the encoding, see image_codecs.get_codec.
+    pyramid_sizes: the sizes of the pyramid levels.
+
+  Returns:
+    The encoded image if pyramid_sizes is empty, otherwise a list of the encoded
+    image followed by its encoded pyramid levels, as expected by HDF5Writer.
+  """
+  codec = image_codecs.get_codec(output_format)
+  encoded = codec.encode(im)
+  if not pyramid_sizes:
+    return encoded
+  return [encoded] + [
+    codec.encode(resize_ready_to_load(im, size)) for size in pyramid_sizes
+  ]
+
+
+def load_and_process_image(path,
+                           bbox=None,
+                           invert_img=False,
+                           output_format=image_codecs.DEFAULT_CODEC,
+                           ready_to_load_size=0,
+                           skip_on_error=False,
+                           pyramid_sizes=()):
+  """Process the image living at path if necessary.
+
+  If the image does not need any processing (inverting, converting to RGB
+  for instance), and is in the desired output_format, then the original
+  byte representation is returned.
+
+  If that is not the case, the resulting image is encoded to output_format.
+
+  Args:
+    path: the path to an image file (e.g. a .png file), or an ArchivedImage.
+    bbox: bounding box to crop the image to.
+    invert_img: change black pixels to white ones and vice versa.
+    output_format: the codec spec of the encoding of the returned image (see
+      image_codecs.get_codec), or None to return the decoded image.
+    ready_to_load_size: if positive, the image is resized as done with the
+      save_ready_to_load flag. Flags are not parsed in worker processes, so the
+      value has to be passed explicitly.
+    skip_on_error: whether to return None instead of raising if the image can
+      not be processed.
+    pyramid_sizes: the sizes of the pyramid levels to encode along with the
+      image. Only used if output_format is not None.
+
+  Returns:
+    A bytes representation of the encoded image (see encode_image), or None if
+    it could not be read and skip_on_error is set.
+  """
+  try:
+    if isinstance(path, ArchivedImage):
+      im = cv2.imdecode(path.read(), cv2.IMREAD_COLOR)
+    else:
+      im = cv2.imread(path, cv2.IMREAD_COLOR)
+    if bbox is not None:
+      left, upper, right, lower = bbox
+      im = im[upper:lower, left:right, :]
+    if invert_img:
+      im = 255 - im
+    if ready_to_load_size > 0:
+      im = resize_ready_to_load(im, ready_to_load_size)
+    if output_format is not None:
+      im = encode_image(im, output_format, pyramid_sizes)
+    return im
+  except:
+    logging.warning('Failed to open image: {}'.format(path))
+    if skip_on_error:
+      return None
+    raise
 
 
 def write_hdf5_from_image_files(class_files,
@@ -248,8 +622,9 @@ def write_hdf5_from_image_files(class_files,
                                 output_path,
                                 invert_img=False,
                                 bboxes=None,
-                                output_format='.jpg',
-                                skip_on_error=False):
+                                output_format=None,
+                                skip_on_error=False,
+                                manifest_path=None):
   """Create and write a hdf5 file for the images corresponding to a class.
 
   Args:
@@ -261,66 +636,74 @@ def write_hdf5_from_image_files(class_files,
       into more conventional-looking white-background-black-digit ones.
     bboxes: list of bounding boxes, one for each filename passed as input. If
       provided, images are cropped to those bounding box values.
-    output_format: a string representing a PIL.Image encoding type: how the
-      image data is encoded inside the hdf5. This needs to be consistent
-      with the hdf5_decoder of the DataProvider that will read the file.
+    output_format: the codec spec of the images inside the hdf5, see
+      image_codecs.get_codec. Defaults to the image_codec flag.
     skip_on_error: whether to skip an image if there is an issue in reading it.
       The default it to crash and report the original exception.
+    manifest_path: optional path to the ConversionManifest of the dataset. If
+      it records the class as converted from the same inputs, it is skipped.
 
   Returns:
     The number of images written into the hdf5 file.
   """
+  written_images_count = 0
+  if output_format is None:
+    output_format = FLAGS.image_codec
+  if bboxes is None:
+    bboxes = [None] * len(class_files)
+  bboxes = [bbox if bbox is None else tuple(bbox) for bbox in bboxes]
+  pyramid_sizes = hdf5_format.parse_pyramid_sizes(FLAGS.pyramid_sizes)
+  manifest = ConversionManifest(manifest_path) if manifest_path else None
+  source_digest = ClassConversion(
+    output_path, class_label, list(class_files), bboxes, invert_img,
+    output_format, skip_on_error).get_source_digest(FLAGS.save_ready_to_load,
+                                                    pyramid_sizes)
+  if manifest is not None and manifest.is_complete(output_path, class_label,
+                                                   source_digest):
+    return manifest.get_num_images(output_path, class_label)
+  args = ((path, bbox, invert_img, output_format, FLAGS.save_ready_to_load,
+           skip_on_error, pyramid_sizes)
+          for path, bbox in zip(class_files, bboxes))
+  with HDF5Writer(output_path, pyramid_sizes=pyramid_sizes) as writer, tqdm(
+      total=len(class_files)) as pbar:
+    # A dataset of the class may be left by an interrupted conversion.
+    writer.add_class(class_label, overwrite=True)
+    for img in _parallel_imap(load_and_process_image, args):
+      pbar.update(1)
+      if img is None:
+        continue
+      writer.write(class_label, img)
+      written_images_count += 1
+    writer.finish_class(class_label)
+    if manifest is not None:
+      manifest.set_complete(output_path, class_label, source_digest,
+                            written_images_count, writer.checksum(class_label))
+  if not skip_on_error:
+    assert (written_images_count == len(class_files))
+  return written_images_count
 
-  def load_and_process_image(path, bbox=None):
-    """Process the image living at path if necessary.
-
-    If the image does not need any processing (inverting, converting to RGB
-    for instance), and is in the desired output_format, then the original
-    byte representation is returned.
-
-    If that is not the case, the resulting image is encoded to output_format.
 
-    Args:
-      path: the path to an image file (e.g. a .png file).
-      bbox: bounding box to crop the image to.
+def list_class_directory(class_directory, files_to_skip=None):
+  """Returns the sorted paths of the image files in class_directory.
 
-    Returns:
-      A bytes representation of the encoded image.
-    """
-    try:
-      im = cv2.imread(path, cv2.IMREAD_COLOR)
-      if bbox is not None:
-        left, upper, right, lower = bbox
-        im = im[upper:lower, left:right, :]
-      if invert_img:
-        im = 255 - im
-      if FLAGS.save_ready_to_load > 0:
-        size = FLAGS.save_ready_to_load
-        aligned_size = int(np.ceil(size / 32.0)) * 32 + 1
-        im = cv2.resize(im, (aligned_size, aligned_size), interpolation=cv2.INTER_CUBIC)
-      if output_format is not None:
-        im = cv2.imencode(output_format, im)[1]
-      return im
-    except:
-      logging.warning('Failed to open image: {}'.format(path))
-      raise
-
-  writer = h5py.File(output_path, 'a')
-  dt = h5py.special_dtype(vlen=np.uint8)
-  writer.create_dataset(str(class_label), dtype=dt, shape=(len(class_files),))
-  written_images_count = 0
-  bboxes = [None] * len(class_files) if bboxes is None else bboxes
-  with Parallel(n_jobs=16) as parallel:
-    with tqdm(total=len(class_files)) as pbar:
-      imgs = parallel(delayed(load_and_process_image)(path, bbox) for path, bbox in zip(class_files, bboxes))
-      written_images_count += len(imgs)
-      for i, img in enumerate(imgs):
-        writer[str(class_label)][i] = img.ravel()
-
-      pbar.update(written_images_count)
-  assert (written_images_count == len(class_files))
-  writer.close()
-  return written_images_count
+  Args:
+    class_directory: the home of the images of a class.
+    files_to_skip: a set containing names of files that should be skipped if
+      present in class_directory.
+  """
+  if files_to_skip is None:
+    files_to_skip = set()
+  class_files = []
+  filenames = sorted(os.listdir(class_directory))
+  for filename in filenames:
+    if filename in files_to_skip:
+      logging.info('skipping file %s', filename)
+      continue
+    filepath = os.path.join(class_directory, filename)
+    if os.path.isdir(filepath):
+      continue
+    class_files.append(filepath)
+  return class_files
 
 
 def write_hdf5_from_directory(class_directory,
@@ -328,7 +711,8 @@ def write_hdf5_from_directory(class_directory,
                               output_path,
                               invert_img=False,
                               files_to_skip=None,
-                              skip_on_error=False):
+                              skip_on_error=False,
+                              manifest_path=None):
   """Create and write an hdf5 file with a dataset for the images corresponding to a class.
 
   Args:
@@ -342,35 +726,464 @@ def write_hdf5_from_directory(class_directory,
       present in class_directory.
     skip_on_error: whether to skip an image if there is an issue in reading it.
       The default it to crash and report the original exception.
+    manifest_path: optional path to the ConversionManifest of the dataset, see
+      write_hdf5_from_image_files.
 
   Returns:
     The number of images written into the hdf5 file.
   """
-  if files_to_skip is None:
-    files_to_skip = set()
-  class_files = []
-  filenames = sorted(os.listdir(class_directory))
-  for filename in filenames:
-    if filename in files_to_skip:
-      logging.info('skipping file %s', filename)
-      continue
-    filepath = os.path.join(class_directory, filename)
-    if os.path.isdir(filepath):
-      continue
-    class_files.append(filepath)
+  class_files = list_class_directory(class_directory, files_to_skip)
 
   written_images_count = write_hdf5_from_image_files(
     class_files,
     class_label,
     output_path,
     invert_img,
-    skip_on_error=skip_on_error)
+    skip_on_error=skip_on_error,
+    manifest_path=manifest_path)
 
   if not skip_on_error:
     assert len(class_files) == written_images_count
   return written_images_count
 
 
+class ConversionManifest(object):
+  """Records which classes of a dataset have been completely converted.
+
+  The manifest is a JSON file that maps each class, identified by its hdf5 file
+  and label, to the digest of the inputs it was converted from, its number of
+  images, the md5 checksum of its encoded images and the size of its hdf5 file
+  once it was written. A class whose entry matches its current inputs, and
+  whose dataset has the recorded number of images in a file at least as large,
+  does not need to be converted again.
+  """
+
+  def __init__(self, path, verify=None):
+    """Initialize a ConversionManifest, loading it from path if it exists.
+
+    Args:
+      path: the path to the JSON file of the manifest.
+      verify: whether is_complete reads the images of the classes to verify
+        their checksum. Defaults to the verify_manifest flag.
+    """
+    self.path = path
+    self.verify = FLAGS.verify_manifest if verify is None else verify
+    self.classes = {}
+    if os.path.exists(path):
+      with open(path, 'r') as f:
+        manifest = json.load(f)
+      if manifest.get('version') == MANIFEST_FORMAT_VERSION:
+        self.classes = manifest['classes']
+      else:
+        logging.warning('Ignoring conversion manifest %s of version %s.', path,
+                        manifest.get('version'))
+
+  @staticmethod
+  def get_key(output_path, class_label):
+    return '{}/{}'.format(os.path.basename(output_path), class_label)
+
+  def is_complete(self, output_path, class_label, source_digest):
+    """Returns whether a class is already converted from the same inputs.
+
+    Only the number of images of the class and the size of its file are
+    checked, as hdf5 files do not shrink when their datasets are replaced, so
+    that resuming a conversion does not read the converted images. With verify, the
+    images are also read to verify their checksum, so that a corrupted dataset
+    is converted again.
+
+    Args:
+      output_path: the hdf5 file of the class.
+      class_label: the label of the class.
+      source_digest: the digest of the inputs of the class, as returned by
+        ClassConversion.get_source_digest.
+    """
+    entry = self.classes.get(self.get_key(output_path, class_label))
+    if entry is None or entry['source_digest'] != source_digest:
+      return False
+    if not os.path.exists(output_path):
+      return False
+    # Entries written before file sizes were recorded have none.
+    if os.path.getsize(output_path) < entry.get('file_size', 0):
+      logging.warning('%s is smaller than when class %s was converted, '
+                      'converting it again.', output_path, class_label)
+      return False
+    with h5py.File(output_path, 'r') as f:
+      key = hdf5_format.get_dataset_name(class_label)
+      if key not in f or f[key].shape[0] != entry['num_images']:
+        return False
+      if self.verify and get_checksum(f, class_label) != entry['checksum']:
+        logging.warning('The images of class %s in %s do not match their '
+                        'checksum, converting them again.', class_label,
+                        output_path)
+        return False
+      return True
+
+  def get_num_images(self, output_path, class_label):
+    return self.classes[self.get_key(output_path, class_label)]['num_images']
+
+  def set_complete(self, output_path, class_label, source_digest, num_images,
+                   checksum):
+    """Records a converted class and saves the manifest.
+
+    The hdf5 file should be flushed, e.g. by HDF5Writer.finish_class, so that
+    the recorded size includes the class.
+
+    Args:
+      output_path: the hdf5 file of the class.
+      class_label: the label of the class.
+      source_digest: the digest of the inputs of the class.
+      num_images: the number of images written.
+      checksum: the md5 hex digest of the written encoded images.
+    """
+    self.classes[self.get_key(output_path, class_label)] = {
+      'source_digest': source_digest,
+      'num_images': num_images,
+      'checksum': checksum,
+      'file_size': os.path.getsize(output_path),
+    }
+    self.save()
+
+  def save(self):
+    """Atomically writes the manifest to self.path."""
+    tmp_path = self.path + '.tmp'
+    with open(tmp_path, 'w') as f:
+      json.dump({'version': MANIFEST_FORMAT_VERSION, 'classes': self.classes},
+                f, indent=1, sort_keys=True)
+    os.replace(tmp_path, self.path)
+
+
+# Marks the end of the images of a class in the queue of the writer process.
+_END_OF_CLASS = 'end_of_class'
+
+
+# Arguments of load_and_process_image for all the images of a class, along
+# with the hdf5 file and label that they are written to.
+class ClassConversion(
+    collections.namedtuple(
+      'ClassConversion', ('output_path, class_label, class_files, bboxes, '
+                          'invert_img, output_format, skip_on_error'))):
+
+  def get_source_digest(self, ready_to_load_size, pyramid_sizes=()):
+    """Returns a md5 hex digest of the inputs and options of the conversion.
+
+    Input files are identified by their path, size and modification time, and
+    ArchivedImages additionally by their location in the archive.
+
+    Args:
+      ready_to_load_size: the value of the save_ready_to_load flag.
+      pyramid_sizes: the sizes of the pyramid levels.
+    """
+    md5 = hashlib.md5()
+    md5.update(repr((self.invert_img, self.output_format, ready_to_load_size,
+                     self.skip_on_error, tuple(pyramid_sizes))).encode())
+    for path, bbox in zip(self.class_files, self.bboxes):
+      file_path = path.path if isinstance(path, ArchivedImage) else path
+      stat = os.stat(file_path) if os.path.exists(file_path) else None
+      md5.update(repr((tuple(path) if isinstance(path, ArchivedImage) else path,
+                       bbox if bbox is None else tuple(bbox),
+                       stat and (stat.st_size, stat.st_mtime_ns))).encode())
+    return md5.hexdigest()
+
+
+def _process_image(args):
+  """Calls load_and_process_image on a tuple of arguments."""
+  return load_and_process_image(*args)
+
+
+class _Throttle(object):
+  """Bounds the number of tasks submitted to a multiprocessing.Pool.
+
+  Pool.imap sends the tasks of its iterable to the workers as fast as it can,
+  and keeps the results until they are consumed, so a slow consumer lets
+  results pile up without limit. The tasks are instead drawn from wrap(), which
+  blocks while max_in_flight tasks are submitted but not consumed, and the
+  consumer calls done() for each result.
+  """
+
+  def __init__(self, max_in_flight):
+    self.semaphore = threading.Semaphore(max_in_flight)
+    # wrap() runs in the task handler thread of the pool.
+    self.lock = threading.Lock()
+    self.stopped = False
+    self.in_flight = 0
+    # The largest number of tasks in flight so far.
+    self.max_in_flight = 0
+
+  def wrap(self, tasks):
+    """Yields the tasks, waiting for room before each one."""
+    for task in tasks:
+      self.semaphore.acquire()
+      if self.stopped:
+        return
+      with self.lock:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+      yield task
+
+  def done(self):
+    """Marks a result as consumed."""
+    with self.lock:
+      self.in_flight -= 1
+    self.semaphore.release()
+
+  def stop(self):
+    """Ends wrap(), so that the pool does not wait for more tasks."""
+    self.stopped = True
+    self.semaphore.release()
+
+
+def _put(q, item, process):
+  """Puts item in q, failing if process dies while q is full."""
+  while True:
+    try:
+      q.put(item, timeout=1)
+      return
+    except queue.Full:
+      if not process.is_alive():
+        raise RuntimeError('The hdf5 writer process died.')
+
+
+def _write_images(image_queue,
+                  result_queue,
+                  chunk_size,
+                  manifest_path=None,
+                  pyramid_sizes=()):
+  """Target of the writer process of ConversionScheduler.
+
+  Consumes (output_path, class_label, item) tuples from image_queue until it
+  gets None. The item of the first tuple of a class is the source digest of
+  the class, which (re)creates its dataset, then come its encoded images, and
+  finally _END_OF_CLASS, after which the class is recorded as complete in the
+  manifest. Each hdf5 file is only opened by this process.
+
+  Args:
+    image_queue: a multiprocessing.Queue of images to write.
+    result_queue: a multiprocessing.Queue where the dict mapping each class
+      label to its number of written images is put when done.
+    chunk_size: the number of images per bulk write.
+    manifest_path: optional path to the ConversionManifest to update.
+    pyramid_sizes: the sizes of the pyramid levels written along with each
+      image, see HDF5Writer.
+  """
+  manifest = ConversionManifest(manifest_path) if manifest_path else None
+  writers = {}
+  counts = {}
+  source_digests = {}
+  try:
+    while True:
+      item = image_queue.get()
+      if item is None:
+        break
+      output_path, class_label, image = item
+      if output_path not in writers:
+        writers[output_path] = HDF5Writer(output_path, chunk_size,
+                                          pyramid_sizes)
+      writer = writers[output_path]
+      if isinstance(image, str):
+        if image == _END_OF_CLASS:
+          writer.finish_class(class_label)
+          if manifest is not None:
+            manifest.set_complete(output_path, class_label,
+                                  source_digests[class_label],
+                                  counts[class_label],
+                                  writer.checksum(class_label))
+        else:
+          writer.add_class(class_label, overwrite=True)
+          source_digests[class_label] = image
+          counts[class_label] = 0
+      else:
+        writer.write(class_label, image)
+        counts[class_label] += 1
+  finally:
+    for writer in writers.values():
+      writer.close()
+  result_queue.put(counts)
+
+
+class ConversionScheduler(object):
+  """Converts the images of all the classes of a dataset in a single pass.
+
+  Classes are first registered with add_image_files or add_directory, and then
+  converted together by run(). A single pool of processes, alive for the whole
+  conversion, loads and encodes the images of all classes, so that small
+  classes do not leave workers idle and the pool is only started once. The
+  encoded images are sent, in order, to a dedicated writer process that owns
+  the hdf5 files and writes them through HDF5Writers. Both the images submitted
+  to the pool and the ones queued for the writer are bounded by
+  max_pending_images, so a slow writer stalls the encoders instead of letting
+  encoded images accumulate in memory.
+
+  If a manifest_path is given, every class is recorded in a ConversionManifest
+  as soon as it is completely written. Classes that the manifest records as
+  converted from the same inputs are skipped, so an interrupted conversion can
+  be resumed, and a dataset with added or changed classes only has those
+  classes converted. Classes left partially written are converted again.
+  """
+
+  def __init__(self,
+               n_jobs=NUM_WORKERS,
+               chunk_size=WRITE_CHUNK_SIZE,
+               max_pending_images=4 * WRITE_CHUNK_SIZE,
+               manifest_path=None):
+    """Initialize a ConversionScheduler.
+
+    Args:
+      n_jobs: the number of processes loading and encoding images.
+      chunk_size: the number of images per bulk write.
+      max_pending_images: the maximum number of images being loaded and
+        encoded, or waiting to be consumed from the pool, and also the
+        maximum number of encoded images waiting to be written, which bounds
+        the memory used by the conversion.
+      manifest_path: optional path to the ConversionManifest of the dataset.
+    """
+    self.n_jobs = n_jobs
+    self.chunk_size = chunk_size
+    self.max_pending_images = max_pending_images
+    self.manifest_path = manifest_path
+    self.conversions = []
+    # The largest number of images in flight in the pool during the last run.
+    self.max_in_flight = 0
+
+  def add_image_files(self,
+                      class_files,
+                      class_label,
+                      output_path,
+                      invert_img=False,
+                      bboxes=None,
+                      output_format=None,
+                      skip_on_error=False):
+    """Registers the images of a class, see write_hdf5_from_image_files.
+
+    Returns:
+      The number of images registered for the class.
+    """
+    if output_format is None:
+      output_format = FLAGS.image_codec
+    if bboxes is None:
+      bboxes = [None] * len(class_files)
+    # The bboxes are read both by get_source_digest and by the workers, so
+    # iterators are made into tuples.
+    bboxes = [bbox if bbox is None else tuple(bbox) for bbox in bboxes]
+    self.conversions.append(
+      ClassConversion(output_path, class_label, list(class_files), bboxes,
+                      invert_img, output_format, skip_on_error))
+    return len(class_files)
+
+  def add_directory(self,
+                    class_directory,
+                    class_label,
+                    output_path,
+                    invert_img=False,
+                    files_to_skip=None,
+                    skip_on_error=False):
+    """Registers the images of a class, see write_hdf5_from_directory.
+
+    Returns:
+      The number of images registered for the class.
+    """
+    class_files = list_class_directory(class_directory, files_to_skip)
+    return self.add_image_files(
+      class_files,
+      class_label,
+      output_path,
+      invert_img,
+      skip_on_error=skip_on_error)
+
+  def run(self):
+    """Converts all the registered classes that are not already converted.
+
+    Returns:
+      A dict mapping each class label to the number of its images written.
+
+    Raises:
+      RuntimeError: if the writer process fails.
+    """
+    ready_to_load_size = FLAGS.save_ready_to_load
+    pyramid_sizes = hdf5_format.parse_pyramid_sizes(FLAGS.pyramid_sizes)
+    counts = {}
+    pending = []
+    if self.manifest_path:
+      manifest = ConversionManifest(self.manifest_path)
+      for c in self.conversions:
+        source_digest = c.get_source_digest(ready_to_load_size, pyramid_sizes)
+        if manifest.is_complete(c.output_path, c.class_label, source_digest):
+          counts[c.class_label] = manifest.get_num_images(
+            c.output_path, c.class_label)
+        else:
+          pending.append((c, source_digest))
+      logging.info('%d classes are already converted, converting %d classes.',
+                   len(counts), len(pending))
+    else:
+      pending = [(c, '') for c in self.conversions]
+    if pending:
+      counts.update(self._convert(pending, ready_to_load_size, pyramid_sizes))
+
+    for c in self.conversions:
+      if not c.skip_on_error:
+        assert counts[c.class_label] == len(c.class_files)
+    return counts
+
+  def _convert(self, pending, ready_to_load_size, pyramid_sizes=()):
+    """Converts the classes in pending, a list of (conversion, digest) pairs."""
+    image_queue = multiprocessing.Queue(self.max_pending_images)
+    result_queue = multiprocessing.Queue()
+    writer = multiprocessing.Process(
+      target=_write_images,
+      args=(image_queue, result_queue, self.chunk_size, self.manifest_path,
+            pyramid_sizes))
+    writer.start()
+    pool = multiprocessing.Pool(self.n_jobs)
+    # Without it, the pool would encode images as fast as it can, however slow
+    # the writer is. It must allow at least a chunk of tasks, which the pool
+    # only submits once complete.
+    chunksize = 8
+    throttle = _Throttle(max(self.max_pending_images, chunksize))
+    start_time = time.time()
+    try:
+      args = ((path, bbox, c.invert_img, c.output_format, ready_to_load_size,
+               c.skip_on_error, pyramid_sizes)
+              for c, _ in pending
+              for path, bbox in zip(c.class_files, c.bboxes))
+      images = pool.imap(_process_image, throttle.wrap(args),
+                         chunksize=chunksize)
+      num_images = sum(len(c.class_files) for c, _ in pending)
+      with tqdm(total=num_images, unit='img') as pbar:
+        for c, source_digest in pending:
+          _put(image_queue, (c.output_path, c.class_label, source_digest),
+               writer)
+          for _ in c.class_files:
+            image = next(images)
+            throttle.done()
+            pbar.update(1)
+            if image is None:
+              continue
+            _put(image_queue, (c.output_path, c.class_label, image), writer)
+          _put(image_queue, (c.output_path, c.class_label, _END_OF_CLASS),
+               writer)
+      pool.close()
+      _put(image_queue, None, writer)
+      counts = None
+      while counts is None:
+        try:
+          counts = result_queue.get(timeout=1)
+        except queue.Empty:
+          if not writer.is_alive():
+            raise RuntimeError('The hdf5 writer process died.')
+      writer.join()
+    finally:
+      throttle.stop()
+      pool.terminate()
+      if writer.is_alive():
+        writer.terminate()
+      self.max_in_flight = throttle.max_in_flight
+
+    elapsed = time.time() - start_time
+    num_written = sum(counts.values())
+    logging.info('Wrote %d images in %.1f s (%.1f images/sec).', num_written,
+                 elapsed, num_written / max(elapsed, 1e-6))
+    return counts
+
+
 class DatasetConverter(object):
   """Converts a dataset to the format required to integrate it in the benchmark.
 
@@ -428,6 +1241,10 @@ class DatasetConverter(object):
     # Where to write the DatasetSpecification instance.
     self.dataset_spec_path = os.path.join(self.records_path, 'dataset_spec.pkl')
 
+    # Where to record the classes already converted, to resume interrupted
+    # conversions.
+    self.manifest_path = os.path.join(self.records_path, MANIFEST_FILENAME)
+
     self.split_file = split_file
     if self.split_file is None:
       self.split_file = os.path.join(FLAGS.splits_root,
@@ -518,13 +1335,18 @@ class DatasetConverter(object):
 
     Wrapper for self.create_dataset_specification_and_records() which does most
     of the work. This method additionally handles writing the finalized
-    DatasetSpecification to the designated location.
+    DatasetSpecification to the designated location, and the records index
+    next to it.
     """
     self.create_dataset_specification_and_records()
 
     # Write the DatasetSpecification to the designated location.
     self.write_data_spec_pkl()
 
+    # Index the records, so that readers do not need to open them to count
+    # their images.
+    records_index.RecordsIndex.build(self.dataset_spec, NUM_WORKERS).save()
+
   def create_dataset_specification_and_records(self):
     """Creates a DatasetSpecification and records for the dataset.
 
@@ -692,7 +1514,8 @@ class OmniglotConverter(DatasetConverter):
 
         # Create and write the hdf5 of the examples of this class.
         write_hdf5_from_directory(
-          class_path, class_label, class_records_path, invert_img=True)
+          class_path, class_label, class_records_path, invert_img=True,
+          manifest_path=self.manifest_path)
 
         # Add this character to the count of subclasses of this superclass.
         superclass_label = len(self.superclass_names)
@@ -794,8 +1617,9 @@ class QuickdrawConverter(DatasetConverter):
       class_path = os.path.join(self.data_root, class_npy_fname)
 
       # Create and write the hdf5 of the examples of this class.
-      num_imgs = write_hdf5_from_npy_single_channel(class_path, class_label,
-                                                    class_records_path)
+      num_imgs = write_hdf5_from_npy_single_channel(
+        class_path, class_label, class_records_path,
+        manifest_path=self.manifest_path)
       self.images_per_class[class_label] = num_imgs
 
   def create_dataset_specification_and_records(self):
@@ -878,16 +1702,16 @@ class CUBirdsConverter(DatasetConverter):
 
     image_root_folder = os.path.join(self.data_root, 'images')
     all_classes = np.concatenate([train_classes, valid_classes, test_classes])
+    scheduler = ConversionScheduler(manifest_path=self.manifest_path)
     for class_id, class_label in enumerate(all_classes):
       logging.info('Creating hdf5 for class ID %d...', class_id)
       class_records_path = os.path.join(
         self.records_path, self.dataset_spec.file_pattern.format(self.name))
       self.class_names[class_id] = class_label
       class_directory = os.path.join(image_root_folder, class_label)
-      self.images_per_class[class_id] = len(
-        os.listdir(class_directory))
-      write_hdf5_from_directory(class_directory, class_id,
-                                class_records_path)
+      self.images_per_class[class_id] = scheduler.add_directory(
+        class_directory, class_id, class_records_path)
+    scheduler.run()
     self.write_data_spec_pkl()
 
 
@@ -945,6 +1769,7 @@ class VGGFlowerConverter(DatasetConverter):
     #     [num_train_classes, num_train_classes + num_validation_classes), and
     #   - test class IDs lie in
     #     [num_train_classes + num_validation_classes, num_classes).
+    scheduler = ConversionScheduler(manifest_path=self.manifest_path)
     for class_id, class_label in enumerate(all_classes):
       logging.info('Creating hdf5 for class ID %d...', class_id)
       class_paths = filepaths[class_label]
@@ -953,9 +1778,10 @@ class VGGFlowerConverter(DatasetConverter):
       self.class_names[class_id] = class_label
       self.images_per_class[class_id] = len(class_paths)
 
-      # Create and write the hdf5 of the examples of this class.
-      write_hdf5_from_image_files(class_paths, class_id, class_records_path)
+      # Schedule the hdf5 writing of the examples of this class.
+      scheduler.add_image_files(class_paths, class_id, class_records_path)
 
+    scheduler.run()
     self.write_data_spec_pkl()
 
 
@@ -1002,6 +1828,7 @@ class DTDConverter(DatasetConverter):
     class_names = sorted(
       os.listdir(os.path.join(self.data_root, 'images')))
 
+    scheduler = ConversionScheduler(manifest_path=self.manifest_path)
     for class_id, class_label in enumerate(all_classes):
       logging.info('Creating hdf5 for class ID %d...', class_id)
       class_name = class_names[class_label]
@@ -1013,12 +1840,13 @@ class DTDConverter(DatasetConverter):
       files_to_skip = set()
       if class_name == 'waffled':
         files_to_skip.add('.directory')
-      self.images_per_class[class_id] = write_hdf5_from_directory(
+      self.images_per_class[class_id] = scheduler.add_directory(
         class_directory,
         class_id,
         class_records_path,
         files_to_skip=files_to_skip)
 
+    scheduler.run()
     self.write_data_spec_pkl()
 
 
@@ -1077,7 +1905,7 @@ class AircraftConverter(DatasetConverter):
         line.split('\n')[0].split(' ') for line in f.readlines()
       ]
       names_to_bboxes = dict(
-        (name, map(int, (xmin, ymin, xmax, ymax)))
+        (name, tuple(map(int, (xmin, ymin, xmax, ymax))))
         for name, xmin, ymin, xmax, ymax in names_to_bboxes)
 
     # Retrieve mapping from filename to variant
@@ -1111,6 +1939,7 @@ class AircraftConverter(DatasetConverter):
     class_names = sorted(variants_to_names.keys())
     assert len(class_names) == len(all_classes)
 
+    scheduler = ConversionScheduler(manifest_path=self.manifest_path)
     for class_id, class_label in enumerate(all_classes):
       logging.info('Creating hdf5 for class ID %d...', class_id)
       class_name = class_names[class_label]
@@ -1128,9 +1957,10 @@ class AircraftConverter(DatasetConverter):
       self.class_names[class_id] = class_name
       self.images_per_class[class_id] = len(class_files)
 
-      write_hdf5_from_image_files(
+      scheduler.add_image_files(
         class_files, class_id, class_records_path, bboxes=bboxes)
 
+    scheduler.run()
     self.write_data_spec_pkl()
 
 
@@ -1173,6 +2003,7 @@ class TrafficSignConverter(DatasetConverter):
     self.classes_per_split[learning_spec.Split.VALID] = len(valid_classes)
     self.classes_per_split[learning_spec.Split.TEST] = len(test_classes)
 
+    scheduler = ConversionScheduler(manifest_path=self.manifest_path)
     for class_id in test_classes:
       logging.info('Creating hdf5 for class ID %d...', class_id)
       # The raw dataset file uncompresses to `GTSRB/Final_Training/Images/`.
@@ -1185,12 +2016,13 @@ class TrafficSignConverter(DatasetConverter):
         self.records_path, self.dataset_spec.file_pattern.format(self.name))
       self.class_names[class_id] = class_id
       # We skip `GT-?????.csv` files, which contain addditional annotations.
-      self.images_per_class[class_id] = write_hdf5_from_directory(
+      self.images_per_class[class_id] = scheduler.add_directory(
         class_directory,
         class_id,
         class_records_path,
         files_to_skip=set(['GT-{:05d}.csv'.format(class_id)]))
 
+    scheduler.run()
     self.write_data_spec_pkl()
 
 
@@ -1222,6 +2054,7 @@ class MSCOCOConverter(DatasetConverter):
     annotation_path = os.path.join(data_root, annotation_json_name)
     if not os.path.exists(annotation_path):
       raise ValueError('Annotation file %s does not exist' % annotation_path)
+    self.annotation_path = annotation_path
     with open(annotation_path, 'r') as json_file:
       annotations = json.load(json_file)
       instance_annotations = annotations['annotations']
@@ -1240,8 +2073,8 @@ class MSCOCOConverter(DatasetConverter):
       raise ValueError('Box scale ratio must be greater or equal to 1.0.')
     self.box_scale_ratio = box_scale_ratio
 
-    super(MSCOCOConverter, self).__init__(name, data_root, records_path,
-                                          split_file)
+    super(MSCOCOConverter, self).__init__(
+      name, data_root, records_path=records_path, split_file=split_file)
 
   def create_splits(self):
     """Create splits for MSCOCO and store them in the default path.
@@ -1275,7 +2108,13 @@ class MSCOCOConverter(DatasetConverter):
     return splits
 
   def create_dataset_specification_and_records(self):
-    """Implements DatasetConverter.create_dataset_specification_and_records."""
+    """Implements DatasetConverter.create_dataset_specification_and_records.
+
+    The crops of an image are of several classes, so the classes are converted
+    together. They are recorded in the manifest once all are written, and all
+    converted again unless they are all recorded as converted from the same
+    annotations and options.
+    """
     splits = self.get_splits()
     self.classes_per_split[learning_spec.Split.TRAIN] = len(splits['train'])
     self.classes_per_split[learning_spec.Split.VALID] = len(splits['valid'])
@@ -1292,74 +2131,113 @@ class MSCOCOConverter(DatasetConverter):
       coco_name = category['name']
       self.class_names[coco_id_to_class_id[coco_id]] = coco_name
 
-    def get_image_crop_and_class_id(annotation):
-      """Gets image crop and its class label."""
-      image_id = annotation['image_id']
-      image_path = os.path.join(self.image_dir, '%012d.jpg' % image_id)
-      # The bounding box is represented as (x_topleft, y_topleft, width, height)
-      bbox = annotation['bbox']
-      coco_class_id = annotation['category_id']
-      image = cv2.imread(image_path, cv2.IMREAD_COLOR)
-      image_w, image_h = image.shape[:2]
-
-      def scale_box(bbox, scale_ratio):
-        x, y, w, h = bbox
-        x = x - 0.5 * w * (scale_ratio - 1.0)
-        y = y - 0.5 * h * (scale_ratio - 1.0)
-        w = w * scale_ratio
-        h = h * scale_ratio
-        return [x, y, w, h]
-
-      x, y, w, h = scale_box(bbox, self.box_scale_ratio)
-      # Convert half-integer to full-integer representation.
-      # The Python Imaging Library uses a Cartesian pixel coordinate system,
-      # with (0,0) in the upper left corner. Note that the coordinates refer
-      # to the implied pixel corners; the centre of a pixel addressed as
-      # (0, 0) actually lies at (0.5, 0.5). Since COCO uses the later
-      # convention and we use PIL to crop the image, we need to convert from
-      # half-integer to full-integer representation.
-      xmin = max(int(round(x - 0.5)), 0)
-      ymin = max(int(round(y - 0.5)), 0)
-      xmax = min(int(round(x + w - 0.5)) + 1, image_w)
-      ymax = min(int(round(y + h - 0.5)) + 1, image_h)
-      image_crop = image[ymin:ymax, xmin:xmax, ...]
-      crop_width, crop_height = image_crop.shape[:2]
-      if crop_width <= 0 or crop_height <= 0:
-        raise ValueError('crops are not valid.')
-      if FLAGS.save_ready_to_load > 0:
-        size = FLAGS.save_ready_to_load
-        aligned_size = int(np.ceil(size / 32.0)) * 32 + 1
-        image_crop = cv2.resize(image_crop, (aligned_size, aligned_size), interpolation=cv2.INTER_CUBIC)
-      class_id = coco_id_to_class_id[coco_class_id]
-      image_crop = cv2.imencode(".jpg", image_crop)[1].ravel()
-      return image_crop, class_id
-
+    pyramid_sizes = hdf5_format.parse_pyramid_sizes(FLAGS.pyramid_sizes)
     output_path = os.path.join(self.records_path,
                                self.dataset_spec.file_pattern.format(self.dataset_spec.name))
-    fp = h5py.File(output_path, 'a')
-    dt = h5py.special_dtype(vlen=np.uint8)
-    for i, annotation in enumerate(self.coco_instance_annotations):
-      try:
-        image_crop, class_id = get_image_crop_and_class_id(annotation)
-      except IOError:
-        logging.warning('Image can not be opened and will be skipped.')
-        continue
-      except ValueError:
-        logging.warning('Image can not be cropped and will be skipped.')
-        continue
+    manifest = ConversionManifest(self.manifest_path)
+    source_digest = get_file_digest(self.annotation_path, self.image_dir,
+                                    self.box_scale_ratio, FLAGS.image_codec,
+                                    FLAGS.save_ready_to_load, pyramid_sizes)
+    class_ids = range(len(shuffled_coco_id))
+    if all(manifest.is_complete(output_path, class_id, source_digest)
+           for class_id in class_ids):
+      logging.info('All the classes of %s are already converted.', self.name)
+      for class_id in class_ids:
+        self.images_per_class[class_id] = manifest.get_num_images(output_path,
+                                                                  class_id)
+      self.write_data_spec_pkl()
+      return
+
+    # Group the annotations by image, so that each image is decoded only once.
+    image_annotations = collections.OrderedDict()
+    for annotation in self.coco_instance_annotations:
+      image_annotations.setdefault(annotation['image_id'], []).append(
+        (annotation['bbox'], coco_id_to_class_id[annotation['category_id']]))
+    args = ((os.path.join(self.image_dir, '%012d.jpg' % image_id), boxes,
+             self.box_scale_ratio, FLAGS.save_ready_to_load, pyramid_sizes,
+             FLAGS.image_codec)
+            for image_id, boxes in image_annotations.items())
+
+    with HDF5Writer(output_path, pyramid_sizes=pyramid_sizes) as writer, tqdm(
+        total=len(image_annotations)) as pbar:
+      # Datasets left by an interrupted conversion are replaced, and classes
+      # without crops get an empty dataset.
+      for class_id in class_ids:
+        writer.add_class(class_id, overwrite=True)
+      for crops in _parallel_imap(_get_mscoco_image_crops, args):
+        pbar.update(1)
+        for image_crop, class_id in crops:
+          writer.write(class_id, image_crop)
+          self.images_per_class[class_id] += 1
+      for class_id in class_ids:
+        writer.finish_class(class_id)
+        manifest.set_complete(output_path, class_id, source_digest,
+                              self.images_per_class[class_id],
+                              writer.checksum(class_id))
 
-      if str(class_id) not in fp.keys():
-        fp.create_dataset(str(class_id), dtype=dt, shape=(0,), maxshape=(None,))
+    self.write_data_spec_pkl()
 
-      logging.info('writing image %d/%d', i,
-                   len(self.coco_instance_annotations))
 
-      fp[str(class_id)].resize(self.images_per_class[class_id] + 1, 0)
-      fp[str(class_id)][self.images_per_class[class_id]] = image_crop
-      self.images_per_class[class_id] += 1
+def _get_mscoco_image_crops(image_path, boxes, box_scale_ratio,
+                            ready_to_load_size=0, pyramid_sizes=(),
+                            output_format=image_codecs.DEFAULT_CODEC):
+  """Gets the crops of all the annotated boxes of a MSCOCO image.
 
-    fp.close()
-    self.write_data_spec_pkl()
+  Args:
+    image_path: the path to the image.
+    boxes: a list of (bbox, class_id) tuples, where bbox is represented as
+      (x_topleft, y_topleft, width, height).
+    box_scale_ratio: the ratio by which the boxes are enlarged.
+    ready_to_load_size: if positive, crops are resized as done with the
+      save_ready_to_load flag.
+    pyramid_sizes: the sizes of the pyramid levels to encode along with each
+      crop.
+    output_format: the codec spec of the crops, see image_codecs.get_codec.
+
+  Returns:
+    A list of (image_crop, class_id) tuples, with each image_crop encoded as
+    done by encode_image.
+    Boxes that can not be cropped are skipped, and so is the whole image if it
+    can not be opened.
+  """
+  image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+  if image is None:
+    logging.warning('Image can not be opened and will be skipped.')
+    return []
+  image_w, image_h = image.shape[:2]
+
+  def scale_box(bbox, scale_ratio):
+    x, y, w, h = bbox
+    x = x - 0.5 * w * (scale_ratio - 1.0)
+    y = y - 0.5 * h * (scale_ratio - 1.0)
+    w = w * scale_ratio
+    h = h * scale_ratio
+    return [x, y, w, h]
+
+  crops = []
+  for bbox, class_id in boxes:
+    x, y, w, h = scale_box(bbox, box_scale_ratio)
+    # Convert half-integer to full-integer representation.
+    # The Python Imaging Library uses a Cartesian pixel coordinate system,
+    # with (0,0) in the upper left corner. Note that the coordinates refer
+    # to the implied pixel corners; the centre of a pixel addressed as
+    # (0, 0) actually lies at (0.5, 0.5). Since COCO uses the later
+    # convention and we use PIL to crop the image, we need to convert from
+    # half-integer to full-integer representation.
+    xmin = max(int(round(x - 0.5)), 0)
+    ymin = max(int(round(y - 0.5)), 0)
+    xmax = min(int(round(x + w - 0.5)) + 1, image_w)
+    ymax = min(int(round(y + h - 0.5)) + 1, image_h)
+    image_crop = image[ymin:ymax, xmin:xmax, ...]
+    crop_width, crop_height = image_crop.shape[:2]
+    if crop_width <= 0 or crop_height <= 0:
+      logging.warning('Image can not be cropped and will be skipped.')
+      continue
+    if ready_to_load_size > 0:
+      image_crop = resize_ready_to_load(image_crop, ready_to_load_size)
+    crops.append((encode_image(image_crop, output_format, pyramid_sizes),
+                  class_id))
+  return crops
 
 
 class ImageNetConverter(DatasetConverter):
@@ -1440,10 +2318,17 @@ class ImageNetConverter(DatasetConverter):
 
     # It is expected that within self.data_root there is a directory
     # for every ILSVRC 2012 synset, named by that synset's WordNet ID
-    # (e.g. n15075141) and containing all images of that synset.
-    set_of_directories = set(
-      entry for entry in os.listdir(self.data_root)
-      if os.path.isdir(os.path.join(self.data_root, entry)))
+    # (e.g. n15075141) and containing all images of that synset. Alternatively,
+    # the images are read without extraction from the training archive, which
+    # holds a tar per synset.
+    tar_path = FLAGS.ilsvrc_2012_train_tar
+    if tar_path:
+      tar_index = imagenet_specification.get_ilsvrc_2012_tar_index(tar_path)
+      set_of_directories = set(tar_index)
+    else:
+      set_of_directories = set(
+        entry for entry in os.listdir(self.data_root)
+        if os.path.isdir(os.path.join(self.data_root, entry)))
     assert set_of_directories == set(all_synset_ids), (
       'self.data_root should contain a directory whose name is the WordNet '
       "id of each synset that is a leaf of any split's subgraph.")
@@ -1451,21 +2336,33 @@ class ImageNetConverter(DatasetConverter):
     # By construction of all_synset_ids, we are guaranteed to get train synsets
     # before validation synsets, and validation synsets before test synsets.
     # Therefore the assigned class_labels will respect that partial order.
+    scheduler = ConversionScheduler(manifest_path=self.manifest_path)
     for class_label, synset_id in enumerate(all_synset_ids):
       self.class_names[class_label] = synset_id
       class_path = os.path.join(self.data_root, synset_id)
       class_records_path = os.path.join(
         self.records_path, self.dataset_spec.file_pattern.format(self.dataset_spec.name))
 
-      # Create and write the hdf5 of the examples of this class.
+      # Schedule the hdf5 writing of the examples of this class.
       # Image files for ImageNet do not necessarily come from a canonical
       # source, so pass 'skip_on_error' to be more resilient and avoid crashes
-      num_images = write_hdf5_from_directory(
-        class_path,
-        class_label,
-        class_records_path,
-        files_to_skip=self.files_to_skip,
-        skip_on_error=True)
+      if tar_path:
+        class_images = [
+          ArchivedImage(tar_path, offset, size)
+          for file_name, offset, size in tar_index[synset_id]
+          if file_name not in self.files_to_skip
+        ]
+        scheduler.add_image_files(
+          class_images, class_label, class_records_path, skip_on_error=True)
+      else:
+        scheduler.add_directory(
+          class_path,
+          class_label,
+          class_records_path,
+          files_to_skip=self.files_to_skip,
+          skip_on_error=True)
+
+    scheduler.run()
 
 
 class FungiConverter(DatasetConverter):
@@ -1560,6 +2457,7 @@ class FungiConverter(DatasetConverter):
     #     [num_train_classes, num_train_classes + num_validation_classes), and
     #   - test class IDs lie in
     #     [num_train_classes + num_validation_classes, num_classes).
+    scheduler = ConversionScheduler(manifest_path=self.manifest_path)
     for class_id, class_label in enumerate(all_classes):
       logging.info('Creating hdf5 for class ID %d...' % class_id)
       class_paths = class_filepaths[class_label]
@@ -1568,9 +2466,10 @@ class FungiConverter(DatasetConverter):
       self.class_names[class_id] = class_label
       self.images_per_class[class_id] = len(class_paths)
 
-      # Create and write the hdf5 of the examples of this class
-      write_hdf5_from_image_files(class_paths, class_id, class_records_path)
+      # Schedule the hdf5 writing of the examples of this class
+      scheduler.add_image_files(class_paths, class_id, class_records_path)
 
+    scheduler.run()
     self.write_data_spec_pkl()
 
 
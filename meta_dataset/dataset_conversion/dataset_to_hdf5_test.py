@@ -0,0 +1,518 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for `dataset_to_hdf5` module."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import multiprocessing
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import unittest
+
+import cv2
+import h5py
+from meta_dataset.data import hdf5_format
+from meta_dataset.data import image_codecs
+from meta_dataset.data import imagenet_specification
+from meta_dataset.dataset_conversion import dataset_to_hdf5
+from meta_dataset.utils.argparse import argparse
+import numpy as np
+
+argparse.parser.parse_args()
+
+
+def make_images(num_images, size=4):
+  """Returns distinct encoded images, uint8 arrays of equal sizes."""
+  return [np.full(size, i, dtype=np.uint8) for i in range(num_images)]
+
+
+def read_images(path, class_label, level=None):
+  with h5py.File(path, 'r') as f:
+    return [np.array(im) for im in
+            f[hdf5_format.get_dataset_name(class_label, level)]]
+
+
+class HDF5WriterTest(unittest.TestCase):
+
+  def setUp(self):
+    super(HDF5WriterTest, self).setUp()
+    self.tmp_dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.tmp_dir, 'test.h5')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+    super(HDF5WriterTest, self).tearDown()
+
+  def test_growth_and_trim(self):
+    images = make_images(5)
+    with dataset_to_hdf5.HDF5Writer(self.path, chunk_size=2) as writer:
+      writer.write_many(3, images)
+      self.assertEqual(writer.num_images(3), 5)
+      writer.flush()
+      # Flushing 2, 4 and then 5 images doubles the capacity from 4 to 8.
+      dataset = writer._datasets[hdf5_format.get_dataset_name(3)]
+      self.assertEqual(dataset.shape, (8,))
+    written = read_images(self.path, 3)
+    # The datasets are trimmed to their images when the writer is closed, and
+    # images of equal sizes are not merged into a 2D array.
+    self.assertEqual(len(written), 5)
+    for image, expected in zip(written, images):
+      np.testing.assert_array_equal(image, expected)
+
+  def test_finish_class(self):
+    with dataset_to_hdf5.HDF5Writer(self.path, chunk_size=4) as writer:
+      writer.write_many(0, make_images(5))
+      writer.finish_class(0)
+      self.assertEqual(len(read_images(self.path, 0)), 5)
+      writer.write_many(1, make_images(2))
+
+  def test_pyramid_levels(self):
+    images = [[np.full(4, i, dtype=np.uint8), np.full(2, i, dtype=np.uint8)]
+              for i in range(3)]
+    with dataset_to_hdf5.HDF5Writer(self.path, chunk_size=2,
+                                    pyramid_sizes=(84,)) as writer:
+      writer.write_many(0, images)
+    self.assertEqual([im.tolist() for im in read_images(self.path, 0, 84)],
+                     [[i, i] for i in range(3)])
+    self.assertEqual(len(read_images(self.path, 0)), 3)
+
+  def test_image_sizes(self):
+    images = [np.zeros(i + 1, np.uint8) for i in range(5)]
+    with dataset_to_hdf5.HDF5Writer(self.path, chunk_size=2) as writer:
+      writer.write_many(0, images)
+      writer.finish_class(0)
+      writer.write_many(1, images[:2])
+    with h5py.File(self.path, 'r') as f:
+      np.testing.assert_array_equal(
+          f[hdf5_format.get_image_sizes_name(0)], [1, 2, 3, 4, 5])
+      # Classes not finished get their sizes when the writer is closed.
+      np.testing.assert_array_equal(
+          f[hdf5_format.get_image_sizes_name(1)], [1, 2])
+
+  def test_overwrite(self):
+    with dataset_to_hdf5.HDF5Writer(self.path) as writer:
+      writer.write_many(0, make_images(3))
+    with dataset_to_hdf5.HDF5Writer(self.path) as writer:
+      with self.assertRaises(ValueError):
+        writer.add_class(0)
+      writer.add_class(0, overwrite=True)
+      writer.write_many(0, make_images(2))
+    self.assertEqual(len(read_images(self.path, 0)), 2)
+
+
+def write_image(path, color, size=16):
+  """Writes a square png image of a single color, whatever the extension."""
+  image = np.full((size, size, 3), color, dtype=np.uint8)
+  with open(path, 'wb') as f:
+    f.write(cv2.imencode('.png', image)[1].tobytes())
+
+
+def make_mscoco(root, images):
+  """Writes a toy MSCOCO of 80 categories with images of a single color.
+
+  Args:
+    root: the data root.
+    images: a list of (color, category ids of the boxes) of each image.
+  """
+  os.makedirs(os.path.join(root, 'train2017'))
+  annotations = []
+  for image_id, (color, category_ids) in enumerate(images):
+    write_image(os.path.join(root, 'train2017', '%012d.jpg' % image_id), color)
+    for i, category_id in enumerate(category_ids):
+      annotations.append(dict(image_id=image_id, category_id=category_id,
+                              bbox=[i, i, 8, 8]))
+  with open(os.path.join(root, 'instances_train2017.json'), 'w') as f:
+    json.dump(dict(annotations=annotations,
+                   categories=[dict(id=i, name='c%d' % i)
+                               for i in range(80)]), f)
+
+
+class MSCOCOTest(unittest.TestCase):
+
+  def setUp(self):
+    super(MSCOCOTest, self).setUp()
+    self.tmp_dir = tempfile.mkdtemp()
+    self.image_codec = argparse.FLAGS.image_codec
+    argparse.FLAGS.image_codec = 'png'
+
+  def tearDown(self):
+    argparse.FLAGS.image_codec = self.image_codec
+    shutil.rmtree(self.tmp_dir)
+    super(MSCOCOTest, self).tearDown()
+
+  def test_image_crops(self):
+    path = os.path.join(self.tmp_dir, 'image.jpg')
+    write_image(path, 7)
+    crops = dataset_to_hdf5._get_mscoco_image_crops(
+        path, [([2, 2, 4, 4], 5), ([20, 20, 4, 4], 6), ([0, 0, 8, 8], 3)],
+        1.0, output_format='png')
+    # The box outside of the image is skipped.
+    self.assertEqual([class_id for _, class_id in crops], [5, 3])
+    crop = image_codecs.decode(crops[0][0])
+    self.assertEqual(crop.shape, (5, 5, 3))
+    self.assertTrue((crop == 7).all())
+
+  def test_crops_grouped_per_image(self):
+    root = os.path.join(self.tmp_dir, 'mscoco')
+    make_mscoco(root, [(10, [0, 1, 0]), (20, [1]), (30, [2, 0])])
+    converter = dataset_to_hdf5.MSCOCOConverter(
+        'mscoco', root, records_path=os.path.join(self.tmp_dir, 'records'),
+        split_file=os.path.join(self.tmp_dir, 'mscoco_splits.pkl'))
+    converter.create_dataset_specification_and_records()
+    class_ids = dict((name, class_id)
+                     for class_id, name in converter.class_names.items())
+    path = os.path.join(converter.records_path, 'mscoco.h5')
+    colors = {}
+    for name, num_images in (('c0', 3), ('c1', 2), ('c2', 1)):
+      self.assertEqual(converter.images_per_class[class_ids[name]], num_images)
+      crops = read_images(path, class_ids[name])
+      self.assertEqual(len(crops), num_images)
+      colors[name] = [int(image_codecs.decode(c).mean()) for c in crops]
+    # The crops of each class are in the order of the images.
+    self.assertEqual(colors, dict(c0=[10, 10, 30], c1=[10, 20], c2=[30]))
+
+
+def make_class_directories(root, num_images_per_class):
+  """Writes a directory of single color images per class, returns their paths."""
+  directories = []
+  for class_id, num_images in enumerate(num_images_per_class):
+    directory = os.path.join(root, 'class_%d' % class_id)
+    os.makedirs(directory)
+    for i in range(num_images):
+      write_image(os.path.join(directory, '%02d.png' % i), 10 * class_id + i)
+    directories.append(directory)
+  return directories
+
+
+def square(x):
+  return x * x
+
+
+class ThrottleTest(unittest.TestCase):
+
+  def test_bounded_in_flight(self):
+    throttle = dataset_to_hdf5._Throttle(8)
+    pool = multiprocessing.Pool(2)
+    try:
+      results = []
+      for result in pool.imap(square, throttle.wrap(range(100)), chunksize=4):
+        self.assertLessEqual(throttle.in_flight, 8)
+        # A slow consumer, which would let the pool run far ahead.
+        time.sleep(0.002)
+        throttle.done()
+        results.append(result)
+    finally:
+      throttle.stop()
+      pool.terminate()
+    self.assertEqual(results, [x * x for x in range(100)])
+    self.assertLessEqual(throttle.max_in_flight, 8)
+
+
+class ConversionSchedulerTest(unittest.TestCase):
+
+  def setUp(self):
+    super(ConversionSchedulerTest, self).setUp()
+    self.tmp_dir = tempfile.mkdtemp()
+    self.image_codec = argparse.FLAGS.image_codec
+    argparse.FLAGS.image_codec = 'png'
+    self.directories = make_class_directories(
+        os.path.join(self.tmp_dir, 'images'), [30, 5, 12])
+    self.path = os.path.join(self.tmp_dir, 'test.h5')
+
+  def tearDown(self):
+    argparse.FLAGS.image_codec = self.image_codec
+    shutil.rmtree(self.tmp_dir)
+    super(ConversionSchedulerTest, self).tearDown()
+
+  def make_scheduler(self, **kwargs):
+    scheduler = dataset_to_hdf5.ConversionScheduler(
+        n_jobs=2, chunk_size=4, max_pending_images=8, **kwargs)
+    for class_id, directory in enumerate(self.directories):
+      scheduler.add_directory(directory, class_id, self.path)
+    return scheduler
+
+  def test_convert(self):
+    scheduler = self.make_scheduler()
+    self.assertEqual(scheduler.run(), {0: 30, 1: 5, 2: 12})
+    self.assertLessEqual(scheduler.max_in_flight, 8)
+    images = read_images(self.path, 2)
+    self.assertEqual([int(image_codecs.decode(im).mean()) for im in images],
+                     [20 + i for i in range(12)])
+
+
+
+class ResumeTest(unittest.TestCase):
+  """Conversions interrupted or run again use the ConversionManifest."""
+
+  def setUp(self):
+    super(ResumeTest, self).setUp()
+    self.tmp_dir = tempfile.mkdtemp()
+    self.image_codec = argparse.FLAGS.image_codec
+    argparse.FLAGS.image_codec = 'png'
+    self.path = os.path.join(self.tmp_dir, 'test.h5')
+    self.manifest_path = os.path.join(self.tmp_dir,
+                                      dataset_to_hdf5.MANIFEST_FILENAME)
+
+  def tearDown(self):
+    argparse.FLAGS.image_codec = self.image_codec
+    shutil.rmtree(self.tmp_dir)
+    super(ResumeTest, self).tearDown()
+
+  def interrupt(self, class_label):
+    """Leaves a partial dataset, as an interrupted conversion would."""
+    with dataset_to_hdf5.HDF5Writer(self.path) as writer:
+      writer.write_many(class_label, make_images(2))
+
+  def corrupt(self, class_label):
+    """Changes an image of a class, keeping the number of images."""
+    with h5py.File(self.path, 'a') as f:
+      f[hdf5_format.get_dataset_name(class_label)][0] = np.zeros(3, np.uint8)
+
+  def test_directory(self):
+    directory, = make_class_directories(os.path.join(self.tmp_dir, 'images'),
+                                        [5])
+    self.interrupt(0)
+    self.assertEqual(dataset_to_hdf5.write_hdf5_from_directory(
+        directory, 0, self.path, manifest_path=self.manifest_path), 5)
+    expected = read_images(self.path, 0)
+    self.assertEqual(len(expected), 5)
+    mtime = os.stat(self.path).st_mtime_ns
+    # The class is recorded as converted, and skipped.
+    self.assertEqual(dataset_to_hdf5.write_hdf5_from_directory(
+        directory, 0, self.path, manifest_path=self.manifest_path), 5)
+    self.assertEqual(os.stat(self.path).st_mtime_ns, mtime)
+    # The checksum is only verified with the verify_manifest flag.
+    self.corrupt(0)
+    mtime = os.stat(self.path).st_mtime_ns
+    dataset_to_hdf5.write_hdf5_from_directory(
+        directory, 0, self.path, manifest_path=self.manifest_path)
+    self.assertEqual(os.stat(self.path).st_mtime_ns, mtime)
+    # A class that does not match its checksum is then converted again.
+    argparse.FLAGS.verify_manifest = True
+    try:
+      dataset_to_hdf5.write_hdf5_from_directory(
+          directory, 0, self.path, manifest_path=self.manifest_path)
+    finally:
+      argparse.FLAGS.verify_manifest = False
+    for image, expected_image in zip(read_images(self.path, 0), expected):
+      np.testing.assert_array_equal(image, expected_image)
+
+  def test_smaller_file(self):
+    directory, = make_class_directories(os.path.join(self.tmp_dir, 'images'),
+                                        [5])
+    dataset_to_hdf5.write_hdf5_from_directory(
+        directory, 0, self.path, manifest_path=self.manifest_path)
+    manifest = dataset_to_hdf5.ConversionManifest(self.manifest_path)
+    source_digest = manifest.classes[manifest.get_key(self.path, 0)][
+        'source_digest']
+    self.assertTrue(manifest.is_complete(self.path, 0, source_digest))
+    # A file smaller than the recorded one, e.g. a truncated copy, is not.
+    os.truncate(self.path, os.path.getsize(self.path) // 2)
+    self.assertFalse(manifest.is_complete(self.path, 0, source_digest))
+
+  def test_npy(self):
+    npy_path = os.path.join(self.tmp_dir, 'class.npy')
+    np.save(npy_path, np.arange(7 * 16, dtype=np.uint8).reshape(7, 16))
+    self.interrupt(3)
+    self.assertEqual(dataset_to_hdf5.write_hdf5_from_npy_single_channel(
+        npy_path, 3, self.path, manifest_path=self.manifest_path), 7)
+    expected = read_images(self.path, 3)
+    self.assertEqual(len(expected), 7)
+    mtime = os.stat(self.path).st_mtime_ns
+    self.assertEqual(dataset_to_hdf5.write_hdf5_from_npy_single_channel(
+        npy_path, 3, self.path, manifest_path=self.manifest_path), 7)
+    self.assertEqual(os.stat(self.path).st_mtime_ns, mtime)
+    # A changed .npy file is converted again.
+    np.save(npy_path, np.zeros((4, 16), dtype=np.uint8))
+    self.assertEqual(dataset_to_hdf5.write_hdf5_from_npy_single_channel(
+        npy_path, 3, self.path, manifest_path=self.manifest_path), 4)
+    self.assertEqual(len(read_images(self.path, 3)), 4)
+
+  def test_scheduler(self):
+    directories = make_class_directories(
+        os.path.join(self.tmp_dir, 'images'), [3, 4])
+    self.interrupt(1)
+
+    def run():
+      scheduler = dataset_to_hdf5.ConversionScheduler(
+          n_jobs=2, manifest_path=self.manifest_path)
+      for class_label, directory in enumerate(directories):
+        scheduler.add_directory(directory, class_label, self.path)
+      return scheduler.run()
+
+    self.assertEqual(run(), {0: 3, 1: 4})
+    mtime = os.stat(self.path).st_mtime_ns
+    self.assertEqual(run(), {0: 3, 1: 4})
+    self.assertEqual(os.stat(self.path).st_mtime_ns, mtime)
+
+  def test_bboxes(self):
+    directories = make_class_directories(
+        os.path.join(self.tmp_dir, 'images'), [3, 2])
+
+    def run():
+      scheduler = dataset_to_hdf5.ConversionScheduler(
+          n_jobs=2, manifest_path=self.manifest_path)
+      for class_label, directory in enumerate(directories):
+        class_files = dataset_to_hdf5.list_class_directory(directory)
+        # The converters may give bboxes as iterators, as AircraftConverter.
+        bboxes = [map(int, ('2', '4', '10', '8')) for _ in class_files]
+        scheduler.add_image_files(class_files, class_label, self.path,
+                                  bboxes=bboxes)
+      return scheduler.run()
+
+    self.assertEqual(run(), {0: 3, 1: 2})
+    for image in read_images(self.path, 1):
+      self.assertEqual(image_codecs.decode(image).shape[:2], (4, 8))
+    mtime = os.stat(self.path).st_mtime_ns
+    self.assertEqual(run(), {0: 3, 1: 2})
+    self.assertEqual(os.stat(self.path).st_mtime_ns, mtime)
+
+  def test_mscoco(self):
+    root = os.path.join(self.tmp_dir, 'mscoco')
+    make_mscoco(root, [(10, [0, 1]), (20, [1])])
+
+    def convert():
+      converter = dataset_to_hdf5.MSCOCOConverter(
+          'mscoco', root, records_path=os.path.join(self.tmp_dir, 'records'),
+          split_file=os.path.join(self.tmp_dir, 'mscoco_splits.pkl'))
+      converter.create_dataset_specification_and_records()
+      return converter
+
+    path = os.path.join(self.tmp_dir, 'records', 'mscoco.h5')
+    os.makedirs(os.path.dirname(path))
+    with dataset_to_hdf5.HDF5Writer(path) as writer:
+      writer.write_many(0, make_images(2))
+    images_per_class = dict(convert().images_per_class)
+    self.assertEqual(sorted(images_per_class.values()), [0] * 78 + [1, 2])
+    mtime = os.stat(path).st_mtime_ns
+    self.assertEqual(dict(convert().images_per_class), images_per_class)
+    self.assertEqual(os.stat(path).st_mtime_ns, mtime)
+
+
+
+def make_train_tar(path, synset_images):
+  """Writes a tar of one tar of png images per synset, as ILSVRC 2012's.
+
+  Args:
+    path: the path to the archive.
+    synset_images: a dict mapping each WordNet id to the colors of its images.
+  """
+  directory = os.path.dirname(path)
+  with tarfile.open(path, 'w') as archive:
+    for wn_id, colors in synset_images.items():
+      synset_path = os.path.join(directory, wn_id + '.tar')
+      with tarfile.open(synset_path, 'w') as synset_tar:
+        for i, color in enumerate(colors):
+          image_path = os.path.join(directory, '%s_%d.JPEG' % (wn_id, i))
+          write_image(image_path, color)
+          synset_tar.add(image_path, os.path.basename(image_path))
+      archive.add(synset_path, os.path.basename(synset_path))
+
+
+class ArchivedImageTest(unittest.TestCase):
+
+  def setUp(self):
+    super(ArchivedImageTest, self).setUp()
+    self.tmp_dir = tempfile.mkdtemp()
+    self.tar_path = os.path.join(self.tmp_dir, 'ILSVRC2012_img_train.tar')
+    make_train_tar(self.tar_path, dict(n01=[10, 11], n02=[20, 21, 22]))
+    self.index = imagenet_specification.get_ilsvrc_2012_tar_index(
+        self.tar_path)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp_dir)
+    super(ArchivedImageTest, self).tearDown()
+
+  def get_images(self, wn_id):
+    return [dataset_to_hdf5.ArchivedImage(self.tar_path, offset, size)
+            for _, offset, size in self.index[wn_id]]
+
+  def test_read(self):
+    self.assertEqual(list(self.index), ['n01', 'n02'])
+    self.assertEqual([name for name, _, _ in self.index['n02']],
+                     ['n02_0.JPEG', 'n02_1.JPEG', 'n02_2.JPEG'])
+    for i, image in enumerate(self.get_images('n02')):
+      with open(os.path.join(self.tmp_dir, 'n02_%d.JPEG' % i), 'rb') as f:
+        self.assertEqual(image.read().tobytes(), f.read())
+      decoded = dataset_to_hdf5.load_and_process_image(image,
+                                                       output_format=None)
+      self.assertEqual(decoded.shape, (16, 16, 3))
+      self.assertTrue((decoded == 20 + i).all())
+
+  def test_convert(self):
+    path = os.path.join(self.tmp_dir, 'test.h5')
+    scheduler = dataset_to_hdf5.ConversionScheduler(n_jobs=2)
+    for class_label, wn_id in enumerate(['n01', 'n02']):
+      scheduler.add_image_files(self.get_images(wn_id), class_label, path,
+                                output_format='png')
+    self.assertEqual(scheduler.run(), {0: 2, 1: 3})
+    self.assertEqual([int(image_codecs.decode(im).mean())
+                      for im in read_images(path, 1)], [20, 21, 22])
+
+
+
+class NpyTest(unittest.TestCase):
+  """Quickdraw-like .npy files, memory-mapped by the encoding workers."""
+
+  def setUp(self):
+    super(NpyTest, self).setUp()
+    self.tmp_dir = tempfile.mkdtemp()
+    self.npy_path = os.path.join(self.tmp_dir, 'class.npy')
+    self.image_codec = argparse.FLAGS.image_codec
+    argparse.FLAGS.image_codec = 'png'
+
+  def tearDown(self):
+    argparse.FLAGS.image_codec = self.image_codec
+    shutil.rmtree(self.tmp_dir)
+    super(NpyTest, self).tearDown()
+
+  def test_encode_slice(self):
+    images = np.random.RandomState(0).randint(0, 256, (10, 9), dtype=np.uint8)
+    np.save(self.npy_path, images)
+    encoded = dataset_to_hdf5._encode_npy_images(self.npy_path, 3, 7, 'png')
+    self.assertEqual(len(encoded), 4)
+    for image, expected in zip(encoded, images[3:7]):
+      np.testing.assert_array_equal(image_codecs.decode(image)[..., 0],
+                                    expected.reshape(3, 3))
+
+  def test_encode_bool(self):
+    np.save(self.npy_path, np.eye(4, dtype=bool).reshape(1, 16))
+    encoded, = dataset_to_hdf5._encode_npy_images(self.npy_path, 0, 1, 'png')
+    np.testing.assert_array_equal(image_codecs.decode(encoded)[..., 0],
+                                  np.eye(4, dtype=np.uint8) * 255)
+
+  def test_write_chunks(self):
+    # More images than a chunk, so that the slices of several workers are
+    # written in order.
+    num_images = dataset_to_hdf5.WRITE_CHUNK_SIZE + 5
+    images = (np.arange(num_images)[:, None] + np.zeros(16, np.int64)) % 256
+    np.save(self.npy_path, images.astype(np.uint8))
+    path = os.path.join(self.tmp_dir, 'test.h5')
+    self.assertEqual(dataset_to_hdf5.write_hdf5_from_npy_single_channel(
+        self.npy_path, 0, path), num_images)
+    written = read_images(path, 0)
+    self.assertEqual([int(image_codecs.decode(im)[0, 0, 0]) for im in written],
+                     [i % 256 for i in range(num_images)])
+
+
+if __name__ == '__main__':
+  unittest.main()
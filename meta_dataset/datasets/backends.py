@@ -1,39 +1,234 @@
-import h5py
 import numpy as np
 import os
-import torchvision.transforms as transforms_lib
 import logging
-import cv2
 from torch.multiprocessing import Queue, Process
 import queue
 import logging
 import gin
+from meta_dataset.data import hdf5_format
+from meta_dataset.data import http_records
+from meta_dataset.data import image_cache
+from meta_dataset.data import image_codecs
+from meta_dataset.data import local_cache
+from meta_dataset.data import pipeline_stats
+from meta_dataset.data import records_index
+from meta_dataset.data import tfrecord_format
+from meta_dataset.data import tracing
+from meta_dataset.data import transforms as transforms_lib
+from meta_dataset.utils.lazy_import import lazy_import
+
+# Only needed once images are read, see meta_dataset.utils.lazy_import.
+cv2 = lazy_import("cv2")
+h5py = lazy_import("h5py")
+torchvision = lazy_import("torchvision")
 
 
 def imdecode(im):
-  return cv2.imdecode(im, cv2.IMREAD_COLOR)
+  return image_codecs.decode(im)
+
+
+def get_level_decoder(level, image_size):
+  """Returns the function decoding the images read from a pyramid level.
+
+  Images read from pyramid level are resized to the size they would have been
+  stored with save_ready_to_load=image_size, which the transforms expect.
+
+  Args:
+      level: the pyramid level the images are read from, or None for the full
+          resolution images, which are not resized
+      image_size: the output image size
+
+  Returns: a torchvision Compose
+  """
+  _transforms = [torchvision.transforms.Lambda(imdecode)]
+  if level is not None:
+    size = hdf5_format.get_aligned_size(image_size)
+    if size != hdf5_format.get_aligned_size(level):
+      _transforms.append(torchvision.transforms.Lambda(
+          lambda im: cv2.resize(im, (size, size), interpolation=cv2.INTER_CUBIC)))
+  return torchvision.transforms.Compose(_transforms)
+
+
+def get_level_transforms(transforms, level, image_size):
+  """Composes decoding, resizing from a pyramid level and transforms.
+
+  Args:
+      transforms: the transforms applied to the decoded images
+      level: the pyramid level the images are read from, see get_level_decoder
+      image_size: the output image size
+
+  Returns: a torchvision Compose
+  """
+  return torchvision.transforms.Compose([get_level_decoder(level, image_size), transforms])
 
 @gin.configurable()
 def Backend(*args, type="random_access", **kwargs):
+  dataset_spec = kwargs["dataset_spec"] if "dataset_spec" in kwargs else args[0]
+  if http_records.is_url(dataset_spec.path):
+    return HttpRecordsBackend(*args, **kwargs)
+  if dataset_spec.file_pattern.endswith(".tfrecords"):
+    return TFRecordBackend(*args, **kwargs)
   if type == "hdf5_random_access":
     return RandomAccessHdf5Backend(*args, **kwargs)
   elif type == "hdf5_sequential_access":
     return SequentialAccessHdf5Backend(*args, **kwargs)
 
 class BaseBackend(object):
+  # Maps each class of the split to its number of images, as read from the
+  # records index, or None if the dataset has no records index.
+  images_per_class = None
+  records_index = None
+  # The TieredImageCache configured with gin (see meta_dataset.data.image_cache),
+  # the name of the dataset, image size and cached transforms in its keys, and
+  # the transforms split into the cached prefix and the per sample suffix (see
+  # meta_dataset.data.transforms).
+  image_cache = None
+  image_cache_name = None
+  prefix_transforms = None
+  suffix_transforms = None
+  # A description of the transforms given to the backend, which identifies them
+  # across runs (see meta_dataset.data.transforms.describe_transforms).
+  transforms_description = None
+  # The identity of the records of each class looked up by this process, also in
+  # the keys of the image cache (see get_records_id).
+  records_ids = None
+
   def setup(self):
     raise NotImplementedError
 
+  def setup_image_cache(self, dataset_spec, image_size, transforms):
+    """ Uses the image cache configured with gin, if any
+
+    The decoded images are cached after the deterministic prefix of the
+    transforms, so that repeated reads skip decoding and e.g. resizing.
+
+    Args:
+        dataset_spec: the dataset specification
+        image_size: the output image size, which determines the decoded images
+        transforms: the transforms applied to the decoded images
+
+    """
+    self.image_cache = image_cache.make_image_cache()
+    self.records_ids = {}
+    self.prefix_transforms, self.suffix_transforms, prefix_name = \
+        transforms_lib.split_transforms(transforms)
+    self.image_cache_name = "%s_%s_%s" % (dataset_spec.name, image_size, prefix_name)
+    self.transforms_description = transforms_lib.describe_transforms(transforms)
+
+  def get_class_path(self, class_id):
+    """ Returns the path of the records of a class """
+    raise NotImplementedError
+
+  def get_records_id(self, class_id):
+    """ Returns a string identifying the records of a class, in the keys of the image cache
+
+    It changes when the records are converted again, so that the images cached in the
+    shared tiers are not read from the old records. The records are only stat'ed the
+    first time each process looks them up.
+
+    Args:
+        class_id: the class of the records
+    """
+    if class_id not in self.records_ids:
+      path = self.get_class_path(class_id)
+      stat = os.stat(path)
+      self.records_ids[class_id] = "%s:%d:%d" % (os.path.abspath(path), stat.st_size,
+                                                 stat.st_mtime_ns)
+    return self.records_ids[class_id]
+
+  def read_cached_images(self, class_id, sorted_indices, read_encoded, get_decoder):
+    """ Reads and transforms images through the image cache
+
+    Args:
+        class_id: the class from which to read
+        sorted_indices: the sorted indices of the images to load, without repetitions
+        read_encoded: a function that returns the encoded images at a list of indices
+        get_decoder: a function that returns the decoder of the encoded images
+
+    Returns: a dict from index to transformed image
+    """
+    def get_prefix():
+      decoder = get_decoder()
+
+      def prefix(im):
+        with pipeline_stats.time_stage("decode"):
+          im = decoder(im)
+        with pipeline_stats.time_stage("transform"):
+          return self.prefix_transforms(im)
+      return prefix
+
+    images = self.image_cache.get_images(self.image_cache_name, class_id, sorted_indices,
+                                         read_encoded, get_prefix,
+                                         self.get_records_id(class_id))
+    with pipeline_stats.time_stage("transform"):
+      return {i: self.suffix_transforms(im) for i, im in zip(sorted_indices, images)}
+
+  def apply_transforms(self, level_transforms, images):
+    """ Decodes and transforms images, timing both stages (see meta_dataset.data.pipeline_stats)
+
+    Args:
+        level_transforms: the Compose of the decoder and the transforms, from get_level_transforms
+        images: the encoded images
+
+    Returns: a list with the transformed images
+    """
+    decoder, transforms = level_transforms.transforms
+    with pipeline_stats.time_stage("decode"):
+      images = [decoder(im) for im in images]
+    with pipeline_stats.time_stage("transform"):
+      return [transforms(im) for im in images]
+
+  def load_records_index(self, dataset_spec):
+    """ Returns the records index of the dataset, or None if it has none """
+    return records_index.RecordsIndex.load(dataset_spec.path)
+
+  def check_missing_images(self, dataset_spec, split, fix_missing_images):
+    """ Checks if the number of examples per class in the dataset spec is the same
+        as in the records index (see meta_dataset.data.records_index). If not, it
+        corrects the theoretical number.
+
+    Args:
+        dataset_spec: the dataset specification
+        split: the split whose classes are checked
+        fix_missing_images: whether to fail or to fix image counts
+
+    """
+    index = self.load_records_index(dataset_spec)
+    self.records_index = index
+    if index is None:
+      logging.warning(" No records index found for %s, using the number of images"
+                      " in the DatasetSpec" % dataset_spec.name)
+      return
+    classes = dataset_spec.get_classes(split)
+    images_per_class = {}
+    errors = 0
+    for class_id in classes:
+      if class_id not in index:
+        raise RuntimeError("Class %s of %s is missing from the records index" %
+                           (class_id, dataset_spec.name))
+      images_per_class[class_id] = index.get_num_images(class_id)
+      if images_per_class[class_id] != dataset_spec.get_total_images_per_class(class_id):
+        errors += 1
+    if errors > 0 and not fix_missing_images:
+      raise RuntimeError("The number of stored images differs with the count in the DatasetSpec")
+    total = int(100 * errors / max(len(classes), 1))
+    if total > 0:
+      logging.warning("".join([" {}% of the classes didn't match the theoretical",
+                               " number of examples per class in dataset {}."]).format(total, dataset_spec.name))
+    self.images_per_class = images_per_class
+
   def read_class(self, class_id, indices):
     raise NotImplementedError
 
 
+@gin.configurable(whitelist=["local_cache_dir", "local_cache_bytes"])
 class RandomAccessHdf5Backend(BaseBackend):
   """Defines a dataset as a series of h5 files grouped by class in the same
   folder
   """
 
-  def __init__(self, dataset_spec, split, image_size, transforms=None, fix_missing_images=True):
+  def __init__(self, dataset_spec, split, image_size, transforms=None, fix_missing_images=True,
+               local_cache_dir=None, local_cache_bytes=100 * 2 ** 30):
     """Initializes the hdf5 backend
 
     Args:
@@ -45,35 +240,37 @@ class RandomAccessHdf5Backend(BaseBackend):
         fix_missing_images: the dataset converter sometimes fails to
             read all the images, so the real number of images per class
             is slightly different from the theoretical one.
+        local_cache_dir: if given, a directory on a local disk where the class
+            files are copied on first access and read from afterwards, shared
+            by all the processes of the node (see meta_dataset.data.local_cache)
+        local_cache_bytes: the maximum size of the copies in local_cache_dir
     """
 
     self.path = dataset_spec.path
+    self.local_cache = None
+    if local_cache_dir:
+      self.local_cache = local_cache.LocalFileCache(local_cache_dir, local_cache_bytes)
     self.image_size = image_size
-    self.transforms = transforms_lib.Compose([transforms_lib.Lambda(imdecode), transforms])
+    self.base_transforms = transforms
+    # Transforms for each pyramid level, since every class file has its own,
+    # and the level of each class file read by this process.
+    self.level_transforms = {}
+    self.class_levels = {}
+    self.transforms = self.get_transforms(None)
     self.split = split
-    logging.warning(" Ignoring missing images")
-    # self.check_missing_images(fix_missing_images)
+    self.check_missing_images(dataset_spec, split, fix_missing_images)
+    self.setup_image_cache(dataset_spec, image_size, transforms)
 
-  def check_missing_images(self, fix_missing_images):
-    """ Checks if the number of examples per class in the dataset spec is the same
-        as in the hdf5. If not, it corrects the theoretical number.
+  def get_transforms(self, level):
+    """Returns the transforms of the images read from a pyramid level
 
     Args:
-        fix_missing_images: whether to fail or to fix image counts
-
+        level: the pyramid level, or None for the full resolution images
     """
-    errors = 0
-    for i, name in enumerate(self.class_set):
-      with h5py.File(self.path, 'r') as h5fp:
-        if h5fp[str(name)].shape[0] != self.total_images_per_class[i]:
-          self.total_images_per_class[i] = h5fp[str(name)].shape[0]
-          errors += 1
-        if errors > 1 and not fix_missing_images:
-          raise RuntimeError("The number of stored images differs with the count in the DatasetSpec")
-    total = int(100 * errors / self.num_classes)
-    if total > 0:
-      logging.warning("".join([" {}% of the classes didn't match the theoretical",
-                               " number of examples per class in dataset {}."]).format(total, self.name))
+    if level not in self.level_transforms:
+      self.level_transforms[level] = get_level_transforms(self.base_transforms, level,
+                                                          self.image_size)
+    return self.level_transforms[level]
 
   def setup(self, worker_id=None):
     """ Thread init function, file pointers are initialized here
@@ -110,10 +307,14 @@ class RandomAccessHdf5Backend(BaseBackend):
 
     unique_indices = np.unique(indices)
     sorted_indices = np.sort(unique_indices).tolist()
-    with h5py.File(os.path.join(self.path, "{}.h5".format(class_id)), 'r') as h5fp:
-      dataset = h5fp["images"]
-      images = dataset[sorted_indices, ...]
-    images = [self.transforms(im) for im in images]
+    if self.image_cache is not None:
+      images = self.read_cached_images(
+          class_id, sorted_indices,
+          lambda missing: self.read_encoded(class_id, missing)[1],
+          lambda: get_level_decoder(self.get_class_level(class_id), self.image_size))
+      return [images[i] for i in indices]
+    level, images = self.read_encoded(class_id, sorted_indices)
+    images = self.apply_transforms(self.get_transforms(level), images)
 
     if len(unique_indices) < len(indices):
       buffer = [None] * len(indices)
@@ -123,6 +324,44 @@ class RandomAccessHdf5Backend(BaseBackend):
     else:
       return images
 
+  def get_class_path(self, class_id):
+    return os.path.join(self.path, "{}.h5".format(class_id))
+
+  def read_encoded(self, class_id, sorted_indices):
+    """Reads the encoded images of a class from its smallest fitting pyramid level
+
+    Returns: the pyramid level and the images
+
+    Args:
+        class_id: the class from which to read
+        sorted_indices: the sorted indices of the images to load
+    """
+    path = self.get_class_path(class_id)
+    if self.local_cache is None:
+      return self._read_images(class_id, path, sorted_indices)
+    with self.local_cache.open(path) as local_path:
+      return self._read_images(class_id, local_path, sorted_indices)
+
+  def _read_images(self, class_id, path, sorted_indices):
+    with pipeline_stats.time_stage("open"):
+      h5fp = h5py.File(path, 'r')
+    with h5fp:
+      with pipeline_stats.time_stage("index"):
+        level = hdf5_format.choose_pyramid_level(hdf5_format.get_pyramid_sizes(h5fp),
+                                                 self.image_size)
+        self.class_levels[class_id] = level
+        if not sorted_indices:
+          return level, []
+        dataset = h5fp[hdf5_format.get_dataset_name("images", level)]
+      with pipeline_stats.time_stage("read"):
+        return level, dataset[sorted_indices, ...]
+
+  def get_class_level(self, class_id):
+    """Returns the pyramid level the images of a class are read from"""
+    if class_id not in self.class_levels:
+      self.read_encoded(class_id, [])
+    return self.class_levels[class_id]
+
   def __del__(self):
     if hasattr(self, "h5fp"):
       try:
@@ -132,12 +371,15 @@ class RandomAccessHdf5Backend(BaseBackend):
 
 
 class MasterHdf5Reader(Process):
-  def __init__(self, dataset_spec, classes, nworkers, buffer_size=1000):
-    super().__init__(daemon=True)
+  def __init__(self, dataset_spec, classes, nworkers, buffer_size=1000, level=None):
+    # The name of the process is its lane in the traces.
+    super().__init__(name="MasterHdf5Reader-%s" % dataset_spec.name, daemon=True)
     self.worker_queues = [Queue() for _ in range(nworkers)]
     self.request_queue = Queue()
     self.path = os.path.join(dataset_spec.path, "{}.h5".format(dataset_spec.name))
     self.classes = list(map(str, classes))
+    # Name of the dataset of each class at the pyramid level that is read.
+    self.keys = {k: hdf5_format.get_dataset_name(k, level) for k in self.classes}
     self.buffer_size = buffer_size
 
   def get_worker_queues(self):
@@ -150,16 +392,17 @@ class MasterHdf5Reader(Process):
     self.cursors = {k: 0 for k in self.classes}
     self.buffers = {k: [] for k in self.classes}
     with h5py.File(self.path, 'r') as h5fp:
-      self.buffer_sizes = {k: min(self.buffer_size, len(h5fp[k])) for k in self.classes}
+      self.buffer_sizes = {k: min(self.buffer_size, len(h5fp[self.keys[k]])) for k in self.classes}
     self.to_fill = self.classes[:]
 
+  @tracing.traced
   def fill_buffer(self, class_id):
     max_buffer_size = self.buffer_sizes[class_id]
     current_buffer_length = len(self.buffers[class_id])
     cursor = self.cursors[class_id]
     if current_buffer_length < max_buffer_size:
       h5fp = h5py.File(self.path, 'r')
-      dataset = h5fp[class_id]
+      dataset = h5fp[self.keys[class_id]]
       dset_length = len(dataset)
       requested = max_buffer_size - current_buffer_length
       end_cursor = cursor + requested
@@ -171,6 +414,7 @@ class MasterHdf5Reader(Process):
         self.cursors[class_id] = end_cursor
       h5fp.close()
 
+  @tracing.traced
   def process_request(self, request):
     header, data = request
     if header is None:
@@ -218,17 +462,24 @@ class SequentialAccessHdf5Backend(BaseBackend):
             is slightly different from the theoretical one.
     """
     self.image_size = image_size
-    self.transforms = transforms_lib.Compose([transforms_lib.Lambda(imdecode), transforms])
-
+    path = os.path.join(dataset_spec.path, "{}.h5".format(dataset_spec.name))
+    with h5py.File(path, 'r') as h5fp:
+      level = hdf5_format.choose_pyramid_level(hdf5_format.get_pyramid_sizes(h5fp),
+                                               image_size)
+    self.transforms = get_level_transforms(transforms, level, image_size)
+    self.transforms_description = transforms_lib.describe_transforms(transforms)
+
+    # The master reader inherits the tracer if tracing is enabled.
+    tracing.get_tracer()
     self.master_reader = MasterHdf5Reader(dataset_spec,
                                           classes=dataset_spec.get_classes(split),
-                                          nworkers=nworkers)
+                                          nworkers=nworkers,
+                                          level=level)
     self.master_reader.start()
     self.worker_queues = self.master_reader.get_worker_queues()
     self.master_queue = self.master_reader.get_request_queue()
 
-    logging.warning(" Ignoring missing images")
-    # self.check_missing_images(fix_missing_images)
+    self.check_missing_images(dataset_spec, split, fix_missing_images)
 
   def setup(self, worker_id=None):
     """ Thread init function, file pointers are initialized here
@@ -264,10 +515,280 @@ class SequentialAccessHdf5Backend(BaseBackend):
         class_id: the class from which to read
         indices: the indices of the images to load
     """
-    self.master_queue.put((self.id, (class_id, len(indices))))
-    images = self.worker_queue.get(block=True)
-    return [self.transforms(im) for im in images]
+    with pipeline_stats.time_stage("read"):
+      self.master_queue.put((self.id, (class_id, len(indices))))
+      images = self.worker_queue.get(block=True)
+    return self.apply_transforms(self.transforms, images)
 
   def __del__(self):
     if not hasattr(self, "id"):
       self.master_queue.put((None, None))
+
+
+class TFRecordBackend(BaseBackend):
+  """Defines a dataset as the per-class TFRecord files of the original
+  Meta-Dataset, read without TensorFlow (see meta_dataset.data.tfrecord_format)
+  """
+
+  def __init__(self, dataset_spec, split, image_size, transforms=None, fix_missing_images=True):
+    """Initializes the TFRecord backend
+
+    Args:
+        dataset_spec: an instance from meta_dataset.data.dataset_spec
+            describing the input dataset, with a '{}.tfrecords' file pattern
+        image_size: the output image size
+        transforms: a function that applies successive transforms to the
+            image
+        fix_missing_images: the dataset converter sometimes fails to
+            read all the images, so the real number of images per class
+            is slightly different from the theoretical one.
+    """
+    if dataset_spec.file_pattern != "{}.tfrecords":
+      raise ValueError("Only the '{}.tfrecords' file pattern is supported, "
+                       "got %r" % dataset_spec.file_pattern)
+    self.path = dataset_spec.path
+    self.file_pattern = dataset_spec.file_pattern
+    self.image_size = image_size
+    self.transforms = get_level_transforms(transforms, None, image_size)
+    self.split = split
+    # Offsets of the records of each class, and the file descriptors opened by
+    # process pid.
+    self.indices = {}
+    self.fds = {}
+    self.pid = None
+    self.check_missing_images(dataset_spec, split, fix_missing_images)
+    self.setup_image_cache(dataset_spec, image_size, transforms)
+
+  def setup(self, worker_id=None):
+    """ Thread init function, file descriptors are opened on demand by each
+        process to avoid sharing them between processes
+
+    Args:
+        worker_id: unique identifier for the thread
+
+    """
+    self.close()
+
+  def get_class_path(self, class_id):
+    return os.path.join(self.path, self.file_pattern.format(class_id))
+
+  def get_fd(self, class_id):
+    """Returns a file descriptor of the records of a class opened by this process
+
+    Args:
+        class_id: the class of the records
+    """
+    if self.pid != os.getpid():
+      self.close()
+    if class_id not in self.fds:
+      path = self.get_class_path(class_id)
+      self.fds[class_id] = os.open(path, os.O_RDONLY)
+      if class_id not in self.indices:
+        if self.records_index is not None and class_id in self.records_index:
+          self.indices[class_id] = np.array(self.records_index.get_image_offsets(class_id))
+        else:
+          self.indices[class_id] = tfrecord_format.load_index(path)
+    return self.fds[class_id]
+
+  def postprocess(self, x):
+    """Helper function to ensure that the episode is returned in the correct
+    order (samples, channels, h, w)
+
+    Returns: postprocessed episode
+
+    Args:
+        x: the episode
+    """
+    return x
+
+  def read_class(self, class_id, indices):
+    """Reads the indexed images from a given class
+
+    Returns: a list with the len(indices) transformed images
+
+    Args:
+        class_id: the class from which to read
+        indices: the indices of the images to load
+    """
+    # As in RandomAccessHdf5Backend, each image is read and decoded once, in
+    # the order of the file.
+    sorted_indices = np.unique(indices).tolist()
+    if self.image_cache is not None:
+      images = self.read_cached_images(
+          class_id, sorted_indices, lambda missing: self.read_encoded(class_id, missing),
+          lambda: get_level_decoder(None, self.image_size))
+    else:
+      images = dict(zip(sorted_indices, self.apply_transforms(
+          self.transforms, self.read_encoded(class_id, sorted_indices))))
+    return [images[i] for i in indices]
+
+  def read_encoded(self, class_id, sorted_indices):
+    """Reads the encoded images of a class
+
+    Returns: a list with the encoded images
+
+    Args:
+        class_id: the class from which to read
+        sorted_indices: the sorted indices of the images to load
+    """
+    with pipeline_stats.time_stage("open"):
+      fd = self.get_fd(class_id)
+    with pipeline_stats.time_stage("index"):
+      offsets = [self.indices[class_id][i] for i in sorted_indices]
+    images = []
+    with pipeline_stats.time_stage("read"):
+      # The file of a class only holds its records, so the label feature is
+      # not parsed.
+      for offset, length in offsets:
+        example = tfrecord_format.parse_example(
+            tfrecord_format.read_record(fd, offset, length), ("image",))
+        images.append(np.frombuffer(example["image"][0], dtype=np.uint8))
+    return images
+
+  def close(self):
+    """Closes the open file descriptors, which in a forked process are copies
+    of the parent's"""
+    for fd in self.fds.values():
+      os.close(fd)
+    self.fds = {}
+    self.pid = os.getpid()
+
+  def __del__(self):
+    try:
+      self.close()
+    except:
+      pass
+
+
+@gin.configurable(whitelist=["block_size", "memory_cache_bytes", "disk_cache_dir"])
+class HttpRecordsBackend(BaseBackend):
+  """Defines a dataset as per-class TFRecord files served over HTTP, e.g. by an
+  object store, read with range requests (see meta_dataset.data.http_records)
+  """
+
+  def __init__(self, dataset_spec, split, image_size, transforms=None, fix_missing_images=True,
+               block_size=http_records.DEFAULT_BLOCK_SIZE,
+               memory_cache_bytes=http_records.DEFAULT_MEMORY_CACHE_BYTES,
+               disk_cache_dir=None):
+    """Initializes the HTTP backend
+
+    Args:
+        dataset_spec: an instance from meta_dataset.data.dataset_spec
+            describing the input dataset, whose path is the url of the
+            directory of the records, with a '{}.tfrecords' file pattern
+        image_size: the output image size
+        transforms: a function that applies successive transforms to the
+            image
+        fix_missing_images: the dataset converter sometimes fails to
+            read all the images, so the real number of images per class
+            is slightly different from the theoretical one.
+        block_size: the size of the blocks the files are fetched and cached in
+        memory_cache_bytes: the maximum size of the blocks cached in the memory
+            of each process
+        disk_cache_dir: optional directory where the blocks are also cached
+    """
+    if dataset_spec.file_pattern != "{}.tfrecords":
+      raise ValueError("Only the '{}.tfrecords' file pattern can be read "
+                       "over HTTP, got %r" % dataset_spec.file_pattern)
+    self.path = dataset_spec.path
+    self.file_pattern = dataset_spec.file_pattern
+    self.image_size = image_size
+    self.transforms = get_level_transforms(transforms, None, image_size)
+    self.split = split
+    self.reader = http_records.HttpRangeReader(block_size, memory_cache_bytes, disk_cache_dir)
+    # Offsets of the records of each class, fetched once.
+    self.indices = {}
+    self.check_missing_images(dataset_spec, split, fix_missing_images)
+    self.setup_image_cache(dataset_spec, image_size, transforms)
+
+  def load_records_index(self, dataset_spec):
+    return http_records.load_records_index(self.reader, dataset_spec.path)
+
+  def setup(self, worker_id=None):
+    """ Thread init function, connections are opened on demand by each
+        process and thread
+
+    Args:
+        worker_id: unique identifier for the thread
+
+    """
+
+  def get_url(self, class_id):
+    return http_records.join_url(self.path, self.file_pattern.format(class_id))
+
+  def get_records_id(self, class_id):
+    """ Returns the url and size of the records of a class, in the keys of the image cache
+
+    The modification time of the records is not available over HTTP, so records
+    converted again are only told apart by their size.
+
+    Args:
+        class_id: the class of the records
+    """
+    if class_id not in self.records_ids:
+      url = self.get_url(class_id)
+      self.records_ids[class_id] = "%s:%d" % (url, self.reader.get_size(url))
+    return self.records_ids[class_id]
+
+  def get_index(self, class_id):
+    """Returns the offsets of the records of a class, fetched on first use
+
+    Args:
+        class_id: the class of the records
+    """
+    if class_id not in self.indices:
+      if self.records_index is not None and class_id in self.records_index:
+        self.indices[class_id] = np.array(self.records_index.get_image_offsets(class_id))
+      else:
+        self.indices[class_id] = http_records.load_tfrecord_index(self.reader,
+                                                                  self.get_url(class_id))
+    return self.indices[class_id]
+
+  def postprocess(self, x):
+    """Helper function to ensure that the episode is returned in the correct
+    order (samples, channels, h, w)
+
+    Returns: postprocessed episode
+
+    Args:
+        x: the episode
+    """
+    return x
+
+  def read_class(self, class_id, indices):
+    """Reads the indexed images from a given class, with the requests of all
+    the images coalesced
+
+    Returns: a list with the len(indices) transformed images
+
+    Args:
+        class_id: the class from which to read
+        indices: the indices of the images to load
+    """
+    sorted_indices = np.unique(indices).tolist()
+    if self.image_cache is not None:
+      images = self.read_cached_images(
+          class_id, sorted_indices, lambda missing: self.read_encoded(class_id, missing),
+          lambda: get_level_decoder(None, self.image_size))
+    else:
+      images = dict(zip(sorted_indices, self.apply_transforms(
+          self.transforms, self.read_encoded(class_id, sorted_indices))))
+    return [images[i] for i in indices]
+
+  def read_encoded(self, class_id, sorted_indices):
+    """Reads the encoded images of a class, with one request per run of blocks
+
+    Returns: a list with the encoded images
+
+    Args:
+        class_id: the class from which to read
+        sorted_indices: the sorted indices of the images to load
+    """
+    with pipeline_stats.time_stage("index"):
+      index = self.get_index(class_id)
+      ranges = [(int(index[i, 0]), int(index[i, 0] + index[i, 1])) for i in sorted_indices]
+    with pipeline_stats.time_stage("read"):
+      records = self.reader.read_ranges(self.get_url(class_id), ranges)
+      # The label feature is not parsed, see TFRecordBackend.read_encoded.
+      return [np.frombuffer(tfrecord_format.parse_example(record, ("image",))["image"][0],
+                            dtype=np.uint8) for record in records]
@@ -0,0 +1,202 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pyformat: disable
+r"""Measures how much prefetching hides the latency of the HTTP backend.
+
+The records of a dataset are served by a local http.server that adds a fixed
+latency to every request, and read with HttpRecordsBackend. Reads of
+episodes, i.e. read_class calls for a few images of several classes, are
+issued with a given number of them in flight, as a DataLoader with that many
+episodes prefetched would. The benchmark reports, for each latency and
+prefetch depth, the images read per second and the requests made.
+
+Without --http_benchmark_path, a synthetic dataset of random images is used.
+
+Example command:
+# pylint: disable=line-too-long
+python -m meta_dataset.datasets.benchmark_http_backend \
+  --http_benchmark_path=<path/to/records>/omniglot \
+  --http_benchmark_latencies=0,0.005,0.02 \
+  --http_benchmark_depths=1,2,4,8
+# pylint: enable=line-too-long
+"""
+# pyformat: enable
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import logging
+import os
+import pickle as pkl
+import shutil
+import tempfile
+import time
+from concurrent import futures
+logging.getLogger().setLevel(logging.INFO)
+
+import numpy as np
+
+from meta_dataset.data import http_records
+from meta_dataset.data import image_codecs
+from meta_dataset.data import records_index
+from meta_dataset.data import tfrecord_test_utils
+from meta_dataset.data.dataset_spec import DatasetSpecification
+from meta_dataset.data.learning_spec import Split
+from meta_dataset.datasets import backends
+from meta_dataset.utils.argparse import argparse
+
+parser = argparse.parser
+parser.add_argument(
+  '--http_benchmark_path', default='',
+  help='Directory of the per-class TFRecord files and dataset_spec.pkl of the '
+       'dataset to serve. By default, a synthetic dataset is generated.')
+parser.add_argument(
+  '--http_benchmark_latencies', default='0,0.005,0.02',
+  help='Comma-separated latencies, in seconds, added to every request.')
+parser.add_argument(
+  '--http_benchmark_depths', default='1,2,4,8',
+  help='Comma-separated numbers of episodes read concurrently.')
+parser.add_argument(
+  '--http_benchmark_episodes', type=int, default=64,
+  help='Number of episodes read for each latency and depth.')
+parser.add_argument(
+  '--http_benchmark_ways', type=int, default=5,
+  help='Number of classes of each episode.')
+parser.add_argument(
+  '--http_benchmark_shots', type=int, default=10,
+  help='Number of images read from each class of an episode.')
+parser.add_argument(
+  '--http_benchmark_block_size', type=int,
+  default=http_records.DEFAULT_BLOCK_SIZE,
+  help='Size of the blocks the records are fetched in.')
+parser.add_argument(
+  '--http_benchmark_output', default='',
+  help='If given, path of a json file where the results are written.')
+FLAGS = argparse.FLAGS
+
+# Size of the synthetic dataset.
+_SYNTHETIC_CLASSES = 20
+_SYNTHETIC_IMAGES = 100
+_SYNTHETIC_IMAGE_SIZE = 84
+
+
+def make_synthetic_dataset(path):
+  """Writes per-class TFRecord files of random images and their index."""
+  rng = np.random.RandomState(0)
+  codec = image_codecs.get_codec(image_codecs.DEFAULT_CODEC)
+  for class_id in range(_SYNTHETIC_CLASSES):
+    records = []
+    for _ in range(_SYNTHETIC_IMAGES):
+      image = rng.randint(0, 256, (_SYNTHETIC_IMAGE_SIZE,
+                                   _SYNTHETIC_IMAGE_SIZE, 3), dtype=np.uint8)
+      records.append(tfrecord_test_utils.serialize_example({
+        'image': [codec.encode(image).tobytes()], 'label': [class_id]}))
+    tfrecord_test_utils.write_records(
+      os.path.join(path, '{}.tfrecords'.format(class_id)), records)
+  dataset_spec = DatasetSpecification(
+    name='synthetic',
+    classes_per_split={Split.TRAIN: _SYNTHETIC_CLASSES, Split.VALID: 0,
+                       Split.TEST: 0},
+    images_per_class={i: _SYNTHETIC_IMAGES for i in range(_SYNTHETIC_CLASSES)},
+    class_names=None, path=path, file_pattern='{}.tfrecords')
+  with open(os.path.join(path, 'dataset_spec.pkl'), 'wb') as f:
+    pkl.dump(dataset_spec, f)
+  records_index.load_or_build(dataset_spec, 1)
+
+
+def make_episodes(backend, split_classes, num_episodes):
+  """Returns the (class_id, indices) read by each episode."""
+  rng = np.random.RandomState(0)
+  episodes = []
+  for _ in range(num_episodes):
+    classes = rng.choice(split_classes, FLAGS.http_benchmark_ways,
+                         replace=False)
+    episode = []
+    for class_id in classes:
+      num_images = backend.images_per_class[class_id]
+      indices = rng.choice(num_images,
+                           min(FLAGS.http_benchmark_shots, num_images),
+                           replace=False)
+      episode.append((str(class_id), indices.tolist()))
+    episodes.append(episode)
+  return episodes
+
+
+def read_episode(backend, episode):
+  return sum(len(backend.read_class(class_id, indices))
+             for class_id, indices in episode)
+
+
+def benchmark(dataset_spec, latency, depth):
+  """Reads episodes with depth of them in flight, from a cold cache."""
+  server = http_records.serve_directory(dataset_spec.path, latency)
+  try:
+    url = 'http://127.0.0.1:%d' % server.server_port
+    backend = backends.HttpRecordsBackend(
+      dataset_spec._replace(path=url), Split.TRAIN, None,
+      transforms=lambda im: im,
+      block_size=FLAGS.http_benchmark_block_size)
+    episodes = make_episodes(backend, dataset_spec.get_classes(Split.TRAIN),
+                             FLAGS.http_benchmark_episodes)
+    start = time.time()
+    with futures.ThreadPoolExecutor(depth) as executor:
+      num_images = sum(executor.map(lambda e: read_episode(backend, e),
+                                    episodes))
+    seconds = time.time() - start
+  finally:
+    server.shutdown()
+    server.server_close()
+  metrics = backend.reader.get_metrics()
+  return {
+    'latency': latency,
+    'depth': depth,
+    'images_per_second': num_images / seconds,
+    'requests': metrics['requests'],
+    'bytes_fetched': metrics['bytes_fetched'],
+  }
+
+
+def main():
+  path = FLAGS.http_benchmark_path
+  tmp_dir = None
+  if not path:
+    tmp_dir = path = tempfile.mkdtemp()
+    logging.info('Generating a synthetic dataset in %s', path)
+    make_synthetic_dataset(path)
+  try:
+    with open(os.path.join(path, 'dataset_spec.pkl'), 'rb') as f:
+      dataset_spec = pkl.load(f)._replace(path=path)
+    results = []
+    for latency in [float(l) for l in
+                    FLAGS.http_benchmark_latencies.split(',')]:
+      for depth in [int(d) for d in FLAGS.http_benchmark_depths.split(',')]:
+        result = benchmark(dataset_spec, latency, depth)
+        logging.info('latency %.3fs, depth %d: %.1f images/s, %d requests',
+                     latency, depth, result['images_per_second'],
+                     result['requests'])
+        results.append(result)
+  finally:
+    if tmp_dir is not None:
+      shutil.rmtree(tmp_dir)
+  if FLAGS.http_benchmark_output:
+    with open(FLAGS.http_benchmark_output, 'w') as f:
+      json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+  argparse.parser.parse_args()
+  main()
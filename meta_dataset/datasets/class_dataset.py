@@ -1,51 +1,43 @@
+import hashlib
 import logging
 import os
-import resource
 import time
 
 import meta_dataset.data.sampling as sampling
+from meta_dataset.data import pipeline_stats
+from meta_dataset.data import tracing
 import numpy as np
 import torch
 from meta_dataset.data.learning_spec import Split
-from meta_dataset.datasets.episodic_dataloader import EpisodicDataLoader
 from torch import multiprocessing
 from torch.utils.data import Dataset
-from tqdm import tqdm
 from meta_dataset.utils.argparse import argparse
+from meta_dataset.utils.lazy_import import lazy_import
 FLAGS = argparse.FLAGS
 
-resource.setrlimit(
-  resource.RLIMIT_CORE,
-  (resource.RLIM_INFINITY, resource.RLIM_INFINITY))
+tqdm = lazy_import("tqdm")
 
-# TODO (prlz77): make this configurable
-torch.utils.data.DataLoader = EpisodicDataLoader
-logging.warning("Extended dataloader __iter__ function for episodic training.")
+# Version of the layout of the cached indices, part of their cache key. Bump it
+# when the episodes or batches built for the same parameters change.
+CACHE_FORMAT_VERSION = 1
 
 obj = None
 queue = None
 
-def get_random_initializer():
-  return np.frombuffer(os.urandom(4), dtype=np.uint32)[0]
-
-# Helper functions to seed workers
-def init_fn(base_seed, _queue, _obj, last):
+# Helper functions for the workers building the cache
+def init_fn(_queue, _obj):
   global obj
   global queue
   queue = _queue
   obj = _obj
-  idx = queue.get(block=True)
-  if idx + 1 != last:
-    queue.put(idx + 1)
-  seed = (idx + base_seed) % 2 ** 32
-  sampling.RNG.seed(seed)
-  obj.RNG = np.random.RandomState(seed=(seed))
-  torch.manual_seed(seed)
 
 
-def build_episode_indices(*args, **kwargs):
+def build_episode_indices(epoch):
   global obj
   global queue
+  # Each epoch draws from its own branch of the seed tree, so the cache does
+  # not depend on which worker builds which epoch.
+  obj.reseed(epoch)
   ret = obj.build_episode_indices()
   queue.put(None, block=False)
   return ret
@@ -61,7 +53,8 @@ class ClassDataset(Dataset):
   Since the epoch is pre-computed with the function build_episode_indices,
   please, make sure to call it after each epoch if epochs are small to avoid
   repeating the same data. To automate this, use meta_dataset.datasets.episodic_dataloader.EpisodicDataLoader
-  instead of torch.utils.data.DataLoader
+  instead of torch.utils.data.DataLoader, or call
+  meta_dataset.datasets.episodic_dataloader.patch_dataloader() to replace it
   """
 
   def __init__(self, backend, dataset_spec, split, epoch_size, pool, reshuffle, shuffle_seed):
@@ -73,33 +66,48 @@ class ClassDataset(Dataset):
         epoch_size: the number of iterations of each epoch
         pool: meta_dataset pool option
         reshuffle: whether to reshuffle the images inside each class each iteration
-        shuffle_seed: seed for the random generator. If fixed, examples will always
-                      come in the same order given the same episode description
+        shuffle_seed: root of the seed tree (see meta_dataset.data.sampling.get_seed_sequence).
+                      The dataset draws from the (shuffle_seed, name, split) node. If fixed,
+                      examples will always come in the same order given the same episode
+                      description
     """
     self.cache = None
+    self._cache_key = None
     self.epoch_size = epoch_size
     self.name = dataset_spec.name
     self.class_set = list(dataset_spec.get_classes(split))
     self.num_classes = len(self.class_set)
     self.backend = backend
     self.start_epoch = None
+    # Latency histograms of the stages of reading an episode (see
+    # meta_dataset.data.pipeline_stats), and the slot of this dataset in them.
+    self.stats = pipeline_stats.get_pipeline_stats()
+    self.stats_slot = None if self.stats is None else self.stats.register(self.name)
+    # Opt-in Chrome traces of the pipeline (see meta_dataset.data.tracing).
+    self.tracer = tracing.get_tracer()
 
     """ 
     The dataset offset is modified by a Multisource Datataset
     so that labels become unique to each dataset
     """
-    self.total_images_per_class = np.array([
-      dataset_spec.get_total_images_per_class(self.class_set[class_idx], pool)
-      for class_idx in range(self.num_classes)])
+    # The counts of the records index, read by the backend, are preferred to the
+    # ones of the dataset_spec, which can be off if some images failed to convert.
+    images_per_class = getattr(backend, "images_per_class", None)
+    if images_per_class is not None and pool is None:
+      self.total_images_per_class = np.array([
+        images_per_class[class_id] for class_id in self.class_set])
+    else:
+      self.total_images_per_class = np.array([
+        dataset_spec.get_total_images_per_class(self.class_set[class_idx], pool)
+        for class_idx in range(self.num_classes)])
 
     self.cursors = np.zeros(self.num_classes, dtype=np.uint32)
 
     self.reshuffle = reshuffle
 
-    if shuffle_seed is not None:
-      self.RNG = np.random.RandomState(seed=shuffle_seed)
-    else:
-      self.RNG = np.random
+    self.shuffle_seed = shuffle_seed
+    self.seed_sequence = sampling.get_seed_sequence(shuffle_seed, dataset_spec.name, split)
+    self.RNG = sampling.make_rng(self.seed_sequence, sampling.SHUFFLE_STREAM)
 
     self._reshuffle_indices()
 
@@ -119,6 +127,21 @@ class ClassDataset(Dataset):
   def setup(self, worker_id):
     self.backend.setup(worker_id)
 
+  def reseed(self, *keys):
+    """ Resets the random generator to a deterministic function of the given keys
+
+    Args:
+        *keys: ints appended to the path of the dataset in the seed tree, e.g. an epoch number
+
+    """
+    self.RNG = sampling.make_rng(self.seed_sequence, sampling.SHUFFLE_STREAM, *keys)
+    if self.reshuffle:
+      self.cursors[:] = 0
+      self._reshuffle_indices()
+    else:
+      # Keep the order of the images but start each class at a random position
+      self.cursors[:] = self.RNG.integers(self.total_images_per_class)
+
   def set_epoch(self, epoch):
     """ Sets the epoch from which to start reading episodes
 
@@ -144,13 +167,46 @@ class ClassDataset(Dataset):
     Returns: list. The cache loaded in main memory
 
     """
-    cache_folder = os.path.join(cache_folder, self.name)
+    cache_folder = os.path.join(cache_folder, self.name, self.get_cache_key())
     try:
       os.makedirs(cache_folder)
       self.save_cache(cache_folder, epochs)
     except OSError:
       self.load_cache(cache_folder, epochs)
 
+  def get_cache_parameters(self):
+    """ Returns the parameters that determine the indices built by build_episode_indices
+
+    Returns: dict. Parameter name to a value with a stable repr
+    """
+    return dict(
+      version=CACHE_FORMAT_VERSION,
+      episodic=self.episodic,
+      name=self.name,
+      split=self.split,
+      class_set=[int(c) for c in self.class_set],
+      total_images_per_class=[int(n) for n in self.total_images_per_class],
+      offset=int(self.offset),
+      epoch_size=int(self.epoch_size),
+      reshuffle=bool(self.reshuffle),
+      # The seed given by the user, since the entropy drawn for a None seed
+      # changes on every run. name and split locate the node of the dataset.
+      seed=sampling.get_seed_key(self.shuffle_seed))
+
+  def get_cache_key(self):
+    """ Returns a digest of get_cache_parameters, naming the cache of this dataset
+
+    Datasets whose parameters did not change keep their cache even if others,
+    e.g. the other sources of a MultisourceEpisodeDataset, did. The key is computed
+    once, after any change of epoch_size or offset by a MultisourceEpisodeDataset.
+
+    Returns: string. Hexadecimal md5 digest
+    """
+    if self._cache_key is None:
+      parameters = sorted(self.get_cache_parameters().items())
+      self._cache_key = hashlib.md5(repr(parameters).encode()).hexdigest()
+    return self._cache_key
+
   def load_cache(self, cache_folder, epochs):
     """ Loads a cache from the given folder
 
@@ -170,7 +226,8 @@ class ClassDataset(Dataset):
       t += 1
       if t > 3600:
         raise TimeoutError
-    self.cache = torch.load(os.path.join(cache_folder, "cache.pt"))
+    # The cache holds numpy arrays, written by save_cache, not only tensors
+    self.cache = torch.load(os.path.join(cache_folder, "cache.pt"), weights_only=False)
     assert (len(self.cache) >= epochs)
     logging.info("Loaded cache from %s" % cache_folder)
 
@@ -186,13 +243,10 @@ class ClassDataset(Dataset):
     """
     logging.info("Saving cache to %s" % cache_folder)
     queue = multiprocessing.Queue()
-    queue.put(1)
     nworkers = 32
-    last = nworkers + 1
-    seed = FLAGS.random_seed if FLAGS.random_seed is not None else get_random_initializer()
-    with multiprocessing.Pool(nworkers, initializer=init_fn, initargs=(seed, queue, self, last)) as pool:
+    with multiprocessing.Pool(nworkers, initializer=init_fn, initargs=(queue, self)) as pool:
       _cache = pool.map_async(build_episode_indices, range(epochs))
-      for _ in tqdm(range(epochs)):
+      for _ in tqdm.tqdm(range(epochs)):
         queue.get(block=True)
       cache = _cache.get()
       del queue
@@ -208,6 +262,15 @@ class ClassDataset(Dataset):
     self.sample_indices = [self.RNG.permutation(self.total_images_per_class[i]) for i in
                            range(self.num_classes)]
 
+  def begin_episode(self):
+    if self.stats is not None:
+      self.stats.begin_episode()
+
+  def end_episode(self):
+    if self.stats is not None:
+      self.stats.end_episode(self.stats_slot)
+
+  @tracing.traced
   def read_class(self, class_id, indices):
     """Abstract method to load examples from disk given a class_id and
         the amount of samples
@@ -243,6 +306,17 @@ class EpisodicClassDataset(ClassDataset):
     self.sampler = sampler
     self.episodic = True
 
+  def reseed(self, *keys):
+    super().reseed(*keys)
+    self.sampler.reseed(*keys)
+
+  def get_cache_parameters(self):
+    parameters = super().get_cache_parameters()
+    for k, v in self.sampler.get_parameters().items():
+      parameters["sampler_" + k] = v
+    return parameters
+
+  @tracing.traced
   def build_episode_indices(self):
     """Pre-computes the indices and labels of the images to load during an
     epoch avoids using random seeds on the worker threads
@@ -260,8 +334,10 @@ class EpisodicClassDataset(ClassDataset):
     self.episodes = []
 
     # Adapted from meta_dataset.data.reader
-    for _ in range(self.epoch_size):
-      episode_description = self.sampler.sample_episode_description()
+    # All the episode descriptions of the epoch are drawn at once.
+    episode_descriptions = self.sampler.sample_episode_descriptions(
+        self.epoch_size)
+    for episode_description in episode_descriptions:
       episode = dict(
         class_idx=[],
         indices=[],
@@ -326,6 +402,7 @@ class EpisodicClassDataset(ClassDataset):
     """
     self.episodes = self.episodes[(epoch + 1):]
 
+  @tracing.traced
   def __getitem__(self, item):
     """Reads an episode and returns it
 
@@ -334,12 +411,14 @@ class EpisodicClassDataset(ClassDataset):
     Args:
         item: episode index in 0..(epoch_size - 1)
     """
-    total_support, total_query, name, episode = self.episodes[item]
-    self.episodes[item] = None  # Release memory
+    self.begin_episode()
+    with pipeline_stats.time_stage("index"):
+      total_support, total_query, name, episode = self.episodes[item]
+      self.episodes[item] = None  # Release memory
 
-    for k in episode.keys():
-      if k not in ["indices", "name", "ways"]:
-        episode[k] = torch.from_numpy(episode[k])
+      for k in episode.keys():
+        if k not in ["indices", "name", "ways"]:
+          episode[k] = torch.from_numpy(episode[k])
 
     episode["support_images"] = []
     episode["query_images"] = []
@@ -350,8 +429,10 @@ class EpisodicClassDataset(ClassDataset):
       episode["support_images"].extend(im[:shot])
       episode["query_images"].extend(im[shot:])
 
-    episode["support_images"] = torch.stack(episode["support_images"], 0)
-    episode["query_images"] = torch.stack(episode["query_images"], 0)
+    with pipeline_stats.time_stage("collate"):
+      episode["support_images"] = torch.stack(episode["support_images"], 0)
+      episode["query_images"] = torch.stack(episode["query_images"], 0)
+    self.end_episode()
     return episode
 
 
@@ -361,10 +442,18 @@ class BatchClassDataset(ClassDataset):
     super().__init__(backend, dataset_spec, split, epoch_size, pool, reshuffle, shuffle_seed)
     self.episodic = False
     self.batch_size = batch_size
-    self.class_proportions = torch.from_numpy(self.total_images_per_class / self.total_images_per_class.sum())
+    self.class_proportions = self.total_images_per_class / self.total_images_per_class.sum()
     self.num_train_classes = num_train_classes
     self.num_test_classes = num_test_classes
 
+  def get_cache_parameters(self):
+    parameters = super().get_cache_parameters()
+    parameters.update(batch_size=int(self.batch_size),
+                      num_train_classes=int(self.num_train_classes),
+                      num_test_classes=int(self.num_test_classes))
+    return parameters
+
+  @tracing.traced
   def build_episode_indices(self):
     """Pre-computes the indices and labels of the images to load during an
     epoch avoids using random seeds on the worker threads
@@ -382,8 +471,8 @@ class BatchClassDataset(ClassDataset):
     # Adapted from meta_dataset.data.reader
     for _ in range(self.epoch_size):
       batch = {}
-      for i in range(self.batch_size):
-        class_idx = int(torch.multinomial(self.class_proportions, 1))
+      class_ids = self.RNG.choice(self.num_classes, size=self.batch_size, p=self.class_proportions)
+      for class_idx in class_ids.tolist():
         remaining = self.total_images_per_class[class_idx] - self.cursors[class_idx]
         if remaining == 0:
           self.cursors[class_idx] = 0
@@ -402,6 +491,7 @@ class BatchClassDataset(ClassDataset):
       self.batches.append(batch)
     return self.batches
 
+  @tracing.traced
   def __getitem__(self, item):
     """Reads an episode and returns it
 
@@ -410,7 +500,9 @@ class BatchClassDataset(ClassDataset):
     Args:
         item: int. Batch number.
     """
-    batch = self.batches[item]
+    self.begin_episode()
+    with pipeline_stats.time_stage("index"):
+      batch = self.batches[item]
 
     images = []
     labels = []
@@ -419,6 +511,8 @@ class BatchClassDataset(ClassDataset):
       images.extend(self.read_class(class_id, indices))
       labels.extend([class_id] * len(indices))
 
-    images = torch.stack(images, 0)
-    labels = torch.from_numpy(np.array(labels))
+    with pipeline_stats.time_stage("collate"):
+      images = torch.stack(images, 0)
+      labels = torch.from_numpy(np.array(labels))
+    self.end_episode()
     return images, labels, self.name
@@ -1,22 +1,20 @@
 import logging
 import os
 
-import h5py
 import meta_dataset.data as data
 import meta_dataset.data.sampling as sampling
+import meta_dataset.data.image_codecs as image_codecs
 from meta_dataset.datasets.multisource_datasets import MultisourceEpisodeDataset
 from meta_dataset.datasets.backends import Backend
 from meta_dataset.datasets.class_dataset import EpisodicClassDataset, BatchClassDataset
 import meta_dataset.data.learning_spec as learning_spec
-import torchvision.transforms as transforms_lib
 import numpy as np
-import cv2
 import torch
 from multiprocessing.pool import ThreadPool
 
 
 def imdecode(im):
-  return cv2.imdecode(im, cv2.IMREAD_COLOR)
+  return image_codecs.decode(im)
 
 
 def make_one_source_batch_dataset(dataset_spec,
@@ -28,7 +26,8 @@ def make_one_source_batch_dataset(dataset_spec,
                                   pool=None,
                                   reshuffle=True,
                                   image_size=None,
-                                  transforms=None):
+                                  transforms=None,
+                                  seed=None):
   """Returns a pipeline emitting data from one single source as Batches.
   Args:
     dataset_spec: A DatasetSpecification object defining what to read from.
@@ -38,12 +37,14 @@ def make_one_source_batch_dataset(dataset_spec,
       use ('valid', or 'test'), used at meta-test time only.
     reshuffle: bool. Whether to reshuffle indices before sampling the images.
     image_size: int, desired image size used during decoding.
+    seed: int (optional), root of the seed tree from which the generators of
+      each source and split are derived.
   Returns:
     A Dataset instance that outputs decoded batches from all classes in the
     split.
   """
 
-  if ".h5" in dataset_spec.file_pattern:
+  if ".h5" in dataset_spec.file_pattern or ".tfrecords" in dataset_spec.file_pattern:
     backend = Backend(dataset_spec=dataset_spec,
                       split=split,
                       image_size=image_size,
@@ -53,7 +54,7 @@ def make_one_source_batch_dataset(dataset_spec,
                               num_test_classes,
                               epoch_size, batch_size, pool,
                               reshuffle=reshuffle,
-                              shuffle_seed=None)
+                              shuffle_seed=seed)
 
   return dataset
 
@@ -66,7 +67,8 @@ def make_multisource_batch_dataset(dataset_spec_list,
                                     pool=None,
                                     reshuffle=True,
                                     image_size=None,
-                                    transforms=None):
+                                    transforms=None,
+                                    seed=None):
   """Returns a pipeline emitting data from multiple source as Batches.
 
   Args:
@@ -80,6 +82,8 @@ def make_multisource_batch_dataset(dataset_spec_list,
       together. There is only one shuffling operation, not one per class.
     read_buffer_size_bytes: int or None, buffer size for each TFRecordDataset.
     image_size: int, desired image size used during decoding.
+    seed: int (optional), root of the seed tree from which the generators of
+      each source and split are derived.
 
   Returns:
     A Dataset instance that outputs decoded batches from all classes in the
@@ -87,7 +91,7 @@ def make_multisource_batch_dataset(dataset_spec_list,
   """
   sources = []
   for dataset_spec in dataset_spec_list:
-    if ".h5" in dataset_spec.file_pattern:
+    if ".h5" in dataset_spec.file_pattern or ".tfrecords" in dataset_spec.file_pattern:
       backend = Backend(dataset_spec=dataset_spec,
                         split=split,
                         image_size=image_size,
@@ -97,7 +101,7 @@ def make_multisource_batch_dataset(dataset_spec_list,
                                 num_test_classes,
                                 epoch_size, batch_size, pool,
                                 reshuffle=reshuffle,
-                                shuffle_seed=None)
+                                shuffle_seed=seed)
     sources.append(dataset)
 
   return MultisourceEpisodeDataset(sources, epoch_size=epoch_size)
@@ -113,7 +117,8 @@ def make_one_source_episode_dataset(dataset_spec,
                                      num_support=None,
                                      num_query=None,
                                      reshuffle=True,
-                                     transforms=None):
+                                     transforms=None,
+                                     seed=None):
   """Returns a pipeline emitting data from one single source as Episodes.
 
   Args:
@@ -137,6 +142,8 @@ def make_one_source_episode_dataset(dataset_spec,
     reshuffle: bool, whether to shuffle the images inside each class.
     transforms: List of functions, pre-processing functions to apply to the
         images inside each class.
+    seed: Integer (optional), root of the seed tree from which the generators
+        of the sampler and of the dataset are derived.
 
   Returns:
     A Dataset instance that outputs fully-assembled and decoded episodes.
@@ -156,9 +163,10 @@ def make_one_source_episode_dataset(dataset_spec,
     use_all_classes=use_all_classes,
     num_ways=num_ways,
     num_support=num_support,
-    num_query=num_query)
+    num_query=num_query,
+    seed=seed)
 
-  if ".h5" in dataset_spec.file_pattern:
+  if ".h5" in dataset_spec.file_pattern or ".tfrecords" in dataset_spec.file_pattern:
     backend = Backend(dataset_spec=dataset_spec,
                       split=split,
                       image_size=image_size,
@@ -166,7 +174,7 @@ def make_one_source_episode_dataset(dataset_spec,
   dataset = EpisodicClassDataset(backend, dataset_spec, split, sampler,
                                  epoch_size, pool,
                                  reshuffle=reshuffle,
-                                 shuffle_seed=None)
+                                 shuffle_seed=seed)
   return dataset
 
 
@@ -181,7 +189,8 @@ def make_multisource_episode_dataset(dataset_spec_list,
                                      num_support=None,
                                      num_query=None,
                                      reshuffle=True,
-                                     transforms=None):
+                                     transforms=None,
+                                     seed=None):
   """Adapted from the original metadataset tensorflow code Returns a pipeline
   emitting data from multiple sources as Episodes.
 
@@ -211,6 +220,8 @@ def make_multisource_episode_dataset(dataset_spec_list,
       reshuffle: bool, whether to shuffle the images inside each class.
       transforms: List of functions, pre-processing functions to apply to the
           images inside each class.
+      seed: Integer (optional), root of the seed tree. Each source draws from
+          its own (seed, source, split) node, so sources are independent.
 
   Returns:
       A Dataset instance that outputs fully-assembled and decoded episodes.
@@ -229,9 +240,10 @@ def make_multisource_episode_dataset(dataset_spec_list,
       use_bilevel_hierarchy=use_bilevel_ontology,
       num_ways=num_ways,
       num_support=num_support,
-      num_query=num_query)
+      num_query=num_query,
+    seed=seed)
 
-    if ".h5" in dataset_spec.file_pattern:
+    if ".h5" in dataset_spec.file_pattern or ".tfrecords" in dataset_spec.file_pattern:
       backend = Backend(dataset_spec=dataset_spec,
                         split=split,
                         image_size=image_size,
@@ -240,7 +252,7 @@ def make_multisource_episode_dataset(dataset_spec_list,
     dataset = EpisodicClassDataset(backend, dataset_spec, split, sampler,
                                    epoch_size, pool,
                                    reshuffle=reshuffle,
-                                   shuffle_seed=None)
+                                   shuffle_seed=seed)
     sources.append(dataset)
 
   return MultisourceEpisodeDataset(sources, epoch_size=epoch_size)
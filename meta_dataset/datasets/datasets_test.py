@@ -163,24 +163,17 @@ class HDF5DatasetTest(unittest.TestCase):
         Even with the same episode descriptions, the content should be different.
         """
         num_episodes = 10
-        init_rng = sampling.RNG
         seed = 20181120
         episode_streams = []
 
-        try:
-            for _ in range(2):
-                sampling.RNG = np.random.RandomState(seed)
-                sampler = sampling.EpisodeDescriptionSampler(self.dataset_spec,
-                                                             self.split)
-                episodes = self.generate_episodes(sampler, num_episodes)
-                episode_streams.append(episodes)
-                for episode in episodes:
-                    examples, targets = unpack_episode(episode)
-                    self.check_episode_consistency(examples, targets)
-
-        finally:
-            # Restore the original RNG
-            sampling.RNG = init_rng
+        for _ in range(2):
+            sampler = sampling.EpisodeDescriptionSampler(self.dataset_spec,
+                                                         self.split, seed=seed)
+            episodes = self.generate_episodes(sampler, num_episodes)
+            episode_streams.append(episodes)
+            for episode in episodes:
+                examples, targets = unpack_episode(episode)
+                self.check_episode_consistency(examples, targets)
 
         # It is unlikely that all episodes will be the same
         num_identical_episodes = 0
@@ -198,24 +191,17 @@ class HDF5DatasetTest(unittest.TestCase):
     def test_deterministic_noshuffle(self):
         """Tests episode generation determinism when there is noshuffle queue."""
         num_episodes = 10
-        init_rng = sampling.RNG
         seed = 20181120
         episode_streams = []
-        try:
-            for _ in range(2):
-                sampling.RNG = np.random.RandomState(seed)
-                sampler = sampling.EpisodeDescriptionSampler(self.dataset_spec,
-                                                             self.split)
-                episodes = self.generate_episodes(sampler, num_episodes, shuffle=False,
-                                                  shuffle_seed=seed)
-                episode_streams.append(episodes)
-                for episode in episodes:
-                    examples, targets = unpack_episode(episode)
-                    self.check_episode_consistency(examples, targets)
-
-        finally:
-            # Restore the original RNG
-            sampling.RNG = init_rng
+        for _ in range(2):
+            sampler = sampling.EpisodeDescriptionSampler(self.dataset_spec,
+                                                         self.split, seed=seed)
+            episodes = self.generate_episodes(sampler, num_episodes, shuffle=False,
+                                              shuffle_seed=seed)
+            episode_streams.append(episodes)
+            for episode in episodes:
+                examples, targets = unpack_episode(episode)
+                self.check_episode_consistency(examples, targets)
 
         for episode1, episode2 in zip(*episode_streams):
             examples1, targets1 = unpack_episode(episode1)
@@ -229,24 +215,17 @@ class HDF5DatasetTest(unittest.TestCase):
         seed = 20181120
         episode_streams = []
         chunk_sizes = []
-        init_rng = sampling.RNG
-        try:
-            for _ in range(2):
-                sampling.RNG = np.random.RandomState(seed)
-                sampler = sampling.EpisodeDescriptionSampler(self.dataset_spec,
-                                                             self.split)
-                episodes = self.generate_episodes(
-                    sampler, num_episodes, shuffle_seed=seed)
-                episode_streams.append(episodes)
-                chunk_size = sampler.compute_chunk_sizes()
-                chunk_sizes.append(chunk_size)
-                for episode in episodes:
-                    examples, targets = unpack_episode(episode)
-                    self.check_episode_consistency(examples, targets)
-
-        finally:
-            # Restore the original RNG
-            sampling.RNG = init_rng
+        for _ in range(2):
+            sampler = sampling.EpisodeDescriptionSampler(self.dataset_spec,
+                                                         self.split, seed=seed)
+            episodes = self.generate_episodes(
+                sampler, num_episodes, shuffle_seed=seed)
+            episode_streams.append(episodes)
+            chunk_size = sampler.compute_chunk_sizes()
+            chunk_sizes.append(chunk_size)
+            for episode in episodes:
+                examples, targets = unpack_episode(episode)
+                self.check_episode_consistency(examples, targets)
 
         self.assertEqual(chunk_sizes[0], chunk_sizes[1])
 
@@ -309,23 +288,15 @@ class HDF5DatasetTest(unittest.TestCase):
         """
         num_episodes = 10
         seed = 20181121
-        init_rng = sampling.RNG
-        try:
-            sampling.RNG = np.random.RandomState(seed)
-            sampler = sampling.EpisodeDescriptionSampler(DATASET_SPEC, split)
-            # Each description is a (class_id, num_support, num_query) tuple.
-            descriptions = [
-                sampler.sample_episode_description() for _ in range(num_episodes)
-            ]
-
-            sampling.RNG = np.random.RandomState(seed)
-            sampler = sampling.EpisodeDescriptionSampler(DATASET_SPEC, split)
-            episodes = self.generate_episodes(sampler, num_episodes)
-            self.assertEqual(len(descriptions), len(episodes))
-            for (description, episode) in zip(descriptions, episodes):
-                self.check_description_episode_consistency(description, episode, offset)
-        finally:
-            sampling.RNG = init_rng
+        sampler = sampling.EpisodeDescriptionSampler(DATASET_SPEC, split, seed=seed)
+        # Each description is a (class_id, num_support, num_query) tuple.
+        descriptions = list(sampler.sample_episode_descriptions(num_episodes))
+
+        sampler = sampling.EpisodeDescriptionSampler(DATASET_SPEC, split, seed=seed)
+        episodes = self.generate_episodes(sampler, num_episodes)
+        self.assertEqual(len(descriptions), len(episodes))
+        for (description, episode) in zip(descriptions, episodes):
+            self.check_description_episode_consistency(description, episode, offset)
 
     def test_same_as_generator(self):
         # The offset corresponds to the difference between the absolute class ID as
@@ -0,0 +1,330 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Stores of frozen evaluation episodes.
+
+Validation and test evaluate on the same episodes every time, determined by the
+seed. freeze_episodes() reads them once and writes them to a directory:
+
+  images.u8      the uint8 images of all the episodes, [num_images, c, h, w],
+                 support images before query images for each episode.
+  episodes.npz   the labels of the images, and per way the class, shots and
+                 querys, with the offsets of each episode in those arrays.
+  store.json     the shape of the images, the number of episodes, the sources,
+                 the seed, and the parameters of the sampler and the transforms
+                 of each source.
+
+FrozenEpisodeDataset memory-maps the images and returns the same episodes as the
+dataset they were read from, without reading or decoding the records. The
+images are stored as uint8, so the evaluation transforms must output tensors in
+[0, 1] of images stored as uint8, i.e. end with ToTensor and have no
+augmentation, which would be frozen too. The store is checked against the
+dataset that it replaces, so that episodes frozen with another episode
+configuration or other transforms are not evaluated.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import logging
+import os
+import shutil
+
+import meta_dataset.data.sampling as sampling
+from meta_dataset.data import tracing
+from meta_dataset.utils.argparse import argparse
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+parser = argparse.parser
+parser.add_argument(
+  '--eval_episodes_dir', default='',
+  help='Directory of the stores of frozen evaluation episodes, see '
+       'meta_dataset.datasets.episode_store. If the store of an evaluation '
+       'split and seed exists, its episodes are read from it.')
+FLAGS = argparse.FLAGS
+
+STORE_FORMAT_VERSION = 2
+IMAGES_FILENAME = 'images.u8'
+EPISODES_FILENAME = 'episodes.npz'
+STORE_FILENAME = 'store.json'
+
+# Arrays with a value per support or query image, and per way of each episode.
+_IMAGE_KEYS = ('support_class_labels', 'query_class_labels',
+               'support_episode_labels', 'query_episode_labels')
+_WAY_KEYS = ('class_idx', 'shots', 'querys')
+
+
+def get_store_path(root, split, seed):
+  """Returns the directory of the store of a split's episodes for a seed."""
+  return os.path.join(root, '%s_seed_%s' % (split, seed))
+
+
+def get_sources(dataset):
+  """Returns the EpisodicClassDatasets of a single or multisource dataset."""
+  return list(getattr(dataset, 'datasets', [dataset]))
+
+
+def get_parameters(dataset):
+  """Returns the parameters that determine the episodes of each source.
+
+  They are the parameters of the sampler (see
+  sampling.EpisodeDescriptionSampler.get_parameters) and the description of the
+  transforms of each source, as stored in store.json.
+  """
+  parameters = [dict(sampler=source.sampler.get_parameters(),
+                     transforms=source.backend.transforms_description)
+                for source in get_sources(dataset)]
+  return json.loads(json.dumps(parameters, default=repr))
+
+
+def choose_sources(dataset, seed, num_episodes):
+  """Returns the source of each episode, drawn from the seed.
+
+  MultisourceEpisodeDataset draws the source of each episode with torch in each
+  worker, which is not reproducible, so frozen episodes draw them from their
+  own node of the seed tree.
+  """
+  num_sources = len(get_sources(dataset))
+  if num_sources == 1:
+    return np.zeros(num_episodes, dtype=np.int64)
+  source = '%s/%s' % (dataset.name, get_sources(dataset)[0].split)
+  rng = sampling.make_rng(sampling.get_seed_sequence(seed, source))
+  return rng.integers(num_sources, size=num_episodes)
+
+
+class _EpisodeReader(Dataset):
+  """Reads the episodes to freeze, possibly in DataLoader workers."""
+
+  def __init__(self, sources, choices):
+    self.sources = sources
+    self.choices = choices
+
+  def setup(self, worker_id=0):
+    for source in self.sources:
+      source.setup(worker_id)
+
+  def __getitem__(self, item):
+    return item, self.sources[self.choices[item]][item]
+
+  def __len__(self):
+    return len(self.choices)
+
+
+def to_uint8(images):
+  """Converts images in [0, 1], as output by ToTensor, back to uint8."""
+  if images.numel() and (images.min() < 0 or images.max() > 1):
+    raise ValueError('Frozen episodes are stored as uint8, the evaluation '
+                     'transforms must output images in [0, 1]')
+  return (images * 255).round().to(torch.uint8).numpy()
+
+
+def freeze_episodes(dataset, path, seed, num_episodes=None, num_workers=0):
+  """Reads the episodes of an evaluation dataset and writes them to a store.
+
+  The episodes are the first epoch built from the seed, so they do not depend
+  on how many episodes were read before, and are written to a temporary
+  directory renamed to path once complete.
+
+  Args:
+    dataset: an EpisodicClassDataset or a MultisourceEpisodeDataset.
+    path: the directory of the store, see get_store_path.
+    seed: the seed the dataset was built with, recorded in the store.
+    num_episodes: the number of episodes, by default the epoch size.
+    num_workers: the number of DataLoader workers reading the episodes.
+
+  Returns:
+    A FrozenEpisodeDataset reading the store.
+  """
+  sources = get_sources(dataset)
+  if num_episodes is None:
+    num_episodes = dataset.epoch_size
+  for source in sources:
+    if not source.episodic:
+      raise ValueError('Only episodes can be frozen')
+    source.epoch_size = num_episodes
+    source.cache = None
+    source.reseed(0)
+    source.build_episode_indices()
+  choices = choose_sources(dataset, seed, num_episodes)
+  sizes = [sources[s].episodes[i][:2] for i, s in enumerate(choices)]
+  support_offsets = np.cumsum([0] + [s for s, _ in sizes])
+  query_offsets = np.cumsum([0] + [q for _, q in sizes])
+  image_offsets = support_offsets + query_offsets
+
+  reader = _EpisodeReader(sources, choices)
+  if num_workers == 0:
+    reader.setup()
+  loader = torch.utils.data.DataLoader(reader, batch_size=None,
+                                       num_workers=num_workers,
+                                       worker_init_fn=reader.setup)
+
+  tmp_path = '%s.tmp.%d' % (path.rstrip(os.sep), os.getpid())
+  os.makedirs(tmp_path)
+  try:
+    images = None
+    arrays = dict((k, [None] * num_episodes) for k in _IMAGE_KEYS + _WAY_KEYS)
+    for item, episode in loader:
+      support = to_uint8(episode['support_images'])
+      query = to_uint8(episode['query_images'])
+      if images is None:
+        shape = support.shape[1:]
+        images = np.memmap(os.path.join(tmp_path, IMAGES_FILENAME),
+                           dtype=np.uint8, mode='w+',
+                           shape=(int(image_offsets[-1]),) + shape)
+      start = image_offsets[item]
+      images[start:start + len(support)] = support
+      images[start + len(support):image_offsets[item + 1]] = query
+      for k in arrays:
+        arrays[k][item] = np.asarray(episode[k], dtype=np.int64)
+    images.flush()
+    del images
+    np.savez(os.path.join(tmp_path, EPISODES_FILENAME),
+             support_offsets=support_offsets,
+             query_offsets=query_offsets,
+             way_offsets=np.cumsum([0] + [len(c) for c in arrays['class_idx']]),
+             sources=choices,
+             **dict((k, np.concatenate(v)) for k, v in arrays.items()))
+    with open(os.path.join(tmp_path, STORE_FILENAME), 'w') as f:
+      json.dump(dict(version=STORE_FORMAT_VERSION,
+                     num_episodes=int(num_episodes),
+                     num_images=int(image_offsets[-1]),
+                     shape=[int(s) for s in shape],
+                     sources=[source.name for source in sources],
+                     split=sources[0].split,
+                     seed=seed,
+                     parameters=get_parameters(dataset)), f, indent=2)
+    os.rename(tmp_path, path)
+  except Exception:
+    shutil.rmtree(tmp_path)
+    raise
+  logging.info('Froze %d episodes of %s to %s' % (num_episodes, dataset.name, path))
+  return FrozenEpisodeDataset(path)
+
+
+class FrozenEpisodeDataset(Dataset):
+  """Reads the episodes written by freeze_episodes.
+
+  It has the interface of the episodic datasets, so it can replace them in an
+  EpisodicDataLoader. The images are memory-mapped in each process, once it
+  reads them.
+  """
+
+  def __init__(self, path):
+    """ Constructor
+
+    Args:
+        path: the directory of the store
+
+    Raises:
+        ValueError: if the store was written with another format
+    """
+    self.path = path
+    with open(os.path.join(path, STORE_FILENAME)) as f:
+      self.spec = json.load(f)
+    if self.spec['version'] != STORE_FORMAT_VERSION:
+      raise ValueError('The episodes in %s have format %s, expected %s, freeze them again' %
+                       (path, self.spec['version'], STORE_FORMAT_VERSION))
+    with np.load(os.path.join(path, EPISODES_FILENAME)) as episodes:
+      self.arrays = dict(episodes.items())
+    self.name = "all" if len(self.spec['sources']) > 1 else self.spec['sources'][0]
+    self.episodic = True
+    self.epoch_size = self.spec['num_episodes']
+    self.images = None
+
+  def __getstate__(self):
+    state = dict(self.__dict__)
+    state['images'] = None
+    return state
+
+  def check_benchmark(self, dataset, image_size):
+    """ Checks that the episodes were frozen from the dataset they replace
+
+    Args:
+        dataset: the EpisodicClassDataset or MultisourceEpisodeDataset that would
+            be read otherwise
+        image_size: the size of the images of the benchmark
+
+    Raises:
+        ValueError: if the sources, the image size, the parameters of the samplers
+            or the transforms differ
+    """
+    sources = [source.name for source in get_sources(dataset)]
+    if list(self.spec['sources']) != sources:
+      raise ValueError('The episodes in %s were frozen from %s, the benchmark reads %s, '
+                       'freeze them again' % (self.path, self.spec['sources'], sources))
+    if list(self.spec['shape'][-2:]) != [image_size, image_size]:
+      raise ValueError('The episodes in %s have images of shape %s, the benchmark reads '
+                       '%dx%d images, freeze them again' %
+                       (self.path, self.spec['shape'], image_size, image_size))
+    parameters = get_parameters(dataset)
+    for name, frozen, current in zip(sources, self.spec['parameters'], parameters):
+      for k in ('sampler', 'transforms'):
+        if frozen[k] != current[k]:
+          raise ValueError('The episodes of %s in %s were frozen with the %s %s, the '
+                           'benchmark uses %s, freeze them again' %
+                           (name, self.path, k, frozen[k], current[k]))
+
+  def get_images(self):
+    if self.images is None:
+      self.images = np.memmap(os.path.join(self.path, IMAGES_FILENAME), dtype=np.uint8,
+                              mode='r', shape=(self.spec['num_images'],) + tuple(self.spec['shape']))
+    return self.images
+
+  def set_epoch(self, epoch):
+    pass
+
+  def load_save_cache(self, cache_folder, epochs):
+    pass
+
+  def build_episode_indices(self):
+    pass
+
+  def setup(self, worker_id=0):
+    pass
+
+  @tracing.traced
+  def __getitem__(self, item):
+    """Reads an episode and returns it
+
+    Returns: a dictionary with the episode, as returned by EpisodicClassDataset
+
+    Args:
+        item: episode index in 0..(epoch_size - 1)
+    """
+    a = self.arrays
+    episode = {}
+    for k in _WAY_KEYS:
+      episode[k] = torch.from_numpy(a[k][a['way_offsets'][item]:a['way_offsets'][item + 1]])
+    # The images of an episode follow the ones of the previous episodes.
+    start = a['support_offsets'][item] + a['query_offsets'][item]
+    for prefix in ('support', 'query'):
+      offsets = a[prefix + '_offsets']
+      labels = slice(offsets[item], offsets[item + 1])
+      for k in ('class_labels', 'episode_labels'):
+        episode['%s_%s' % (prefix, k)] = torch.from_numpy(a['%s_%s' % (prefix, k)][labels])
+      end = start + labels.stop - labels.start
+      images = np.array(self.get_images()[start:end])
+      episode[prefix + '_images'] = torch.from_numpy(images).float().div_(255)
+      start = end
+    episode["name"] = self.spec['sources'][int(a['sources'][item])]
+    episode["ways"] = len(episode["shots"])
+    return episode
+
+  def __len__(self):
+    return self.epoch_size
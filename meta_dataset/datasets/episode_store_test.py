@@ -0,0 +1,154 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for `episode_store` module."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import pickle as pkl
+import shutil
+import tempfile
+import unittest
+
+from meta_dataset.data import image_codecs
+from meta_dataset.data import sampling
+from meta_dataset.data.dataset_spec import DatasetSpecification
+from meta_dataset.data.learning_spec import Split
+from meta_dataset.datasets import backends
+from meta_dataset.datasets import episode_store
+from meta_dataset.datasets.class_dataset import EpisodicClassDataset
+from meta_dataset.datasets.multisource_datasets import MultisourceEpisodeDataset
+import h5py
+import numpy as np
+import torch
+from torchvision import transforms
+
+SEED = 3
+
+
+def make_source(path, name, transform=None, num_ways=3):
+  """Writes a toy dataset and returns an episodic dataset of its valid split."""
+  rng = np.random.RandomState(len(name))
+  os.makedirs(path)
+  for class_id in range(6):
+    with h5py.File(os.path.join(path, '%d.h5' % class_id), 'w') as f:
+      images = f.create_dataset('images', (5,),
+                                dtype=h5py.vlen_dtype(np.uint8))
+      for i in range(5):
+        image = rng.randint(0, 256, (8, 8, 3), dtype=np.uint8)
+        images[i] = image_codecs.get_codec('png').encode(image)
+  spec = DatasetSpecification(
+      name=name, classes_per_split={Split.TRAIN: 2, Split.VALID: 4,
+                                    Split.TEST: 0},
+      images_per_class=dict((i, 5) for i in range(6)), class_names=None,
+      path=path, file_pattern='{}.h5')
+  backend = backends.RandomAccessHdf5Backend(spec, Split.VALID, 8,
+                                             transforms=transform or transforms.ToTensor())
+  sampler = sampling.EpisodeDescriptionSampler(
+      spec, Split.VALID, num_ways=num_ways, num_support=2, num_query=1,
+      seed=SEED)
+  return EpisodicClassDataset(backend, spec, Split.VALID, sampler, 4, None,
+                              reshuffle=True, shuffle_seed=SEED)
+
+
+class EpisodeStoreTest(unittest.TestCase):
+
+  def setUp(self):
+    super(EpisodeStoreTest, self).setUp()
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+    super(EpisodeStoreTest, self).tearDown()
+
+  def assertEpisodesEqual(self, frozen, expected):
+    self.assertEqual(set(frozen), set(expected) - {'indices'})
+    for k, v in expected.items():
+      if torch.is_tensor(v):
+        self.assertTrue(torch.equal(frozen[k], v), k)
+      elif k != 'indices':
+        self.assertEqual(frozen[k], v)
+
+  def test_single_source(self):
+    path = episode_store.get_store_path(self.directory, 'valid', SEED)
+    frozen = episode_store.freeze_episodes(
+        make_source(os.path.join(self.directory, 'toy'), 'toy'), path, SEED)
+    self.assertEqual(len(frozen), 4)
+    self.assertEqual(frozen.name, 'toy')
+    self.assertFalse(any(name.startswith('valid_seed_3.tmp')
+                         for name in os.listdir(self.directory)))
+    # The same episodes as those of the first epoch of a new dataset.
+    dataset = make_source(os.path.join(self.directory, 'toy_again'), 'toy')
+    dataset.reseed(0)
+    dataset.build_episode_indices()
+    frozen = pkl.loads(pkl.dumps(frozen))
+    for item in range(4):
+      self.assertEpisodesEqual(frozen[item], dataset[item])
+
+  def test_multisource(self):
+    dataset = MultisourceEpisodeDataset(
+        [make_source(os.path.join(self.directory, n), n) for n in ('a', 'bb')],
+        epoch_size=6)
+    path = episode_store.get_store_path(self.directory, 'valid', SEED)
+    frozen = episode_store.freeze_episodes(dataset, path, SEED, num_workers=2)
+    names = [frozen[i]['name'] for i in range(len(frozen))]
+    self.assertEqual(len(names), 6)
+    self.assertEqual(set(names), {'a', 'bb'})
+    loader = torch.utils.data.DataLoader(frozen, batch_size=None,
+                                         num_workers=2)
+    for item, episode in enumerate(loader):
+      self.assertEqual(episode['name'], names[item])
+      self.assertEqual(episode['support_images'].shape, (6, 3, 8, 8))
+      self.assertEqual(episode['query_images'].shape, (3, 3, 8, 8))
+
+  def test_check_benchmark(self):
+    path = episode_store.get_store_path(self.directory, 'valid', SEED)
+    frozen = episode_store.freeze_episodes(
+        make_source(os.path.join(self.directory, 'toy'), 'toy'), path, SEED)
+    frozen.check_benchmark(
+        make_source(os.path.join(self.directory, 'same'), 'toy'), 8)
+    with self.assertRaises(ValueError):
+      frozen.check_benchmark(
+          make_source(os.path.join(self.directory, 'other'), 'other'), 8)
+    with self.assertRaises(ValueError):
+      frozen.check_benchmark(
+          make_source(os.path.join(self.directory, 'size'), 'toy'), 84)
+    # Episodes frozen with another episode configuration or other transforms.
+    with self.assertRaises(ValueError):
+      frozen.check_benchmark(
+          make_source(os.path.join(self.directory, 'ways'), 'toy',
+                      num_ways=2), 8)
+    with self.assertRaises(ValueError):
+      frozen.check_benchmark(
+          make_source(os.path.join(self.directory, 'transforms'), 'toy',
+                      transforms.Compose([transforms.ToTensor(),
+                                          transforms.CenterCrop(6)])), 8)
+
+  def test_images_out_of_range(self):
+    dataset = make_source(
+        os.path.join(self.directory, 'toy'), 'toy',
+        transforms.Compose([transforms.ToTensor(),
+                            transforms.Lambda(lambda x: x * 2 - 1)]))
+    path = episode_store.get_store_path(self.directory, 'valid', SEED)
+    with self.assertRaises(ValueError):
+      episode_store.freeze_episodes(dataset, path, SEED)
+    self.assertEqual(os.listdir(self.directory), ['toy'])
+
+
+if __name__ == '__main__':
+  unittest.main()
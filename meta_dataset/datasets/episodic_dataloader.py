@@ -1,6 +1,11 @@
+import functools
+import torch.utils.data
 from torch.utils.data import DataLoader
 import logging
+import resource
 import time
+from meta_dataset.data import pipeline_stats
+from meta_dataset.data import tracing
 
 
 class EpisodicDataLoader(DataLoader):
@@ -14,4 +19,66 @@ class EpisodicDataLoader(DataLoader):
         self.dataset.build_episode_indices()
         logging.info("done in %.01f s" % (time.time() - t))
 
-        return super().__iter__()
+        stats = pipeline_stats.get_pipeline_stats()
+        # Created before the workers start, so that they inherit it.
+        tracer = tracing.get_tracer()
+        iterator = super().__iter__()
+        if stats is None and tracer is None:
+            return iterator
+        slot = None if stats is None else stats.register(self.dataset.name)
+        # The iterator is timed in place, rather than wrapped, so that it keeps its
+        # type and methods. With persistent workers, the same iterator is returned
+        # every epoch, and only timed once.
+        next_data = getattr(iterator, "_untimed_next_data", None)
+        if next_data is None:
+            next_data = iterator._untimed_next_data = iterator._next_data
+        iterator._next_data = functools.partial(self._time_wait, next_data, stats, slot,
+                                                tracer)
+        return iterator
+
+    def _time_wait(self, next_data, stats, slot, tracer=None):
+        """ Records how long the main process waits for an episode, the "wait" stage
+            of meta_dataset.data.pipeline_stats, and its "wait" span in the traces
+
+        Args:
+            next_data: the _next_data method of the DataLoader iterator
+            stats: the PipelineStats, or None if disabled
+            slot: the slot of the dataset in stats
+            tracer: the Tracer, or None if disabled
+
+        Returns: the next episode
+        """
+        start = time.monotonic_ns()
+        try:
+            episode = next_data()
+        except StopIteration:
+            # Reports the statistics of the epochs so far, with the counters of the caches.
+            if stats is not None:
+                stats.log_summary()
+            raise
+        duration = time.monotonic_ns() - start
+        if stats is not None:
+            stats.record(slot, "wait", duration)
+        if tracer is not None:
+            tracer.record("wait(%s)" % self.dataset.name, start, duration)
+        return episode
+
+
+def patch_dataloader():
+    """ Replaces torch.utils.data.DataLoader with EpisodicDataLoader
+
+        This used to happen when importing meta_dataset.datasets.class_dataset.
+        It is now opt-in, so that importing meta_dataset, e.g. in DataLoader
+        workers, has no side effects. Code that builds its DataLoaders with
+        torch.utils.data.DataLoader must call this once, before building them.
+    """
+    if torch.utils.data.DataLoader is not EpisodicDataLoader:
+        torch.utils.data.DataLoader = EpisodicDataLoader
+        logging.warning("Extended dataloader __iter__ function for episodic training.")
+
+
+def enable_core_dumps():
+    """ Removes the limit on the size of core dumps, to debug crashing workers """
+    resource.setrlimit(
+        resource.RLIMIT_CORE,
+        (resource.RLIM_INFINITY, resource.RLIM_INFINITY))
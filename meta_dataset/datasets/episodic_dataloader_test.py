@@ -18,6 +18,7 @@ from meta_dataset.data.dataset_spec import DatasetSpecification
 from meta_dataset.data.learning_spec import Split
 from meta_dataset.datasets.datasets import EpisodicHDF5ClassDataset
 from meta_dataset.datasets.datasets_test import make_dummy_dataset
+from meta_dataset.datasets.episodic_dataloader import EpisodicDataLoader
 
 # DatasetSpecification to use in tests
 DATASET_SPEC = DatasetSpecification(
@@ -77,9 +78,8 @@ class EpisodicDataLoaderTest(unittest.TestCase):
                                         transforms.ToPILImage(),
                                         transforms.Resize(84),
                                         transforms.ToTensor()])
-        sampling.RNG.seed(1234)
         sampler = sampling.EpisodeDescriptionSampler(self.dataset_spec,
-                                                     self.split)
+                                                     self.split, seed=1234)
         dataset1 = EpisodicHDF5ClassDataset(self.dataset_spec, self.split,
                                     sampler=sampler, epoch_size=self.num_episodes,
                                     image_size=84,
@@ -88,7 +88,7 @@ class EpisodicDataLoaderTest(unittest.TestCase):
         read1 = []
 
         dataset1.setup()
-        dataloader1 = torch.utils.data.DataLoader(dataset1, 1, num_workers=0, shuffle=False)
+        dataloader1 = EpisodicDataLoader(dataset1, 1, num_workers=0, shuffle=False)
 
         counter = 0
         for ep1 in dataloader1:
@@ -97,13 +97,13 @@ class EpisodicDataLoaderTest(unittest.TestCase):
             counter += 1
         self.assertEqual(counter, self.num_episodes)
 
-        sampling.RNG.seed(1234)
+        sampler.reseed()
         dataset2 = EpisodicHDF5ClassDataset(self.dataset_spec, self.split,
                                     sampler=sampler, epoch_size=self.num_episodes,
                                     image_size=84,
                                     transforms=transform,
                                     shuffle_seed=1234)
-        dataloader2 = torch.utils.data.DataLoader(dataset2, 1, num_workers=0, shuffle=False)
+        dataloader2 = EpisodicDataLoader(dataset2, 1, num_workers=0, shuffle=False)
         dataset2.setup()
         read2 = []
         counter = 0
@@ -123,9 +123,8 @@ class EpisodicDataLoaderTest(unittest.TestCase):
                                         transforms.ToPILImage(),
                                         transforms.Resize(84),
                                         transforms.ToTensor()])
-        sampling.RNG.seed(1234)
         sampler = sampling.EpisodeDescriptionSampler(self.dataset_spec,
-                                                     self.split)
+                                                     self.split, seed=1234)
         dataset1 = EpisodicHDF5ClassDataset(self.dataset_spec, self.split,
                                     sampler=sampler, epoch_size=self.num_episodes,
                                     image_size=84,
@@ -133,7 +132,7 @@ class EpisodicDataLoaderTest(unittest.TestCase):
                                     shuffle_seed=1234)
         read1 = []
 
-        dataloader1 = torch.utils.data.DataLoader(dataset1, 1, num_workers=2, shuffle=False,
+        dataloader1 = EpisodicDataLoader(dataset1, 1, num_workers=2, shuffle=False,
                                                   worker_init_fn=dataset1.setup)
 
         counter = 0
@@ -143,13 +142,13 @@ class EpisodicDataLoaderTest(unittest.TestCase):
             counter += 1
         self.assertEqual(counter, self.num_episodes)
 
-        sampling.RNG.seed(1234)
+        sampler.reseed()
         dataset2 = EpisodicHDF5ClassDataset(self.dataset_spec, self.split,
                                     sampler=sampler, epoch_size=self.num_episodes,
                                     image_size=84,
                                     transforms=transform,
                                     shuffle_seed=1234)
-        dataloader2 = torch.utils.data.DataLoader(dataset2, 1, num_workers=2, shuffle=False,
+        dataloader2 = EpisodicDataLoader(dataset2, 1, num_workers=2, shuffle=False,
                                                   worker_init_fn=dataset2.setup)
         read2 = []
         counter = 0
@@ -183,8 +182,8 @@ class EpisodicDataLoaderTest(unittest.TestCase):
                                     shuffle_seed=1234)
         dataset1.setup()
         dataset2.setup()
-        dataloader1 = torch.utils.data.DataLoader(dataset1, 1, num_workers=0, shuffle=True)
-        dataloader2 = torch.utils.data.DataLoader(dataset2, 1, num_workers=0, shuffle=True)
+        dataloader1 = EpisodicDataLoader(dataset1, 1, num_workers=0, shuffle=True)
+        dataloader2 = EpisodicDataLoader(dataset2, 1, num_workers=0, shuffle=True)
 
         counter = 0
         different = 0
@@ -215,7 +214,7 @@ class EpisodicDataLoaderTest(unittest.TestCase):
                                     shuffle_seed=1234)
         dataset1.setup()
         dataset1.build_episode_indices()
-        dataloader1 = torch.utils.data.DataLoader(dataset1, 1,
+        dataloader1 = EpisodicDataLoader(dataset1, 1,
                                                   num_workers=0,
                                                   shuffle=True,
                                                   collate_fn=lambda x: x)
@@ -249,9 +248,9 @@ class EpisodicDataLoaderTest(unittest.TestCase):
                                     transforms=transform,
                                     shuffle_seed=1234)
 
-        dataloader1 = torch.utils.data.DataLoader(dataset1, 1, num_workers=2, shuffle=True,
+        dataloader1 = EpisodicDataLoader(dataset1, 1, num_workers=2, shuffle=True,
                                                   worker_init_fn=dataset1.setup)
-        dataloader2 = torch.utils.data.DataLoader(dataset2, 1, num_workers=2, shuffle=True,
+        dataloader2 = EpisodicDataLoader(dataset2, 1, num_workers=2, shuffle=True,
                                                   worker_init_fn=dataset2.setup)
 
         counter = 0
@@ -281,7 +280,7 @@ class EpisodicDataLoaderTest(unittest.TestCase):
                                     transforms=transform,
                                     shuffle_seed=1234)
 
-        dataloader1 = torch.utils.data.DataLoader(dataset1, 1, num_workers=2, shuffle=True,
+        dataloader1 = EpisodicDataLoader(dataset1, 1, num_workers=2, shuffle=True,
                                                   worker_init_fn=dataset1.setup)
 
         threaded = 0
@@ -292,7 +291,7 @@ class EpisodicDataLoaderTest(unittest.TestCase):
 
         logging.info("Threaded time %.03fs" % threaded)
         dataset1.setup()
-        dataloader2 = torch.utils.data.DataLoader(dataset1, 1, num_workers=0, shuffle=True, )
+        dataloader2 = EpisodicDataLoader(dataset1, 1, num_workers=0, shuffle=True, )
         nothreaded = 0
         t = time.time()
         for _ in dataloader2:
@@ -1,6 +1,7 @@
 import torch
 from torch.utils.data import Dataset
 import gin
+from meta_dataset.data import tracing
 
 
 @gin.configurable('BatchSplitReaderGetReader', whitelist=['add_dataset_offset'])
@@ -55,6 +56,7 @@ class MultisourceEpisodeDataset(Dataset):
         for dataset in self.datasets:
             dataset.load_save_cache(cache_folder, epochs)
 
+    @tracing.traced
     def build_episode_indices(self):
         """ Generates the indices for all the episodes in an epoch.
 
@@ -74,6 +76,7 @@ class MultisourceEpisodeDataset(Dataset):
         for dataset in self.datasets:
             dataset.setup(worker_id)
 
+    @tracing.traced
     def __getitem__(self, item):
         """ Sample an episode from a randomly chosen dataset
 
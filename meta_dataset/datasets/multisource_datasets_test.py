@@ -13,6 +13,7 @@ from meta_dataset.data.dataset_spec import DatasetSpecification
 from meta_dataset.data.learning_spec import Split
 from meta_dataset.datasets.datasets_test import make_dummy_dataset
 from meta_dataset.datasets.datasets import make_multisource_episode_dataset
+from meta_dataset.datasets.episodic_dataloader import EpisodicDataLoader
 
 
 # DatasetSpecification to use in tests
@@ -91,7 +92,7 @@ class EpisodicDataLoaderTest(unittest.TestCase):
                                                     image_size,
                                                     transforms=transform)
 
-        dataloader1 = torch.utils.data.DataLoader(dataset1, 1, num_workers=2, shuffle=False,
+        dataloader1 = EpisodicDataLoader(dataset1, 1, num_workers=2, shuffle=False,
                                                   worker_init_fn=dataset1.setup)
 
         counter = 0
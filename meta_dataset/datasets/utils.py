@@ -1,3 +1,4 @@
+import collections.abc
 import os
 import pickle as pkl
 import logging
@@ -5,6 +6,155 @@ import meta_dataset.data.dataset_spec as dataset_spec_lib
 
 DATASETS_WITH_EXAMPLE_SPLITS = ()
 
+# Compiled hierarchical specifications are stored next to their dataset_spec.pkl
+COMPILED_SPEC_FILENAME = 'dataset_spec.compiled.pkl'
+# Bump when the content of the compiled specifications changes
+COMPILED_SPEC_VERSION = 1
+
+# Specifications loaded by this process, keyed by path and stamp of their pkl
+_dataset_specs = {}
+_pickled_specs = {}
+
+
+def get_file_stamp(path):
+    """ Returns the (mtime in ns, size) of a file, which change whenever it is rewritten """
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _load_pickled_spec(dataset_spec_path, stamp):
+    """ Unpickles a dataset_spec.pkl once per process """
+    key = (dataset_spec_path, stamp)
+    if key not in _pickled_specs:
+        with open(dataset_spec_path, 'rb') as f:
+            _pickled_specs[key] = pkl.load(f)
+    return _pickled_specs[key]
+
+
+class LazySplitMapping(collections.abc.Mapping):
+    """ A field of a pickled HierarchicalDatasetSpecification, only loaded when accessed
+
+    Compiled specifications use it for split_subgraphs and images_per_class, so that
+    the ontology is not unpickled unless it is needed, e.g. to sample from the DAG.
+    Both fields are read from the same unpickled specification, so their Synsets match.
+    """
+    def __init__(self, dataset_spec_path, stamp, field):
+        self.dataset_spec_path = dataset_spec_path
+        self.stamp = stamp
+        self.field = field
+
+    def _get(self):
+        return getattr(_load_pickled_spec(self.dataset_spec_path, self.stamp), self.field)
+
+    def __getitem__(self, key):
+        return self._get()[key]
+
+    def __iter__(self):
+        return iter(self._get())
+
+    def __len__(self):
+        return len(self._get())
+
+
+def compile_dataset_spec(data_spec, stamp):
+    """ Returns the compact, picklable summary of a HierarchicalDatasetSpecification
+
+    Args:
+        data_spec: a HierarchicalDatasetSpecification
+        stamp: the stamp of the dataset_spec.pkl it was loaded from (see get_file_stamp)
+
+    Returns: dict. Counts and splits of the classes, without the ontology
+    """
+    data_spec.initialize()
+    return dict(version=COMPILED_SPEC_VERSION,
+                stamp=stamp,
+                name=data_spec.name,
+                class_names=data_spec.class_names,
+                file_pattern=data_spec.file_pattern,
+                classes_per_split=data_spec.classes_per_split,
+                class_num_images=data_spec.get_class_num_images())
+
+
+def restore_dataset_spec(compiled, dataset_spec_path, dataset_records_path):
+    """ Builds a HierarchicalDatasetSpecification from its compiled summary
+
+    The ontology is loaded from dataset_spec_path on first access.
+    """
+    stamp = compiled['stamp']
+    data_spec = dataset_spec_lib.HierarchicalDatasetSpecification(
+        compiled['name'],
+        LazySplitMapping(dataset_spec_path, stamp, 'split_subgraphs'),
+        LazySplitMapping(dataset_spec_path, stamp, 'images_per_class'),
+        compiled['class_names'],
+        dataset_records_path,
+        compiled['file_pattern'])
+    data_spec.class_names_to_ids = dict(
+        zip(data_spec.class_names.values(), data_spec.class_names.keys()))
+    data_spec.classes_per_split = compiled['classes_per_split']
+    data_spec.class_num_images = compiled['class_num_images']
+    return data_spec
+
+
+def load_compiled_dataset_spec(compiled_path, stamp):
+    """ Returns the compiled specification at compiled_path, or None if missing or stale """
+    try:
+        with open(compiled_path, 'rb') as f:
+            compiled = pkl.load(f)
+    except (OSError, EOFError, pkl.UnpicklingError):
+        return None
+    if compiled.get('version') != COMPILED_SPEC_VERSION or compiled.get('stamp') != stamp:
+        return None
+    return compiled
+
+
+def save_compiled_dataset_spec(compiled, compiled_path):
+    """ Atomically writes a compiled specification, logs a warning if it cannot be written """
+    tmp_path = '%s.%d.tmp' % (compiled_path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as f:
+            pkl.dump(compiled, f, protocol=pkl.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, compiled_path)
+    except OSError as e:
+        logging.warning('Could not save the compiled dataset specification to %s: %s' % (compiled_path, e))
+
+
+def load_dataset_spec(dataset_records_path):
+    """ Loads the DatasetSpecification of the records in dataset_records_path
+
+    Specifications are memoized in-process, keyed by the mtime and size of their
+    dataset_spec.pkl, so that building several MetaDatasets, or one per worker, only
+    unpickles them once. Hierarchical specifications (ImageNet) are additionally
+    compiled next to their pkl into a versioned summary of their classes, and the
+    ontology is only unpickled when accessed.
+
+    Args:
+        dataset_records_path: the directory of the records and dataset_spec.pkl
+
+    Returns: a DatasetSpecification whose path is dataset_records_path
+    """
+    dataset_spec_path = os.path.join(dataset_records_path, 'dataset_spec.pkl')
+    stamp = get_file_stamp(dataset_spec_path)
+    key = (dataset_spec_path, stamp)
+    if key in _dataset_specs:
+        return _dataset_specs[key]
+
+    compiled_path = os.path.join(dataset_records_path, COMPILED_SPEC_FILENAME)
+    compiled = load_compiled_dataset_spec(compiled_path, stamp)
+    if compiled is not None:
+        data_spec = restore_dataset_spec(compiled, dataset_spec_path, dataset_records_path)
+    else:
+        data_spec = _load_pickled_spec(dataset_spec_path, stamp)
+        if isinstance(data_spec, dataset_spec_lib.HierarchicalDatasetSpecification):
+            compiled = compile_dataset_spec(data_spec, stamp)
+            save_compiled_dataset_spec(compiled, compiled_path)
+            data_spec = restore_dataset_spec(compiled, dataset_spec_path, dataset_records_path)
+        else:
+            # Replace outdated path of where to find the dataset's records.
+            data_spec = data_spec._replace(path=dataset_records_path)
+
+    _dataset_specs[key] = data_spec
+    return data_spec
+
 def get_benchmark_specification(dataset_list, records_root_dir, eval_imbalance_dataset, image_shape):
     """Returns a BenchmarkSpecification."""
     valid_benchmark_spec = None  # a benchmark spec for validation only.
@@ -18,11 +168,7 @@ def get_benchmark_specification(dataset_list, records_root_dir, eval_imbalance_d
                 'Dataset specification for {} is not found in the expected path '
                 '({}).'.format(dataset_name, dataset_spec_path))
 
-        with open(dataset_spec_path, 'rb') as f:
-            data_spec = pkl.load(f)
-
-        # Replace outdated path of where to find the dataset's records.
-        data_spec = data_spec._replace(path=dataset_records_path)
+        data_spec = load_dataset_spec(dataset_records_path)
 
         if dataset_name in DATASETS_WITH_EXAMPLE_SPLITS:
             # Check the file_pattern field is correct now.
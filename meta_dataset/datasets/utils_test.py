@@ -0,0 +1,155 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for `utils` module."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import pickle as pkl
+import shutil
+import tempfile
+import unittest
+
+from meta_dataset.data import dataset_spec as dataset_spec_lib
+from meta_dataset.data import imagenet_specification as imagenet_spec
+from meta_dataset.data.learning_spec import Split
+from meta_dataset.datasets import utils
+
+
+def create_hierarchical_spec(num_images):
+  """Creates a spec with a root and two leaves per split.
+
+  Args:
+    num_images: int, the number of images of the first leaf of each split.
+  """
+  split_subgraphs, images_per_class, class_names = {}, {}, {}
+  for split in Split:
+    root = imagenet_spec.Synset('r%d' % split.value, 'root', set(), set())
+    nodes = set([root])
+    for _ in range(2):
+      class_id = len(class_names)
+      class_names[class_id] = 'n%08d' % class_id
+      leaf = imagenet_spec.Synset(class_names[class_id], 'leaf', set(),
+                                  set([root]))
+      root.children.add(leaf)
+      nodes.add(leaf)
+    split_subgraphs[split] = nodes
+    images_per_class[split] = dict(
+        (n, num_images if n.wn_id == class_names[2 * split.value] else 10)
+        for n in imagenet_spec.get_leaves(nodes))
+    images_per_class[split][root] = num_images + 10
+  return dataset_spec_lib.HierarchicalDatasetSpecification(
+      'hierarchical', split_subgraphs, images_per_class, class_names, '/old',
+      '{}.h5')
+
+
+class LoadDatasetSpecTest(unittest.TestCase):
+
+  def setUp(self):
+    super(LoadDatasetSpecTest, self).setUp()
+    self.path = tempfile.mkdtemp()
+    self.spec_path = os.path.join(self.path, 'dataset_spec.pkl')
+    self.compiled_path = os.path.join(self.path, utils.COMPILED_SPEC_FILENAME)
+    self.write_spec(5)
+    self.clear_memo()
+
+  def tearDown(self):
+    self.clear_memo()
+    shutil.rmtree(self.path)
+    super(LoadDatasetSpecTest, self).tearDown()
+
+  def clear_memo(self):
+    utils._dataset_specs.clear()
+    utils._pickled_specs.clear()
+
+  def write_spec(self, num_images):
+    with open(self.spec_path, 'wb') as f:
+      pkl.dump(create_hierarchical_spec(num_images), f)
+
+  def assert_counts(self, data_spec, num_images):
+    self.assertEqual(data_spec.path, self.path)
+    for split in Split:
+      self.assertEqual(list(data_spec.get_classes(split)),
+                       [2 * split.value, 2 * split.value + 1])
+      self.assertEqual(
+          data_spec.get_total_images_per_class(2 * split.value), num_images)
+      self.assertEqual(
+          data_spec.get_total_images_per_class(2 * split.value + 1), 10)
+
+  def test_round_trip(self):
+    data_spec = utils.load_dataset_spec(self.path)
+    self.assertTrue(os.path.exists(self.compiled_path))
+    self.assert_counts(data_spec, 5)
+    self.clear_memo()
+    # Restored from the compiled specification, without the hierarchy.
+    data_spec = utils.load_dataset_spec(self.path)
+    self.assertIsInstance(data_spec.split_subgraphs, utils.LazySplitMapping)
+    self.assert_counts(data_spec, 5)
+    self.assertEqual(utils._pickled_specs, {})
+    # The hierarchy is loaded on access.
+    leaves = imagenet_spec.get_leaves(data_spec.split_subgraphs[Split.TEST])
+    self.assertEqual(sorted(n.wn_id for n in leaves),
+                     ['n00000004', 'n00000005'])
+    self.assertEqual(
+        sorted(data_spec.images_per_class[Split.TEST][n] for n in leaves),
+        [5, 10])
+
+  def test_pickle(self):
+    utils.load_dataset_spec(self.path)
+    self.clear_memo()
+    data_spec = pkl.loads(pkl.dumps(utils.load_dataset_spec(self.path)))
+    self.assertIsInstance(data_spec.split_subgraphs, utils.LazySplitMapping)
+    self.assertIsInstance(data_spec.images_per_class, utils.LazySplitMapping)
+    self.assert_counts(data_spec, 5)
+    self.assertEqual(utils._pickled_specs, {})
+
+  def test_stale(self):
+    utils.load_dataset_spec(self.path)
+    stamp = utils.get_file_stamp(self.spec_path)
+    self.write_spec(50)
+    # Make sure the stamp changes, even on filesystems with coarse mtimes.
+    os.utime(self.spec_path, ns=(stamp[0] + 10 ** 9, stamp[0] + 10 ** 9))
+    self.clear_memo()
+    self.assertIsNone(utils.load_compiled_dataset_spec(
+        self.compiled_path, utils.get_file_stamp(self.spec_path)))
+    self.assert_counts(utils.load_dataset_spec(self.path), 50)
+    self.assertIsNotNone(utils.load_compiled_dataset_spec(
+        self.compiled_path, utils.get_file_stamp(self.spec_path)))
+
+  def test_version(self):
+    utils.load_dataset_spec(self.path)
+    stamp = utils.get_file_stamp(self.spec_path)
+    compiled = utils.load_compiled_dataset_spec(self.compiled_path, stamp)
+    compiled['version'] = utils.COMPILED_SPEC_VERSION - 1
+    utils.save_compiled_dataset_spec(compiled, self.compiled_path)
+    self.assertIsNone(utils.load_compiled_dataset_spec(self.compiled_path,
+                                                       stamp))
+
+  def test_memoized(self):
+    data_spec = utils.load_dataset_spec(self.path)
+    self.assertIs(utils.load_dataset_spec(self.path), data_spec)
+    stamp = utils.get_file_stamp(self.spec_path)
+    self.write_spec(50)
+    os.utime(self.spec_path, ns=(stamp[0] + 10 ** 9, stamp[0] + 10 ** 9))
+    other_data_spec = utils.load_dataset_spec(self.path)
+    self.assertIsNot(other_data_spec, data_spec)
+    self.assert_counts(other_data_spec, 50)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,85 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pyformat: disable
+r"""Freezes the validation and test episodes of a configuration.
+
+The num_eval_episodes episodes of each split are sampled from --random_seed,
+read, transformed and written to a store in --eval_episodes_dir (see
+meta_dataset.datasets.episode_store). MetaDataset reads the evaluation episodes
+from there when given the same --eval_episodes_dir and --random_seed, so
+evaluations do not read the records, and evaluate on the same episodes on any
+machine.
+
+Example command:
+# pylint: disable=line-too-long
+python -m meta_dataset.pytorch.freeze_eval_episodes \
+  --gin_config=meta_dataset/learn/gin/default/prototypical_imagenet.gin \
+  --records_root_dir=<path/to/records> \
+  --eval_episodes_dir=<path/to/eval_episodes> \
+  --random_seed=0
+# pylint: enable=line-too-long
+"""
+# pyformat: enable
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import logging
+import os
+
+import gin
+from meta_dataset.datasets import episode_store
+from meta_dataset.pytorch.meta_dataset import MetaDataset
+from meta_dataset.utils.argparse import argparse
+
+parser = argparse.parser
+parser.add_argument('--gin_config', nargs='+', default=[])
+parser.add_argument('--gin_bindings', nargs='+', default=[],
+                    help='Commandline overrides for the gin configuration')
+parser.add_argument('--eval_imbalance_dataset', action='store_true')
+parser.add_argument('--random_seed', type=int, default=0,
+                    help='Root of the seed tree the episodes are sampled from.')
+parser.add_argument('--freeze_splits', default='valid,test',
+                    help='Comma-separated evaluation splits to freeze.')
+parser.add_argument('--freeze_workers', type=int, default=8,
+                    help='Number of DataLoader workers reading the episodes.')
+parser.set_defaults(use_cached_episodes=False)
+FLAGS = argparse.FLAGS
+
+
+def main():
+  if not FLAGS.eval_episodes_dir:
+    raise ValueError('--eval_episodes_dir is required')
+  gin.parse_config_files_and_bindings(FLAGS.gin_config, FLAGS.gin_bindings)
+  for split in FLAGS.freeze_splits.split(','):
+    path = episode_store.get_store_path(FLAGS.eval_episodes_dir, split,
+                                        FLAGS.random_seed)
+    if os.path.isdir(path):
+      logging.info('%s is already frozen in %s', split, path)
+      continue
+    # The validation episodes are only built when training.
+    meta_dataset = MetaDataset(is_training=split == 'valid')
+    dataset = meta_dataset.build_episodic_dataset(split, frozen=False)
+    os.makedirs(FLAGS.eval_episodes_dir, exist_ok=True)
+    episode_store.freeze_episodes(dataset, path, FLAGS.random_seed,
+                                  meta_dataset.learn_config.num_eval_episodes,
+                                  FLAGS.freeze_workers)
+
+
+if __name__ == '__main__':
+  logging.getLogger().setLevel(logging.INFO)
+  argparse.parser.parse_args()
+  main()
@@ -2,25 +2,30 @@ import gin
 import sys
 from os.path import dirname, abspath
 import torch
-from torchvision.transforms import transforms
 
 sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
 from meta_dataset.utils.argparse import argparse
 from meta_dataset.datasets.utils import get_benchmark_specification
 import meta_dataset.datasets.datasets as datasets_lib
+from meta_dataset.datasets import episode_store
 import meta_dataset.data.config
+from meta_dataset.data import hdf5_format
 from meta_dataset.data import learning_spec
+from meta_dataset.data import transforms as transforms_lib
 import meta_dataset.learner
 import os
 from functools import partial
 import logging
-import hashlib
 import shutil
-import cv2
-import numpy as np
+from meta_dataset.datasets.episodic_dataloader import enable_core_dumps
+from meta_dataset.datasets.episodic_dataloader import patch_dataloader
+from meta_dataset.utils.lazy_import import lazy_import
 
 FLAGS = argparse.FLAGS
 
+cv2 = lazy_import("cv2")
+torchvision = lazy_import("torchvision")
+
 
 def get_split_enum(split):
   """Returns the Enum value corresponding to the given split.
@@ -117,12 +122,12 @@ def parse_augmentation(augmentation_spec, image_size):
   if augmentation_spec.enable_gaussian_noise and \
       augmentation_spec.gaussian_noise_std > 0:
     f = partial(gaussian_noise, std=augmentation_spec.gaussian_noise_std)
-    _transforms.append(transforms.Lambda(f))
+    _transforms.append(torchvision.transforms.Lambda(f))
   if augmentation_spec.enable_jitter and \
       augmentation_spec.jitter_amount > 0:
-    _transforms.append(transforms.ToPILImage())
+    _transforms.append(torchvision.transforms.ToPILImage())
     amount = augmentation_spec.jitter_amount
-    _transforms.append(transforms.RandomCrop(image_size,
+    _transforms.append(torchvision.transforms.RandomCrop(image_size,
                                              padding=amount))
   return _transforms
 
@@ -146,17 +151,19 @@ def get_transforms(name,
   Returns:
 
   """
-  # Numpy transforms
+  # Numpy transforms. The deterministic ones come first, so that the backends
+  # can cache their outputs (see meta_dataset.data.transforms).
   support_transforms = []
   query_transforms = []
   if name in ["quickdraw", "omniglot"]:
-    size = int(np.ceil(image_size / 32.)) * 32 + 1
-    support_transforms.append(transforms.Lambda(lambda im: cv2.resize(im, (size, size), cv2.INTER_CUBIC)))
-    query_transforms.append(transforms.Lambda(lambda im: cv2.resize(im, (size, size), cv2.INTER_CUBIC)))
+    size = hdf5_format.get_aligned_size(image_size)
+    resize = lambda im: cv2.resize(im, (size, size), cv2.INTER_CUBIC)
+    support_transforms.append(transforms_lib.deterministic(resize, "resize_%d" % size))
+    query_transforms.append(transforms_lib.deterministic(resize, "resize_%d" % size))
   support_transforms += parse_augmentation(support_data_augmentation, image_size)
   query_transforms += parse_augmentation(query_data_augmentation, image_size)
   # PIL transforms
-  support_transforms.append(transforms.ToTensor())
+  support_transforms.append(torchvision.transforms.ToTensor())
   # Tensor transforms
   return support_transforms, query_transforms
 
@@ -213,7 +220,7 @@ class MetaDataset(object):
     if len(self.query_transforms) > 0:
       logging.warning("Different transforms for the query set not supported. We fallback to same transform.")
 
-    self.support_transforms = {k: transforms.Compose(v) for k,v in self.support_transforms.items()}
+    self.support_transforms = {k: torchvision.transforms.Compose(v) for k,v in self.support_transforms.items()}
 
     if self.valid_benchmark_spec is None:
       # This means that ImageNet is not a dataset in the given benchmark spec.
@@ -300,7 +307,8 @@ class MetaDataset(object):
         batch_size=batch_size,
         reshuffle=self.data_config.shuffle_buffer_size > 0,
         image_size=image_shape,
-        transforms=self.support_transforms[dataset_spec_list[0].name])
+        transforms=self.support_transforms[dataset_spec_list[0].name],
+        seed=FLAGS.random_seed)
     elif len(dataset_spec_list) > 1:
       dataset = datasets_lib.make_multisource_batch_dataset(
         dataset_spec_list,
@@ -311,7 +319,8 @@ class MetaDataset(object):
         batch_size=batch_size,
         reshuffle=self.data_config.shuffle_buffer_size > 0,
         image_size=image_shape,
-        transforms=self.support_transforms)
+        transforms=self.support_transforms,
+        seed=FLAGS.random_seed)
     else:
       raise ValueError("Empty list of datasets")
 
@@ -321,50 +330,65 @@ class MetaDataset(object):
 
   def maybe_save_cache(self, dataset, split):
     if FLAGS.use_cached_episodes:
-      m = hashlib.md5()
-      sources = []
-      for root, _, files in os.walk("meta_dataset_pytorch/meta_dataset/learn"):
-        for file in sorted(files):
-          filename = os.path.join(root, file)
-          if ".gin" == os.path.splitext(filename)[1]:
-            sources.append(filename)
-      for root, _, files in os.walk("meta_dataset_pytorch/meta_dataset/datasets"):
-        for file in sorted(files):
-          filename = os.path.join(root, file)
-          if ".py" == os.path.splitext(filename)[1] and "episodic" in os.path.splitext(filename)[0]:
-            sources.append(filename)
-      for root, _, files in os.walk("meta_dataset_pytorch/meta_dataset/pytorch"):
-        for file in sorted(files):
-          filename = os.path.join(root, file)
-          if ".py" == os.path.splitext(filename)[1]:
-            sources.append(filename)
-      for source in sorted(sources):
-        with open(source, 'rb') as infile:
-          m.update(infile.read())
-      critical_flags = ["random_seed"]
-      for flag in critical_flags:
-        m.update(str(getattr(FLAGS, flag)).encode())
-
       if FLAGS.cache_dir is not None:
         cache_root = FLAGS.cache_dir
       else:
         cache_root = '.cache'
-      dirname = os.path.join(cache_root, 'metadataset', m.hexdigest(),
+      # Each source caches its indices under a key computed from its own
+      # parameters (see ClassDataset.get_cache_key), so sources and splits that
+      # did not change keep their cache.
+      dirname = os.path.join(cache_root, 'metadataset',
                              "%s_%s" % (split, "episodic" if dataset.episodic else "batched"))
       if FLAGS.force_cache and os.path.isdir(dirname):
         logging.info("Cache rebuild forced")
         shutil.rmtree(dirname)
+      # The moved cache is only used by the sources whose cache key it holds.
       if os.path.isdir(FLAGS.reuse_cache):
         shutil.move(FLAGS.reuse_cache, dirname)
-        logging.info("The code in episodic dataloader changed but user specified to use previous cache")
+        logging.info("Reusing the cache in %s" % FLAGS.reuse_cache)
 
       dataset.load_save_cache(dirname, FLAGS.epochs)
 
-  def build_episodic_dataset(self, split):
+  def get_frozen_episodes(self, split, dataset):
+    """ Returns the frozen episodes of an evaluation split, or None if not frozen
+
+    The episodes are read from the store of the split and seed in
+    --eval_episodes_dir, written by meta_dataset.pytorch.freeze_eval_episodes.
+
+    Args:
+        split: 'valid' or 'test'
+        dataset: the episodic dataset of the split, which the frozen episodes replace
+
+    Returns: a FrozenEpisodeDataset or None
+
+    Raises:
+        ValueError: if the episodes were frozen from other datasets, at another image
+            size, with other episode parameters or transforms than the ones of
+            dataset, or are fewer than num_eval_episodes
+
+    """
+    if split not in ['valid', 'test'] or not FLAGS.eval_episodes_dir:
+      return None
+    path = episode_store.get_store_path(FLAGS.eval_episodes_dir, split, FLAGS.random_seed)
+    if not os.path.isdir(path):
+      logging.warning("No frozen %s episodes in %s, they are sampled and read" % (split, path))
+      return None
+    frozen = episode_store.FrozenEpisodeDataset(path)
+    benchmark_spec = (self.valid_benchmark_spec if split == 'valid' else self.train_benchmark_spec)
+    frozen.check_benchmark(dataset, benchmark_spec.image_shape)
+    if len(frozen) < self.learn_config.num_eval_episodes:
+      raise ValueError("%s has %d episodes, %d are evaluated" %
+                       (path, len(frozen), self.learn_config.num_eval_episodes))
+    frozen.epoch_size = self.learn_config.num_eval_episodes
+    logging.info("Reading the frozen %s episodes from %s" % (split, path))
+    return frozen
+
+  def build_episodic_dataset(self, split, frozen=True):
     """ Constructs an Episodic dataset with a single or multiple sources
 
     Args:
         split: meta_dataset.data.learning_spec.Split
+        frozen: whether to read the evaluation episodes from their store, if any
 
     Returns: torch.utils.data.Dataset instance
 
@@ -393,7 +417,8 @@ class MetaDataset(object):
         num_support=num_train_examples,
         num_query=num_test_examples,
         reshuffle=self.data_config.shuffle_buffer_size > 0,
-        transforms=self.support_transforms[dataset_spec_list[0].name])
+        transforms=self.support_transforms[dataset_spec_list[0].name],
+        seed=FLAGS.random_seed)
     elif len(dataset_spec_list) > 1:
       dataset = datasets_lib.make_multisource_episode_dataset(
         dataset_spec_list,
@@ -406,10 +431,16 @@ class MetaDataset(object):
         num_support=num_train_examples,
         num_query=num_test_examples,
         reshuffle=self.data_config.shuffle_buffer_size > 0,
-        transforms=self.support_transforms)
+        transforms=self.support_transforms,
+        seed=FLAGS.random_seed)
     else:
       raise ValueError("Empty list of datasets")
 
+    # The dataset is built even if its episodes are frozen, to check them against it.
+    frozen_dataset = self.get_frozen_episodes(split, dataset) if frozen else None
+    if frozen_dataset is not None:
+      return frozen_dataset
+
     self.maybe_save_cache(dataset, split)
     return dataset
 
@@ -461,4 +492,6 @@ if __name__ == "__main__":
                       help="Whether we are training or only testing")
   logging.getLogger().setLevel(logging.INFO)
   parser.parse_args()
+  enable_core_dumps()
+  patch_dataloader()
   batch_main()
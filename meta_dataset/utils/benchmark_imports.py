@@ -0,0 +1,173 @@
+# coding=utf-8
+# Copyright 2019 The Meta-Dataset Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pyformat: disable
+r"""Measures the time it takes to import the entry modules of meta_dataset.
+
+Each module is imported in a fresh interpreter with `python -X importtime`,
+which reports, for every module imported, the time spent in the module itself
+and in the modules it imports. The benchmark reports the total time to import
+each entry module, keeping the best of several runs, and its most expensive
+imports. Results can be saved, and compared against previously saved results
+to catch regressions, e.g. a heavy module imported eagerly again.
+
+Example command:
+# pylint: disable=line-too-long
+python -m meta_dataset.utils.benchmark_imports \
+  --import_output=<path/to/results.json> \
+  --import_baseline=<path/to/previous_results.json>
+# pylint: enable=line-too-long
+"""
+# pyformat: enable
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+logging.getLogger().setLevel(logging.INFO)
+
+from meta_dataset.utils.argparse import argparse
+
+ENTRY_MODULES = (
+  'meta_dataset.data.sampling',
+  'meta_dataset.datasets.backends',
+  'meta_dataset.datasets.class_dataset',
+  'meta_dataset.datasets.datasets',
+  'meta_dataset.pytorch.meta_dataset',
+)
+
+parser = argparse.parser
+parser.add_argument(
+  '--import_modules', default=','.join(ENTRY_MODULES),
+  help='Comma-separated names of the modules whose import is timed.')
+parser.add_argument(
+  '--import_repeats', type=int, default=3,
+  help='Number of times each module is imported, the fastest run is kept.')
+parser.add_argument(
+  '--import_top', type=int, default=10,
+  help='Number of most expensive imports reported for each module.')
+parser.add_argument(
+  '--import_output', default='',
+  help='If given, path of a json file where the results are written.')
+parser.add_argument(
+  '--import_baseline', default='',
+  help='If given, path of a json file with previous results to compare with.')
+parser.add_argument(
+  '--import_threshold', type=float, default=1.2,
+  help='Ratio to the baseline above which an import time is a regression.')
+FLAGS = argparse.FLAGS
+
+# Lines written by -X importtime, e.g.
+# "import time:       201 |       1034 |   meta_dataset.data.sampling"
+_IMPORTTIME_RE = re.compile(r'^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)')
+
+
+def parse_importtime(stderr):
+  """Parses the output of -X importtime.
+
+  Args:
+    stderr: str, the standard error of the interpreter.
+
+  Returns:
+    A dict from module name to its cumulative import time in microseconds.
+  """
+  times = {}
+  for line in stderr.splitlines():
+    match = _IMPORTTIME_RE.match(line)
+    if match is not None:
+      times[match.group(4)] = int(match.group(2))
+  return times
+
+
+def time_import(module):
+  """Imports module in a fresh interpreter and returns its import times.
+
+  Raises:
+    RuntimeError: if the module cannot be imported.
+  """
+  root = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+  env = dict(os.environ)
+  env['PYTHONPATH'] = os.pathsep.join(
+    p for p in (root, env.get('PYTHONPATH')) if p)
+  process = subprocess.run(
+    [sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+    stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+    universal_newlines=True)
+  if process.returncode != 0:
+    raise RuntimeError('Failed to import %s:\n%s' % (module, process.stderr))
+  return parse_importtime(process.stderr)
+
+
+def benchmark_module(module, repeats, top):
+  """Returns the fastest import time of module and its top imports, in us."""
+  best = None
+  for _ in range(repeats):
+    times = time_import(module)
+    if best is None or times[module] < best[module]:
+      best = times
+  imports = sorted(((t, m) for m, t in best.items() if m != module),
+                   reverse=True)[:top]
+  return {
+    'total_us': best[module],
+    'top_imports': [{'module': m, 'cumulative_us': t} for t, m in imports],
+  }
+
+
+def compare(results, baseline, threshold):
+  """Returns the modules whose import time exceeds threshold times baseline."""
+  regressions = []
+  for module, result in results.items():
+    if module not in baseline:
+      continue
+    ratio = result['total_us'] / float(max(baseline[module]['total_us'], 1))
+    if ratio > threshold:
+      regressions.append((module, ratio))
+  return regressions
+
+
+def main():
+  modules = [m.strip() for m in FLAGS.import_modules.split(',') if m.strip()]
+  results = {}
+  for module in modules:
+    results[module] = benchmark_module(module, FLAGS.import_repeats,
+                                       FLAGS.import_top)
+    logging.info('%s: %.1f ms', module, results[module]['total_us'] / 1e3)
+    for entry in results[module]['top_imports']:
+      logging.info('  %-40s %9.1f ms', entry['module'],
+                   entry['cumulative_us'] / 1e3)
+
+  if FLAGS.import_output:
+    with open(FLAGS.import_output, 'w') as f:
+      json.dump(results, f, indent=2)
+
+  if FLAGS.import_baseline:
+    with open(FLAGS.import_baseline) as f:
+      baseline = json.load(f)
+    regressions = compare(results, baseline, FLAGS.import_threshold)
+    for module, ratio in regressions:
+      logging.error('%s imports %.2fx slower than the baseline', module, ratio)
+    if regressions:
+      sys.exit(1)
+
+
+if __name__ == '__main__':
+  argparse.parser.parse_args()
+  main()
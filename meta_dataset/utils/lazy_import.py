@@ -0,0 +1,31 @@
+"""Deferred imports of heavy modules.
+
+Modules imported with lazy_import are only executed when one of their
+attributes is first accessed, so that importing meta_dataset, e.g. when a
+DataLoader worker is spawned, does not pay for modules it does not use.
+"""
+import importlib
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+  """Returns a module that is executed on its first attribute access.
+
+  Args:
+    name: the absolute name of the module.
+
+  Returns:
+    The module, already executed if it was imported before.
+  """
+  if name in sys.modules:
+    return sys.modules[name]
+  spec = importlib.util.find_spec(name)
+  if spec is None:
+    raise ImportError("No module named %r" % name, name=name)
+  loader = importlib.util.LazyLoader(spec.loader)
+  spec.loader = loader
+  module = importlib.util.module_from_spec(spec)
+  sys.modules[name] = module
+  loader.exec_module(module)
+  return module